@@ -29,6 +29,9 @@ extern "C" {
 #endif
 
 struct otd_session;
+struct otd_cond_program;
+struct otd_bitplanes;
+struct otd_chunk;
 
 /**
  * @file
@@ -128,6 +131,7 @@ enum otd_loglevel {
  *   - expose it to PDs in module_opentracedecode.c:PyInit_sigrokdecode()
  *   - add a check in type_decoder.c:Decoder_put()
  *   - add a debug string in type_decoder.c:output_type_name()
+ *   - update OTD_NUM_OUTPUT_TYPES in libopentracedecode-internal.h
  */
 enum otd_output_type {
 	OTD_OUTPUT_ANN,
@@ -201,6 +205,12 @@ struct otd_decoder {
 	/** List of decoder options. */
 	GSList *options;
 
+	/**
+	 * Annotation classes with lazy texts (see 'annotation_formats'),
+	 * TRUE for each of them. NULL if the decoder has none.
+	 */
+	gboolean *lazy_ann_classes;
+
 	/** Python module. */
 	void *py_mod;
 
@@ -253,36 +263,123 @@ struct otd_decoder_inst {
 	void *py_inst;
 	char *inst_id;
 	GSList *pd_output;
+
+	/** The items of 'pd_output', indexed by their output ID. */
+	GPtrArray *pd_output_table;
+
+	/** Number of annotation classes of the decoder. */
+	int num_ann_classes;
+
+	/** Output types the frontend wants, bit n for output type n. */
+	unsigned int output_types;
+
+	/** Annotation classes the frontend wants, or NULL for all of them. */
+	gboolean *ann_classes_wanted;
+
+	/** The options which were set, an a{sv} dictionary, or NULL. */
+	GVariant *option_values;
+
+	/** Formatters of lazy annotations, indexed by annotation class. */
+	void *ann_formatters;
+
+	/** Bound decode() or decode_batch() method of a stacked decoder. */
+	void *py_decode;
+
+	/** Items for decode_batch() which were not passed on yet. */
+	void *py_decode_items;
+
+	/** Greenlet which runs decode() in inline or pool mode. */
+	void *py_greenlet;
+
+	/** Worker pool thread which runs the greenlet, see pool.c. */
+	struct otd_pool_worker *pool_worker;
+
+	/** Scheduling state in the worker pool, see pool.c. */
+	int pool_state;
+	gboolean pool_again;
+	gboolean pool_stop;
+
+	/** Worker process which runs the stack, see process.c. */
+	struct otd_process *process;
+
 	int dec_num_channels;
 	int *dec_channelmap;
 	int data_unitsize;
 	uint8_t *channel_samples;
 	GSList *next_di;
 
-	/** List of conditions a PD wants to wait for. */
-	GSList *condition_list;
+	/** Compiled conditions a PD wants to wait for. */
+	struct otd_cond_program *cond_prog;
+
+	/** Cache of compiled condition programs, see cond_program_get(). */
+	GHashTable *cond_cache;
+
+	/** Per-condition skip state of the current wait() call. */
+	GArray *cond_skip_array;
+
+	/** Scratch space which wait() conditions get compiled into. */
+	GArray *cond_scratch;
 
 	/** Array of booleans denoting which conditions matched. */
 	GArray *match_array;
 
+	/** Converted annotation texts, see type_decoder.c. */
+	struct otd_ann_cache *ann_cache;
+
+	/** Annotations which the batch callback did not receive yet. */
+	struct otd_ann_batch *ann_batch;
+
+	/** Binary output which the frontend did not receive yet. */
+	struct otd_bin_buffer *bin_buffer;
+
+	/** Pin value tuples returned by wait(), indexed by pin bitmask. */
+	void **pin_tuples;
+
+	/** 'matched' tuples returned by wait(), see type_decoder.c. */
+	void **matched_tuples;
+
 	/** Absolute start sample number. */
 	uint64_t abs_start_samplenum;
 
 	/** Absolute end sample number. */
 	uint64_t abs_end_samplenum;
 
+	/** The chunk of input samples, shared within the session. */
+	const struct otd_chunk *chunk;
+
 	/** Pointer to the buffer/chunk of input samples. */
 	const uint8_t *inbuf;
 
 	/** Length (in bytes) of the input sample buffer. */
 	uint64_t inbuflen;
 
+	/** Python memoryviews of the current chunk, see chunk_view(). */
+	void *chunk_views;
+
+	/** Chunks queued by otd_session_send_async(), not yet decoded. */
+	GQueue chunk_queue;
+
+	/** The current chunk when it was taken from the queue. */
+	struct otd_chunk *queued_chunk;
+
+	/** Number of queued chunks which were not released yet. */
+	unsigned int chunks_pending;
+
+	/** Absolute end sample number of the last queued chunk. */
+	uint64_t abs_queued_samplenum;
+
 	/** Absolute current samplenumber. */
 	uint64_t abs_cur_samplenum;
 
+	/** The number of put() calls, wraps around. Access atomically. */
+	gint num_puts;
+
 	/** Array of "old" (previous sample) pin values. */
 	GArray *old_pins_array;
 
+	/** Bit-planes of the current chunk, see bitplane.c. */
+	struct otd_bitplanes *planes;
+
 	/** Handle for this PD stack's worker thread. */
 	GThread *thread_handle;
 
@@ -335,7 +432,7 @@ struct otd_proto_data_binary {
 struct otd_proto_data_logic {
 	int logic_group;
 	uint64_t repeat_count; /* Number of times the value in data was repeated. */
-	const uint8_t *data; /* Bitfield containing the states of the logic outputs */
+	const uint8_t *data; /* Bitfield containing the states of the logic outputs, one bit per logic output channel */
 };
 
 typedef void (*otd_pd_output_callback)(struct otd_proto_data *pdata,
@@ -347,6 +444,12 @@ struct otd_pd_callback {
 	void *cb_data;
 };
 
+typedef void (*otd_pd_output_batch_callback)(struct otd_proto_data *pdata,
+					size_t count, void *cb_data);
+
+typedef void (*otd_chunk_release_callback)(const uint8_t *inbuf,
+					void *cb_data);
+
 /* srd.c */
 OTD_API int otd_init(const char *path);
 OTD_API int otd_exit(void);
@@ -360,11 +463,41 @@ OTD_API int otd_session_metadata_set(struct otd_session *sess, int key,
 OTD_API int otd_session_send(struct otd_session *sess,
 		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize);
+OTD_API int otd_session_send_rle(struct otd_session *sess,
+		uint64_t abs_start_samplenum, const uint8_t *values,
+		const uint64_t *lengths, uint64_t num_runs, uint64_t unitsize);
+OTD_API int otd_session_queue_depth_set(struct otd_session *sess,
+		unsigned int depth);
+OTD_API int otd_session_binary_buffer_set(struct otd_session *sess,
+		size_t size);
+OTD_API int otd_session_inline_set(struct otd_session *sess,
+		gboolean enable);
+OTD_API int otd_session_pool_set(struct otd_session *sess,
+		gboolean enable);
+OTD_API int otd_session_priority_set(struct otd_session *sess,
+		int priority);
+OTD_API int otd_session_parallel_set(struct otd_session *sess,
+		gboolean enable);
+OTD_API int otd_session_process_set(struct otd_session *sess,
+		gboolean enable);
+OTD_API int otd_session_process_timeout_set(struct otd_session *sess,
+		unsigned int timeout_ms);
+OTD_API int otd_session_send_async(struct otd_session *sess,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize,
+		otd_chunk_release_callback release_cb, void *cb_data);
+OTD_API int otd_session_drain(struct otd_session *sess);
 OTD_API int otd_session_send_eof(struct otd_session *sess);
 OTD_API int otd_session_terminate_reset(struct otd_session *sess);
 OTD_API int otd_session_destroy(struct otd_session *sess);
 OTD_API int otd_pd_output_callback_add(struct otd_session *sess,
 		int output_type, otd_pd_output_callback cb, void *cb_data);
+OTD_API int otd_pd_output_batch_callback_add(struct otd_session *sess,
+		int output_type, otd_pd_output_batch_callback cb, void *cb_data,
+		size_t max_count);
+
+/* pool.c */
+OTD_API int otd_pool_size_set(unsigned int num_threads);
 
 /* decoder.c */
 OTD_API const GSList *otd_decoder_list(void);
@@ -386,6 +519,14 @@ OTD_API int otd_inst_stack(struct otd_session *sess,
 		struct otd_decoder_inst *di_from, struct otd_decoder_inst *di_to);
 OTD_API struct otd_decoder_inst *otd_inst_find_by_id(struct otd_session *sess,
 		const char *inst_id);
+OTD_API int otd_inst_output_types_set(struct otd_decoder_inst *di,
+		unsigned int output_types);
+OTD_API int otd_inst_annotation_classes_set(struct otd_decoder_inst *di,
+		GArray *ann_classes);
+OTD_API int otd_inst_annotation_rows_set(struct otd_decoder_inst *di,
+		GSList *row_ids);
+OTD_API int otd_inst_annotation_cache_stats_get(
+		const struct otd_decoder_inst *di, uint64_t *hits, uint64_t *misses);
 OTD_API int otd_inst_initial_pins_set_all(struct otd_decoder_inst *di,
 		GArray *initial_pins);
 
@@ -0,0 +1,360 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libopentracedecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <stdint.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * Bit-plane sample engine.
+ *
+ * The samples of a chunk get transposed once into one bit-plane per PD
+ * channel: Bit n of word w of a channel's plane holds the channel's value
+ * in sample (w * 64 + n) of the chunk. Conditions of wait() calls then get
+ * evaluated for 64 samples at a time with a few logic operations per term,
+ * and the first matching sample is found by counting trailing zeros.
+ * Long stretches of idle lines are skipped a word at a time.
+ */
+
+/** @cond PRIVATE */
+
+/* Chunks with less samples than this get scanned sample by sample. */
+#define OTD_BITPLANE_MIN_SAMPLES 256
+
+#define WORD_BITS 64
+
+/** @endcond */
+
+/**
+ * Transpose an 8x8 bit matrix.
+ *
+ * Byte n of the input is row n. On return, byte n holds bit n of all
+ * input bytes, with bit m taken from input byte m.
+ */
+static inline uint64_t transpose8(uint64_t x)
+{
+	uint64_t t;
+
+	t = (x ^ (x >> 7)) & 0x00aa00aa00aa00aaULL;
+	x = x ^ t ^ (t << 7);
+	t = (x ^ (x >> 14)) & 0x0000cccc0000ccccULL;
+	x = x ^ t ^ (t << 14);
+	t = (x ^ (x >> 28)) & 0x00000000f0f0f0f0ULL;
+	x = x ^ t ^ (t << 28);
+
+	return x;
+}
+
+/* Mask of the bits from 'lo' (inclusive) to 'hi' (exclusive), hi <= 64. */
+static inline uint64_t bit_range(unsigned int lo, unsigned int hi)
+{
+	uint64_t m;
+
+	if (lo >= hi)
+		return 0;
+	m = (hi == WORD_BITS) ? ~(uint64_t)0 : (((uint64_t)1 << hi) - 1);
+
+	return m & ~(((uint64_t)1 << lo) - 1);
+}
+
+/** @private */
+OTD_PRIV void bitplanes_invalidate(struct otd_decoder_inst *di)
+{
+	if (!di || !di->planes)
+		return;
+
+	di->planes->valid = FALSE;
+}
+
+/** @private */
+OTD_PRIV void bitplanes_free(struct otd_decoder_inst *di)
+{
+	if (!di || !di->planes)
+		return;
+
+	g_free(di->planes->words);
+	g_free(di->planes);
+	di->planes = NULL;
+}
+
+/*
+ * Transpose one byte lane of the chunk into the planes of the PD channels
+ * which are mapped to it. 'lane_chans' has the PD channel index for every
+ * bit of the lane, or -1.
+ */
+static void bitplanes_build_lane(struct otd_bitplanes *bp,
+		const uint8_t *inbuf, unsigned int unitsize, unsigned int lane,
+		const int *lane_chans)
+{
+	const uint8_t *p;
+	uint64_t num_samples, s, x, t;
+	uint64_t *plane;
+	size_t w;
+	unsigned int g, k, n, b;
+
+	num_samples = bp->num_samples;
+	p = inbuf + lane;
+	for (w = 0; w < bp->num_words; w++) {
+		for (g = 0; g < WORD_BITS / 8; g++) {
+			s = (uint64_t)w * WORD_BITS + g * 8;
+			if (s >= num_samples)
+				break;
+			n = MIN(8, num_samples - s);
+			x = 0;
+			for (k = 0; k < n; k++)
+				x |= (uint64_t)p[(s + k) * unitsize] << (8 * k);
+			if (!x)
+				continue;
+			t = transpose8(x);
+			for (b = 0; b < 8; b++) {
+				if (lane_chans[b] < 0)
+					continue;
+				plane = bp->words + (size_t)lane_chans[b] * bp->num_words;
+				plane[w] |= ((t >> (8 * b)) & 0xff) << (8 * g);
+			}
+		}
+	}
+}
+
+/*
+ * Transpose the instance's current chunk into bit-planes, for all PD
+ * channels which are mapped to an input channel. Unmapped channels get
+ * all-zero planes.
+ */
+static void bitplanes_build(struct otd_decoder_inst *di)
+{
+	struct otd_bitplanes *bp;
+	int lane_chans[8];
+	unsigned int lane, ch, other;
+	size_t need;
+
+	if (!di->planes)
+		di->planes = g_malloc0(sizeof(*di->planes));
+	bp = di->planes;
+
+	bp->num_samples = di->abs_end_samplenum - di->abs_start_samplenum;
+	bp->num_words = (bp->num_samples + WORD_BITS - 1) / WORD_BITS;
+	bp->num_planes = di->dec_num_channels;
+	need = bp->num_words * bp->num_planes;
+	if (need > bp->alloc_words) {
+		g_free(bp->words);
+		bp->words = g_malloc(need * sizeof(uint64_t));
+		bp->alloc_words = need;
+	}
+	memset(bp->words, 0, need * sizeof(uint64_t));
+
+	/* Transpose every byte lane which holds at least one mapped channel. */
+	for (ch = 0; ch < bp->num_planes; ch++) {
+		if (di->dec_channelmap[ch] == -1)
+			continue;
+		lane = di->dec_channelmap[ch] / 8;
+		if (lane >= (unsigned int)di->data_unitsize)
+			continue;
+		memset(lane_chans, -1, sizeof(lane_chans));
+		for (other = 0; other < bp->num_planes; other++) {
+			if (di->dec_channelmap[other] == -1)
+				continue;
+			if ((unsigned int)di->dec_channelmap[other] / 8 != lane)
+				continue;
+			if (other < ch)
+				break; /* Lane was done already. */
+			lane_chans[di->dec_channelmap[other] % 8] = other;
+		}
+		if (other < ch)
+			continue;
+		bitplanes_build_lane(bp, di->inbuf, di->data_unitsize, lane,
+			lane_chans);
+	}
+
+	bp->valid = TRUE;
+}
+
+/**
+ * Check whether the bit-plane engine should be used for the current chunk.
+ *
+ * @param di The decoder instance to use. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV gboolean bitplanes_wanted(const struct otd_decoder_inst *di)
+{
+	return di->abs_end_samplenum - di->abs_start_samplenum
+		>= OTD_BITPLANE_MIN_SAMPLES;
+}
+
+/*
+ * Get the positions within the word where 'cond' is true, given the values
+ * ('cur') and previous values ('prev') of all channels, and the mask 'm'
+ * of positions which are eligible.
+ */
+static inline uint64_t cond_word_matches(const struct otd_cond *cond,
+		const uint64_t *cur, const uint64_t *prev, uint64_t m)
+{
+	uint64_t bits;
+	unsigned int ch;
+
+	if (cond->always_false || !cond->num_terms)
+		return 0;
+
+	for (bits = cond->level_mask; bits && m; bits &= bits - 1) {
+		ch = __builtin_ctzll(bits);
+		if (cond->level_value & ((uint64_t)1 << ch))
+			m &= cur[ch];
+		else
+			m &= ~cur[ch];
+	}
+	for (bits = cond->rise_mask; bits && m; bits &= bits - 1) {
+		ch = __builtin_ctzll(bits);
+		m &= cur[ch] & ~prev[ch];
+	}
+	for (bits = cond->fall_mask; bits && m; bits &= bits - 1) {
+		ch = __builtin_ctzll(bits);
+		m &= ~cur[ch] & prev[ch];
+	}
+	for (bits = cond->edge_mask; bits && m; bits &= bits - 1) {
+		ch = __builtin_ctzll(bits);
+		m &= cur[ch] ^ prev[ch];
+	}
+	for (bits = cond->no_edge_mask; bits && m; bits &= bits - 1) {
+		ch = __builtin_ctzll(bits);
+		m &= ~(cur[ch] ^ prev[ch]);
+	}
+
+	return m;
+}
+
+/*
+ * Restrict the positions 'm' within word 'w' to those which a condition's
+ * skip term lets pass. 'abs_start' is the chunk's first sample.
+ */
+static inline uint64_t skip_word_mask(const struct otd_cond_skip *skip,
+		uint64_t abs_start, size_t w, uint64_t m)
+{
+	uint64_t eligible;
+
+	if (skip->abs_target_samplenum <= abs_start)
+		return m;
+	eligible = skip->abs_target_samplenum - abs_start;
+	if (eligible >= (uint64_t)(w + 1) * WORD_BITS)
+		return 0;
+	if (eligible > (uint64_t)w * WORD_BITS)
+		m &= ~(((uint64_t)1 << (eligible % WORD_BITS)) - 1);
+
+	return m;
+}
+
+/**
+ * Find the first sample which matches the current conditions, using the
+ * bit-plane engine.
+ *
+ * Scans the samples from di->abs_cur_samplenum to the end of the chunk.
+ * Upon return, di->abs_cur_samplenum is the matching sample, or the end
+ * of the chunk if there was no match. The per-condition match results
+ * get updated in the same way the sample by sample scan would have done.
+ *
+ * @param di The decoder instance to use. Must not be NULL.
+ * @param old_pins The pin values before the current sample.
+ *
+ * @return TRUE if a sample matched, FALSE otherwise.
+ *
+ * @private
+ */
+OTD_PRIV gboolean bitplanes_find_match(struct otd_decoder_inst *di,
+		uint64_t old_pins)
+{
+	const struct otd_cond_program *prog;
+	const struct otd_cond *cond;
+	struct otd_bitplanes *bp;
+	struct otd_cond_skip *skips;
+	gboolean *matches;
+	uint64_t cur[OTD_MAX_COND_CHANNELS], prev[OTD_MAX_COND_CHANNELS];
+	uint64_t rel_first, rel_end, valid, any, m;
+	const uint64_t *plane;
+	size_t w, w_first, w_last;
+	unsigned int i, j, ch, lo, hi, pos;
+
+	prog = di->cond_prog;
+	if (!di->planes || !di->planes->valid)
+		bitplanes_build(di);
+	bp = di->planes;
+
+	matches = (gboolean *)di->match_array->data;
+	skips = (struct otd_cond_skip *)di->cond_skip_array->data;
+
+	rel_first = di->abs_cur_samplenum - di->abs_start_samplenum;
+	rel_end = di->abs_end_samplenum - di->abs_start_samplenum;
+	w_first = rel_first / WORD_BITS;
+	w_last = (rel_end - 1) / WORD_BITS;
+
+	any = 0;
+	for (w = w_first; w <= w_last; w++) {
+		lo = (w == w_first) ? rel_first % WORD_BITS : 0;
+		hi = (w == w_last) ? (rel_end - 1) % WORD_BITS + 1 : WORD_BITS;
+		valid = bit_range(lo, hi);
+
+		/* Current and previous values of the referenced channels. */
+		for (i = 0; i < prog->num_chans; i++) {
+			ch = prog->chans[i].channel;
+			plane = bp->words + (size_t)ch * bp->num_words;
+			cur[ch] = plane[w];
+			prev[ch] = cur[ch] << 1;
+			if (w > 0)
+				prev[ch] |= plane[w - 1] >> (WORD_BITS - 1);
+			if (w == w_first) {
+				/* The first sample's predecessor is in the old pins. */
+				prev[ch] &= ~((uint64_t)1 << lo);
+				if (old_pins & ((uint64_t)1 << ch))
+					prev[ch] |= (uint64_t)1 << lo;
+			}
+		}
+
+		for (j = 0; j < prog->num_conds; j++) {
+			cond = &prog->conds[j];
+			m = valid;
+			if (cond->has_skip)
+				m = skip_word_mask(&skips[j], di->abs_start_samplenum, w, m);
+			if (m)
+				any |= cond_word_matches(cond, cur, prev, m);
+		}
+		if (any)
+			break;
+	}
+
+	pos = 0;
+	if (any) {
+		/* Determine which of the conditions matched at the found sample. */
+		pos = __builtin_ctzll(any);
+		for (j = 0; j < prog->num_conds; j++) {
+			cond = &prog->conds[j];
+			m = (uint64_t)1 << pos;
+			if (cond->has_skip)
+				m = skip_word_mask(&skips[j], di->abs_start_samplenum, w, m);
+			matches[j] = m && cond_word_matches(cond, cur, prev, m);
+		}
+		di->abs_cur_samplenum = di->abs_start_samplenum +
+			(uint64_t)w * WORD_BITS + pos;
+	} else {
+		di->abs_cur_samplenum = di->abs_end_samplenum;
+	}
+
+	return any != 0;
+}
@@ -0,0 +1,479 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libopentracedecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <inttypes.h>
+#include <stdint.h>
+#include <string.h>
+
+/**
+ * @file
+ *
+ * Sample chunks and their transition index.
+ *
+ * A session describes every chunk of sample data it receives in a
+ * struct otd_chunk, which is shared by all decoder stacks of the session.
+ * For sparse data the chunk carries an index of the positions where any
+ * input channel changes its value. The index gets built once per chunk,
+ * and allows all instances' matchers to hop from transition to transition
+ * instead of visiting every unchanged sample.
+ *
+ * Run-length encoded chunks are never expanded. Their index directly
+ * follows from the runs, and individual samples get looked up in the
+ * runs when needed.
+ */
+
+/** @cond PRIVATE */
+
+/* Chunks with less samples than this don't get an index. */
+#define OTD_CHUNK_INDEX_MIN_SAMPLES 256
+
+/*
+ * The index gets dropped when more than one in this many samples is a
+ * transition. Dense data is better handled by the bit-plane engine.
+ */
+#define OTD_CHUNK_DENSE_RATIO 16
+
+/** @endcond */
+
+/* Load a sample of up to 8 bytes, bit n is input channel n. */
+static inline uint64_t sample_load(const uint8_t *p, unsigned int unitsize)
+{
+	uint64_t v;
+	unsigned int i;
+
+	switch (unitsize) {
+	case 1:
+		return p[0];
+	case 2:
+		return p[0] | ((uint64_t)p[1] << 8);
+	default:
+		v = 0;
+		for (i = 0; i < unitsize; i++)
+			v |= (uint64_t)p[i] << (8 * i);
+		return v;
+	}
+}
+
+static void chunk_index_add(struct otd_chunk *chunk, uint64_t pos,
+		uint64_t diff)
+{
+	if (chunk->num_changes == chunk->alloc_changes) {
+		chunk->alloc_changes = chunk->alloc_changes ?
+			chunk->alloc_changes * 2 : 256;
+		chunk->changes = g_realloc(chunk->changes,
+			chunk->alloc_changes * sizeof(uint64_t));
+		chunk->diffs = g_realloc(chunk->diffs,
+			chunk->alloc_changes * sizeof(uint64_t));
+	}
+	chunk->changes[chunk->num_changes] = pos;
+	chunk->diffs[chunk->num_changes] = diff;
+	chunk->num_changes++;
+}
+
+/*
+ * Build the transition index of a chunk. Gives up (and leaves the chunk
+ * without an index) as soon as the data turns out to be dense.
+ */
+static void chunk_index_build(struct otd_chunk *chunk)
+{
+	const uint8_t *p;
+	uint64_t num_samples, max_changes, i, prev, cur;
+	unsigned int unitsize;
+
+	chunk->have_index = FALSE;
+	chunk->num_changes = 0;
+
+	unitsize = chunk->unitsize;
+	num_samples = chunk->num_samples;
+	if (num_samples < OTD_CHUNK_INDEX_MIN_SAMPLES)
+		return;
+	max_changes = num_samples / OTD_CHUNK_DENSE_RATIO;
+
+	p = chunk->inbuf;
+	chunk->have_diffs = unitsize <= sizeof(uint64_t);
+	if (chunk->have_diffs) {
+		prev = sample_load(p, unitsize);
+		for (i = 1; i < num_samples; i++) {
+			cur = sample_load(p + i * unitsize, unitsize);
+			if (cur == prev)
+				continue;
+			if (chunk->num_changes >= max_changes)
+				return;
+			chunk_index_add(chunk, i, cur ^ prev);
+			prev = cur;
+		}
+	} else {
+		for (i = 1; i < num_samples; i++) {
+			if (!memcmp(p + i * unitsize, p + (i - 1) * unitsize, unitsize))
+				continue;
+			if (chunk->num_changes >= max_changes)
+				return;
+			chunk_index_add(chunk, i, ~(uint64_t)0);
+		}
+	}
+
+	chunk->have_index = TRUE;
+
+	otd_spew("Chunk %" PRIu64 "-%" PRIu64 ": %" PRIu64 " transitions.",
+		chunk->abs_start_samplenum, chunk->abs_end_samplenum,
+		chunk->num_changes);
+}
+
+/**
+ * Describe a chunk of sample data, and index its transitions.
+ *
+ * @param chunk The chunk to set up. Must not be NULL. Previously allocated
+ *              index memory gets reused.
+ * @param abs_start_samplenum The absolute starting sample number.
+ * @param abs_end_samplenum The absolute ending sample number.
+ * @param inbuf Pointer to sample data.
+ * @param inbuflen Length in bytes of the buffer.
+ * @param unitsize The number of bytes per sample.
+ *
+ * @private
+ */
+OTD_PRIV void chunk_setup(struct otd_chunk *chunk,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize)
+{
+	chunk->abs_start_samplenum = abs_start_samplenum;
+	chunk->abs_end_samplenum = abs_end_samplenum;
+	chunk->inbuf = inbuf;
+	chunk->inbuflen = inbuflen;
+	chunk->unitsize = unitsize;
+	chunk->num_samples = 0;
+	chunk->run_values = NULL;
+	chunk->num_runs = 0;
+	chunk->have_index = FALSE;
+	chunk->num_changes = 0;
+
+	/* Invalid input gets rejected by otd_inst_decode(). */
+	if (!inbuf || !unitsize || abs_end_samplenum < abs_start_samplenum)
+		return;
+	chunk->num_samples = MIN(abs_end_samplenum - abs_start_samplenum,
+		inbuflen / unitsize);
+
+	chunk_index_build(chunk);
+}
+
+/**
+ * Describe a chunk of run-length encoded sample data, and index its
+ * transitions.
+ *
+ * @param chunk The chunk to set up. Must not be NULL. Previously allocated
+ *              index memory gets reused.
+ * @param abs_start_samplenum The absolute starting sample number.
+ * @param values The runs' sample values, 'unitsize' bytes each.
+ * @param lengths The runs' lengths in samples.
+ * @param num_runs The number of runs.
+ * @param unitsize The number of bytes per sample.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+OTD_PRIV int chunk_setup_rle(struct otd_chunk *chunk,
+		uint64_t abs_start_samplenum, const uint8_t *values,
+		const uint64_t *lengths, uint64_t num_runs, uint64_t unitsize)
+{
+	const uint8_t *value, *prev;
+	uint64_t i, pos;
+
+	chunk_setup(chunk, abs_start_samplenum, abs_start_samplenum,
+		NULL, 0, unitsize);
+	if (!values || !lengths || !num_runs || !unitsize)
+		return OTD_ERR_ARG;
+
+	if (num_runs > chunk->alloc_runs) {
+		g_free(chunk->run_starts);
+		chunk->run_starts = g_malloc(num_runs * sizeof(uint64_t));
+		chunk->alloc_runs = num_runs;
+	}
+
+	chunk->have_diffs = unitsize <= sizeof(uint64_t);
+	prev = NULL;
+	pos = 0;
+	for (i = 0; i < num_runs; i++) {
+		chunk->run_starts[i] = pos;
+		if (pos + lengths[i] < pos)
+			return OTD_ERR_ARG;
+		if (!lengths[i])
+			continue;
+		value = values + i * unitsize;
+		if (prev && memcmp(value, prev, unitsize)) {
+			chunk_index_add(chunk, pos, chunk->have_diffs ?
+				sample_load(value, unitsize) ^
+				sample_load(prev, unitsize) : ~(uint64_t)0);
+		}
+		prev = value;
+		pos += lengths[i];
+	}
+	if (!pos)
+		return OTD_ERR_ARG;
+
+	chunk->abs_end_samplenum = abs_start_samplenum + pos;
+	chunk->num_samples = pos;
+	chunk->run_values = values;
+	chunk->num_runs = num_runs;
+	chunk->inbuflen = num_runs * unitsize;
+	chunk->have_index = TRUE;
+
+	otd_spew("RLE chunk %" PRIu64 "-%" PRIu64 ": %" PRIu64 " runs, %"
+		PRIu64 " transitions.", chunk->abs_start_samplenum,
+		chunk->abs_end_samplenum, num_runs, chunk->num_changes);
+
+	return OTD_OK;
+}
+
+/**
+ * Get a sample of a run-length encoded chunk.
+ *
+ * @param chunk The chunk. Must not be NULL.
+ * @param pos The sample's position relative to the chunk's start. Must
+ *            be within the chunk.
+ *
+ * @return Pointer to the sample's value.
+ *
+ * @private
+ */
+OTD_PRIV const uint8_t *chunk_run_sample(const struct otd_chunk *chunk,
+		uint64_t pos)
+{
+	uint64_t lo, hi, mid;
+
+	/* Find the last run which starts at or before 'pos'. */
+	lo = 0;
+	hi = chunk->num_runs;
+	while (hi - lo > 1) {
+		mid = lo + (hi - lo) / 2;
+		if (chunk->run_starts[mid] <= pos)
+			lo = mid;
+		else
+			hi = mid;
+	}
+
+	return chunk->run_values + lo * chunk->unitsize;
+}
+
+/** @private */
+OTD_PRIV void chunk_free(struct otd_chunk *chunk)
+{
+	if (!chunk)
+		return;
+
+	g_free(chunk->changes);
+	g_free(chunk->diffs);
+	g_free(chunk->run_starts);
+	g_free(chunk->owned_buf);
+	g_free(chunk);
+}
+
+/**
+ * Create a reference counted chunk for asynchronous decoding.
+ *
+ * Without a release callback the sample data gets copied, otherwise the
+ * caller's buffer is referenced until the release callback runs.
+ *
+ * @return The new chunk, holding one reference.
+ *
+ * @private
+ */
+OTD_PRIV struct otd_chunk *chunk_new(uint64_t abs_start_samplenum,
+		uint64_t abs_end_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, uint64_t unitsize,
+		otd_chunk_release_callback release_cb, void *cb_data)
+{
+	struct otd_chunk *chunk;
+
+	chunk = g_malloc0(sizeof(*chunk));
+	if (!release_cb && inbuf && inbuflen) {
+		chunk->owned_buf = g_malloc(inbuflen);
+		memcpy(chunk->owned_buf, inbuf, inbuflen);
+		inbuf = chunk->owned_buf;
+	}
+	chunk->refcount = 1;
+	chunk->release_cb = release_cb;
+	chunk->cb_data = cb_data;
+	chunk_setup(chunk, abs_start_samplenum, abs_end_samplenum,
+		inbuf, inbuflen, unitsize);
+
+	return chunk;
+}
+
+/** @private */
+OTD_PRIV struct otd_chunk *chunk_ref(struct otd_chunk *chunk)
+{
+	g_atomic_int_inc(&chunk->refcount);
+
+	return chunk;
+}
+
+/**
+ * Drop a reference to a chunk. The last reference runs the release
+ * callback, in whichever thread dropped it, and frees the chunk.
+ *
+ * @private
+ */
+OTD_PRIV void chunk_unref(struct otd_chunk *chunk)
+{
+	if (!chunk)
+		return;
+	if (!g_atomic_int_dec_and_test(&chunk->refcount))
+		return;
+
+	if (chunk->release_cb)
+		chunk->release_cb(chunk->inbuf, chunk->cb_data);
+	chunk_free(chunk);
+}
+
+/* Find the first transition after relative sample position 'pos'. */
+static uint64_t chunk_change_after(const struct otd_chunk *chunk,
+		uint64_t pos)
+{
+	uint64_t lo, hi, mid;
+
+	lo = 0;
+	hi = chunk->num_changes;
+	while (lo < hi) {
+		mid = lo + (hi - lo) / 2;
+		if (chunk->changes[mid] <= pos)
+			lo = mid + 1;
+		else
+			hi = mid;
+	}
+
+	return lo;
+}
+
+/* First sample (relative) which a condition's skip term lets pass. */
+static inline uint64_t skip_eligible(const struct otd_decoder_inst *di,
+		const struct otd_cond_skip *skip)
+{
+	if (skip->abs_target_samplenum <= di->abs_start_samplenum)
+		return 0;
+
+	return skip->abs_target_samplenum - di->abs_start_samplenum;
+}
+
+/**
+ * Find the first sample which matches the current conditions, using the
+ * transition index of the instance's current chunk.
+ *
+ * Within a run of samples with unchanged pins, only the first sample can
+ * have edges. The run's later samples match a condition without edge
+ * terms either all or none, subject to the condition's skip term. So the
+ * matcher only needs to inspect the start of every run, the sample after
+ * it, and the samples where skip terms expire.
+ *
+ * Upon return, di->abs_cur_samplenum is the matching sample, or the end
+ * of the chunk if there was no match. The per-condition match results
+ * get updated in the same way the sample by sample scan would have done.
+ *
+ * @param di The decoder instance to use. Must not be NULL. Its chunk must
+ *           have a transition index.
+ * @param old_pins The pin values before the current sample.
+ *
+ * @return TRUE if a sample matched, FALSE otherwise.
+ *
+ * @private
+ */
+OTD_PRIV gboolean transitions_find_match(struct otd_decoder_inst *di,
+		uint64_t old_pins)
+{
+	const struct otd_chunk *chunk;
+	const struct otd_cond_program *prog;
+	const struct otd_cond *cond;
+	struct otd_cond_skip *skips;
+	gboolean *matches, found;
+	uint64_t rel_first, rel_end, pos, run_end, best, p, k;
+	uint64_t pins;
+	unsigned int j;
+
+	chunk = di->chunk;
+	prog = di->cond_prog;
+	matches = (gboolean *)di->match_array->data;
+	skips = (struct otd_cond_skip *)di->cond_skip_array->data;
+
+	rel_first = di->abs_cur_samplenum - di->abs_start_samplenum;
+	rel_end = di->abs_end_samplenum - di->abs_start_samplenum;
+
+	found = FALSE;
+	pos = rel_first;
+	k = chunk_change_after(chunk, pos);
+	while (pos < rel_end) {
+		pins = sample_pins_get(prog, inst_sample_pos(di,
+			di->abs_start_samplenum + pos));
+
+		/* Find the end of the run, ignore changes of other channels. */
+		while (k < chunk->num_changes && chunk->have_diffs &&
+				!(chunk->diffs[k] & prog->input_mask))
+			k++;
+		run_end = (k < chunk->num_changes) ? chunk->changes[k] : rel_end;
+		run_end = MIN(run_end, rel_end);
+
+		/* The run's first sample, possibly with edges. */
+		for (j = 0; j < prog->num_conds; j++) {
+			cond = &prog->conds[j];
+			matches[j] = (!cond->has_skip ||
+				skip_eligible(di, &skips[j]) <= pos) &&
+				cond_terms_match(cond, old_pins, pins);
+			found |= matches[j];
+		}
+		if (found)
+			break;
+
+		/* The run's remaining samples, without edges. */
+		best = UINT64_MAX;
+		for (j = 0; j < prog->num_conds && pos + 1 < run_end; j++) {
+			cond = &prog->conds[j];
+			if (cond->rise_mask || cond->fall_mask || cond->edge_mask)
+				continue;
+			if (!cond_terms_match(cond, pins, pins))
+				continue;
+			p = pos + 1;
+			if (cond->has_skip)
+				p = MAX(p, skip_eligible(di, &skips[j]));
+			if (p < run_end)
+				best = MIN(best, p);
+		}
+		if (best != UINT64_MAX) {
+			for (j = 0; j < prog->num_conds; j++) {
+				cond = &prog->conds[j];
+				matches[j] = !cond->rise_mask && !cond->fall_mask &&
+					!cond->edge_mask &&
+					(!cond->has_skip ||
+					skip_eligible(di, &skips[j]) <= best) &&
+					cond_terms_match(cond, pins, pins);
+			}
+			pos = best;
+			found = TRUE;
+			break;
+		}
+
+		old_pins = pins;
+		pos = run_end;
+		k++;
+	}
+
+	di->abs_cur_samplenum = di->abs_start_samplenum + (found ? pos : rel_end);
+
+	return found;
+}
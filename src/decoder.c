@@ -48,6 +48,7 @@ extern OTD_PRIV GSList *searchpaths;
 /* session.c */
 extern OTD_PRIV GSList *sessions;
 extern OTD_PRIV int max_session_id;
+extern OTD_PRIV GMutex sessions_mutex;
 
 /* module_opentracedecode.c */
 extern OTD_PRIV PyObject *mod_opentracedecode;
@@ -174,6 +175,7 @@ static void decoder_free(struct otd_decoder *dec)
 	Py_XDECREF(dec->py_mod);
 	PyGILState_Release(gstate);
 
+	g_free(dec->lazy_ann_classes);
 	g_slist_free_full(dec->options, &decoder_option_free);
 	g_slist_free_full(dec->binary, (GDestroyNotify)&g_strfreev);
 	g_slist_free_full(dec->annotation_rows, &annotation_row_free);
@@ -568,6 +570,104 @@ err_out:
 	return OTD_ERR_PYTHON;
 }
 
+/*
+ * Check the formats of lazy annotations: a dict which maps annotation
+ * classes to either a sequence of str.format() templates, or the name of
+ * a method which returns the texts.
+ */
+static int get_annotation_formats(struct otd_decoder *dec, size_t cls_count)
+{
+	const char *py_member_name = "annotation_formats";
+
+	PyObject *py_formats, *py_key, *py_value, *py_item;
+	gboolean *lazy_ann_classes, valid;
+	Py_ssize_t pos, i, num_tmpls;
+	size_t class_idx;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+
+	if (!PyObject_HasAttrString(dec->py_dec, py_member_name)) {
+		PyGILState_Release(gstate);
+		return OTD_OK;
+	}
+
+	lazy_ann_classes = g_new0(gboolean, MAX(cls_count, 1));
+
+	py_formats = PyObject_GetAttrString(dec->py_dec, py_member_name);
+	if (!py_formats)
+		goto except_out;
+
+	if (!PyDict_Check(py_formats)) {
+		otd_err("Protocol decoder %s %s must be a dict.",
+			dec->name, py_member_name);
+		goto err_out;
+	}
+
+	pos = 0;
+	while (PyDict_Next(py_formats, &pos, &py_key, &py_value)) {
+		if (!PyLong_Check(py_key)) {
+			otd_err("Protocol decoder %s %s keys must be annotation "
+				"class numbers.", dec->name, py_member_name);
+			goto err_out;
+		}
+		class_idx = PyLong_AsSize_t(py_key);
+		if (PyErr_Occurred())
+			goto except_out;
+		if (class_idx >= cls_count) {
+			otd_err("Protocol decoder %s %s references invalid "
+				"class %zu.", dec->name, py_member_name, class_idx);
+			goto err_out;
+		}
+
+		if (PyUnicode_Check(py_value)) {
+			/* The name of a method which returns the texts. */
+			py_item = PyObject_GetAttr(dec->py_dec, py_value);
+			if (!py_item)
+				PyErr_Clear();
+			valid = py_item && PyCallable_Check(py_item);
+			Py_XDECREF(py_item);
+		} else if (PyTuple_Check(py_value) || PyList_Check(py_value)) {
+			/* A sequence of str.format() templates. */
+			num_tmpls = PySequence_Size(py_value);
+			valid = num_tmpls > 0;
+			for (i = 0; valid && i < num_tmpls; i++) {
+				py_item = PySequence_GetItem(py_value, i);
+				if (!py_item)
+					goto except_out;
+				valid = PyUnicode_Check(py_item);
+				Py_DECREF(py_item);
+			}
+		} else {
+			valid = FALSE;
+		}
+		if (!valid) {
+			otd_err("Protocol decoder %s %s for class %zu must be a "
+				"method name or a sequence of format strings.",
+				dec->name, py_member_name, class_idx);
+			goto err_out;
+		}
+
+		lazy_ann_classes[class_idx] = TRUE;
+	}
+	dec->lazy_ann_classes = lazy_ann_classes;
+	Py_DECREF(py_formats);
+	PyGILState_Release(gstate);
+
+	return OTD_OK;
+
+except_out:
+	otd_exception_catch("Failed to get %s decoder annotation formats",
+			dec->name);
+
+err_out:
+	g_free(lazy_ann_classes);
+	Py_XDECREF(py_formats);
+	PyGILState_Release(gstate);
+
+	return OTD_ERR_PYTHON;
+}
+
 /* Convert binary classes to GSList of char **. */
 static int get_binary_classes(struct otd_decoder *dec)
 {
@@ -767,6 +867,21 @@ OTD_PRIV long otd_decoder_apiver(const struct otd_decoder *d)
 	return apiver;
 }
 
+/**
+ * Get the size of a decoder's logic output data: a bitfield with the
+ * states of all its logic output channels.
+ *
+ * @param d The decoder to use. Must not be NULL.
+ *
+ * @return The size in bytes, 0 for a decoder without logic outputs.
+ *
+ * @private
+ */
+OTD_PRIV size_t otd_decoder_logic_unitsize(const struct otd_decoder *d)
+{
+	return (g_slist_length(d->logic_output_channels) + 7) / 8;
+}
+
 static gboolean contains_duplicates(GSList *list)
 {
 	for (GSList *l1 = list; l1; l1 = l1->next) {
@@ -984,6 +1099,11 @@ OTD_API int otd_decoder_load(const char *module_name)
 		goto err_out;
 	}
 
+	if (get_annotation_formats(d, ann_cls_count) != OTD_OK) {
+		fail_txt = "cannot get annotation formats";
+		goto err_out;
+	}
+
 	if (get_binary_classes(d) != OTD_OK) {
 		fail_txt = "cannot get binary classes";
 		goto err_out;
@@ -1146,10 +1266,12 @@ OTD_API int otd_decoder_unload(struct otd_decoder *dec)
 	 * stack. A frontend reloading a decoder thus has to restart all
 	 * instances, and rebuild the stack.
 	 */
+	g_mutex_lock(&sessions_mutex);
 	for (l = sessions; l; l = l->next) {
 		sess = l->data;
 		otd_inst_free_all(sess);
 	}
+	g_mutex_unlock(&sessions_mutex);
 
 	/* Remove the PD from the list of loaded decoders. */
 	pd_list = g_slist_remove(pd_list, dec);
@@ -100,6 +100,7 @@ OTD_API int otd_inst_option_set(struct otd_decoder_inst *di,
 	gint64 val_int;
 	int ret;
 	const char *val_str;
+	GVariantBuilder values;
 	PyGILState_STATE gstate;
 
 	if (!di) {
@@ -129,6 +130,7 @@ OTD_API int otd_inst_option_set(struct otd_decoder_inst *di,
 
 	ret = OTD_ERR_PYTHON;
 	py_optval = NULL;
+	g_variant_builder_init(&values, G_VARIANT_TYPE_VARDICT);
 
 	/*
 	 * The 'options' tuple is a class variable, but we need to
@@ -187,6 +189,7 @@ OTD_API int otd_inst_option_set(struct otd_decoder_inst *di,
 			Py_XDECREF(py_optval);
 			goto err_out;
 		}
+		g_variant_builder_add(&values, "{sv}", sdo->id, value);
 		/* Not harmful even if we used the default. */
 		g_hash_table_remove(options, sdo->id);
 		Py_XDECREF(py_optval);
@@ -194,9 +197,16 @@ OTD_API int otd_inst_option_set(struct otd_decoder_inst *di,
 	if (g_hash_table_size(options) != 0)
 		otd_warn("Unknown options specified for '%s'", di->inst_id);
 
+	/* Worker processes set up their instances with these, see process.c. */
+	if (di->option_values)
+		g_variant_unref(di->option_values);
+	di->option_values = g_variant_ref_sink(g_variant_builder_end(&values));
+
 	ret = OTD_OK;
 
 err_out:
+	if (ret != OTD_OK)
+		g_variant_builder_clear(&values);
 	if (PyErr_Occurred()) {
 		otd_exception_catch("Stray exception in otd_inst_option_set()");
 		ret = OTD_ERR_PYTHON;
@@ -316,6 +326,11 @@ OTD_API int otd_inst_channel_set_all(struct otd_decoder_inst *di,
 	g_free(di->dec_channelmap);
 	di->dec_channelmap = new_channelmap;
 
+	/* Compiled conditions and bit-planes refer to the old channel map. */
+	cond_cache_free(di);
+	bitplanes_invalidate(di);
+	wait_tuples_free(di, FALSE);
+
 	return OTD_OK;
 }
 
@@ -352,10 +367,21 @@ OTD_API struct otd_decoder_inst *otd_inst_new(struct otd_session *sess,
 		return NULL;
 	}
 
+	if (g_slist_length(dec->channels) + g_slist_length(dec->opt_channels)
+			> OTD_MAX_COND_CHANNELS) {
+		otd_err("Protocol decoder %s has more than %d channels.",
+			decoder_id, OTD_MAX_COND_CHANNELS);
+		return NULL;
+	}
+
 	di = g_malloc0(sizeof(struct otd_decoder_inst));
 
 	di->decoder = dec;
 	di->sess = sess;
+	di->pd_output_table = g_ptr_array_new();
+	di->num_ann_classes = g_slist_length(dec->annotations);
+	di->output_types = (1U << OTD_NUM_OUTPUT_TYPES) - 1;
+	di->ann_classes_wanted = NULL;
 
 	if (options) {
 		inst_id = g_hash_table_lookup(options, "id");
@@ -402,25 +428,34 @@ OTD_API struct otd_decoder_inst *otd_inst_new(struct otd_session *sess,
 			otd_exception_catch("Failed to create %s instance",
 					decoder_id);
 		PyGILState_Release(gstate);
-		g_free(di->dec_channelmap);
-		g_free(di);
-		return NULL;
+		goto err_out;
 	}
 
 	PyGILState_Release(gstate);
 
-	if (options && otd_inst_option_set(di, options) != OTD_OK) {
-		g_free(di->dec_channelmap);
-		g_free(di);
-		return NULL;
-	}
+	if (options && otd_inst_option_set(di, options) != OTD_OK)
+		goto err_out;
 
-	di->condition_list = NULL;
+	di->cond_prog = NULL;
+	di->cond_cache = NULL;
+	di->cond_skip_array = NULL;
+	di->cond_scratch = NULL;
 	di->match_array = NULL;
+	di->pin_tuples = NULL;
+	di->matched_tuples = NULL;
+	di->planes = NULL;
 	di->abs_start_samplenum = 0;
 	di->abs_end_samplenum = 0;
+	di->chunk = NULL;
 	di->inbuf = NULL;
 	di->inbuflen = 0;
+	di->chunk_views = NULL;
+	di->ann_batch = NULL;
+	di->ann_cache = NULL;
+	g_queue_init(&di->chunk_queue);
+	di->queued_chunk = NULL;
+	di->chunks_pending = 0;
+	di->abs_queued_samplenum = 0;
 	di->abs_cur_samplenum = 0;
 	di->thread_handle = NULL;
 	di->got_new_samples = FALSE;
@@ -429,6 +464,9 @@ OTD_API struct otd_decoder_inst *otd_inst_new(struct otd_session *sess,
 	di->communicate_eof = FALSE;
 	di->decoder_state = OTD_OK;
 
+	/* Have the Python object refer to its instance, see put() and wait(). */
+	((otd_Decoder *)di->py_inst)->di = di;
+
 	/*
 	 * Strictly speaking initialization of statically allocated
 	 * condition and mutex variables (or variables allocated on the
@@ -444,12 +482,178 @@ OTD_API struct otd_decoder_inst *otd_inst_new(struct otd_session *sess,
 	otd_dbg("Creating new %s instance %s.", decoder_id, di->inst_id);
 
 	return di;
+
+err_out:
+	if (di->py_inst) {
+		gstate = PyGILState_Ensure();
+		Py_DECREF(di->py_inst);
+		PyGILState_Release(gstate);
+	}
+	oldpins_array_free(di);
+	if (di->option_values)
+		g_variant_unref(di->option_values);
+	g_free(di->inst_id);
+	g_free(di->dec_channelmap);
+	g_free(di->channel_samples);
+	g_ptr_array_free(di->pd_output_table, TRUE);
+	g_free(di);
+
+	return NULL;
+}
+
+/* Check whether an instance's greenlet has finished running decode(). */
+static gboolean greenlet_dead(struct otd_decoder_inst *di)
+{
+	PyObject *py_dead;
+	int dead;
+
+	py_dead = PyObject_GetAttrString(di->py_greenlet, "dead");
+	dead = py_dead ? PyObject_IsTrue(py_dead) : 1;
+	Py_XDECREF(py_dead);
+	PyErr_Clear();
+
+	return dead != 0;
+}
+
+/* Mark an instance's decode() method as terminated, see di_thread(). */
+static void greenlet_done(struct otd_decoder_inst *di)
+{
+	g_mutex_lock(&di->data_mutex);
+	di->want_wait_terminate = TRUE;
+	di->handled_all_samples = TRUE;
+	g_cond_signal(&di->handled_all_samples_cond);
+	g_mutex_unlock(&di->data_mutex);
+}
+
+/**
+ * Run an instance's decode() method in inline or pool mode, until it has
+ * handled all samples which were sent to it. The first call starts
+ * decode() in a new greenlet, later calls resume it where wait()
+ * suspended it.
+ *
+ * Greenlets only run on the thread which created them. In pool mode,
+ * this is the instance's pool thread.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_inst_greenlet_resume(struct otd_decoder_inst *di)
+{
+	PyObject *py_mod, *py_decode, *py_res;
+	int wanted_term;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+
+	if (!di->py_greenlet) {
+		otd_dbg("%s: Starting greenlet for decoder.", di->inst_id);
+		py_mod = PyImport_ImportModule("greenlet");
+		py_decode = PyObject_GetAttrString(di->py_inst, "decode");
+		if (py_mod && py_decode)
+			di->py_greenlet = PyObject_CallMethod(py_mod, "greenlet",
+				"O", py_decode);
+		Py_XDECREF(py_decode);
+		Py_XDECREF(py_mod);
+		if (!di->py_greenlet) {
+			otd_exception_catch("%s: Cannot create greenlet",
+				di->inst_id);
+			di->decoder_state = OTD_ERR_PYTHON;
+			greenlet_done(di);
+			PyGILState_Release(gstate);
+			return;
+		}
+	} else if (greenlet_dead(di)) {
+		/* decode() terminated before, there is nothing to run. */
+		greenlet_done(di);
+		PyGILState_Release(gstate);
+		return;
+	}
+
+	py_res = PyObject_CallMethod(di->py_greenlet, "switch", NULL);
+
+	/* Suspended in wait() again, all samples were handled. */
+	if (py_res && !greenlet_dead(di)) {
+		Py_DECREF(py_res);
+		PyGILState_Release(gstate);
+		return;
+	}
+
+	/* decode() terminated, see di_thread(). */
+	otd_dbg("%s: decode() terminated.", di->inst_id);
+	if (PyErr_Occurred() && PyErr_ExceptionMatches(PyExc_EOFError)) {
+		otd_dbg("%s: ignoring EOFError during decode() execution.",
+			di->inst_id);
+		PyErr_Clear();
+		if (!py_res) {
+			Py_INCREF(Py_None);
+			py_res = Py_None;
+		}
+	}
+	if (!py_res)
+		di->decoder_state = OTD_ERR;
+
+	wanted_term = di->want_wait_terminate;
+	greenlet_done(di);
+
+	if (!py_res && !wanted_term)
+		otd_exception_catch("Protocol decoder instance %s: ", di->inst_id);
+	Py_XDECREF(py_res);
+	PyErr_Clear();
+
+	PyGILState_Release(gstate);
+}
+
+/**
+ * Terminate an instance's decode() method in inline or pool mode, and
+ * drop its greenlet. Must run on the thread which created the greenlet.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_inst_greenlet_stop(struct otd_decoder_inst *di)
+{
+	PyObject *py_res;
+	PyGILState_STATE gstate;
+
+	if (!di->py_greenlet)
+		return;
+
+	otd_dbg("%s: Stopping greenlet.", di->inst_id);
+
+	gstate = PyGILState_Ensure();
+
+	/* Have wait() return an error, so that decode() terminates. */
+	g_mutex_lock(&di->data_mutex);
+	di->want_wait_terminate = TRUE;
+	g_mutex_unlock(&di->data_mutex);
+	if (!greenlet_dead(di)) {
+		py_res = PyObject_CallMethod(di->py_greenlet, "switch", NULL);
+		Py_XDECREF(py_res);
+	}
+	PyErr_Clear();
+	Py_CLEAR(di->py_greenlet);
+
+	PyGILState_Release(gstate);
 }
 
 static void otd_inst_join_decode_thread(struct otd_decoder_inst *di)
 {
 	if (!di)
 		return;
+	if (di->process) {
+		otd_process_stop(di);
+		return;
+	}
+	if (di->pool_worker) {
+		otd_pool_stop(di);
+		return;
+	}
+	if (di->py_greenlet) {
+		otd_inst_greenlet_stop(di);
+		return;
+	}
 	if (!di->thread_handle)
 		return;
 
@@ -484,16 +688,40 @@ static void otd_inst_join_decode_thread(struct otd_decoder_inst *di)
 
 static void otd_inst_reset_state(struct otd_decoder_inst *di)
 {
+	struct otd_chunk *chunk;
+
 	if (!di)
 		return;
 
 	otd_dbg("%s: Resetting decoder state.", di->inst_id);
 
+	/* Views of the current chunk must not outlive it. */
+	chunk_views_release(di);
+
+	/* Deliver output which was put after the last flush. */
+	ann_batch_deliver(di);
+	ann_batch_free(di);
+	bin_buffer_deliver(di);
+	bin_buffer_free(di);
+
+	/* Drop input from a lower decoder which was not decoded yet. */
+	stacked_decode_free(di);
+
+	/* Release queued chunks which will not get decoded. */
+	chunk_unref(di->queued_chunk);
+	di->queued_chunk = NULL;
+	while ((chunk = g_queue_pop_head(&di->chunk_queue)))
+		chunk_unref(chunk);
+	di->chunks_pending = 0;
+	di->abs_queued_samplenum = 0;
+
 	/* Reset internal state of the decoder. */
-	condition_list_free(di);
+	cond_cache_free(di);
 	match_array_free(di);
+	bitplanes_free(di);
 	di->abs_start_samplenum = 0;
 	di->abs_end_samplenum = 0;
+	di->chunk = NULL;
 	di->inbuf = NULL;
 	di->inbuflen = 0;
 	di->abs_cur_samplenum = 0;
@@ -629,6 +857,177 @@ OTD_API struct otd_decoder_inst *otd_inst_find_by_id(struct otd_session *sess,
 	return di;
 }
 
+/**
+ * Select the output types which the frontend wants to receive from a
+ * decoder instance.
+ *
+ * Decoder output of other types is discarded by the instance right away,
+ * without getting converted or passed to callbacks. Python output still
+ * goes to the decoders stacked on top. All output types are wanted by
+ * default.
+ *
+ * This should be called before otd_session_start(), or while the
+ * instance's stack is not decoding.
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param output_types Bitmask of the wanted output types, with bit n set
+ *                     for output type n (see enum otd_output_type).
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_inst_output_types_set(struct otd_decoder_inst *di,
+		unsigned int output_types)
+{
+	if (!di) {
+		otd_err("Invalid decoder instance.");
+		return OTD_ERR_ARG;
+	}
+
+	di->output_types = output_types;
+
+	return OTD_OK;
+}
+
+/**
+ * Select the annotation classes which the frontend wants to receive from
+ * a decoder instance.
+ *
+ * Annotations of other classes are discarded by the instance right away,
+ * without converting their texts. Decoders can check whether the frontend
+ * wants a class with self.is_wanted(). All classes are wanted by default.
+ *
+ * This should be called before otd_session_start(), or while the
+ * instance's stack is not decoding.
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param ann_classes A GArray of int annotation class indices, or NULL
+ *                    to receive all classes again.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_inst_annotation_classes_set(struct otd_decoder_inst *di,
+		GArray *ann_classes)
+{
+	gboolean *wanted;
+	guint i;
+	int ann_class;
+
+	if (!di) {
+		otd_err("Invalid decoder instance.");
+		return OTD_ERR_ARG;
+	}
+
+	wanted = NULL;
+	if (ann_classes) {
+		wanted = g_new0(gboolean, MAX(di->num_ann_classes, 1));
+		for (i = 0; i < ann_classes->len; i++) {
+			ann_class = g_array_index(ann_classes, int, i);
+			if (ann_class < 0 || ann_class >= di->num_ann_classes) {
+				otd_err("Invalid annotation class %d.", ann_class);
+				g_free(wanted);
+				return OTD_ERR_ARG;
+			}
+			wanted[ann_class] = TRUE;
+		}
+	}
+
+	g_free(di->ann_classes_wanted);
+	di->ann_classes_wanted = wanted;
+
+	return OTD_OK;
+}
+
+/**
+ * Select the annotation rows which the frontend wants to receive from a
+ * decoder instance.
+ *
+ * This selects the annotation classes of the rows, see
+ * otd_inst_annotation_classes_set().
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param row_ids A GSList of annotation row IDs (char *), or NULL to
+ *                receive all classes again.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_inst_annotation_rows_set(struct otd_decoder_inst *di,
+		GSList *row_ids)
+{
+	GSList *l, *r, *c;
+	struct otd_decoder_annotation_row *row;
+	GArray *ann_classes;
+	int ann_class, ret;
+
+	if (!di) {
+		otd_err("Invalid decoder instance.");
+		return OTD_ERR_ARG;
+	}
+
+	if (!row_ids)
+		return otd_inst_annotation_classes_set(di, NULL);
+
+	/* Resolve the rows to their annotation classes. */
+	ann_classes = g_array_new(FALSE, FALSE, sizeof(int));
+	for (l = row_ids; l; l = l->next) {
+		for (r = di->decoder->annotation_rows; r; r = r->next) {
+			row = r->data;
+			if (!strcmp(row->id, l->data))
+				break;
+		}
+		if (!r) {
+			otd_err("Invalid annotation row '%s'.", (char *)l->data);
+			g_array_free(ann_classes, TRUE);
+			return OTD_ERR_ARG;
+		}
+		for (c = row->ann_classes; c; c = c->next) {
+			ann_class = GPOINTER_TO_INT(c->data);
+			g_array_append_val(ann_classes, ann_class);
+		}
+	}
+
+	ret = otd_inst_annotation_classes_set(di, ann_classes);
+	g_array_free(ann_classes, TRUE);
+
+	return ret;
+}
+
+/**
+ * Get the statistics of a decoder instance's annotation text cache.
+ *
+ * Annotation texts which a decoder puts repeatedly get converted to C
+ * strings only once, and are passed to the frontend as the same
+ * pointers while they stay in the cache. Every annotation which was
+ * looked up in the cache counts as a hit or a miss.
+ *
+ * The counters are updated by the stack's worker thread, so they are
+ * only exact while the stack is not decoding.
+ *
+ * @param di Decoder instance to use. Must not be NULL.
+ * @param hits Pointer to store the number of hits in. Must not be NULL.
+ * @param misses Pointer to store the number of misses in. Must not be NULL.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_inst_annotation_cache_stats_get(
+		const struct otd_decoder_inst *di, uint64_t *hits, uint64_t *misses)
+{
+	if (!di || !hits || !misses)
+		return OTD_ERR_ARG;
+
+	*hits = di->ann_cache ? di->ann_cache->hits : 0;
+	*misses = di->ann_cache ? di->ann_cache->misses : 0;
+
+	return OTD_OK;
+}
+
 /**
  * Set the list of initial (assumed) pin values.
  *
@@ -720,65 +1119,6 @@ OTD_PRIV int otd_inst_start(struct otd_decoder_inst *di)
 	return OTD_OK;
 }
 
-/**
- * Check whether the specified sample matches the specified term.
- *
- * In the case of OTD_TERM_SKIP, this function can modify
- * term->num_samples_already_skipped.
- *
- * @param old_sample The value of the previous sample (0/1).
- * @param sample The value of the current sample (0/1).
- * @param term The term that should be checked for a match. Must not be NULL.
- *
- * @retval TRUE The current sample matches the specified term.
- * @retval FALSE The current sample doesn't match the specified term, or an
- *               invalid term was provided.
- *
- * @private
- */
-__attribute__((always_inline))
-static inline gboolean sample_matches(uint8_t old_sample, uint8_t sample, struct otd_term *term)
-{
-	/* Caller ensures term != NULL. */
-
-	switch (term->type) {
-	case OTD_TERM_HIGH:
-		if (sample == 1)
-			return TRUE;
-		break;
-	case OTD_TERM_LOW:
-		if (sample == 0)
-			return TRUE;
-		break;
-	case OTD_TERM_RISING_EDGE:
-		if (old_sample == 0 && sample == 1)
-			return TRUE;
-		break;
-	case OTD_TERM_FALLING_EDGE:
-		if (old_sample == 1 && sample == 0)
-			return TRUE;
-		break;
-	case OTD_TERM_EITHER_EDGE:
-		if ((old_sample == 1 && sample == 0) || (old_sample == 0 && sample == 1))
-			return TRUE;
-		break;
-	case OTD_TERM_NO_EDGE:
-		if ((old_sample == 0 && sample == 0) || (old_sample == 1 && sample == 1))
-			return TRUE;
-		break;
-	case OTD_TERM_SKIP:
-		if (term->num_samples_already_skipped == term->num_samples_to_skip)
-			return TRUE;
-		term->num_samples_already_skipped++;
-		break;
-	default:
-		otd_err("Unknown term type %d.", term->type);
-		break;
-	}
-
-	return FALSE;
-}
-
 /** @private */
 OTD_PRIV void match_array_free(struct otd_decoder_inst *di)
 {
@@ -789,38 +1129,169 @@ OTD_PRIV void match_array_free(struct otd_decoder_inst *di)
 	di->match_array = NULL;
 }
 
-/** @private */
-OTD_PRIV void condition_list_free(struct otd_decoder_inst *di)
+/* FNV-1a over the compiled conditions, see cond_program_get(). */
+static guint cond_program_hash(gconstpointer key)
 {
-	GSList *l, *ll;
+	const struct otd_cond_program *prog;
+	const uint8_t *p;
+	size_t i, len;
+	guint h;
+
+	prog = key;
+	p = (const uint8_t *)prog->conds;
+	len = prog->num_conds * sizeof(struct otd_cond);
+
+	h = 2166136261u;
+	for (i = 0; i < len; i++) {
+		h ^= p[i];
+		h *= 16777619u;
+	}
+
+	return h;
+}
+
+static gboolean cond_program_equal(gconstpointer a, gconstpointer b)
+{
+	const struct otd_cond_program *pa, *pb;
+
+	pa = a;
+	pb = b;
+	if (pa->num_conds != pb->num_conds)
+		return FALSE;
+
+	return memcmp(pa->conds, pb->conds,
+		pa->num_conds * sizeof(struct otd_cond)) == 0;
+}
+
+static void cond_program_free(struct otd_cond_program *prog)
+{
+	if (!prog)
+		return;
 
+	g_free(prog->conds);
+	g_free(prog);
+}
+
+/** @private */
+OTD_PRIV void cond_cache_free(struct otd_decoder_inst *di)
+{
 	if (!di)
 		return;
 
-	for (l = di->condition_list; l; l = l->next) {
-		ll = l->data;
-		if (ll)
-			g_slist_free_full(ll, g_free);
+	di->cond_prog = NULL;
+	if (di->cond_cache) {
+		g_hash_table_destroy(di->cond_cache);
+		di->cond_cache = NULL;
 	}
+	if (di->cond_skip_array) {
+		g_array_free(di->cond_skip_array, TRUE);
+		di->cond_skip_array = NULL;
+	}
+	if (di->cond_scratch) {
+		g_array_free(di->cond_scratch, TRUE);
+		di->cond_scratch = NULL;
+	}
+}
 
-	g_slist_free(di->condition_list);
-	di->condition_list = NULL;
+/*
+ * Resolve the sample data location of all channels a program references.
+ * This depends on the instance's channel map, which is why the cache gets
+ * flushed when the channel map changes.
+ */
+static void cond_program_link_channels(const struct otd_decoder_inst *di,
+		struct otd_cond_program *prog)
+{
+	struct otd_cond_chan *chan;
+	int ch;
+
+	prog->num_chans = 0;
+	prog->input_mask = 0;
+	for (ch = 0; ch < di->dec_num_channels; ch++) {
+		if (!(prog->chan_mask & ((uint64_t)1 << ch)))
+			continue;
+		chan = &prog->chans[prog->num_chans++];
+		chan->channel = ch;
+		if (di->dec_channelmap[ch] == -1) {
+			/* Unused optional channels always read as low. */
+			chan->byte_offset = 0;
+			chan->bit_mask = 0;
+			continue;
+		}
+		chan->byte_offset = di->dec_channelmap[ch] / 8;
+		chan->bit_mask = 1 << (di->dec_channelmap[ch] % 8);
+		if (di->dec_channelmap[ch] < 64)
+			prog->input_mask |= (uint64_t)1 << di->dec_channelmap[ch];
+		else
+			prog->input_mask = ~(uint64_t)0;
+	}
 }
 
-static gboolean have_non_null_conds(const struct otd_decoder_inst *di)
+/**
+ * Get the compiled program for a list of conditions.
+ *
+ * A previously compiled program with the same structure is taken from the
+ * instance's cache, otherwise a new program gets added to the cache. The
+ * cache is bounded, and gets flushed when it exceeds OTD_COND_CACHE_MAX
+ * entries.
+ *
+ * @param di The decoder instance to use. Must not be NULL.
+ * @param conds Array of compiled conditions. Must not be NULL.
+ * @param num_conds Number of conditions. Must be > 0.
+ *
+ * @return The program, owned by the instance's cache.
+ *
+ * @private
+ */
+OTD_PRIV struct otd_cond_program *cond_program_get(struct otd_decoder_inst *di,
+		const struct otd_cond *conds, unsigned int num_conds)
 {
-	GSList *l, *cond;
+	struct otd_cond_program key, *prog;
+	unsigned int i;
 
-	if (!di)
-		return FALSE;
+	if (!di->cond_cache) {
+		di->cond_cache = g_hash_table_new_full(cond_program_hash,
+			cond_program_equal, (GDestroyNotify)cond_program_free,
+			NULL);
+	}
+
+	key.num_conds = num_conds;
+	key.conds = (struct otd_cond *)conds;
+	if ((prog = g_hash_table_lookup(di->cond_cache, &key)))
+		return prog;
 
-	for (l = di->condition_list; l; l = l->next) {
-		cond = l->data;
-		if (cond)
-			return TRUE;
+	if (g_hash_table_size(di->cond_cache) >= OTD_COND_CACHE_MAX) {
+		otd_dbg("%s: Flushing condition cache.", di->inst_id);
+		di->cond_prog = NULL;
+		g_hash_table_remove_all(di->cond_cache);
 	}
 
-	return FALSE;
+	prog = g_malloc0(sizeof(*prog));
+	prog->num_conds = num_conds;
+	prog->conds = g_malloc(num_conds * sizeof(*conds));
+	memcpy(prog->conds, conds, num_conds * sizeof(*conds));
+	for (i = 0; i < num_conds; i++) {
+		prog->chan_mask |= conds[i].level_mask | conds[i].rise_mask |
+			conds[i].fall_mask | conds[i].edge_mask |
+			conds[i].no_edge_mask;
+		if (conds[i].num_terms)
+			prog->num_active++;
+	}
+	prog->pure_skip = TRUE;
+	for (i = 0; i < num_conds; i++) {
+		if (conds[i].always_false || !conds[i].num_terms)
+			continue;
+		if (!conds[i].has_skip || conds[i].level_mask ||
+				conds[i].rise_mask || conds[i].fall_mask ||
+				conds[i].edge_mask || conds[i].no_edge_mask)
+			prog->pure_skip = FALSE;
+	}
+	cond_program_link_channels(di, prog);
+	g_hash_table_insert(di->cond_cache, prog, prog);
+
+	otd_spew("%s: Compiled %u condition(s), channel mask 0x%" PRIx64 ".",
+		di->inst_id, num_conds, prog->chan_mask);
+
+	return prog;
 }
 
 static void update_old_pins_array(struct otd_decoder_inst *di,
@@ -852,7 +1323,7 @@ static void update_old_pins_array_initial_pins(struct otd_decoder_inst *di)
 	if (!di || !di->dec_channelmap)
 		return;
 
-	sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
+	sample_pos = inst_sample_pos(di, di->abs_cur_samplenum);
 
 	oldpins_array_seed(di);
 	for (i = 0; i < di->dec_num_channels; i++) {
@@ -867,114 +1338,173 @@ static void update_old_pins_array_initial_pins(struct otd_decoder_inst *di)
 	}
 }
 
-static gboolean term_matches(const struct otd_decoder_inst *di,
-		struct otd_term *term, const uint8_t *sample_pos)
+/* Get the "old" pin values of the given channels as a bitmask. */
+static uint64_t old_pins_get(struct otd_decoder_inst *di, uint64_t chan_mask)
 {
-	uint8_t old_sample, sample;
-	int byte_offset, bit_offset, ch;
+	uint64_t pins;
+	int ch;
 
-	/* Caller ensures di, di->dec_channelmap, term, sample_pos != NULL. */
+	oldpins_array_seed(di);
+	pins = 0;
+	for (ch = 0; ch < di->dec_num_channels; ch++) {
+		if (!(chan_mask & ((uint64_t)1 << ch)))
+			continue;
+		if (di->old_pins_array->data[ch] == 1)
+			pins |= (uint64_t)1 << ch;
+	}
 
-	if (term->type == OTD_TERM_SKIP)
-		return sample_matches(0, 0, term);
+	return pins;
+}
 
-	ch = term->channel;
-	byte_offset = di->dec_channelmap[ch] / 8;
-	bit_offset = di->dec_channelmap[ch] % 8;
-	sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
-	old_sample = di->old_pins_array->data[ch];
+/**
+ * Check whether the specified sample matches the specified condition.
+ *
+ * A skip term counts every sample, regardless of the condition's other
+ * terms. The condition's other terms get checked once the requested
+ * number of samples was skipped.
+ *
+ * @param cond The condition to check. Must not be NULL.
+ * @param skip The condition's skip state. Must not be NULL.
+ * @param samplenum The absolute number of the sample.
+ * @param old_pins The previous sample's pin values.
+ * @param pins The current sample's pin values.
+ *
+ * @private
+ */
+__attribute__((always_inline))
+static inline gboolean cond_matches(const struct otd_cond *cond,
+		const struct otd_cond_skip *skip, uint64_t samplenum,
+		uint64_t old_pins, uint64_t pins)
+{
+	if (cond->has_skip && samplenum < skip->abs_target_samplenum)
+		return FALSE;
 
-	return sample_matches(old_sample, sample, term);
+	return cond_terms_match(cond, old_pins, pins);
 }
 
-static gboolean all_terms_match(const struct otd_decoder_inst *di,
-		const GSList *cond, const uint8_t *sample_pos)
+/*
+ * Scan the current chunk sample by sample, starting at the current sample.
+ * Leaves di->abs_cur_samplenum at the matching sample, or at the end of
+ * the chunk if there was no match.
+ */
+static gboolean scan_samples(struct otd_decoder_inst *di, uint64_t old_pins)
 {
-	const GSList *l;
-	struct otd_term *term;
+	const struct otd_cond_program *prog;
+	struct otd_cond_skip *skips;
+	const uint8_t *sample_pos;
+	uint64_t pins;
+	gboolean *matches, found;
+	unsigned int j;
+
+	prog = di->cond_prog;
+	matches = (gboolean *)di->match_array->data;
+	skips = (struct otd_cond_skip *)di->cond_skip_array->data;
+	found = FALSE;
+
+	for (; di->abs_cur_samplenum < di->abs_end_samplenum; di->abs_cur_samplenum++) {
+		sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
+		pins = sample_pins_get(prog, sample_pos);
 
-	/* Caller ensures di, cond, sample_pos != NULL. */
+		/* Check whether the current sample matches at least one of the conditions (logical OR). */
+		/* IMPORTANT: We need to check all conditions, even if there was a match already! */
+		for (j = 0; j < prog->num_conds; j++) {
+			matches[j] = cond_matches(&prog->conds[j], &skips[j],
+				di->abs_cur_samplenum, old_pins, pins);
+			found |= matches[j];
+		}
+		if (found)
+			break;
 
-	for (l = cond; l; l = l->next) {
-		term = l->data;
-		if (term->type == OTD_TERM_ALWAYS_FALSE)
-			return FALSE;
-		if (!term_matches(di, term, sample_pos))
-			return FALSE;
+		old_pins = pins;
 	}
 
-	return TRUE;
+	return found;
 }
 
-static gboolean at_least_one_condition_matched(
-		const struct otd_decoder_inst *di, unsigned int num_conditions)
+/*
+ * Advance to the earliest skip target of a program which only consists
+ * of skip conditions, or to the end of the chunk if the target is beyond.
+ */
+static gboolean skip_to_target(struct otd_decoder_inst *di)
 {
-	unsigned int i;
+	const struct otd_cond_program *prog;
+	const struct otd_cond *cond;
+	struct otd_cond_skip *skips;
+	gboolean *matches;
+	uint64_t target;
+	unsigned int j;
+
+	prog = di->cond_prog;
+	matches = (gboolean *)di->match_array->data;
+	skips = (struct otd_cond_skip *)di->cond_skip_array->data;
+
+	target = UINT64_MAX;
+	for (j = 0; j < prog->num_conds; j++) {
+		cond = &prog->conds[j];
+		if (cond->always_false || !cond->num_terms)
+			continue;
+		target = MIN(target, skips[j].abs_target_samplenum);
+	}
+	target = MAX(target, di->abs_cur_samplenum);
 
-	/* Caller ensures di != NULL. */
+	if (target >= di->abs_end_samplenum) {
+		di->abs_cur_samplenum = di->abs_end_samplenum;
+		return FALSE;
+	}
 
-	for (i = 0; i < num_conditions; i++) {
-		if (di->match_array->data[i])
-			return TRUE;
+	for (j = 0; j < prog->num_conds; j++) {
+		cond = &prog->conds[j];
+		matches[j] = cond->num_terms && !cond->always_false &&
+			skips[j].abs_target_samplenum <= target;
 	}
+	di->abs_cur_samplenum = target;
 
-	return FALSE;
+	return TRUE;
 }
 
 static gboolean find_match(struct otd_decoder_inst *di)
 {
-	uint64_t i, j, num_samples_to_process;
-	GSList *l, *cond;
-	const uint8_t *sample_pos;
-	unsigned int num_conditions;
+	const struct otd_cond_program *prog;
+	uint64_t old_pins, last;
+	gboolean found;
 
 	/* Caller ensures di != NULL. */
 
-	/* Check whether the condition list is NULL/empty. */
-	if (!di->condition_list) {
+	/* Check whether there are any conditions with terms. */
+	prog = di->cond_prog;
+	if (!prog || !prog->num_active) {
 		otd_dbg("NULL/empty condition list, automatic match.");
 		return TRUE;
 	}
 
-	/* Check whether we have any non-NULL conditions. */
-	if (!have_non_null_conds(di)) {
-		otd_dbg("Only NULL conditions in list, automatic match.");
-		return TRUE;
-	}
-
-	num_samples_to_process = di->abs_end_samplenum - di->abs_cur_samplenum;
-	num_conditions = g_slist_length(di->condition_list);
-
-	/* di->match_array is NULL here. Create a new GArray. */
-	di->match_array = g_array_sized_new(FALSE, TRUE, sizeof(gboolean), num_conditions);
-	g_array_set_size(di->match_array, num_conditions);
+	if (di->abs_cur_samplenum >= di->abs_end_samplenum)
+		return FALSE;
 
 	/* Sample 0: Set di->old_pins_array for OTD_INITIAL_PIN_SAME_AS_SAMPLE0 pins. */
 	if (di->abs_cur_samplenum == 0)
 		update_old_pins_array_initial_pins(di);
 
-	for (i = 0; i < num_samples_to_process; i++, (di->abs_cur_samplenum)++) {
-
-		sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
-
-		/* Check whether the current sample matches at least one of the conditions (logical OR). */
-		/* IMPORTANT: We need to check all conditions, even if there was a match already! */
-		for (l = di->condition_list, j = 0; l; l = l->next, j++) {
-			cond = l->data;
-			if (!cond)
-				continue;
-			/* All terms in 'cond' must match (logical AND). */
-			di->match_array->data[j] = all_terms_match(di, cond, sample_pos);
-		}
-
-		update_old_pins_array(di, sample_pos);
+	old_pins = old_pins_get(di, prog->chan_mask);
 
-		/* If at least one condition matched we're done. */
-		if (at_least_one_condition_matched(di, num_conditions))
-			return TRUE;
-	}
-
-	return FALSE;
+	/*
+	 * Skip-only conditions resolve without looking at the samples.
+	 * Sparse chunks come with an index of their transitions, large
+	 * dense chunks get evaluated 64 samples at a time.
+	 */
+	if (prog->pure_skip)
+		found = skip_to_target(di);
+	else if (di->chunk && di->chunk->have_index)
+		found = transitions_find_match(di, old_pins);
+	else if (bitplanes_wanted(di))
+		found = bitplanes_find_match(di, old_pins);
+	else
+		found = scan_samples(di, old_pins);
+
+	/* Keep all pins of the last inspected sample for edge detection. */
+	last = found ? di->abs_cur_samplenum : di->abs_end_samplenum - 1;
+	update_old_pins_array(di, inst_sample_pos(di, last));
+
+	return found;
 }
 
 /**
@@ -1135,63 +1665,94 @@ static gpointer di_thread(gpointer data)
 /**
  * Decode a chunk of samples.
  *
- * The calls to this function must provide the samples that shall be
- * used by the protocol decoder
+ * The chunks passed to this function must provide the samples that shall
+ * be used by the protocol decoder
  *  - in the correct order ([...]5, 6, 4, 7, 8[...] is a bug),
  *  - starting from sample zero (2, 3, 4, 5, 6[...] is a bug),
  *  - consecutively, with no gaps (0, 1, 2, 4, 5[...] is a bug).
  *
  * The start- and end-sample numbers are absolute sample numbers (relative
  * to the start of the whole capture/file/stream), i.e. they are not relative
- * sample numbers within the chunk specified by 'inbuf' and 'inbuflen'.
+ * sample numbers within the chunk's sample data.
  *
  * Correct example (4096 samples total, 4 chunks @ 1024 samples each):
- *   otd_inst_decode(di, 0,    1024, inbuf, 1024, 1);
- *   otd_inst_decode(di, 1024, 2048, inbuf, 1024, 1);
- *   otd_inst_decode(di, 2048, 3072, inbuf, 1024, 1);
- *   otd_inst_decode(di, 3072, 4096, inbuf, 1024, 1);
+ *   start 0,    end 1024,  1024 bytes, unitsize 1
+ *   start 1024, end 2048,  1024 bytes, unitsize 1
+ *   start 2048, end 3072,  1024 bytes, unitsize 1
+ *   start 3072, end 4096,  1024 bytes, unitsize 1
  *
- * The chunk size ('inbuflen') can be arbitrary and can differ between calls.
+ * The chunk size can be arbitrary and can differ between calls.
  *
  * Correct example (4096 samples total, 7 chunks @ various samples each):
- *   otd_inst_decode(di, 0,    1024, inbuf, 1024, 1);
- *   otd_inst_decode(di, 1024, 1124, inbuf,  100, 1);
- *   otd_inst_decode(di, 1124, 1424, inbuf,  300, 1);
- *   otd_inst_decode(di, 1424, 1643, inbuf,  219, 1);
- *   otd_inst_decode(di, 1643, 2048, inbuf,  405, 1);
- *   otd_inst_decode(di, 2048, 3072, inbuf, 1024, 1);
- *   otd_inst_decode(di, 3072, 4096, inbuf, 1024, 1);
+ *   start 0,    end 1024,  1024 bytes, unitsize 1
+ *   start 1024, end 1124,   100 bytes, unitsize 1
+ *   start 1124, end 1424,   300 bytes, unitsize 1
+ *   start 1424, end 1643,   219 bytes, unitsize 1
+ *   start 1643, end 2048,   405 bytes, unitsize 1
+ *   start 2048, end 3072,  1024 bytes, unitsize 1
+ *   start 3072, end 4096,  1024 bytes, unitsize 1
  *
  * INCORRECT example (4096 samples total, 4 chunks @ 1024 samples each, but
  * the start- and end-samplenumbers are not absolute):
- *   otd_inst_decode(di, 0,    1024, inbuf, 1024, 1);
- *   otd_inst_decode(di, 0,    1024, inbuf, 1024, 1);
- *   otd_inst_decode(di, 0,    1024, inbuf, 1024, 1);
- *   otd_inst_decode(di, 0,    1024, inbuf, 1024, 1);
+ *   start 0,    end 1024,  1024 bytes, unitsize 1
+ *   start 0,    end 1024,  1024 bytes, unitsize 1
+ *   start 0,    end 1024,  1024 bytes, unitsize 1
+ *   start 0,    end 1024,  1024 bytes, unitsize 1
  *
  * @param di The decoder instance to call. Must not be NULL.
- * @param abs_start_samplenum The absolute starting sample number for the
- * 		buffer's sample set, relative to the start of capture.
- * @param abs_end_samplenum The absolute ending sample number for the
- * 		buffer's sample set, relative to the start of capture.
- * @param inbuf The buffer to decode. Must not be NULL.
- * @param inbuflen Length of the buffer. Must be > 0.
- * @param unitsize The number of bytes per sample. Must be > 0.
+ * @param chunk The chunk of samples to decode. Must not be NULL. Its
+ *              sample data must be valid until this function returns.
  *
  * @return OTD_OK upon success, a (negative) error code otherwise.
  *
  * @private
  */
 OTD_PRIV int otd_inst_decode(struct otd_decoder_inst *di,
-		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
-		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize)
+		const struct otd_chunk *chunk)
 {
+	int ret;
+
+	if ((ret = otd_inst_decode_push(di, chunk)) != OTD_OK)
+		return ret;
+
+	return otd_inst_decode_wait(di);
+}
+
+/**
+ * Hand a chunk of samples to a decoder stack, without waiting for it.
+ *
+ * The same rules as for otd_inst_decode() apply. Every successful call
+ * must be followed by otd_inst_decode_wait() before the next chunk gets
+ * pushed, and before the chunk's sample data becomes invalid.
+ *
+ * @param di The decoder instance to call. Must not be NULL.
+ * @param chunk The chunk of samples to decode. Must not be NULL.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+OTD_PRIV int otd_inst_decode_push(struct otd_decoder_inst *di,
+		const struct otd_chunk *chunk)
+{
+	uint64_t abs_start_samplenum, abs_end_samplenum, inbuflen, unitsize;
+	const uint8_t *inbuf;
+
 	/* Return an error upon unusable input. */
 	if (!di) {
 		otd_dbg("empty decoder instance");
 		return OTD_ERR_ARG;
 	}
-	if (!inbuf) {
+	if (!chunk) {
+		otd_dbg("NULL chunk pointer");
+		return OTD_ERR_ARG;
+	}
+	abs_start_samplenum = chunk->abs_start_samplenum;
+	abs_end_samplenum = chunk->abs_end_samplenum;
+	inbuf = chunk->inbuf;
+	inbuflen = chunk->inbuflen;
+	unitsize = chunk->unitsize;
+	if (!inbuf && !chunk->run_values) {
 		otd_dbg("NULL buffer pointer");
 		return OTD_ERR_ARG;
 	}
@@ -1220,8 +1781,12 @@ OTD_PRIV int otd_inst_decode(struct otd_decoder_inst *di,
 		abs_end_samplenum - abs_start_samplenum, inbuflen, di->data_unitsize,
 		di->inst_id);
 
+	/* Hand the chunk to the stack's worker process. */
+	if (di->sess->exec_mode == OTD_EXEC_PROCESS)
+		return otd_process_push(di, chunk);
+
 	/* If this is the first call, start the worker thread. */
-	if (!di->thread_handle) {
+	if (!di->thread_handle && di->sess->exec_mode == OTD_EXEC_THREAD) {
 		otd_dbg("No worker thread for this decoder stack "
 			"exists yet, creating one: %s.", di->inst_id);
 		di->thread_handle = g_thread_new(di->inst_id,
@@ -1232,8 +1797,10 @@ OTD_PRIV int otd_inst_decode(struct otd_decoder_inst *di,
 	g_mutex_lock(&di->data_mutex);
 	di->abs_start_samplenum = abs_start_samplenum;
 	di->abs_end_samplenum = abs_end_samplenum;
+	di->chunk = chunk;
 	di->inbuf = inbuf;
 	di->inbuflen = inbuflen;
+	bitplanes_invalidate(di);
 	di->got_new_samples = TRUE;
 	di->handled_all_samples = FALSE;
 
@@ -1241,14 +1808,50 @@ OTD_PRIV int otd_inst_decode(struct otd_decoder_inst *di,
 	g_cond_signal(&di->got_new_samples_cond);
 	g_mutex_unlock(&di->data_mutex);
 
-	/* When all samples in this chunk were handled, return. */
-	g_mutex_lock(&di->data_mutex);
-	while (!di->handled_all_samples && !di->want_wait_terminate)
-		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
-	g_mutex_unlock(&di->data_mutex);
+	/* Have the pool pick up the chunk. */
+	if (di->sess->exec_mode == OTD_EXEC_POOL && !di->want_wait_terminate)
+		otd_pool_schedule(di);
+
+	return OTD_OK;
+}
+
+/**
+ * Wait until a decoder stack has handled the chunk which was handed to it
+ * by otd_inst_decode_push(), and flush the stack.
+ *
+ * @param di The decoder instance to call. Must not be NULL.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+OTD_PRIV int otd_inst_decode_wait(struct otd_decoder_inst *di)
+{
+	if (di->sess->exec_mode == OTD_EXEC_PROCESS) {
+		/* The worker process flushes the stack. */
+		otd_process_wait(di);
+		return di->want_wait_terminate ? OTD_ERR_TERM_REQ : OTD_OK;
+	}
+
+	if (di->sess->exec_mode == OTD_EXEC_INLINE) {
+		/* Run decode() on this thread until it needs more samples. */
+		if (!di->want_wait_terminate)
+			otd_inst_greenlet_resume(di);
+	} else if (di->sess->exec_mode == OTD_EXEC_POOL) {
+		/* Wait until decode() on the pool needs more samples. */
+		otd_pool_wait(di);
+	} else {
+		/* When all samples in this chunk were handled, return. */
+		g_mutex_lock(&di->data_mutex);
+		while (!di->handled_all_samples && !di->want_wait_terminate)
+			g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+		g_mutex_unlock(&di->data_mutex);
+	}
 
 	/* Flush all PDs in the stack that can be flushed */
 	otd_inst_flush(di);
+	ann_batch_deliver(di);
+	bin_buffer_deliver(di);
 
 	if (di->want_wait_terminate)
 		return OTD_ERR_TERM_REQ;
@@ -1257,6 +1860,171 @@ OTD_PRIV int otd_inst_decode(struct otd_decoder_inst *di,
 }
 
 
+/**
+ * Queue a chunk of samples for decoding, without waiting for it.
+ *
+ * Takes a reference to the chunk, which gets dropped after the worker
+ * thread has decoded it and has flushed the stack. Blocks while
+ * 'queue_depth' chunks are pending already.
+ *
+ * @param di The decoder instance to call. Must not be NULL.
+ * @param chunk The chunk of samples to decode. Must not be NULL.
+ * @param queue_depth The maximum number of pending chunks.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+OTD_PRIV int otd_inst_decode_async(struct otd_decoder_inst *di,
+		struct otd_chunk *chunk, unsigned int queue_depth)
+{
+	uint64_t abs_next_samplenum;
+
+	if (!di) {
+		otd_dbg("empty decoder instance");
+		return OTD_ERR_ARG;
+	}
+	if (!chunk || !chunk->inbuf || !chunk->inbuflen || !chunk->unitsize) {
+		otd_dbg("unusable chunk");
+		return OTD_ERR_ARG;
+	}
+
+	/* Without a worker thread, decode the chunk right away. */
+	if (di->sess->exec_mode == OTD_EXEC_INLINE ||
+			di->sess->exec_mode == OTD_EXEC_PROCESS)
+		return otd_inst_decode(di, chunk);
+
+	/* If this is the first call, start the worker thread. */
+	if (!di->thread_handle && di->sess->exec_mode == OTD_EXEC_THREAD) {
+		otd_dbg("No worker thread for this decoder stack "
+			"exists yet, creating one: %s.", di->inst_id);
+		di->thread_handle = g_thread_new(di->inst_id,
+						 di_thread, di);
+	}
+
+	g_mutex_lock(&di->data_mutex);
+	while (di->chunks_pending >= queue_depth && !di->want_wait_terminate)
+		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+	if (di->want_wait_terminate) {
+		g_mutex_unlock(&di->data_mutex);
+		return OTD_ERR_TERM_REQ;
+	}
+
+	/* Chunks must continue where the previously sent one ended. */
+	if (di->chunks_pending)
+		abs_next_samplenum = di->abs_queued_samplenum;
+	else
+		abs_next_samplenum = di->abs_cur_samplenum;
+	if (chunk->abs_start_samplenum != abs_next_samplenum ||
+	    chunk->abs_end_samplenum < chunk->abs_start_samplenum) {
+		g_mutex_unlock(&di->data_mutex);
+		otd_dbg("Incorrect sample numbers: start=%" PRIu64 ", next=%"
+			PRIu64 ", end=%" PRIu64 ".", chunk->abs_start_samplenum,
+			abs_next_samplenum, chunk->abs_end_samplenum);
+		return OTD_ERR_ARG;
+	}
+
+	otd_spew("Queueing: abs start sample %" PRIu64 ", abs end sample %"
+		PRIu64 ", instance %s.", chunk->abs_start_samplenum,
+		chunk->abs_end_samplenum, di->inst_id);
+
+	g_queue_push_tail(&di->chunk_queue, chunk_ref(chunk));
+	di->chunks_pending++;
+	di->abs_queued_samplenum = chunk->abs_end_samplenum;
+	g_cond_signal(&di->got_new_samples_cond);
+	g_mutex_unlock(&di->data_mutex);
+
+	/* Have the pool pick up the chunk. */
+	if (di->sess->exec_mode == OTD_EXEC_POOL)
+		otd_pool_schedule(di);
+
+	return OTD_OK;
+}
+
+/**
+ * Have the worker thread pick up the next queued chunk.
+ *
+ * Must be called with the instance's data mutex held.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @return TRUE when a chunk was taken from the queue.
+ *
+ * @private
+ */
+OTD_PRIV gboolean otd_inst_queue_next(struct otd_decoder_inst *di)
+{
+	struct otd_chunk *chunk;
+
+	if (!(chunk = g_queue_pop_head(&di->chunk_queue)))
+		return FALSE;
+
+	di->data_unitsize = chunk->unitsize;
+	di->abs_start_samplenum = chunk->abs_start_samplenum;
+	di->abs_end_samplenum = chunk->abs_end_samplenum;
+	di->queued_chunk = chunk;
+	di->chunk = chunk;
+	di->inbuf = chunk->inbuf;
+	di->inbuflen = chunk->inbuflen;
+	bitplanes_invalidate(di);
+	di->got_new_samples = TRUE;
+	di->handled_all_samples = FALSE;
+
+	return TRUE;
+}
+
+/**
+ * Finish a queued chunk after the worker thread has handled all of its
+ * samples: flush the stack, release the chunk, and wake up senders
+ * which wait for queue space.
+ *
+ * Must be called from the worker thread, without the data mutex held.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ * @param chunk The chunk which was decoded. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_inst_queue_done(struct otd_decoder_inst *di,
+		struct otd_chunk *chunk)
+{
+	otd_inst_flush(di);
+	ann_batch_deliver(di);
+	bin_buffer_deliver(di);
+	chunk_unref(chunk);
+
+	g_mutex_lock(&di->data_mutex);
+	di->chunks_pending--;
+	g_cond_signal(&di->handled_all_samples_cond);
+	g_mutex_unlock(&di->data_mutex);
+}
+
+/**
+ * Wait until all queued chunks were decoded and released.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+OTD_PRIV int otd_inst_drain(struct otd_decoder_inst *di)
+{
+	int ret;
+
+	if (!di)
+		return OTD_ERR_ARG;
+
+	g_mutex_lock(&di->data_mutex);
+	while (di->chunks_pending && !di->want_wait_terminate)
+		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+	ret = di->chunks_pending ? OTD_ERR_TERM_REQ : OTD_OK;
+	g_mutex_unlock(&di->data_mutex);
+
+	return ret;
+}
+
+
 /**
  * Flush all data that is pending, bottom decoder first up to the top of the stack.
  *
@@ -1276,6 +2044,9 @@ OTD_PRIV int otd_inst_flush(struct otd_decoder_inst *di)
 	if (!di)
 		return OTD_ERR_ARG;
 
+	/* Decode what the instance below put since the last flush. */
+	decode_batch_deliver(di);
+
 	gstate = PyGILState_Ensure();
 	if (PyObject_HasAttrString(di->py_inst, "flush")) {
 		otd_dbg("Calling flush() of instance %s", di->inst_id);
@@ -1317,13 +2088,19 @@ OTD_PRIV int otd_inst_send_eof(struct otd_decoder_inst *di)
 	 * started or previously finished is perfectly acceptable.
 	 */
 	otd_dbg("End of sample data: instance %s.", di->inst_id);
-	if (!di->thread_handle) {
+	if (di->process) {
+		/* The worker process passes EOF on to the whole stack. */
+		otd_process_eof(di);
+		return OTD_OK;
+	}
+	if (!di->thread_handle && !di->py_greenlet && !di->pool_worker) {
 		otd_dbg("No worker thread, nothing to do.");
 		return OTD_OK;
 	}
 
 	/* Signal the thread about the EOF condition. */
 	g_mutex_lock(&di->data_mutex);
+	di->chunk = NULL;
 	di->inbuf = NULL;
 	di->inbuflen = 0;
 	di->got_new_samples = TRUE;
@@ -1334,13 +2111,21 @@ OTD_PRIV int otd_inst_send_eof(struct otd_decoder_inst *di)
 	g_mutex_unlock(&di->data_mutex);
 
 	/* Only return from here when the condition was handled. */
-	g_mutex_lock(&di->data_mutex);
-	while (!di->handled_all_samples && !di->want_wait_terminate)
-		g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
-	g_mutex_unlock(&di->data_mutex);
+	if (di->pool_worker) {
+		otd_pool_run(di);
+	} else if (di->py_greenlet) {
+		otd_inst_greenlet_resume(di);
+	} else {
+		g_mutex_lock(&di->data_mutex);
+		while (!di->handled_all_samples && !di->want_wait_terminate)
+			g_cond_wait(&di->handled_all_samples_cond, &di->data_mutex);
+		g_mutex_unlock(&di->data_mutex);
+	}
 
 	/* Flush the decoder instance which handled EOF. */
 	otd_inst_flush(di);
+	ann_batch_deliver(di);
+	bin_buffer_deliver(di);
 
 	/* Pass EOF to all stacked decoders. */
 	for (l = di->next_di; l; l = l->next) {
@@ -1428,8 +2213,12 @@ OTD_PRIV void otd_inst_free(struct otd_decoder_inst *di)
 	otd_inst_join_decode_thread(di);
 
 	otd_inst_reset_state(di);
+	wait_tuples_free(di, TRUE);
+	ann_cache_free(di);
 
 	gstate = PyGILState_Ensure();
+	((otd_Decoder *)di->py_inst)->di = NULL;
+	Py_XDECREF(di->ann_formatters);
 	Py_DECREF(di->py_inst);
 	PyGILState_Release(gstate);
 
@@ -1443,6 +2232,10 @@ OTD_PRIV void otd_inst_free(struct otd_decoder_inst *di)
 		g_free(pdo);
 	}
 	g_slist_free(di->pd_output);
+	g_ptr_array_free(di->pd_output_table, TRUE);
+	g_free(di->ann_classes_wanted);
+	if (di->option_values)
+		g_variant_unref(di->option_values);
 	g_free(di);
 }
 
@@ -21,8 +21,13 @@
 #ifndef LIBSIGROKDECODE_LIBSIGROKDECODE_INTERNAL_H
 #define LIBSIGROKDECODE_LIBSIGROKDECODE_INTERNAL_H
 
-/* Use the stable ABI subset as per PEP 384. */
+/*
+ * Use the stable ABI subset as per PEP 384. Free-threaded Python builds
+ * (PEP 703) don't provide it, they need the full API.
+ */
+#ifndef HAVE_PYTHON_FREE_THREADED
 #define Py_LIMITED_API 0x03020000
+#endif
 
 #include <Python.h> /* First, so we avoid a _POSIX_C_SOURCE warning. */
 #include <opentracedecode/libopentracedecode.h>
@@ -49,15 +54,227 @@ enum {
 	OTD_TERM_SKIP,
 };
 
-struct otd_term {
-	int type;
-	int channel;
+/*
+ * The condition matcher keeps pin states as bitmasks over the PD's channel
+ * indices, so decoders with more channels than this are not supported.
+ */
+#define OTD_MAX_COND_CHANNELS 64
+
+/*
+ * wait_batch() reports the conditions which matched as a bitmask per
+ * match, so condition lists which get searched in bulk are limited to
+ * this many conditions.
+ */
+#define OTD_MAX_CONDITIONS 64
+
+/* Upper bound on the number of compiled programs cached per instance. */
+#define OTD_COND_CACHE_MAX 64
+
+/*
+ * wait() returns shared tuples of pin values for decoders with up to this
+ * many channels, and shared 'matched' tuples for up to this many conditions.
+ */
+#define OTD_PIN_TUPLE_MAX_CHANNELS 8
+#define OTD_MATCHED_TUPLE_MAX_CONDS 6
+
+/* Number of values in enum otd_output_type. */
+#define OTD_NUM_OUTPUT_TYPES (OTD_OUTPUT_META + 1)
+
+/* Default number of annotations which trigger a batch callback. */
+#define OTD_ANN_BATCH_DEFAULT_MAX_COUNT 4096
+
+/*
+ * Each instance caches the C strings of this many distinct annotation
+ * text lists, of up to this many texts each.
+ */
+#define OTD_ANN_CACHE_SIZE 256
+#define OTD_ANN_CACHE_MAX_TEXTS 8
+
+/*
+ * Maximum number of OTD_OUTPUT_PYTHON items which get collected for a
+ * stacked decoder's decode_batch() method before it is called.
+ */
+#define OTD_DECODE_BATCH_MAX_COUNT 4096
+
+/* Default maximum number of edges which one edges() call returns. */
+#define OTD_EDGES_DEFAULT_MAX_COUNT 1024
+
+/* Default number of asynchronously sent chunks queued per decoder stack. */
+#define OTD_DEFAULT_QUEUE_DEPTH 4
+
+/* Default milliseconds to wait for a worker process, see process.c. */
+#define OTD_PROCESS_DEFAULT_TIMEOUT 10000
+
+/* How the decode() methods of a session's decoder stacks get run. */
+enum otd_exec_mode {
+	/* In a worker thread per stack. */
+	OTD_EXEC_THREAD,
+	/* In greenlets, on the thread which sends the samples. */
+	OTD_EXEC_INLINE,
+	/* In greenlets, on the threads of the worker pool, see pool.c. */
+	OTD_EXEC_POOL,
+	/* In a worker process per stack, see process.c. */
+	OTD_EXEC_PROCESS,
+};
+
+/*
+ * One compiled condition (one dict passed to wait()). All terms of the
+ * condition are folded into bitmasks over PD channel indices. A condition
+ * matches when all of its terms match (logical AND).
+ */
+struct otd_cond {
+	uint64_t level_mask;   /* Channels with 'h' or 'l' terms. */
+	uint64_t level_value;  /* Required levels of those channels. */
+	uint64_t rise_mask;    /* Channels with 'r' terms. */
+	uint64_t fall_mask;    /* Channels with 'f' terms. */
+	uint64_t edge_mask;    /* Channels with 'e' terms. */
+	uint64_t no_edge_mask; /* Channels with 'n' terms. */
+	uint32_t num_terms;
+	uint32_t has_skip;
+	uint32_t always_false;
+	uint32_t reserved;
+};
+
+/* Sample data location of one PD channel referenced by a program. */
+struct otd_cond_chan {
+	uint32_t byte_offset;
+	uint8_t bit_mask;
+	uint8_t channel;
+};
+
+/*
+ * A compiled condition list (the argument of one wait() call). Programs
+ * are cached per decoder instance, keyed on the conditions' structure.
+ * Skip counts are not part of the key, they are per-call parameters.
+ */
+struct otd_cond_program {
+	unsigned int num_conds;
+	/* Number of conditions with at least one term. */
+	unsigned int num_active;
+	/* Whether all conditions which can match only have skip terms. */
+	gboolean pure_skip;
+	/* All channels referenced by any of the conditions. */
+	uint64_t chan_mask;
+	/* Input channels (sample bits) of the referenced channels. */
+	uint64_t input_mask;
+	unsigned int num_chans;
+	struct otd_cond_chan chans[OTD_MAX_COND_CHANNELS];
+	struct otd_cond *conds;
+};
+
+/*
+ * Per-call skip state of one condition. A skip term counts every sample
+ * starting with the sample where wait() was called, so it translates to
+ * an absolute sample number from where the condition can match.
+ */
+struct otd_cond_skip {
 	uint64_t num_samples_to_skip;
-	uint64_t num_samples_already_skipped;
+	uint64_t abs_target_samplenum;
+};
+
+/* Get the pin values of a program's channels in a sample as a bitmask. */
+static inline uint64_t sample_pins_get(const struct otd_cond_program *prog,
+		const uint8_t *sample_pos)
+{
+	const struct otd_cond_chan *chan;
+	uint64_t pins;
+	unsigned int i;
+
+	pins = 0;
+	for (i = 0; i < prog->num_chans; i++) {
+		chan = &prog->chans[i];
+		if (sample_pos[chan->byte_offset] & chan->bit_mask)
+			pins |= (uint64_t)1 << chan->channel;
+	}
+
+	return pins;
+}
+
+/*
+ * Check the level and edge terms of a condition, given the previous and
+ * the current pin values. Skip terms are not considered here.
+ */
+static inline gboolean cond_terms_match(const struct otd_cond *cond,
+		uint64_t old_pins, uint64_t pins)
+{
+	uint64_t edges;
+
+	if (cond->always_false || !cond->num_terms)
+		return FALSE;
+
+	if ((pins ^ cond->level_value) & cond->level_mask)
+		return FALSE;
+
+	edges = old_pins ^ pins;
+	if ((edges & pins & cond->rise_mask) != cond->rise_mask)
+		return FALSE;
+	if ((edges & old_pins & cond->fall_mask) != cond->fall_mask)
+		return FALSE;
+	if ((edges & cond->edge_mask) != cond->edge_mask)
+		return FALSE;
+	if (edges & cond->no_edge_mask)
+		return FALSE;
+
+	return TRUE;
+}
+
+/*
+ * One chunk of sample data as passed to otd_session_send(), shared by all
+ * decoder stacks of the session. See chunk.c. Run-length encoded chunks
+ * (otd_session_send_rle()) have no 'inbuf', but 'run_values' instead.
+ */
+struct otd_chunk {
+	uint64_t abs_start_samplenum;
+	uint64_t abs_end_samplenum;
+	const uint8_t *inbuf;
+	uint64_t inbuflen;
+	uint64_t unitsize;
+	uint64_t num_samples;
+	/* Run-length encoded sample data. */
+	const uint8_t *run_values;
+	uint64_t num_runs;
+	/* Relative position of every run's first sample. */
+	uint64_t *run_starts;
+	uint64_t alloc_runs;
+	/* Transition index, only present for sparse data. */
+	gboolean have_index;
+	/* Whether diffs[] are valid (unitsize <= 8). */
+	gboolean have_diffs;
+	uint64_t num_changes;
+	/* Relative positions of samples which differ from their predecessor. */
+	uint64_t *changes;
+	/* The differing input channels at those positions. */
+	uint64_t *diffs;
+	uint64_t alloc_changes;
+	/* Reference count of chunks sent with otd_session_send_async(). */
+	gint refcount;
+	otd_chunk_release_callback release_cb;
+	void *cb_data;
+	/* Copy of the sample data when no release callback was given. */
+	uint8_t *owned_buf;
+};
+
+/*
+ * Per-channel bit-planes of the current sample chunk, see bitplane.c.
+ * The plane of PD channel n starts at words[n * num_words].
+ */
+struct otd_bitplanes {
+	gboolean valid;
+	uint64_t num_samples;
+	size_t num_words;
+	unsigned int num_planes;
+	uint64_t *words;
+	size_t alloc_words;
 };
 
 /* Custom Python types: */
 
+typedef struct {
+	PyObject_HEAD
+	/* The instance which owns this object, NULL when there is none. */
+	struct otd_decoder_inst *di;
+} otd_Decoder;
+
 typedef struct {
 	PyObject_HEAD
 	struct otd_decoder_inst *di;
@@ -76,28 +293,176 @@ struct otd_session {
 
 	/* List of frontend callbacks to receive decoder output. */
 	GSList *callbacks;
+
+	/* The first callback of 'callbacks' for each output type. */
+	struct otd_pd_callback *callback_table[OTD_NUM_OUTPUT_TYPES];
+
+	/* The chunk of sample data currently being decoded. */
+	struct otd_chunk *chunk;
+
+	/* Maximum number of asynchronously sent chunks per stack. */
+	unsigned int queue_depth;
+
+	/* Frontend callback to receive batches of annotations. */
+	otd_pd_output_batch_callback ann_batch_cb;
+	void *ann_batch_cb_data;
+	size_t ann_batch_max_count;
+
+	/* Size of coalesced binary output blocks, 0 to pass on every put. */
+	size_t bin_buffer_size;
+
+	/* How the decode() methods of the session's stacks get run. */
+	enum otd_exec_mode exec_mode;
+
+	/* Priority of the session's stacks in the worker pool. */
+	int priority;
+
+	/* Hand each chunk to all stacks before waiting for any of them. */
+	gboolean parallel;
+
+	/* Milliseconds to wait for a worker process, 0 to wait forever. */
+	unsigned int process_timeout;
+
+	/* Whether otd_session_start() was called. */
+	gboolean started;
+
+	/*
+	 * The samplerate set before and after the session started (0 if
+	 * none), for the worker processes to set up their stacks.
+	 */
+	uint64_t samplerate[2];
+};
+
+/*
+ * Least recently used cache of converted annotation text lists. Entries
+ * are keyed on the Python strings, which they keep references to.
+ */
+struct otd_ann_cache {
+	GHashTable *entries;
+	GQueue lru;
+	uint64_t hits;
+	uint64_t misses;
+};
+
+/*
+ * Annotations of an instance which were not passed to the batch callback
+ * yet. The texts of all annotations live in one string chunk, and their
+ * (NULL terminated) string vectors back to back in 'texts'.
+ */
+struct otd_ann_batch {
+	/* struct otd_proto_data, one per annotation. */
+	GArray *pdata;
+	/* struct otd_proto_data_annotation, one per annotation. */
+	GArray *anns;
+	/* Index of each annotation's string vector in 'texts'. */
+	GArray *text_idx;
+	GPtrArray *texts;
+	GStringChunk *strings;
+	/* Cached string vectors which got evicted while in this batch. */
+	GPtrArray *retired;
+};
+
+/*
+ * Binary output of an instance which was not passed to the frontend yet.
+ * Consecutive puts of the same output and binary class are appended to
+ * one block, which spans their combined sample range.
+ */
+struct otd_bin_buffer {
+	struct otd_pd_output *pdo;
+	int bin_class;
+	uint64_t start_sample;
+	uint64_t end_sample;
+	GByteArray *data;
 };
 
 /* srd.c */
 OTD_PRIV int otd_decoder_searchpath_add(const char *path);
 
 /* session.c */
+OTD_PRIV int otd_inst_send_meta(struct otd_decoder_inst *di, int key,
+		GVariant *data);
 OTD_PRIV struct otd_pd_callback *otd_pd_output_callback_find(struct otd_session *sess,
 		int output_type);
 
 /* instance.c */
 OTD_PRIV int otd_inst_start(struct otd_decoder_inst *di);
 OTD_PRIV void match_array_free(struct otd_decoder_inst *di);
-OTD_PRIV void condition_list_free(struct otd_decoder_inst *di);
+OTD_PRIV void cond_cache_free(struct otd_decoder_inst *di);
+OTD_PRIV struct otd_cond_program *cond_program_get(struct otd_decoder_inst *di,
+		const struct otd_cond *conds, unsigned int num_conds);
 OTD_PRIV int otd_inst_decode(struct otd_decoder_inst *di,
-		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
-		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize);
+		const struct otd_chunk *chunk);
+OTD_PRIV int otd_inst_decode_push(struct otd_decoder_inst *di,
+		const struct otd_chunk *chunk);
+OTD_PRIV int otd_inst_decode_wait(struct otd_decoder_inst *di);
+OTD_PRIV int otd_inst_decode_async(struct otd_decoder_inst *di,
+		struct otd_chunk *chunk, unsigned int queue_depth);
+OTD_PRIV gboolean otd_inst_queue_next(struct otd_decoder_inst *di);
+OTD_PRIV void otd_inst_queue_done(struct otd_decoder_inst *di,
+		struct otd_chunk *chunk);
+OTD_PRIV int otd_inst_drain(struct otd_decoder_inst *di);
 OTD_PRIV int process_samples_until_condition_match(struct otd_decoder_inst *di, gboolean *found_match);
 OTD_PRIV int otd_inst_flush(struct otd_decoder_inst *di);
 OTD_PRIV int otd_inst_send_eof(struct otd_decoder_inst *di);
 OTD_PRIV int otd_inst_terminate_reset(struct otd_decoder_inst *di);
 OTD_PRIV void otd_inst_free(struct otd_decoder_inst *di);
 OTD_PRIV void otd_inst_free_all(struct otd_session *sess);
+OTD_PRIV void otd_inst_greenlet_resume(struct otd_decoder_inst *di);
+OTD_PRIV void otd_inst_greenlet_stop(struct otd_decoder_inst *di);
+
+/* bitplane.c */
+OTD_PRIV void bitplanes_invalidate(struct otd_decoder_inst *di);
+OTD_PRIV void bitplanes_free(struct otd_decoder_inst *di);
+OTD_PRIV gboolean bitplanes_wanted(const struct otd_decoder_inst *di);
+OTD_PRIV gboolean bitplanes_find_match(struct otd_decoder_inst *di,
+		uint64_t old_pins);
+
+/* pool.c */
+OTD_PRIV void otd_pool_schedule(struct otd_decoder_inst *di);
+OTD_PRIV void otd_pool_run(struct otd_decoder_inst *di);
+OTD_PRIV void otd_pool_wait(struct otd_decoder_inst *di);
+OTD_PRIV void otd_pool_stop(struct otd_decoder_inst *di);
+OTD_PRIV void otd_pool_shutdown(void);
+
+/* process.c */
+OTD_PRIV int otd_process_push(struct otd_decoder_inst *di,
+		const struct otd_chunk *chunk);
+OTD_PRIV void otd_process_wait(struct otd_decoder_inst *di);
+OTD_PRIV void otd_process_eof(struct otd_decoder_inst *di);
+OTD_PRIV void otd_process_meta(struct otd_decoder_inst *di, int key,
+		GVariant *data);
+OTD_PRIV void otd_process_stop(struct otd_decoder_inst *di);
+OTD_PRIV int otd_process_worker_main(void);
+
+/* chunk.c */
+OTD_PRIV void chunk_setup(struct otd_chunk *chunk,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize);
+OTD_PRIV int chunk_setup_rle(struct otd_chunk *chunk,
+		uint64_t abs_start_samplenum, const uint8_t *values,
+		const uint64_t *lengths, uint64_t num_runs, uint64_t unitsize);
+OTD_PRIV void chunk_free(struct otd_chunk *chunk);
+OTD_PRIV struct otd_chunk *chunk_new(uint64_t abs_start_samplenum,
+		uint64_t abs_end_samplenum, const uint8_t *inbuf,
+		uint64_t inbuflen, uint64_t unitsize,
+		otd_chunk_release_callback release_cb, void *cb_data);
+OTD_PRIV struct otd_chunk *chunk_ref(struct otd_chunk *chunk);
+OTD_PRIV void chunk_unref(struct otd_chunk *chunk);
+OTD_PRIV const uint8_t *chunk_run_sample(const struct otd_chunk *chunk,
+		uint64_t pos);
+OTD_PRIV gboolean transitions_find_match(struct otd_decoder_inst *di,
+		uint64_t old_pins);
+
+/* Get a sample of the instance's current chunk, by absolute number. */
+static inline const uint8_t *inst_sample_pos(const struct otd_decoder_inst *di,
+		uint64_t samplenum)
+{
+	if (di->chunk && di->chunk->run_values)
+		return chunk_run_sample(di->chunk,
+			samplenum - di->abs_start_samplenum);
+
+	return di->inbuf + (samplenum - di->abs_start_samplenum) * di->data_unitsize;
+}
 
 /* log.c */
 #if defined(G_OS_WIN32) && (__GNUC__ > 4 || (__GNUC__ == 4 && __GNUC_MINOR__ >= 4))
@@ -119,10 +484,21 @@ OTD_PRIV int otd_log(int loglevel, const char *format, ...) G_GNUC_PRINTF(2, 3);
 
 /* decoder.c */
 OTD_PRIV long otd_decoder_apiver(const struct otd_decoder *d);
+OTD_PRIV size_t otd_decoder_logic_unitsize(const struct otd_decoder *d);
 
 /* type_decoder.c */
 OTD_PRIV PyObject *otd_Decoder_type_new(void);
+OTD_PRIV void otd_Decoder_type_free(void);
 OTD_PRIV const char *output_type_name(unsigned int idx);
+OTD_PRIV void wait_tuples_free(struct otd_decoder_inst *di, gboolean all);
+OTD_PRIV void chunk_views_release(struct otd_decoder_inst *di);
+OTD_PRIV void ann_batch_deliver(struct otd_decoder_inst *di);
+OTD_PRIV void ann_batch_free(struct otd_decoder_inst *di);
+OTD_PRIV void ann_cache_free(struct otd_decoder_inst *di);
+OTD_PRIV void bin_buffer_deliver(struct otd_decoder_inst *di);
+OTD_PRIV void bin_buffer_free(struct otd_decoder_inst *di);
+OTD_PRIV void decode_batch_deliver(struct otd_decoder_inst *di);
+OTD_PRIV void stacked_decode_free(struct otd_decoder_inst *di);
 
 /* type_logic.c */
 OTD_PRIV PyObject *otd_logic_type_new(void);
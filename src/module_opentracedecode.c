@@ -71,6 +71,12 @@ PyMODINIT_FUNC PyInit_opentracedecode(void)
 	if (PyModule_AddIntConstant(mod, "OTD_CONF_SAMPLERATE", OTD_CONF_SAMPLERATE) < 0)
 		goto err_out;
 
+	/*
+	 * The module doesn't declare Py_MOD_GIL_NOT_USED. Its types and the
+	 * decoder instances' Python state rely on the GIL, so a free-threaded
+	 * Python enables the GIL when it imports the module.
+	 */
+
 	mod_opentracedecode = mod;
 
 	PyGILState_Release(gstate);
@@ -31,6 +31,7 @@ OTD_PRIV GSList *searchpaths = NULL;
 /* session.c */
 extern OTD_PRIV GSList *sessions;
 extern OTD_PRIV int max_session_id;
+extern OTD_PRIV GMutex sessions_mutex;
 
 /** @endcond */
 
@@ -343,11 +344,19 @@ static void otd_session_destroy_cb(void *arg, void *ignored)
  */
 OTD_API int otd_exit(void)
 {
+	GSList *l;
+
 	otd_dbg("Exiting libopentracedecode.");
 
-	g_slist_foreach(sessions, otd_session_destroy_cb, NULL);
-	g_slist_free(sessions);
+	g_mutex_lock(&sessions_mutex);
+	l = sessions;
 	sessions = NULL;
+	g_mutex_unlock(&sessions_mutex);
+	g_slist_foreach(l, otd_session_destroy_cb, NULL);
+	g_slist_free(l);
+
+	/* All stacks stopped, the pool's threads can exit. */
+	otd_pool_shutdown();
 
 	otd_decoder_unload_all();
 	g_slist_free_full(searchpaths, g_free);
@@ -357,8 +366,10 @@ OTD_API int otd_exit(void)
 	 * Acquire the GIL, otherwise Py_Finalize() might have issues.
 	 * Ignore the return value, we don't need it here.
 	 */
-	if (Py_IsInitialized())
+	if (Py_IsInitialized()) {
 		(void)PyGILState_Ensure();
+		otd_Decoder_type_free();
+	}
 
 	/* Py_Finalize() returns void, any finalization errors are ignored. */
 	Py_Finalize();
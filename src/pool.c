@@ -0,0 +1,349 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libopentracedecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+
+/**
+ * @file
+ *
+ * Worker pool for decoder stacks.
+ *
+ * Sessions in pool mode (see otd_session_pool_set()) don't start a thread
+ * per decoder stack. Like in inline mode, each stack's decode() method
+ * runs in a greenlet instead, which is pinned to one of a fixed number of
+ * worker threads shared by all sessions. Sending samples to a stack queues
+ * it on its worker, which resumes the greenlet until wait() runs out of
+ * samples again.
+ *
+ * Each worker runs its queued stacks by session priority, and in the
+ * order they were queued within a priority. Since a stack only runs until
+ * it has handled the chunks which were sent to it, sessions of the same
+ * priority take turns chunk by chunk.
+ */
+
+/** @cond PRIVATE */
+
+/* Scheduling states of an instance, see struct otd_decoder_inst. */
+enum {
+	POOL_IDLE,
+	POOL_QUEUED,
+	POOL_RUNNING,
+};
+
+struct otd_pool_worker {
+	GThread *thread;
+	GMutex mutex;
+	GCond cond;
+	/* Instances to run, highest session priority first. */
+	GQueue runnable;
+	/* Number of instances whose greenlets live on this worker. */
+	unsigned int num_insts;
+	gboolean want_exit;
+};
+
+/* Protects the list of workers and their instance counts. */
+static GMutex pool_mutex;
+static GPtrArray *pool_workers = NULL;
+static unsigned int pool_size = 0;
+
+/** @endcond */
+
+/* Queue an instance on its worker, with the worker's mutex held. */
+static void pool_queue(struct otd_pool_worker *w, struct otd_decoder_inst *di)
+{
+	struct otd_decoder_inst *queued;
+	GList *l;
+
+	if (di->pool_state == POOL_RUNNING) {
+		/* Have the worker run it again when it's done. */
+		di->pool_again = TRUE;
+		return;
+	}
+	if (di->pool_state == POOL_QUEUED)
+		return;
+
+	/* Go behind all instances of the same or a higher priority. */
+	for (l = w->runnable.tail; l; l = l->prev) {
+		queued = l->data;
+		if (queued->sess->priority >= di->sess->priority)
+			break;
+	}
+	if (l)
+		g_queue_insert_after(&w->runnable, l, di);
+	else
+		g_queue_push_head(&w->runnable, di);
+	di->pool_state = POOL_QUEUED;
+	g_cond_broadcast(&w->cond);
+}
+
+static gpointer pool_thread(gpointer data)
+{
+	struct otd_pool_worker *w;
+	struct otd_decoder_inst *di;
+	PyGILState_STATE gstate;
+	PyThreadState *tstate;
+
+	w = data;
+
+	/* Keep the thread state which the greenlets belong to. */
+	gstate = PyGILState_Ensure();
+	tstate = PyEval_SaveThread();
+
+	g_mutex_lock(&w->mutex);
+	while (1) {
+		while (!(di = g_queue_pop_head(&w->runnable)) && !w->want_exit)
+			g_cond_wait(&w->cond, &w->mutex);
+		if (!di)
+			break;
+		di->pool_state = POOL_RUNNING;
+		g_mutex_unlock(&w->mutex);
+
+		if (di->pool_stop)
+			otd_inst_greenlet_stop(di);
+		else
+			otd_inst_greenlet_resume(di);
+
+		g_mutex_lock(&w->mutex);
+		di->pool_state = POOL_IDLE;
+		if (di->pool_again) {
+			di->pool_again = FALSE;
+			pool_queue(w, di);
+		}
+		g_cond_broadcast(&w->cond);
+	}
+	g_mutex_unlock(&w->mutex);
+
+	PyEval_RestoreThread(tstate);
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+/* Start the worker threads, with the pool mutex held. */
+static void pool_start(void)
+{
+	struct otd_pool_worker *w;
+	unsigned int i, num_threads;
+	char *name;
+
+	num_threads = pool_size ? pool_size : g_get_num_processors();
+	otd_dbg("Starting worker pool with %u threads.", num_threads);
+
+	pool_workers = g_ptr_array_new();
+	for (i = 0; i < num_threads; i++) {
+		w = g_malloc0(sizeof(*w));
+		g_mutex_init(&w->mutex);
+		g_cond_init(&w->cond);
+		g_queue_init(&w->runnable);
+		name = g_strdup_printf("otd-pool-%u", i);
+		w->thread = g_thread_new(name, pool_thread, w);
+		g_free(name);
+		g_ptr_array_add(pool_workers, w);
+	}
+}
+
+/* Stop the worker threads, with the pool mutex held. */
+static void pool_stop_all(void)
+{
+	struct otd_pool_worker *w;
+	guint i;
+
+	if (!pool_workers)
+		return;
+
+	otd_dbg("Stopping worker pool.");
+
+	for (i = 0; i < pool_workers->len; i++) {
+		w = g_ptr_array_index(pool_workers, i);
+		g_mutex_lock(&w->mutex);
+		w->want_exit = TRUE;
+		g_cond_broadcast(&w->cond);
+		g_mutex_unlock(&w->mutex);
+		(void)g_thread_join(w->thread);
+		g_cond_clear(&w->cond);
+		g_mutex_clear(&w->mutex);
+		g_free(w);
+	}
+	g_ptr_array_free(pool_workers, TRUE);
+	pool_workers = NULL;
+}
+
+/*
+ * Pin an instance to the worker with the least instances, starting
+ * the pool if needed.
+ */
+static void pool_assign(struct otd_decoder_inst *di)
+{
+	struct otd_pool_worker *w, *best;
+	guint i;
+
+	g_mutex_lock(&pool_mutex);
+	if (!pool_workers)
+		pool_start();
+	best = NULL;
+	for (i = 0; i < pool_workers->len; i++) {
+		w = g_ptr_array_index(pool_workers, i);
+		if (!best || w->num_insts < best->num_insts)
+			best = w;
+	}
+	best->num_insts++;
+	di->pool_worker = best;
+	di->pool_state = POOL_IDLE;
+	di->pool_again = FALSE;
+	di->pool_stop = FALSE;
+	g_mutex_unlock(&pool_mutex);
+}
+
+/**
+ * Have the worker pool run an instance's decode() method, until it has
+ * handled all samples which were sent to it. Returns without waiting.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_pool_schedule(struct otd_decoder_inst *di)
+{
+	struct otd_pool_worker *w;
+
+	if (!di->pool_worker)
+		pool_assign(di);
+	w = di->pool_worker;
+
+	g_mutex_lock(&w->mutex);
+	pool_queue(w, di);
+	g_mutex_unlock(&w->mutex);
+}
+
+/**
+ * Have the worker pool run an instance's decode() method, and wait until
+ * it has handled all samples which were sent to it.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_pool_run(struct otd_decoder_inst *di)
+{
+	otd_pool_schedule(di);
+	otd_pool_wait(di);
+}
+
+/**
+ * Wait until the worker pool is done running an instance's decode()
+ * method, see otd_pool_schedule().
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_pool_wait(struct otd_decoder_inst *di)
+{
+	struct otd_pool_worker *w;
+
+	if (!(w = di->pool_worker))
+		return;
+
+	g_mutex_lock(&w->mutex);
+	while (di->pool_state != POOL_IDLE)
+		g_cond_wait(&w->cond, &w->mutex);
+	g_mutex_unlock(&w->mutex);
+}
+
+/**
+ * Terminate an instance's decode() method on its pool thread, and unpin
+ * the instance from the thread.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_pool_stop(struct otd_decoder_inst *di)
+{
+	struct otd_pool_worker *w;
+
+	if (!(w = di->pool_worker))
+		return;
+
+	g_mutex_lock(&w->mutex);
+	di->pool_stop = TRUE;
+	pool_queue(w, di);
+	while (di->pool_state != POOL_IDLE)
+		g_cond_wait(&w->cond, &w->mutex);
+	di->pool_stop = FALSE;
+	g_mutex_unlock(&w->mutex);
+
+	g_mutex_lock(&pool_mutex);
+	w->num_insts--;
+	di->pool_worker = NULL;
+	g_mutex_unlock(&pool_mutex);
+}
+
+/**
+ * Stop the threads of the worker pool.
+ *
+ * All instances must have been stopped before, see otd_pool_stop().
+ *
+ * @private
+ */
+OTD_PRIV void otd_pool_shutdown(void)
+{
+	g_mutex_lock(&pool_mutex);
+	pool_stop_all();
+	g_mutex_unlock(&pool_mutex);
+}
+
+/**
+ * Set the number of threads of the worker pool.
+ *
+ * The pool runs the decoder stacks of all sessions in pool mode (see
+ * otd_session_pool_set()). Its threads get started when the first of
+ * these stacks receives samples, and keep running until otd_exit().
+ *
+ * @param num_threads The number of threads, or 0 for one thread per
+ *                    processor (the default).
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *         OTD_ERR_ARG when stacks are running on the pool.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_pool_size_set(unsigned int num_threads)
+{
+	struct otd_pool_worker *w;
+	guint i;
+
+	g_mutex_lock(&pool_mutex);
+	for (i = 0; pool_workers && i < pool_workers->len; i++) {
+		w = g_ptr_array_index(pool_workers, i);
+		if (w->num_insts) {
+			g_mutex_unlock(&pool_mutex);
+			otd_err("Cannot resize the worker pool while it is in use.");
+			return OTD_ERR_ARG;
+		}
+	}
+
+	/* Idle threads get replaced when the pool is used next. */
+	pool_stop_all();
+	pool_size = num_threads;
+	g_mutex_unlock(&pool_mutex);
+
+	return OTD_OK;
+}
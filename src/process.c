@@ -0,0 +1,1591 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include "libopentracedecode-internal.h" /* First, so we avoid a _POSIX_C_SOURCE warning. */
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <string.h>
+
+#ifdef G_OS_UNIX
+#include <errno.h>
+#include <fcntl.h>
+#include <poll.h>
+#include <signal.h>
+#include <spawn.h>
+#include <sys/mman.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+extern char **environ;
+#endif
+
+/**
+ * @file
+ *
+ * Worker processes for decoder stacks.
+ *
+ * Sessions in process mode (see otd_session_process_set()) run each
+ * decoder stack in a process of its own. The process gets started when
+ * the stack receives samples for the first time. It runs the otd-worker
+ * executable, which gets spawned (not forked), so it doesn't inherit the
+ * state of the frontend's other threads. The parent sends it a
+ * description of the stack: the decoders, their options, channel map,
+ * initial pins and stacking, the session's output callbacks and
+ * metadata. The worker process sets up the same stack from that, and
+ * starts it.
+ *
+ * Sample data gets passed in a shared memory buffer of each process, and
+ * commands and results over a socket. A command has the process decode
+ * the samples in the buffer, handle EOF, or pass on metadata. The process
+ * replies with the output of the stack, one message per otd_proto_data,
+ * followed by a message which completes the command. Log messages of the
+ * process go to the parent as well. The parent passes the output to the
+ * frontend's callbacks in the order it arrives.
+ *
+ * While the stack is busy, a thread of the process reports its progress:
+ * when the stack put output, or its decoders advanced in the samples,
+ * since the last report. When a process dies, or does not report progress
+ * within the session's timeout, it gets killed, and the stack fails like
+ * a decoder which raised an exception. The thread also watches a pipe,
+ * which only the parent has the write end of. The process exits when the
+ * pipe reports EOF, that is when the parent is gone.
+ */
+
+#ifdef G_OS_UNIX
+
+/** @cond PRIVATE */
+
+/* Size of the sample buffer of each worker process. */
+#define PROCESS_SHM_SIZE (4 * 1024 * 1024)
+
+/* Worker processes send their output in messages of about this size. */
+#define PROCESS_MSG_SIZE (64 * 1024)
+
+/*
+ * The file descriptors of the socket, the sample buffer and the read end
+ * of the parent's pipe in the worker.
+ */
+#define WORKER_FD_SOCKET 3
+#define WORKER_FD_SHM 4
+#define WORKER_FD_PARENT 5
+
+/* The longest time between two progress reports of a worker process. */
+#define PROCESS_PROGRESS_MAX_INTERVAL 1000
+
+/*
+ * The description of a stack for the worker process: the log level, the
+ * decoder search paths, the output types the frontend has callbacks for
+ * (bit n for output type n), whether it has a batch callback and its
+ * maximum count, the binary buffer size, the instances (depth first), and
+ * the samplerate set before and after the session started (0 if none).
+ *
+ * Each instance has the name of its decoder's module, the decoder ID,
+ * the instance ID, the options (if any were set), the channel map, the
+ * initial pins, the wanted output types and annotation classes (empty for
+ * all), and the index of the instance it is stacked on (-1 for none).
+ */
+#define PROCESS_CONFIG_TYPE "(iasubtta(sssma{sv}aiayuabi)tt)"
+
+enum {
+	PROCESS_CMD_DECODE,
+	PROCESS_CMD_DECODE_RLE,
+	PROCESS_CMD_EOF,
+	PROCESS_CMD_META,
+};
+
+enum {
+	PROCESS_MSG_OUTPUT,
+	PROCESS_MSG_DONE,
+	PROCESS_MSG_LOG,
+	PROCESS_MSG_PROGRESS,
+};
+
+/* A command from the parent. */
+struct process_cmd {
+	uint32_t type;
+	int32_t key;
+	uint64_t abs_start_samplenum;
+	uint64_t abs_end_samplenum;
+	/* Bytes of sample data, or runs, in the shared buffer. */
+	uint64_t len;
+	uint64_t unitsize;
+	uint64_t value;
+	/* The session's timeout in ms, or 0 for none. */
+	uint64_t timeout;
+};
+
+/*
+ * The header of a message from the worker process. A PROCESS_MSG_DONE
+ * message carries the int32 result of the command, a PROCESS_MSG_LOG
+ * message the int32 log level and the NUL terminated text. A
+ * PROCESS_MSG_PROGRESS message carries nothing.
+ */
+struct process_msg {
+	uint32_t type;
+	/* The number of bytes which follow the header. */
+	uint32_t size;
+};
+
+/*
+ * The payload of a PROCESS_MSG_OUTPUT message. The output data follows:
+ * 'count' NUL terminated annotation texts, binary data, the bitfield of
+ * logic data (see otd_decoder_logic_unitsize()), or the 8 byte value of a
+ * metadata output.
+ */
+struct process_output {
+	/* Index of the putting instance in the stack, depth first. */
+	uint32_t inst;
+	int32_t pdo_id;
+	uint64_t start_sample;
+	uint64_t end_sample;
+	/* The annotation class, binary class or logic group. */
+	int32_t cls;
+	/* The number of annotation texts, or the logic repeat count. */
+	uint64_t count;
+};
+
+struct otd_process {
+	pid_t pid;
+	int fd;
+	/* The end of the parent's pipe, see WORKER_FD_PARENT. */
+	int pipe_fd;
+	uint8_t *shm;
+	/* The instances of the stack, depth first. */
+	GPtrArray *insts;
+	/* Whether a command waits for completion. */
+	gboolean busy;
+	/* The chunk being sent, and the samples or runs sent so far. */
+	const struct otd_chunk *chunk;
+	uint64_t chunk_pos;
+	/* Messages which were received, or which wait to be sent. */
+	GByteArray *buf;
+	/*
+	 * In the worker process: Protects 'buf', the socket's sending
+	 * side, and 'timeout'.
+	 */
+	GMutex lock;
+	/* The timeout of the current command, in ms. */
+	uint64_t timeout;
+	/* A pipe which wakes the watch thread when the timeout changed. */
+	int wake_fds[2];
+	/* Annotation texts for a callback. */
+	GPtrArray *texts;
+	/* Annotations for the batch callback. */
+	struct otd_ann_batch batch;
+};
+
+/** @endcond */
+
+/* Collect the instances of a stack, depth first. */
+static void process_insts_add(GPtrArray *insts, struct otd_decoder_inst *di)
+{
+	GSList *l;
+
+	g_ptr_array_add(insts, di);
+	for (l = di->next_di; l; l = l->next)
+		process_insts_add(insts, l->data);
+}
+
+static struct otd_process *process_new(void)
+{
+	struct otd_process *proc;
+
+	proc = g_malloc0(sizeof(*proc));
+	proc->fd = -1;
+	proc->pipe_fd = -1;
+	proc->wake_fds[0] = proc->wake_fds[1] = -1;
+	g_mutex_init(&proc->lock);
+	proc->insts = g_ptr_array_new();
+	proc->buf = g_byte_array_new();
+	proc->texts = g_ptr_array_new();
+	proc->batch.pdata = g_array_new(FALSE, FALSE, sizeof(struct otd_proto_data));
+	proc->batch.anns = g_array_new(FALSE, FALSE,
+		sizeof(struct otd_proto_data_annotation));
+	proc->batch.text_idx = g_array_new(FALSE, FALSE, sizeof(guint));
+	proc->batch.texts = g_ptr_array_new();
+	proc->batch.strings = g_string_chunk_new(4096);
+
+	return proc;
+}
+
+static void process_free(struct otd_process *proc)
+{
+	if (proc->fd >= 0)
+		close(proc->fd);
+	if (proc->pipe_fd >= 0)
+		close(proc->pipe_fd);
+	if (proc->wake_fds[0] >= 0) {
+		close(proc->wake_fds[0]);
+		close(proc->wake_fds[1]);
+	}
+	g_mutex_clear(&proc->lock);
+	if (proc->shm)
+		munmap(proc->shm, PROCESS_SHM_SIZE);
+	g_ptr_array_free(proc->insts, TRUE);
+	g_byte_array_free(proc->buf, TRUE);
+	g_ptr_array_free(proc->texts, TRUE);
+	g_array_free(proc->batch.pdata, TRUE);
+	g_array_free(proc->batch.anns, TRUE);
+	g_array_free(proc->batch.text_idx, TRUE);
+	g_ptr_array_free(proc->batch.texts, TRUE);
+	g_string_chunk_free(proc->batch.strings);
+	g_free(proc);
+}
+
+static int send_all(int fd, const void *data, size_t len)
+{
+	const uint8_t *p;
+	ssize_t n;
+
+	p = data;
+	while (len) {
+		n = send(fd, p, len, MSG_NOSIGNAL);
+		if (n < 0 && errno == EINTR)
+			continue;
+		if (n <= 0)
+			return OTD_ERR;
+		p += n;
+		len -= n;
+	}
+
+	return OTD_OK;
+}
+
+static int recv_all(int fd, void *data, size_t len)
+{
+	uint8_t *p;
+	ssize_t n;
+
+	p = data;
+	while (len) {
+		n = recv(fd, p, len, 0);
+		if (n < 0 && errno == EINTR)
+			continue;
+		if (n <= 0)
+			return OTD_ERR;
+		p += n;
+		len -= n;
+	}
+
+	return OTD_OK;
+}
+
+/*
+ * Worker process side.
+ */
+
+/*
+ * Send the queued messages to the parent, exit when it is gone. The
+ * caller must hold the lock.
+ */
+static void child_flush(struct otd_process *proc)
+{
+	if (send_all(proc->fd, proc->buf->data, proc->buf->len) != OTD_OK)
+		_exit(1);
+	g_byte_array_set_size(proc->buf, 0);
+}
+
+/* Queue a message, the caller must hold the lock. */
+static void child_msg_queue(struct otd_process *proc, uint32_t type,
+		const void *data, size_t size, const void *extra, size_t extra_size)
+{
+	struct process_msg msg;
+
+	msg.type = type;
+	msg.size = size + extra_size;
+	g_byte_array_append(proc->buf, (const guint8 *)&msg, sizeof(msg));
+	g_byte_array_append(proc->buf, data, size);
+	if (extra_size)
+		g_byte_array_append(proc->buf, extra, extra_size);
+}
+
+static void child_msg_add(struct otd_process *proc, uint32_t type,
+		const void *data, size_t size, const void *extra, size_t extra_size)
+{
+	g_mutex_lock(&proc->lock);
+	child_msg_queue(proc, type, data, size, extra, extra_size);
+	if (proc->buf->len >= PROCESS_MSG_SIZE)
+		child_flush(proc);
+	g_mutex_unlock(&proc->lock);
+}
+
+/* Send the queued messages to the parent. */
+static void child_send(struct otd_process *proc)
+{
+	g_mutex_lock(&proc->lock);
+	child_flush(proc);
+	g_mutex_unlock(&proc->lock);
+}
+
+/*
+ * How far the stack got: the number of put() calls, and the sample
+ * numbers its decoders are at. Changes when the stack makes progress.
+ */
+static uint64_t child_progress(struct otd_process *proc)
+{
+	struct otd_decoder_inst *di;
+	uint64_t progress;
+	guint i;
+
+	progress = 0;
+	for (i = 0; i < proc->insts->len; i++) {
+		di = g_ptr_array_index(proc->insts, i);
+		progress += (guint)g_atomic_int_get(&di->num_puts);
+		g_mutex_lock(&di->data_mutex);
+		progress += di->abs_cur_samplenum;
+		g_mutex_unlock(&di->data_mutex);
+	}
+
+	return progress;
+}
+
+/*
+ * Watch thread of the worker process. Exits the process when the parent
+ * is gone, and reports progress to the parent, several times within the
+ * timeout of the current command.
+ */
+static gpointer child_watch(gpointer data)
+{
+	struct otd_process *proc;
+	struct pollfd pfds[2];
+	uint64_t progress, last;
+	int interval, ret;
+	char c;
+
+	proc = data;
+
+	pfds[0].fd = WORKER_FD_PARENT;
+	pfds[0].events = POLLIN;
+	pfds[1].fd = proc->wake_fds[0];
+	pfds[1].events = POLLIN;
+	last = 0;
+	while (1) {
+		g_mutex_lock(&proc->lock);
+		interval = PROCESS_PROGRESS_MAX_INTERVAL;
+		if (proc->timeout)
+			interval = CLAMP(proc->timeout / 4, 1,
+				PROCESS_PROGRESS_MAX_INTERVAL);
+		g_mutex_unlock(&proc->lock);
+
+		/* The parent never writes, its pipe only reports EOF. */
+		ret = poll(pfds, 2, interval);
+		if (ret < 0 && errno == EINTR)
+			continue;
+		if (ret < 0 || pfds[0].revents)
+			_exit(1);
+		if (pfds[1].revents) {
+			/* The timeout changed, wait for the new interval. */
+			if (read(proc->wake_fds[0], &c, 1) < 0 && errno != EINTR)
+				_exit(1);
+			continue;
+		}
+
+		/* The instances exist once the watched commands come in. */
+		if (!g_atomic_int_get(&proc->busy))
+			continue;
+		progress = child_progress(proc);
+		if (progress == last)
+			continue;
+		last = progress;
+		g_mutex_lock(&proc->lock);
+		child_msg_queue(proc, PROCESS_MSG_PROGRESS, NULL, 0, NULL, 0);
+		child_flush(proc);
+		g_mutex_unlock(&proc->lock);
+	}
+
+	return NULL;
+}
+
+/* Output callback of the worker process, queues the output for the parent. */
+static void child_output_cb(struct otd_proto_data *pdata, void *cb_data)
+{
+	struct otd_process *proc;
+	struct otd_proto_data_annotation *pda;
+	struct otd_proto_data_binary *pdb;
+	struct otd_proto_data_logic *pdl;
+	struct process_output out;
+	GString *texts;
+	GVariant *value;
+	int64_t i64;
+	double dbl;
+	guint i;
+
+	proc = cb_data;
+
+	memset(&out, 0, sizeof(out));
+	for (i = 0; i < proc->insts->len; i++) {
+		if (g_ptr_array_index(proc->insts, i) == pdata->pdo->di)
+			break;
+	}
+	out.inst = i;
+	out.pdo_id = pdata->pdo->pdo_id;
+	out.start_sample = pdata->start_sample;
+	out.end_sample = pdata->end_sample;
+
+	switch (pdata->pdo->output_type) {
+	case OTD_OUTPUT_ANN:
+		pda = pdata->data;
+		out.cls = pda->ann_class;
+		texts = g_string_new(NULL);
+		for (i = 0; pda->ann_text[i]; i++)
+			g_string_append_len(texts, pda->ann_text[i],
+				strlen(pda->ann_text[i]) + 1);
+		out.count = i;
+		child_msg_add(proc, PROCESS_MSG_OUTPUT, &out, sizeof(out),
+			texts->str, texts->len);
+		g_string_free(texts, TRUE);
+		break;
+	case OTD_OUTPUT_BINARY:
+		pdb = pdata->data;
+		out.cls = pdb->bin_class;
+		child_msg_add(proc, PROCESS_MSG_OUTPUT, &out, sizeof(out),
+			pdb->data, pdb->size);
+		break;
+	case OTD_OUTPUT_LOGIC:
+		pdl = pdata->data;
+		out.cls = pdl->logic_group;
+		out.count = pdl->repeat_count;
+		child_msg_add(proc, PROCESS_MSG_OUTPUT, &out, sizeof(out),
+			pdl->data, otd_decoder_logic_unitsize(pdata->pdo->di->decoder));
+		break;
+	case OTD_OUTPUT_META:
+		value = pdata->data;
+		if (g_variant_is_of_type(value, G_VARIANT_TYPE_INT64)) {
+			i64 = g_variant_get_int64(value);
+			child_msg_add(proc, PROCESS_MSG_OUTPUT, &out, sizeof(out),
+				&i64, sizeof(i64));
+		} else if (g_variant_is_of_type(value, G_VARIANT_TYPE_DOUBLE)) {
+			dbl = g_variant_get_double(value);
+			child_msg_add(proc, PROCESS_MSG_OUTPUT, &out, sizeof(out),
+				&dbl, sizeof(dbl));
+		}
+		break;
+	default:
+		/* Python objects don't leave the worker process. */
+		break;
+	}
+}
+
+static void child_batch_cb(struct otd_proto_data *pdata, size_t count,
+		void *cb_data)
+{
+	size_t i;
+
+	for (i = 0; i < count; i++)
+		child_output_cb(&pdata[i], cb_data);
+}
+
+/* Log callback of the worker process, passes the messages to the parent. */
+static int child_log_cb(void *cb_data, int loglevel, const char *format,
+		va_list args)
+{
+	struct otd_process *proc;
+	int32_t level;
+	char *text;
+
+	proc = cb_data;
+
+	level = loglevel;
+	text = g_strdup_vprintf(format, args);
+	child_msg_add(proc, PROCESS_MSG_LOG, &level, sizeof(level),
+		text, strlen(text) + 1);
+	g_free(text);
+
+	return OTD_OK;
+}
+
+/* Receive the description of the stack, see PROCESS_CONFIG_TYPE. */
+static GVariant *child_config_read(struct otd_process *proc)
+{
+	uint64_t size;
+	void *data;
+
+	if (recv_all(proc->fd, &size, sizeof(size)) != OTD_OK)
+		return NULL;
+	data = g_malloc(size);
+	if (recv_all(proc->fd, data, size) != OTD_OK) {
+		g_free(data);
+		return NULL;
+	}
+
+	return g_variant_ref_sink(g_variant_new_from_data(
+		G_VARIANT_TYPE(PROCESS_CONFIG_TYPE), data, size, FALSE,
+		g_free, data));
+}
+
+/* Create a decoder instance as described by the parent. */
+static struct otd_decoder_inst *child_inst_new(struct otd_process *proc,
+		struct otd_session *sess, GVariant *config)
+{
+	struct otd_decoder_inst *di, *parent;
+	GVariant *py_options, *channelmap, *pins, *wanted, *value;
+	GVariantIter iter;
+	GHashTable *options;
+	const char *module, *decoder_id, *inst_id, *key;
+	const int32_t *map;
+	const uint8_t *pin_values;
+	const uint8_t *classes;
+	uint32_t output_types;
+	int32_t parent_idx;
+	gsize n;
+	int i;
+
+	g_variant_get(config, "(&s&s&sm@a{sv}@ai@ayu@abi)", &module,
+		&decoder_id, &inst_id, &py_options, &channelmap, &pins,
+		&output_types, &wanted, &parent_idx);
+
+	di = NULL;
+	if (!otd_decoder_get_by_id(decoder_id) &&
+			otd_decoder_load(module) != OTD_OK)
+		goto out;
+
+	options = NULL;
+	if (py_options) {
+		options = g_hash_table_new_full(g_str_hash, g_str_equal,
+			g_free, (GDestroyNotify)g_variant_unref);
+		g_variant_iter_init(&iter, py_options);
+		while (g_variant_iter_next(&iter, "{&sv}", &key, &value))
+			g_hash_table_insert(options, g_strdup(key), value);
+	}
+	di = otd_inst_new(sess, decoder_id, options);
+	if (options)
+		g_hash_table_destroy(options);
+	if (!di)
+		goto out;
+
+	g_free(di->inst_id);
+	di->inst_id = g_strdup(inst_id);
+
+	map = g_variant_get_fixed_array(channelmap, &n, sizeof(int32_t));
+	for (i = 0; i < di->dec_num_channels && (gsize)i < n; i++)
+		di->dec_channelmap[i] = map[i];
+	pin_values = g_variant_get_fixed_array(pins, &n, sizeof(uint8_t));
+	for (i = 0; i < (int)di->old_pins_array->len && (gsize)i < n; i++)
+		di->old_pins_array->data[i] = pin_values[i];
+
+	di->output_types = output_types;
+	classes = g_variant_get_fixed_array(wanted, &n, sizeof(uint8_t));
+	if (n && (int)n == di->num_ann_classes) {
+		di->ann_classes_wanted = g_malloc(n * sizeof(gboolean));
+		for (i = 0; (gsize)i < n; i++)
+			di->ann_classes_wanted[i] = classes[i];
+	}
+
+	if (parent_idx >= 0 && (guint)parent_idx < proc->insts->len) {
+		parent = g_ptr_array_index(proc->insts, parent_idx);
+		if (otd_inst_stack(sess, parent, di) != OTD_OK)
+			di = NULL;
+	}
+	if (di)
+		g_ptr_array_add(proc->insts, di);
+
+out:
+	if (py_options)
+		g_variant_unref(py_options);
+	g_variant_unref(channelmap);
+	g_variant_unref(pins);
+	g_variant_unref(wanted);
+
+	return di;
+}
+
+/* Set a samplerate which the parent's session got, if any. */
+static int child_samplerate_set(struct otd_session *sess, uint64_t samplerate)
+{
+	if (!samplerate)
+		return OTD_OK;
+
+	return otd_session_metadata_set(sess, OTD_CONF_SAMPLERATE,
+		g_variant_new_uint64(samplerate));
+}
+
+/* Set up and start the stack as described by the parent. */
+static struct otd_decoder_inst *child_stack_new(struct otd_process *proc,
+		GVariant *config)
+{
+	struct otd_session *sess;
+	GVariant *paths, *insts, *inst;
+	GVariantIter iter;
+	const char *path;
+	uint64_t batch_max, bin_size, samplerate[2];
+	uint32_t callbacks;
+	gboolean batch;
+	int32_t loglevel;
+	int i;
+
+	g_variant_get(config, "(i@asubtt@a(sssma{sv}aiayuabi)tt)", &loglevel,
+		&paths, &callbacks, &batch, &batch_max, &bin_size, &insts,
+		&samplerate[0], &samplerate[1]);
+
+	otd_log_loglevel_set(loglevel);
+	sess = NULL;
+	if (otd_init(NULL) != OTD_OK)
+		goto out;
+	g_variant_iter_init(&iter, paths);
+	while (g_variant_iter_next(&iter, "&s", &path)) {
+		if (otd_decoder_searchpath_add(path) != OTD_OK)
+			goto out;
+	}
+
+	otd_session_new(&sess);
+	g_variant_iter_init(&iter, insts);
+	while ((inst = g_variant_iter_next_value(&iter))) {
+		if (!child_inst_new(proc, sess, inst)) {
+			g_variant_unref(inst);
+			goto out;
+		}
+		g_variant_unref(inst);
+	}
+	if (!proc->insts->len)
+		goto out;
+
+	/* Have the output go to the parent, see child_output_cb(). */
+	for (i = 0; i < OTD_NUM_OUTPUT_TYPES; i++) {
+		if (callbacks & (1U << i))
+			otd_pd_output_callback_add(sess, i, child_output_cb, proc);
+	}
+	if (batch)
+		otd_pd_output_batch_callback_add(sess, OTD_OUTPUT_ANN,
+			child_batch_cb, proc, batch_max);
+	otd_session_binary_buffer_set(sess, bin_size);
+
+	if (child_samplerate_set(sess, samplerate[0]) != OTD_OK ||
+			otd_session_start(sess) != OTD_OK ||
+			child_samplerate_set(sess, samplerate[1]) != OTD_OK)
+		goto out;
+
+	g_variant_unref(paths);
+	g_variant_unref(insts);
+
+	return g_ptr_array_index(proc->insts, 0);
+
+out:
+	g_variant_unref(paths);
+	g_variant_unref(insts);
+
+	return NULL;
+}
+
+/* Run the commands of the parent, until it stops the process. */
+static void child_run(struct otd_decoder_inst *di, struct otd_process *proc)
+{
+	struct otd_chunk *chunk;
+	struct process_cmd cmd;
+	GVariant *data;
+	uint64_t max_runs;
+	int32_t ret;
+
+	chunk = g_malloc0(sizeof(*chunk));
+	while (recv_all(proc->fd, &cmd, sizeof(cmd)) == OTD_OK) {
+		if (cmd.timeout != proc->timeout) {
+			g_mutex_lock(&proc->lock);
+			proc->timeout = cmd.timeout;
+			g_mutex_unlock(&proc->lock);
+			if (write(proc->wake_fds[1], "", 1) < 0)
+				_exit(1);
+		}
+		g_atomic_int_set(&proc->busy, TRUE);
+		switch (cmd.type) {
+		case PROCESS_CMD_DECODE:
+			chunk_setup(chunk, cmd.abs_start_samplenum,
+				cmd.abs_end_samplenum, proc->shm, cmd.len,
+				cmd.unitsize);
+			ret = otd_inst_decode(di, chunk);
+			break;
+		case PROCESS_CMD_DECODE_RLE:
+			/* The runs' lengths, followed by their values. */
+			max_runs = PROCESS_SHM_SIZE / (sizeof(uint64_t) + cmd.unitsize);
+			ret = chunk_setup_rle(chunk, cmd.abs_start_samplenum,
+				proc->shm + max_runs * sizeof(uint64_t),
+				(const uint64_t *)proc->shm, cmd.len, cmd.unitsize);
+			if (ret == OTD_OK)
+				ret = otd_inst_decode(di, chunk);
+			break;
+		case PROCESS_CMD_EOF:
+			ret = otd_inst_send_eof(di);
+			break;
+		case PROCESS_CMD_META:
+			data = g_variant_ref_sink(g_variant_new_uint64(cmd.value));
+			ret = otd_inst_send_meta(di, cmd.key, data);
+			g_variant_unref(data);
+			break;
+		default:
+			ret = OTD_ERR_BUG;
+			break;
+		}
+		g_atomic_int_set(&proc->busy, FALSE);
+		child_msg_add(proc, PROCESS_MSG_DONE, &ret, sizeof(ret), NULL, 0);
+		child_send(proc);
+	}
+}
+
+/**
+ * Run a worker process, see src/worker.c. The parent passes the socket,
+ * the sample buffer and the read end of its pipe as file descriptors
+ * WORKER_FD_SOCKET, WORKER_FD_SHM and WORKER_FD_PARENT, and sends the
+ * description of the stack first.
+ *
+ * @return The exit status of the process.
+ *
+ * @private
+ */
+OTD_PRIV int otd_process_worker_main(void)
+{
+	struct otd_process *proc;
+	struct otd_decoder_inst *di;
+	GVariant *config;
+	void *shm;
+
+	proc = process_new();
+	proc->fd = WORKER_FD_SOCKET;
+	proc->pipe_fd = WORKER_FD_PARENT;
+	otd_log_callback_set(child_log_cb, proc);
+	if (pipe(proc->wake_fds) < 0) {
+		otd_err("Failed to create a pipe: %s.", g_strerror(errno));
+		child_send(proc);
+		return 1;
+	}
+	g_thread_unref(g_thread_new("watch", child_watch, proc));
+
+	shm = mmap(NULL, PROCESS_SHM_SIZE, PROT_READ | PROT_WRITE,
+		MAP_SHARED, WORKER_FD_SHM, 0);
+	close(WORKER_FD_SHM);
+	if (shm == MAP_FAILED) {
+		otd_err("Failed to map the sample buffer: %s.",
+			g_strerror(errno));
+		child_send(proc);
+		return 1;
+	}
+	proc->shm = shm;
+
+	if (!(config = child_config_read(proc)))
+		return 1;
+	di = child_stack_new(proc, config);
+	g_variant_unref(config);
+	if (!di) {
+		child_send(proc);
+		return 1;
+	}
+
+	child_run(di, proc);
+
+	/* The parent is gone, or stopped the process. */
+	return 0;
+}
+
+/*
+ * Parent side.
+ */
+
+/* Kill the worker process of an instance, and release it. */
+static int process_kill(struct otd_decoder_inst *di)
+{
+	struct otd_process *proc;
+	int status;
+
+	proc = di->process;
+	kill(proc->pid, SIGKILL);
+	status = 0;
+	while (waitpid(proc->pid, &status, 0) < 0 && errno == EINTR)
+		;
+	process_free(proc);
+	di->process = NULL;
+
+	return status;
+}
+
+/* Describe an instance of the stack for the worker process. */
+static GVariant *process_inst_config(GPtrArray *insts, guint idx)
+{
+	struct otd_decoder_inst *di, *other;
+	GVariantBuilder wanted;
+	const char *pins;
+	gsize num_pins;
+	PyGILState_STATE gstate;
+	char *module;
+	int32_t parent_idx;
+	guint i;
+	int j;
+	GVariant *config;
+
+	di = g_ptr_array_index(insts, idx);
+
+	gstate = PyGILState_Ensure();
+	if (py_attr_as_str(di->decoder->py_mod, "__name__", &module) != OTD_OK)
+		module = g_strdup(di->decoder->id);
+	PyGILState_Release(gstate);
+
+	parent_idx = -1;
+	for (i = 0; i < idx; i++) {
+		other = g_ptr_array_index(insts, i);
+		if (g_slist_find(other->next_di, di))
+			parent_idx = i;
+	}
+
+	/* A reset releases the initial pins, the defaults apply again. */
+	pins = NULL;
+	num_pins = 0;
+	if (di->old_pins_array) {
+		pins = di->old_pins_array->data;
+		num_pins = di->old_pins_array->len;
+	}
+
+	g_variant_builder_init(&wanted, G_VARIANT_TYPE("ab"));
+	for (j = 0; di->ann_classes_wanted && j < di->num_ann_classes; j++)
+		g_variant_builder_add(&wanted, "b", di->ann_classes_wanted[j]);
+
+	config = g_variant_new("(sssm@a{sv}@ai@ayu@abi)", module,
+		di->decoder->id, di->inst_id, di->option_values,
+		g_variant_new_fixed_array(G_VARIANT_TYPE_INT32,
+			di->dec_channelmap, di->dec_num_channels, sizeof(int32_t)),
+		g_variant_new_fixed_array(G_VARIANT_TYPE_BYTE, pins,
+			num_pins, sizeof(uint8_t)),
+		di->output_types, g_variant_builder_end(&wanted), parent_idx);
+	g_free(module);
+
+	return config;
+}
+
+/* Describe the stack for the worker process, see PROCESS_CONFIG_TYPE. */
+static GVariant *process_config(struct otd_decoder_inst *di,
+		GPtrArray *insts)
+{
+	struct otd_session *sess;
+	GVariantBuilder paths, inst_configs;
+	GSList *l, *searchpaths;
+	uint32_t callbacks;
+	guint i;
+
+	sess = di->sess;
+
+	/* The oldest path first, like otd_init() added them. */
+	g_variant_builder_init(&paths, G_VARIANT_TYPE_STRING_ARRAY);
+	searchpaths = g_slist_reverse(otd_searchpaths_get());
+	for (l = searchpaths; l; l = l->next)
+		g_variant_builder_add(&paths, "s", l->data);
+	g_slist_free_full(searchpaths, g_free);
+
+	callbacks = 0;
+	for (i = 0; i < OTD_NUM_OUTPUT_TYPES; i++) {
+		if (sess->callback_table[i])
+			callbacks |= 1U << i;
+	}
+
+	g_variant_builder_init(&inst_configs,
+		G_VARIANT_TYPE("a(sssma{sv}aiayuabi)"));
+	for (i = 0; i < insts->len; i++)
+		g_variant_builder_add_value(&inst_configs,
+			process_inst_config(insts, i));
+
+	return g_variant_ref_sink(g_variant_new("(i@asubtt@a(sssma{sv}aiayuabi)tt)",
+		otd_log_loglevel_get(), g_variant_builder_end(&paths), callbacks,
+		sess->ann_batch_cb != NULL, (uint64_t)sess->ann_batch_max_count,
+		(uint64_t)sess->bin_buffer_size,
+		g_variant_builder_end(&inst_configs),
+		sess->samplerate[0], sess->samplerate[1]));
+}
+
+/* Create the shared sample buffer of a worker process. */
+static int process_shm_new(void)
+{
+	static gint count = 0;
+	char *name;
+	int fd;
+
+	do {
+		name = g_strdup_printf("/otd-%ld-%d", (long)getpid(),
+			g_atomic_int_add(&count, 1));
+		fd = shm_open(name, O_RDWR | O_CREAT | O_EXCL, 0600);
+		if (fd >= 0)
+			shm_unlink(name);
+		g_free(name);
+	} while (fd < 0 && errno == EEXIST);
+	if (fd < 0)
+		return -1;
+
+	if (ftruncate(fd, PROCESS_SHM_SIZE) < 0 ||
+			fcntl(fd, F_SETFD, FD_CLOEXEC) < 0) {
+		close(fd);
+		return -1;
+	}
+
+	return fd;
+}
+
+/*
+ * Move a file descriptor above those which the worker process gets, so
+ * posix_spawn() can dup2() it to them. Keeps FD_CLOEXEC set for the
+ * processes which other threads may start meanwhile.
+ */
+static int process_fd_move(int fd)
+{
+	int new_fd;
+
+	if (fd > WORKER_FD_PARENT)
+		return fd;
+	new_fd = fcntl(fd, F_DUPFD_CLOEXEC, WORKER_FD_PARENT + 1);
+	close(fd);
+
+	return new_fd;
+}
+
+/* Spawn the worker process of a stack, and have it set up the stack. */
+static int process_start(struct otd_decoder_inst *di)
+{
+	struct otd_process *proc;
+	posix_spawn_file_actions_t actions;
+	GVariant *config;
+	const char *path;
+	char *argv[2];
+	uint64_t size;
+	pid_t pid;
+	int fds[2], pipe_fds[2], shm_fd, ret;
+	void *shm;
+
+	if ((shm_fd = process_shm_new()) < 0 ||
+			(shm_fd = process_fd_move(shm_fd)) < 0) {
+		otd_err("%s: Failed to create a sample buffer: %s.",
+			di->inst_id, g_strerror(errno));
+		return OTD_ERR_MALLOC;
+	}
+	shm = mmap(NULL, PROCESS_SHM_SIZE, PROT_READ | PROT_WRITE,
+		MAP_SHARED, shm_fd, 0);
+	if (shm == MAP_FAILED) {
+		otd_err("%s: Failed to map a sample buffer: %s.", di->inst_id,
+			g_strerror(errno));
+		close(shm_fd);
+		return OTD_ERR_MALLOC;
+	}
+	if (socketpair(AF_UNIX, SOCK_STREAM, 0, fds) < 0) {
+		otd_err("%s: Failed to create a socket pair: %s.", di->inst_id,
+			g_strerror(errno));
+		munmap(shm, PROCESS_SHM_SIZE);
+		close(shm_fd);
+		return OTD_ERR;
+	}
+	fcntl(fds[0], F_SETFD, FD_CLOEXEC);
+	fcntl(fds[1], F_SETFD, FD_CLOEXEC);
+	fds[1] = process_fd_move(fds[1]);
+
+	/* The worker process watches the pipe for EOF, see child_watch(). */
+	if (pipe(pipe_fds) < 0) {
+		otd_err("%s: Failed to create a pipe: %s.", di->inst_id,
+			g_strerror(errno));
+		munmap(shm, PROCESS_SHM_SIZE);
+		close(shm_fd);
+		close(fds[0]);
+		if (fds[1] >= 0)
+			close(fds[1]);
+		return OTD_ERR;
+	}
+	fcntl(pipe_fds[0], F_SETFD, FD_CLOEXEC);
+	fcntl(pipe_fds[1], F_SETFD, FD_CLOEXEC);
+	pipe_fds[0] = process_fd_move(pipe_fds[0]);
+
+	proc = process_new();
+	proc->fd = fds[0];
+	proc->pipe_fd = pipe_fds[1];
+	proc->shm = shm;
+	process_insts_add(proc->insts, di);
+
+	/* The environment variable is for running uninstalled. */
+	if (!(path = g_getenv("OPENTRACEDECODE_WORKER")))
+		path = OTD_WORKER_PATH;
+	otd_dbg("%s: Starting worker process %s.", di->inst_id, path);
+
+	argv[0] = (char *)path;
+	argv[1] = NULL;
+	posix_spawn_file_actions_init(&actions);
+	posix_spawn_file_actions_adddup2(&actions, fds[1], WORKER_FD_SOCKET);
+	posix_spawn_file_actions_adddup2(&actions, shm_fd, WORKER_FD_SHM);
+	posix_spawn_file_actions_adddup2(&actions, pipe_fds[0],
+		WORKER_FD_PARENT);
+	ret = fds[1] < 0 || pipe_fds[0] < 0 ? EBADF :
+		posix_spawn(&pid, path, &actions, NULL, argv, environ);
+	posix_spawn_file_actions_destroy(&actions);
+	if (fds[1] >= 0)
+		close(fds[1]);
+	if (pipe_fds[0] >= 0)
+		close(pipe_fds[0]);
+	close(shm_fd);
+	if (ret != 0) {
+		otd_err("%s: Failed to start worker process %s: %s.",
+			di->inst_id, path, g_strerror(ret));
+		process_free(proc);
+		return OTD_ERR;
+	}
+	proc->pid = pid;
+
+	/* A process which fails to set up the stack exits. */
+	config = process_config(di, proc->insts);
+	size = g_variant_get_size(config);
+	ret = send_all(proc->fd, &size, sizeof(size));
+	if (ret == OTD_OK)
+		ret = send_all(proc->fd, g_variant_get_data(config), size);
+	g_variant_unref(config);
+	di->process = proc;
+	if (ret != OTD_OK) {
+		otd_err("%s: Failed to set up worker process.", di->inst_id);
+		process_kill(di);
+		return OTD_ERR;
+	}
+
+	return OTD_OK;
+}
+
+/* Have the stack fail after its worker process died or hung. */
+static void process_fail(struct otd_decoder_inst *di)
+{
+	int status;
+
+	status = process_kill(di);
+	if (WIFSIGNALED(status) && WTERMSIG(status) != SIGKILL)
+		otd_err("%s: Worker process terminated by signal %d.",
+			di->inst_id, WTERMSIG(status));
+	else if (WIFEXITED(status))
+		otd_err("%s: Worker process exited with status %d.",
+			di->inst_id, WEXITSTATUS(status));
+
+	di->decoder_state = OTD_ERR;
+	di->want_wait_terminate = TRUE;
+}
+
+static int process_command(struct otd_decoder_inst *di,
+		struct process_cmd *cmd)
+{
+	cmd->timeout = di->sess->process_timeout;
+	if (send_all(di->process->fd, cmd, sizeof(*cmd)) != OTD_OK)
+		return OTD_ERR;
+	di->process->busy = TRUE;
+
+	return OTD_OK;
+}
+
+/* Copy the next part of the chunk to the shared buffer, and decode it. */
+static int process_send_samples(struct otd_decoder_inst *di)
+{
+	struct otd_process *proc;
+	const struct otd_chunk *chunk;
+	struct process_cmd cmd;
+	uint64_t max, offset, n, i, len, *lengths;
+	uint8_t *values;
+
+	proc = di->process;
+	chunk = proc->chunk;
+
+	memset(&cmd, 0, sizeof(cmd));
+	cmd.unitsize = chunk->unitsize;
+
+	if (!chunk->run_values) {
+		cmd.type = PROCESS_CMD_DECODE;
+		max = PROCESS_SHM_SIZE / chunk->unitsize;
+		if (!max) {
+			otd_err("%s: Unit size too large for the worker process.",
+				di->inst_id);
+			return OTD_ERR_ARG;
+		}
+		offset = proc->chunk_pos * chunk->unitsize;
+		cmd.abs_start_samplenum = chunk->abs_start_samplenum + proc->chunk_pos;
+		if (chunk->num_samples - proc->chunk_pos <= max) {
+			/* The rest of the chunk. */
+			n = chunk->num_samples - proc->chunk_pos;
+			cmd.abs_end_samplenum = chunk->abs_end_samplenum;
+			cmd.len = MIN(chunk->inbuflen - offset, max * chunk->unitsize);
+		} else {
+			n = max;
+			cmd.abs_end_samplenum = cmd.abs_start_samplenum + n;
+			cmd.len = n * chunk->unitsize;
+		}
+		memcpy(proc->shm, chunk->inbuf + offset, cmd.len);
+		proc->chunk_pos += n;
+		if (proc->chunk_pos >= chunk->num_samples)
+			proc->chunk = NULL;
+	} else {
+		/* Pass the runs' lengths, leave out those of length zero. */
+		cmd.type = PROCESS_CMD_DECODE_RLE;
+		max = PROCESS_SHM_SIZE / (sizeof(uint64_t) + chunk->unitsize);
+		if (!max) {
+			otd_err("%s: Unit size too large for the worker process.",
+				di->inst_id);
+			return OTD_ERR_ARG;
+		}
+		lengths = (uint64_t *)proc->shm;
+		values = proc->shm + max * sizeof(uint64_t);
+		cmd.abs_start_samplenum = chunk->abs_start_samplenum +
+			chunk->run_starts[proc->chunk_pos];
+		n = 0;
+		for (i = proc->chunk_pos; i < chunk->num_runs && n < max; i++) {
+			if (i + 1 < chunk->num_runs)
+				len = chunk->run_starts[i + 1] - chunk->run_starts[i];
+			else
+				len = chunk->num_samples - chunk->run_starts[i];
+			if (!len)
+				continue;
+			lengths[n] = len;
+			memcpy(values + n * chunk->unitsize,
+				chunk->run_values + i * chunk->unitsize,
+				chunk->unitsize);
+			n++;
+		}
+		cmd.len = n;
+		proc->chunk_pos = i;
+		if (i >= chunk->num_runs ||
+				chunk->run_starts[i] >= chunk->num_samples)
+			proc->chunk = NULL;
+		if (!n)
+			return OTD_OK;
+	}
+
+	return process_command(di, &cmd);
+}
+
+/* Pass collected annotations to the frontend's batch callback. */
+static void process_batch_deliver(struct otd_decoder_inst *di)
+{
+	struct otd_session *sess;
+	struct otd_ann_batch *batch;
+	struct otd_proto_data *pdata;
+	struct otd_proto_data_annotation *anns;
+	guint i, idx;
+
+	sess = di->sess;
+	batch = &di->process->batch;
+	if (!batch->pdata->len)
+		return;
+
+	pdata = (struct otd_proto_data *)batch->pdata->data;
+	anns = (struct otd_proto_data_annotation *)batch->anns->data;
+	for (i = 0; i < batch->pdata->len; i++) {
+		idx = g_array_index(batch->text_idx, guint, i);
+		anns[i].ann_text = (char **)&batch->texts->pdata[idx];
+		pdata[i].data = &anns[i];
+	}
+	sess->ann_batch_cb(pdata, batch->pdata->len, sess->ann_batch_cb_data);
+
+	g_array_set_size(batch->pdata, 0);
+	g_array_set_size(batch->anns, 0);
+	g_array_set_size(batch->text_idx, 0);
+	g_ptr_array_set_size(batch->texts, 0);
+	g_string_chunk_clear(batch->strings);
+}
+
+/* Split the NUL terminated texts of an annotation, into 'texts'. */
+static int process_texts_get(const char *data, size_t size, uint64_t count,
+		GPtrArray *texts)
+{
+	const char *end;
+	uint64_t i;
+
+	for (i = 0; i < count; i++) {
+		if (!(end = memchr(data, 0, size)))
+			return OTD_ERR;
+		g_ptr_array_add(texts, (char *)data);
+		size -= end + 1 - data;
+		data = end + 1;
+	}
+	g_ptr_array_add(texts, NULL);
+
+	return OTD_OK;
+}
+
+/* Pass one output message of the worker process to the frontend. */
+static int process_output(struct otd_decoder_inst *di, const uint8_t *payload,
+		size_t size)
+{
+	struct otd_process *proc;
+	struct otd_session *sess;
+	struct otd_decoder_inst *out_di;
+	struct otd_pd_output *pdo;
+	struct otd_pd_callback *cb;
+	struct otd_proto_data pdata;
+	struct otd_proto_data_annotation pda;
+	struct otd_proto_data_binary pdb;
+	struct otd_proto_data_logic pdl;
+	struct process_output out;
+	const uint8_t *data;
+	GVariant *value;
+	guint i, idx;
+	int64_t i64;
+	double dbl;
+
+	proc = di->process;
+	sess = di->sess;
+
+	if (size < sizeof(out))
+		return OTD_ERR;
+	memcpy(&out, payload, sizeof(out));
+	data = payload + sizeof(out);
+	size -= sizeof(out);
+
+	if (out.inst >= proc->insts->len)
+		return OTD_ERR;
+	out_di = g_ptr_array_index(proc->insts, out.inst);
+	if (out.pdo_id < 0 || (guint)out.pdo_id >= out_di->pd_output_table->len)
+		return OTD_ERR;
+	pdo = g_ptr_array_index(out_di->pd_output_table, out.pdo_id);
+
+	pdata.start_sample = out.start_sample;
+	pdata.end_sample = out.end_sample;
+	pdata.pdo = pdo;
+
+	if (pdo->output_type == OTD_OUTPUT_ANN && sess->ann_batch_cb) {
+		/* Collect the annotation, deliver full batches. */
+		idx = proc->batch.texts->len;
+		if (process_texts_get((const char *)data, size, out.count,
+				proc->batch.texts) != OTD_OK)
+			return OTD_ERR;
+		for (i = idx; i + 1 < proc->batch.texts->len; i++) {
+			proc->batch.texts->pdata[i] = g_string_chunk_insert(
+				proc->batch.strings, proc->batch.texts->pdata[i]);
+		}
+		pdata.data = NULL;
+		pda.ann_class = out.cls;
+		pda.ann_text = NULL;
+		g_array_append_val(proc->batch.pdata, pdata);
+		g_array_append_val(proc->batch.anns, pda);
+		g_array_append_val(proc->batch.text_idx, idx);
+		if (proc->batch.pdata->len >= sess->ann_batch_max_count)
+			process_batch_deliver(di);
+		return OTD_OK;
+	}
+
+	if (!(cb = otd_pd_output_callback_find(sess, pdo->output_type)))
+		return OTD_OK;
+
+	switch (pdo->output_type) {
+	case OTD_OUTPUT_ANN:
+		g_ptr_array_set_size(proc->texts, 0);
+		if (process_texts_get((const char *)data, size, out.count,
+				proc->texts) != OTD_OK)
+			return OTD_ERR;
+		pda.ann_class = out.cls;
+		pda.ann_text = (char **)proc->texts->pdata;
+		pdata.data = &pda;
+		cb->cb(&pdata, cb->cb_data);
+		break;
+	case OTD_OUTPUT_BINARY:
+		pdb.bin_class = out.cls;
+		pdb.size = size;
+		pdb.data = data;
+		pdata.data = &pdb;
+		cb->cb(&pdata, cb->cb_data);
+		break;
+	case OTD_OUTPUT_LOGIC:
+		if (size != otd_decoder_logic_unitsize(pdo->di->decoder))
+			return OTD_ERR;
+		pdl.logic_group = out.cls;
+		pdl.repeat_count = out.count;
+		pdl.data = data;
+		pdata.data = &pdl;
+		cb->cb(&pdata, cb->cb_data);
+		break;
+	case OTD_OUTPUT_META:
+		if (size < sizeof(i64))
+			return OTD_ERR;
+		if (g_variant_type_equal(pdo->meta_type, G_VARIANT_TYPE_INT64)) {
+			memcpy(&i64, data, sizeof(i64));
+			value = g_variant_new_int64(i64);
+		} else {
+			memcpy(&dbl, data, sizeof(dbl));
+			value = g_variant_new_double(dbl);
+		}
+		pdata.data = g_variant_ref_sink(value);
+		cb->cb(&pdata, cb->cb_data);
+		g_variant_unref(value);
+		break;
+	default:
+		break;
+	}
+
+	return OTD_OK;
+}
+
+/* Log a message of the worker process. */
+static int process_log(const uint8_t *payload, size_t size)
+{
+	int32_t loglevel;
+
+	if (size <= sizeof(loglevel) || payload[size - 1])
+		return OTD_ERR;
+	memcpy(&loglevel, payload, sizeof(loglevel));
+	otd_log(loglevel, "%s", (const char *)payload + sizeof(loglevel));
+
+	return OTD_OK;
+}
+
+/*
+ * Pass the output of the worker process to the frontend, until the
+ * current command is complete. Returns the result of the command in
+ * 'result'.
+ */
+static int process_receive(struct otd_decoder_inst *di, int32_t *result)
+{
+	struct otd_process *proc;
+	struct process_msg msg;
+	const uint8_t *payload;
+	size_t pos, len;
+	ssize_t n;
+	struct pollfd pfd;
+	int timeout, ret;
+
+	proc = di->process;
+	timeout = di->sess->process_timeout ? (int)di->sess->process_timeout : -1;
+
+	while (1) {
+		/* Handle all complete messages. */
+		pos = 0;
+		while (proc->buf->len - pos >= sizeof(msg)) {
+			memcpy(&msg, proc->buf->data + pos, sizeof(msg));
+			if (proc->buf->len - pos - sizeof(msg) < msg.size)
+				break;
+			payload = proc->buf->data + pos + sizeof(msg);
+			pos += sizeof(msg) + msg.size;
+			if (msg.type == PROCESS_MSG_DONE) {
+				if (msg.size < sizeof(*result))
+					return OTD_ERR;
+				memcpy(result, payload, sizeof(*result));
+				g_byte_array_remove_range(proc->buf, 0, pos);
+				return OTD_OK;
+			}
+			if (msg.type == PROCESS_MSG_PROGRESS)
+				/* Only resets the timeout. */
+				ret = OTD_OK;
+			else if (msg.type == PROCESS_MSG_LOG)
+				ret = process_log(payload, msg.size);
+			else
+				ret = process_output(di, payload, msg.size);
+			if (ret != OTD_OK) {
+				otd_err("%s: Invalid output from the worker process.",
+					di->inst_id);
+				return OTD_ERR;
+			}
+		}
+		g_byte_array_remove_range(proc->buf, 0, pos);
+
+		/* Receive more. */
+		pfd.fd = proc->fd;
+		pfd.events = POLLIN;
+		ret = poll(&pfd, 1, timeout);
+		if (ret < 0 && errno == EINTR)
+			continue;
+		if (ret == 0) {
+			otd_err("%s: Worker process made no progress for %d ms.",
+				di->inst_id, timeout);
+			return OTD_ERR;
+		}
+		if (ret < 0)
+			return OTD_ERR;
+		len = proc->buf->len;
+		g_byte_array_set_size(proc->buf, len + PROCESS_MSG_SIZE);
+		n = recv(proc->fd, proc->buf->data + len, PROCESS_MSG_SIZE, 0);
+		g_byte_array_set_size(proc->buf, len + MAX(n, 0));
+		if (n < 0 && errno == EINTR)
+			continue;
+		if (n <= 0)
+			return OTD_ERR;
+	}
+}
+
+/**
+ * Have the worker process of a decoder stack decode a chunk of samples,
+ * starting the process if needed. Returns without waiting.
+ *
+ * @param di The bottom decoder instance of the stack. Must not be NULL.
+ * @param chunk The chunk to decode. Must not be NULL. Its sample data
+ *              must be valid until otd_process_wait() returns.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @private
+ */
+OTD_PRIV int otd_process_push(struct otd_decoder_inst *di,
+		const struct otd_chunk *chunk)
+{
+	int ret;
+
+	if (di->want_wait_terminate)
+		return OTD_OK;
+
+	if (!di->process && (ret = process_start(di)) != OTD_OK)
+		return ret;
+
+	di->abs_cur_samplenum = chunk->abs_end_samplenum;
+	di->process->chunk = chunk;
+	di->process->chunk_pos = 0;
+	if ((ret = process_send_samples(di)) == OTD_ERR_ARG)
+		return ret;
+	if (ret != OTD_OK)
+		process_fail(di);
+
+	return OTD_OK;
+}
+
+/**
+ * Wait until the worker process of a decoder stack has handled the
+ * samples, metadata or EOF which were sent to it, and pass its output to
+ * the frontend.
+ *
+ * @param di The bottom decoder instance of the stack. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_process_wait(struct otd_decoder_inst *di)
+{
+	struct otd_process *proc;
+	int32_t result;
+
+	while ((proc = di->process) && proc->busy) {
+		if (process_receive(di, &result) != OTD_OK) {
+			process_fail(di);
+			return;
+		}
+		proc->busy = FALSE;
+		if (di->sess->ann_batch_cb)
+			process_batch_deliver(di);
+		if (result != OTD_OK) {
+			/* A decoder raised an exception. */
+			proc->chunk = NULL;
+			di->decoder_state = OTD_ERR;
+			di->want_wait_terminate = TRUE;
+			return;
+		}
+		if (proc->chunk && process_send_samples(di) != OTD_OK) {
+			process_fail(di);
+			return;
+		}
+	}
+}
+
+/**
+ * Have the worker process of a decoder stack handle EOF, and wait for it.
+ *
+ * @param di The bottom decoder instance of the stack. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_process_eof(struct otd_decoder_inst *di)
+{
+	struct process_cmd cmd;
+
+	if (!di->process || di->want_wait_terminate)
+		return;
+
+	memset(&cmd, 0, sizeof(cmd));
+	cmd.type = PROCESS_CMD_EOF;
+	if (process_command(di, &cmd) != OTD_OK) {
+		process_fail(di);
+		return;
+	}
+	otd_process_wait(di);
+
+	/* Like the worker thread, the stack is done now. */
+	di->want_wait_terminate = TRUE;
+}
+
+/**
+ * Pass metadata to the worker process of a decoder stack, and wait until
+ * it was handled.
+ *
+ * @param di The bottom decoder instance of the stack. Must not be NULL.
+ *           Must have a worker process.
+ * @param key The configuration key (OTD_CONF_*).
+ * @param data The value, a uint64. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_process_meta(struct otd_decoder_inst *di, int key,
+		GVariant *data)
+{
+	struct process_cmd cmd;
+
+	if (di->want_wait_terminate)
+		return;
+
+	memset(&cmd, 0, sizeof(cmd));
+	cmd.type = PROCESS_CMD_META;
+	cmd.key = key;
+	cmd.value = g_variant_get_uint64(data);
+	if (process_command(di, &cmd) != OTD_OK) {
+		process_fail(di);
+		return;
+	}
+	otd_process_wait(di);
+}
+
+/**
+ * Kill the worker process of a decoder stack.
+ *
+ * @param di The bottom decoder instance of the stack. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void otd_process_stop(struct otd_decoder_inst *di)
+{
+	if (!di->process)
+		return;
+
+	otd_dbg("%s: Stopping worker process %ld.", di->inst_id,
+		(long)di->process->pid);
+	process_kill(di);
+}
+
+#else
+
+/* Sessions can't enter process mode without posix_spawn(). */
+
+OTD_PRIV int otd_process_push(struct otd_decoder_inst *di,
+		const struct otd_chunk *chunk)
+{
+	(void)di;
+	(void)chunk;
+
+	return OTD_ERR_BUG;
+}
+
+OTD_PRIV void otd_process_wait(struct otd_decoder_inst *di)
+{
+	(void)di;
+}
+
+OTD_PRIV void otd_process_eof(struct otd_decoder_inst *di)
+{
+	(void)di;
+}
+
+OTD_PRIV void otd_process_meta(struct otd_decoder_inst *di, int key,
+		GVariant *data)
+{
+	(void)di;
+	(void)key;
+	(void)data;
+}
+
+OTD_PRIV void otd_process_stop(struct otd_decoder_inst *di)
+{
+	(void)di;
+}
+
+OTD_PRIV int otd_process_worker_main(void)
+{
+	return 1;
+}
+
+#endif
@@ -42,6 +42,8 @@
 
 OTD_PRIV GSList *sessions = NULL;
 OTD_PRIV int max_session_id = -1;
+/* Protects the above, sessions get created and destroyed by any thread. */
+OTD_PRIV GMutex sessions_mutex;
 
 /** @endcond */
 
@@ -64,11 +66,28 @@ OTD_API int otd_session_new(struct otd_session **sess)
 		return OTD_ERR_ARG;
 
 	*sess = g_malloc(sizeof(struct otd_session));
+	g_mutex_lock(&sessions_mutex);
 	(*sess)->session_id = ++max_session_id;
+	g_mutex_unlock(&sessions_mutex);
 	(*sess)->di_list = (*sess)->callbacks = NULL;
+	memset((*sess)->callback_table, 0, sizeof((*sess)->callback_table));
+	(*sess)->chunk = NULL;
+	(*sess)->queue_depth = OTD_DEFAULT_QUEUE_DEPTH;
+	(*sess)->ann_batch_cb = NULL;
+	(*sess)->ann_batch_cb_data = NULL;
+	(*sess)->ann_batch_max_count = OTD_ANN_BATCH_DEFAULT_MAX_COUNT;
+	(*sess)->bin_buffer_size = 0;
+	(*sess)->exec_mode = OTD_EXEC_THREAD;
+	(*sess)->priority = 0;
+	(*sess)->parallel = FALSE;
+	(*sess)->process_timeout = OTD_PROCESS_DEFAULT_TIMEOUT;
+	(*sess)->started = FALSE;
+	(*sess)->samplerate[0] = (*sess)->samplerate[1] = 0;
 
 	/* Keep a list of all sessions, so we can clean up as needed. */
+	g_mutex_lock(&sessions_mutex);
 	sessions = g_slist_append(sessions, *sess);
+	g_mutex_unlock(&sessions_mutex);
 
 	otd_dbg("Creating session %d.", (*sess)->session_id);
 
@@ -98,6 +117,8 @@ OTD_API int otd_session_start(struct otd_session *sess)
 
 	otd_dbg("Calling start() of all instances in session %d.", sess->session_id);
 
+	sess->started = TRUE;
+
 	/* Run the start() method of all decoders receiving frontend data. */
 	ret = OTD_OK;
 	for (d = sess->di_list; d; d = d->next) {
@@ -109,7 +130,8 @@ OTD_API int otd_session_start(struct otd_session *sess)
 	return ret;
 }
 
-static int otd_inst_send_meta(struct otd_decoder_inst *di, int key,
+/** @private */
+OTD_PRIV int otd_inst_send_meta(struct otd_decoder_inst *di, int key,
 		GVariant *data)
 {
 	PyObject *py_ret;
@@ -122,6 +144,13 @@ static int otd_inst_send_meta(struct otd_decoder_inst *di, int key,
 		/* This is the only key we pass on to the decoder for now. */
 		return OTD_OK;
 
+	/*
+	 * A worker process passes the metadata on to its stack. The
+	 * instances here keep it for processes which get started later.
+	 */
+	if (di->process)
+		otd_process_meta(di, key, data);
+
 	gstate = PyGILState_Ensure();
 
 	if (PyObject_HasAttrString(di->py_inst, "metadata")) {
@@ -190,17 +219,54 @@ OTD_API int otd_session_metadata_set(struct otd_session *sess, int key,
 	otd_dbg("Setting session %d samplerate to %"G_GUINT64_FORMAT".",
 			sess->session_id, g_variant_get_uint64(data));
 
-	ret = OTD_OK;
-	for (l = sess->di_list; l; l = l->next) {
+	/* Metadata applies after all previously sent samples. */
+	ret = otd_session_drain(sess);
+	for (l = sess->di_list; l && ret == OTD_OK; l = l->next) {
 		if ((ret = otd_inst_send_meta(l->data, key, data)) != OTD_OK)
 			break;
 	}
 
+	/* Worker processes which start later set it up the same way. */
+	sess->samplerate[sess->started ? 1 : 0] = g_variant_get_uint64(data);
+
 	g_variant_unref(data);
 
 	return ret;
 }
 
+/* Have all decoder stacks of the session decode the session's chunk. */
+static int session_send_chunk(struct otd_session *sess)
+{
+	GSList *d, *pushed;
+	int ret, wait_ret;
+
+	/* Previously queued chunks go first. */
+	if ((ret = otd_session_drain(sess)) != OTD_OK)
+		return ret;
+
+	if (!sess->parallel) {
+		for (d = sess->di_list; d; d = d->next) {
+			if ((ret = otd_inst_decode(d->data, sess->chunk)) != OTD_OK)
+				return ret;
+		}
+		return OTD_OK;
+	}
+
+	/* Let all stacks work on the chunk, then wait for each of them. */
+	for (d = sess->di_list; d; d = d->next) {
+		if ((ret = otd_inst_decode_push(d->data, sess->chunk)) != OTD_OK)
+			break;
+	}
+	pushed = d;
+	for (d = sess->di_list; d != pushed; d = d->next) {
+		wait_ret = otd_inst_decode_wait(d->data);
+		if (ret == OTD_OK)
+			ret = wait_ret;
+	}
+
+	return ret;
+}
+
 /**
  * Send a chunk of logic sample data to a running decoder session.
  *
@@ -246,6 +312,18 @@ OTD_API int otd_session_metadata_set(struct otd_session *sess, int key,
  *   otd_session_send(s, 0,    1023, inbuf, 1024, 1);
  *   otd_session_send(s, 0,    1023, inbuf, 1024, 1);
  *
+ * With several decoder stacks in the session, the chunk gets delivered to
+ * one stack after the other (or to all of them at once, see
+ * otd_session_parallel_set()). Delivery is not transactional. If a stack
+ * fails, the function returns that stack's error, but the stacks before
+ * it have already decoded the chunk. Nothing gets rolled back. Sending
+ * the chunk again is rejected with OTD_ERR_ARG, because those stacks
+ * expect the next chunk's sample numbers. A failed stack stays failed,
+ * while the other stacks keep decoding the chunks that follow. Use
+ * otd_session_terminate_reset() to start over with all stacks. Arguments
+ * which don't fit the sample numbers are rejected by the first stack,
+ * before any stack receives the chunk.
+ *
  * @param sess The session to use. Must not be NULL.
  * @param abs_start_samplenum The absolute starting sample number for the
  *              buffer's sample set, relative to the start of capture.
@@ -263,19 +341,489 @@ OTD_API int otd_session_send(struct otd_session *sess,
 		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
 		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize)
 {
+	if (!sess)
+		return OTD_ERR_ARG;
+
+	/* Index the chunk once, for all decoder stacks. */
+	if (!sess->chunk)
+		sess->chunk = g_malloc0(sizeof(*sess->chunk));
+	chunk_setup(sess->chunk, abs_start_samplenum, abs_end_samplenum,
+		inbuf, inbuflen, unitsize);
+
+	return session_send_chunk(sess);
+}
+
+/**
+ * Send a chunk of run-length encoded logic sample data to a running
+ * decoder session.
+ *
+ * This is the equivalent of otd_session_send() for sample data which
+ * is available as a sequence of runs, where each run is a sample value
+ * and the number of consecutive samples having that value. The data
+ * does not get expanded, decoders consume the runs directly. Decoders
+ * see exactly the same sample numbers, pin values and matched conditions
+ * as they would with the expanded data.
+ *
+ * The same rules as for otd_session_send() apply: Chunks must provide
+ * the samples in order, starting from sample zero, and without gaps.
+ * Dense and run-length encoded chunks can be mixed within a session.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param abs_start_samplenum The absolute starting sample number of the
+ *              chunk's first run, relative to the start of capture.
+ * @param values The runs' sample values, 'unitsize' bytes each, arranged
+ *              in the same way as samples for otd_session_send().
+ *              Must not be NULL.
+ * @param lengths The runs' lengths in samples. Runs of length zero are
+ *              accepted and ignored. Must not be NULL.
+ * @param num_runs The number of runs. Must be > 0.
+ * @param unitsize The number of bytes per sample. Must be > 0.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_send_rle(struct otd_session *sess,
+		uint64_t abs_start_samplenum, const uint8_t *values,
+		const uint64_t *lengths, uint64_t num_runs, uint64_t unitsize)
+{
+	int ret;
+
+	if (!sess)
+		return OTD_ERR_ARG;
+
+	if (!sess->chunk)
+		sess->chunk = g_malloc0(sizeof(*sess->chunk));
+	ret = chunk_setup_rle(sess->chunk, abs_start_samplenum, values,
+		lengths, num_runs, unitsize);
+	if (ret != OTD_OK) {
+		otd_err("Invalid run-length encoded sample data.");
+		return ret;
+	}
+
+	return session_send_chunk(sess);
+}
+
+/**
+ * Set the number of chunks which otd_session_send_async() queues per
+ * decoder stack.
+ *
+ * When this many chunks are pending in a stack, otd_session_send_async()
+ * blocks until the stack's worker thread has released one of them. The
+ * default depth is 4.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param depth The maximum number of pending chunks per stack. Must be > 0.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_queue_depth_set(struct otd_session *sess,
+		unsigned int depth)
+{
+	if (!sess || !depth)
+		return OTD_ERR_ARG;
+
+	sess->queue_depth = depth;
+
+	return OTD_OK;
+}
+
+/**
+ * Coalesce the OTD_OUTPUT_BINARY output of each decoder instance into
+ * larger blocks.
+ *
+ * By default, the OTD_OUTPUT_BINARY callback runs for every put() of a
+ * decoder. With a buffer size set, consecutive puts of the same output
+ * and binary class get appended to one block instead, whose sample range
+ * spans all of them. A block is passed to the callback when it holds at
+ * least 'size' bytes, when the decoder puts a different binary class,
+ * when a chunk of samples was decoded and the stack was flushed, and at
+ * the end of the stream. A single put of 'size' bytes or more is passed
+ * on as it is.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param size The block size in bytes, or 0 to disable coalescing.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_binary_buffer_set(struct otd_session *sess,
+		size_t size)
+{
+	if (!sess)
+		return OTD_ERR_ARG;
+
+	sess->bin_buffer_size = size;
+
+	return OTD_OK;
+}
+
+/* Change how a session runs its stacks, before any of them started. */
+static int session_exec_mode_set(struct otd_session *sess,
+		enum otd_exec_mode mode)
+{
+	struct otd_decoder_inst *di;
+	PyObject *py_mod;
+	PyGILState_STATE gstate;
+	GSList *l;
+
+	if (!sess)
+		return OTD_ERR_ARG;
+
+	for (l = sess->di_list; l; l = l->next) {
+		di = l->data;
+		if (di->thread_handle || di->py_greenlet || di->pool_worker ||
+				di->process) {
+			otd_err("Cannot change the execution mode while decoding.");
+			return OTD_ERR_ARG;
+		}
+	}
+
+#ifndef G_OS_UNIX
+	if (mode == OTD_EXEC_PROCESS) {
+		otd_err("Worker processes are not supported on this platform.");
+		return OTD_ERR_ARG;
+	}
+#endif
+
+	if (mode == OTD_EXEC_INLINE || mode == OTD_EXEC_POOL) {
+		gstate = PyGILState_Ensure();
+		py_mod = PyImport_ImportModule("greenlet");
+		if (!py_mod) {
+			PyErr_Clear();
+			PyGILState_Release(gstate);
+			otd_err("Running decoders without a thread per stack "
+				"needs the Python greenlet module.");
+			return OTD_ERR_PYTHON;
+		}
+		Py_DECREF(py_mod);
+		PyGILState_Release(gstate);
+	}
+
+	sess->exec_mode = mode;
+
+	return OTD_OK;
+}
+
+/**
+ * Run the decoders of a session on the thread which sends the samples.
+ *
+ * By default, the bottom decoder of each stack runs in a worker thread,
+ * and every chunk gets handed to that thread and back. In inline mode,
+ * each stack's decode() method runs as a coroutine (a greenlet) instead:
+ * Sending samples resumes it on the calling thread, and wait() suspends
+ * it when the chunk is exhausted. This avoids the handoff between the
+ * threads, which dominates with small chunks, but stacks no longer run
+ * in parallel.
+ *
+ * Inline mode needs the Python 'greenlet' module. Samples, metadata and
+ * EOF must be sent from one thread, which also has to terminate or
+ * destroy the session. otd_session_send_async() decodes chunks before
+ * it returns.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param enable TRUE for inline mode, FALSE for worker threads.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *         OTD_ERR_ARG when samples were sent already, OTD_ERR_PYTHON
+ *         when the greenlet module is not available.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_inline_set(struct otd_session *sess,
+		gboolean enable)
+{
+	return session_exec_mode_set(sess,
+		enable ? OTD_EXEC_INLINE : OTD_EXEC_THREAD);
+}
+
+/**
+ * Run the decoders of a session on the shared worker pool.
+ *
+ * By default, the bottom decoder of each stack gets a thread of its own.
+ * In pool mode, each stack's decode() method runs as a coroutine (a
+ * greenlet) on one of the threads of a worker pool, which is shared by
+ * all sessions (see otd_pool_size_set()). The number of threads then
+ * stays the same, no matter how many sessions decode at once.
+ *
+ * Stacks run on the pool when samples were sent to them, and hand the
+ * thread to the next stack when they need more samples. Stacks of
+ * sessions with a higher priority run first (see
+ * otd_session_priority_set()), stacks with the same priority take turns.
+ *
+ * Pool mode needs the Python 'greenlet' module.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param enable TRUE for pool mode, FALSE for worker threads.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *         OTD_ERR_ARG when samples were sent already, OTD_ERR_PYTHON
+ *         when the greenlet module is not available.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_pool_set(struct otd_session *sess,
+		gboolean enable)
+{
+	return session_exec_mode_set(sess,
+		enable ? OTD_EXEC_POOL : OTD_EXEC_THREAD);
+}
+
+/**
+ * Set the priority of a session's decoder stacks in the worker pool.
+ *
+ * When stacks wait for a pool thread, those of the session with the
+ * highest priority run first. The default priority is 0. Takes effect
+ * the next time the session's stacks get queued.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param priority The priority, higher values run first.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_priority_set(struct otd_session *sess,
+		int priority)
+{
+	if (!sess)
+		return OTD_ERR_ARG;
+
+	sess->priority = priority;
+
+	return OTD_OK;
+}
+
+/**
+ * Have the decoder stacks of a session work on each chunk at the same time.
+ *
+ * By default, otd_session_send() and otd_session_send_rle() hand a chunk
+ * to one stack after the other, and wait for each stack to handle it
+ * before the next one starts. In parallel mode, all stacks get the chunk
+ * first, and then the session waits for all of them. The stacks' worker
+ * threads (or the worker pool, see otd_session_pool_set()) then scan the
+ * samples for their wait() conditions at the same time.
+ *
+ * Only that scanning runs in parallel. The Python code of the decoders
+ * runs one stack at a time, since it needs the GIL, also with a
+ * free-threaded Python build. Stacks which spend most of their time in
+ * Python (e.g. because of frequent edges) don't get faster, and may get
+ * a little slower. Only process mode (see otd_session_process_set())
+ * runs the Python code of several stacks at the same time.
+ *
+ * Like with otd_session_send_async(), decoder output callbacks run in
+ * the stacks' worker threads, possibly concurrently for different stacks.
+ * Each stack's output still arrives in order. In inline mode (see
+ * otd_session_inline_set()), the stacks decode one after the other. In
+ * process mode (see otd_session_process_set()), the stacks' processes
+ * decode at the same time, and the callbacks run on the sending thread.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param enable TRUE to hand chunks to all stacks at once, FALSE to hand
+ *               them to one stack after the other.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_parallel_set(struct otd_session *sess,
+		gboolean enable)
+{
+	if (!sess)
+		return OTD_ERR_ARG;
+
+	sess->parallel = enable;
+
+	return OTD_OK;
+}
+
+/**
+ * Run each decoder stack of a session in a worker process.
+ *
+ * In process mode, each decoder stack runs in a process of its own,
+ * which gets started when the stack receives samples for the first time.
+ * The process runs the otd-worker executable, which is installed to the
+ * libexec directory (the OPENTRACEDECODE_WORKER environment variable
+ * overrides its path). It sets up the same stack as the session has:
+ * the decoders with their options, channel maps, initial pins, stacking
+ * and output subscriptions. It also sets the same samplerate, before or
+ * after calling start(), like the session got it. Other changes which
+ * the frontend made to the decoders' Python objects don't carry over.
+ *
+ * The stack's decoders and options must be set up, and the session must
+ * have been started before. Samples get copied into a
+ * shared memory buffer of the process, and the process sends the output
+ * of the stack back. The output callbacks run on the thread which sends
+ * the samples, metadata or EOF, in the order the decoders put the output.
+ * Log messages of the processes go to the frontend's log callback as
+ * well. OTD_OUTPUT_PYTHON output does not leave the worker process.
+ *
+ * A decoder which crashes its process, or which hangs (see
+ * otd_session_process_timeout_set()), does not affect the frontend: The
+ * process gets killed, and the stack fails like a decoder whose decode()
+ * method raised an exception. otd_session_terminate_reset() and
+ * otd_session_destroy() kill the processes, sending samples after a
+ * reset starts new ones. With otd_session_parallel_set(), the processes
+ * of the stacks decode each chunk at the same time, without sharing
+ * the Python interpreter.
+ *
+ * Process mode is not available on Windows. otd_session_send_async()
+ * decodes chunks before it returns.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param enable TRUE for worker processes, FALSE for worker threads.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *         OTD_ERR_ARG when samples were sent already, or when the
+ *         platform does not support worker processes.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_process_set(struct otd_session *sess,
+		gboolean enable)
+{
+	return session_exec_mode_set(sess,
+		enable ? OTD_EXEC_PROCESS : OTD_EXEC_THREAD);
+}
+
+/**
+ * Set how long to wait for the worker processes of a session.
+ *
+ * While a worker process (see otd_session_process_set()) handles
+ * samples, metadata or EOF, it reports progress several times within the
+ * timeout, when its decoders put output or advanced in the samples.
+ * When it makes no progress for this long, it gets killed, and its
+ * stack fails. So a slow decoder keeps running, while one which is stuck
+ * in a loop does not. The default timeout is 10 seconds.
+ *
+ * Without a timeout, a hanging decoder blocks the sending thread forever.
+ * Worker processes exit by themselves when the frontend's process is gone.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param timeout_ms The timeout in milliseconds, or 0 to wait forever.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_process_timeout_set(struct otd_session *sess,
+		unsigned int timeout_ms)
+{
+	if (!sess || timeout_ms > G_MAXINT)
+		return OTD_ERR_ARG;
+
+	sess->process_timeout = timeout_ms;
+
+	return OTD_OK;
+}
+
+/**
+ * Send a chunk of logic sample data to a running decoder session, without
+ * waiting for the decoders to process it.
+ *
+ * This is the asynchronous equivalent of otd_session_send(). The chunk
+ * gets queued for all decoder stacks of the session, and the call returns
+ * as soon as every stack has room for it in its queue (see
+ * otd_session_queue_depth_set()). Each stack's worker thread decodes its
+ * queued chunks in order and flushes the stack after each of them.
+ *
+ * When 'release_cb' is given, the library references the caller's buffer,
+ * which must remain valid and unmodified until the callback was invoked
+ * with 'inbuf' and 'cb_data'. The callback runs exactly once, after all
+ * stacks are done with the chunk, in the thread which dropped the last
+ * reference. That usually is a worker thread. When 'release_cb' is NULL,
+ * the sample data gets copied, and the caller may reuse the buffer as
+ * soon as this function returns.
+ *
+ * The same rules as for otd_session_send() apply to sample numbers.
+ * Decoder output callbacks run in the stacks' worker threads, possibly
+ * concurrently for different stacks. Use otd_session_drain() to wait for
+ * the completion of all queued chunks.
+ * Synchronous sends, metadata and EOF drain the queues implicitly.
+ * otd_session_terminate_reset() and otd_session_destroy() release
+ * queued chunks without decoding them.
+ *
+ * @param sess The session to use. Must not be NULL.
+ * @param abs_start_samplenum The absolute starting sample number for the
+ *              buffer's sample set, relative to the start of capture.
+ * @param abs_end_samplenum The absolute ending sample number for the
+ *              buffer's sample set, relative to the start of capture.
+ * @param inbuf Pointer to sample data. Must not be NULL.
+ * @param inbuflen Length in bytes of the buffer. Must be > 0.
+ * @param unitsize The number of bytes per sample. Must be > 0.
+ * @param release_cb The function to call when the library no longer
+ *              references 'inbuf'. Can be NULL.
+ * @param cb_data Private data for the release callback. Can be NULL.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise. The
+ *         release callback runs in either case. Like with
+ *         otd_session_send(), an error from one stack leaves the chunk
+ *         queued for the stacks before it, see there.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_send_async(struct otd_session *sess,
+		uint64_t abs_start_samplenum, uint64_t abs_end_samplenum,
+		const uint8_t *inbuf, uint64_t inbuflen, uint64_t unitsize,
+		otd_chunk_release_callback release_cb, void *cb_data)
+{
+	struct otd_chunk *chunk;
 	GSList *d;
 	int ret;
 
+	if (!sess || !inbuf || !inbuflen || !unitsize) {
+		if (release_cb)
+			release_cb(inbuf, cb_data);
+		return OTD_ERR_ARG;
+	}
+
+	chunk = chunk_new(abs_start_samplenum, abs_end_samplenum,
+		inbuf, inbuflen, unitsize, release_cb, cb_data);
+
+	ret = OTD_OK;
+	for (d = sess->di_list; d; d = d->next) {
+		ret = otd_inst_decode_async(d->data, chunk, sess->queue_depth);
+		if (ret != OTD_OK)
+			break;
+	}
+
+	/* Drop the sender's reference, stacks hold their own. */
+	chunk_unref(chunk);
+
+	return ret;
+}
+
+/**
+ * Wait until all chunks sent with otd_session_send_async() were decoded
+ * and released.
+ *
+ * @param sess The session to use. Must not be NULL.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *         OTD_ERR_TERM_REQ when a stack terminated before it could
+ *         decode all of its queued chunks.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_session_drain(struct otd_session *sess)
+{
+	GSList *d;
+	int ret, first_ret;
+
 	if (!sess)
 		return OTD_ERR_ARG;
 
+	first_ret = OTD_OK;
 	for (d = sess->di_list; d; d = d->next) {
-		if ((ret = otd_inst_decode(d->data, abs_start_samplenum,
-				abs_end_samplenum, inbuf, inbuflen, unitsize)) != OTD_OK)
-			return ret;
+		ret = otd_inst_drain(d->data);
+		if (ret != OTD_OK && first_ret == OTD_OK)
+			first_ret = ret;
 	}
 
-	return OTD_OK;
+	return first_ret;
 }
 
 /**
@@ -295,6 +843,9 @@ OTD_API int otd_session_send_eof(struct otd_session *sess)
 	if (!sess)
 		return OTD_ERR_ARG;
 
+	if ((ret = otd_session_drain(sess)) != OTD_OK)
+		return ret;
+
 	for (d = sess->di_list; d; d = d->next) {
 		ret = otd_inst_send_eof(d->data);
 		if (ret != OTD_OK)
@@ -366,7 +917,10 @@ OTD_API int otd_session_destroy(struct otd_session *sess)
 		otd_inst_free_all(sess);
 	if (sess->callbacks)
 		g_slist_free_full(sess->callbacks, g_free);
+	chunk_free(sess->chunk);
+	g_mutex_lock(&sessions_mutex);
 	sessions = g_slist_remove(sessions, sess);
+	g_mutex_unlock(&sessions_mutex);
 	g_free(sess);
 
 	otd_dbg("Destroyed session %d.", session_id);
@@ -407,6 +961,56 @@ OTD_API int otd_pd_output_callback_add(struct otd_session *sess,
 	pd_cb->cb_data = cb_data;
 	sess->callbacks = g_slist_append(sess->callbacks, pd_cb);
 
+	/* Puts look up the first callback for their output type. */
+	if (output_type >= 0 && output_type < OTD_NUM_OUTPUT_TYPES &&
+			!sess->callback_table[output_type])
+		sess->callback_table[output_type] = pd_cb;
+
+	return OTD_OK;
+}
+
+/**
+ * Register a callback function which receives annotations in batches.
+ *
+ * While a batch callback is registered, annotations no longer go to the
+ * OTD_OUTPUT_ANN callback of otd_pd_output_callback_add(). Instead, each
+ * decoder instance collects its annotations, and passes them to the batch
+ * callback as an array of 'count' struct otd_proto_data, whose 'data'
+ * fields point to struct otd_proto_data_annotation. The array and all
+ * annotation texts are only valid during the callback.
+ *
+ * Batches are delivered when 'max_count' annotations were collected,
+ * when a chunk of samples was decoded and the stack was flushed, and at
+ * the end of the stream. Annotations of one instance are delivered in
+ * the order the instance created them. Callbacks for different decoder
+ * stacks may run concurrently, from the stacks' worker threads.
+ *
+ * @param sess The session in which to register the callback.
+ *             Must not be NULL.
+ * @param output_type The output type, only OTD_OUTPUT_ANN is supported.
+ * @param cb The function to call. Must not be NULL.
+ * @param cb_data Private data for the callback function. Can be NULL.
+ * @param max_count The maximum number of annotations per batch, or 0 for
+ *                  the default of 4096.
+ *
+ * @return OTD_OK upon success, a (negative) error code otherwise.
+ *
+ * @since 0.7.0
+ */
+OTD_API int otd_pd_output_batch_callback_add(struct otd_session *sess,
+		int output_type, otd_pd_output_batch_callback cb, void *cb_data,
+		size_t max_count)
+{
+	if (!sess || !cb || output_type != OTD_OUTPUT_ANN)
+		return OTD_ERR_ARG;
+
+	otd_dbg("Registering new batch callback for output type %s.",
+		output_type_name(output_type));
+
+	sess->ann_batch_cb = cb;
+	sess->ann_batch_cb_data = cb_data;
+	sess->ann_batch_max_count = max_count ? max_count : OTD_ANN_BATCH_DEFAULT_MAX_COUNT;
+
 	return OTD_OK;
 }
 
@@ -414,22 +1018,10 @@ OTD_API int otd_pd_output_callback_add(struct otd_session *sess,
 OTD_PRIV struct otd_pd_callback *otd_pd_output_callback_find(
 		struct otd_session *sess, int output_type)
 {
-	GSList *l;
-	struct otd_pd_callback *tmp, *pd_cb;
-
-	if (!sess)
+	if (!sess || output_type < 0 || output_type >= OTD_NUM_OUTPUT_TYPES)
 		return NULL;
 
-	pd_cb = NULL;
-	for (l = sess->callbacks; l; l = l->next) {
-		tmp = l->data;
-		if (tmp->output_type == output_type) {
-			pd_cb = tmp;
-			break;
-		}
-	}
-
-	return pd_cb;
+	return sess->callback_table[output_type];
 }
 
 /** @} */
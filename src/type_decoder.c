@@ -22,13 +22,9 @@
 #include <opentracedecode/libopentracedecode.h>
 #include <inttypes.h>
 
-/** @cond PRIVATE */
-extern OTD_PRIV GSList *sessions;
-/** @endcond */
-
-typedef struct {
-        PyObject_HEAD
-} otd_Decoder;
+/* Interned attribute names which wait() assigns on every return. */
+static PyObject *py_attr_samplenum;
+static PyObject *py_attr_matched;
 
 /* This is only used for nicer otd_dbg() output. */
 OTD_PRIV const char *output_type_name(unsigned int idx)
@@ -53,18 +49,21 @@ static void release_annotation(struct otd_proto_data_annotation *pda)
 		g_strfreev(pda->ann_text);
 }
 
-static int convert_annotation(struct otd_decoder_inst *di, PyObject *obj,
-		struct otd_proto_data *pdata)
+/*
+ * Check that an annotation is a list of [annotation class, [string, ...]].
+ * Returns the class, and the (borrowed) list of strings.
+ */
+static int check_annotation(struct otd_decoder_inst *di, PyObject *obj,
+		int *ann_class, PyObject **py_texts)
 {
 	PyObject *py_tmp;
-	struct otd_pd_output *pdo;
-	struct otd_proto_data_annotation *pda;
-	int ann_class;
-	char **ann_text;
+	int ret;
 	PyGILState_STATE gstate;
 
 	gstate = PyGILState_Ensure();
 
+	ret = OTD_ERR_PYTHON;
+
 	/* Should be a list of [annotation class, [string, ...]]. */
 	if (!PyList_Check(obj)) {
 		otd_err("Protocol decoder %s submitted an annotation that is not a list",
@@ -90,10 +89,10 @@ static int convert_annotation(struct otd_decoder_inst *di, PyObject *obj,
 				di->decoder->name);
 		goto err;
 	}
-	ann_class = PyLong_AsLong(py_tmp);
-	if (!(pdo = g_slist_nth_data(di->decoder->annotations, ann_class))) {
+	*ann_class = PyLong_AsLong(py_tmp);
+	if (*ann_class < 0 || *ann_class >= di->num_ann_classes) {
 		otd_err("Protocol decoder %s submitted data to unregistered annotation class %d.",
-				di->decoder->name, ann_class);
+				di->decoder->name, *ann_class);
 		goto err;
 	}
 
@@ -104,7 +103,188 @@ static int convert_annotation(struct otd_decoder_inst *di, PyObject *obj,
 				di->decoder->name);
 		goto err;
 	}
-	if (py_strseq_to_char(py_tmp, &ann_text) != OTD_OK) {
+	*py_texts = py_tmp;
+	ret = OTD_OK;
+
+err:
+	PyGILState_Release(gstate);
+
+	return ret;
+}
+
+struct ann_cache_entry {
+	guint hash;
+	unsigned int num_texts;
+	PyObject *texts[OTD_ANN_CACHE_MAX_TEXTS];
+	char **strv;
+	GList link;
+};
+
+static guint ann_cache_entry_hash(gconstpointer key)
+{
+	return ((const struct ann_cache_entry *)key)->hash;
+}
+
+/* Texts are equal when they are the same objects, or compare equal. */
+static gboolean ann_cache_entry_equal(gconstpointer a, gconstpointer b)
+{
+	const struct ann_cache_entry *ea, *eb;
+	unsigned int i;
+
+	ea = a;
+	eb = b;
+	if (ea->hash != eb->hash || ea->num_texts != eb->num_texts)
+		return FALSE;
+	for (i = 0; i < ea->num_texts; i++) {
+		if (ea->texts[i] != eb->texts[i] &&
+				PyUnicode_Compare(ea->texts[i], eb->texts[i]) != 0)
+			return FALSE;
+	}
+
+	return TRUE;
+}
+
+static void ann_cache_entry_free(struct ann_cache_entry *entry)
+{
+	unsigned int i;
+
+	for (i = 0; i < entry->num_texts; i++)
+		Py_DECREF(entry->texts[i]);
+	g_strfreev(entry->strv);
+	g_free(entry);
+}
+
+/*
+ * Get the C strings of an annotation's texts from the instance's cache,
+ * converting and caching them upon a miss. The strings are shared, and
+ * stay valid until the entry gets evicted. Entries which get evicted
+ * while a batch of annotations is pending are kept until the batch was
+ * delivered, see ann_batch_deliver().
+ *
+ * Returns OTD_ERR_ARG when the texts can't be cached (too many of them,
+ * or not plain strings), the caller needs to convert them itself then.
+ */
+static int ann_cache_lookup(struct otd_decoder_inst *di, PyObject *py_texts,
+		char ***strv)
+{
+	struct otd_ann_cache *cache;
+	struct ann_cache_entry key, *entry;
+	Py_ssize_t i, num_texts;
+	Py_hash_t hash;
+	GList *link;
+
+	num_texts = PyList_Size(py_texts);
+	if (num_texts > OTD_ANN_CACHE_MAX_TEXTS)
+		return OTD_ERR_ARG;
+	key.hash = 0;
+	key.num_texts = num_texts;
+	for (i = 0; i < num_texts; i++) {
+		key.texts[i] = PyList_GetItem(py_texts, i);
+		if (!PyUnicode_CheckExact(key.texts[i]))
+			return OTD_ERR_ARG;
+		if ((hash = PyObject_Hash(key.texts[i])) == -1) {
+			PyErr_Clear();
+			return OTD_ERR_ARG;
+		}
+		key.hash = key.hash * 1000003 ^ (guint)hash;
+	}
+
+	if (!(cache = di->ann_cache)) {
+		cache = g_malloc0(sizeof(*cache));
+		cache->entries = g_hash_table_new(ann_cache_entry_hash,
+			ann_cache_entry_equal);
+		g_queue_init(&cache->lru);
+		di->ann_cache = cache;
+	}
+
+	if ((entry = g_hash_table_lookup(cache->entries, &key))) {
+		cache->hits++;
+		g_queue_unlink(&cache->lru, &entry->link);
+		g_queue_push_head_link(&cache->lru, &entry->link);
+		*strv = entry->strv;
+		return OTD_OK;
+	}
+	cache->misses++;
+
+	if (py_strseq_to_char(py_texts, strv) != OTD_OK)
+		return OTD_ERR_PYTHON;
+
+	/* Make room by evicting the least recently used entry. */
+	if (cache->lru.length >= OTD_ANN_CACHE_SIZE) {
+		link = g_queue_pop_tail_link(&cache->lru);
+		entry = link->data;
+		g_hash_table_remove(cache->entries, entry);
+		if (di->ann_batch) {
+			g_ptr_array_add(di->ann_batch->retired, entry->strv);
+			entry->strv = NULL;
+		}
+		ann_cache_entry_free(entry);
+	}
+
+	entry = g_malloc(sizeof(*entry));
+	*entry = key;
+	for (i = 0; i < num_texts; i++)
+		Py_INCREF(entry->texts[i]);
+	entry->strv = *strv;
+	entry->link.data = entry;
+	entry->link.prev = entry->link.next = NULL;
+	g_hash_table_add(cache->entries, entry);
+	g_queue_push_head_link(&cache->lru, &entry->link);
+
+	return OTD_OK;
+}
+
+/**
+ * Free the annotation text cache of an instance.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void ann_cache_free(struct otd_decoder_inst *di)
+{
+	struct otd_ann_cache *cache;
+	GList *link;
+	PyGILState_STATE gstate;
+
+	if (!(cache = di->ann_cache))
+		return;
+
+	gstate = PyGILState_Ensure();
+
+	otd_dbg("%s: Annotation text cache: %" PRIu64 " hits, %" PRIu64
+		" misses.", di->inst_id, cache->hits, cache->misses);
+	while ((link = g_queue_pop_head_link(&cache->lru)))
+		ann_cache_entry_free(link->data);
+	g_hash_table_destroy(cache->entries);
+	g_free(cache);
+	di->ann_cache = NULL;
+
+	PyGILState_Release(gstate);
+}
+
+/*
+ * Convert an annotation. Sets 'interned' when the texts are shared with
+ * the instance's cache, and must not be freed.
+ */
+static int convert_annotation(struct otd_decoder_inst *di, PyObject *obj,
+		struct otd_proto_data *pdata, gboolean *interned)
+{
+	PyObject *py_texts;
+	struct otd_proto_data_annotation *pda;
+	int ann_class, ret;
+	char **ann_text;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+
+	if (check_annotation(di, obj, &ann_class, &py_texts) != OTD_OK)
+		goto err;
+	ret = ann_cache_lookup(di, py_texts, &ann_text);
+	*interned = ret == OTD_OK;
+	if (ret == OTD_ERR_ARG)
+		ret = py_strseq_to_char(py_texts, &ann_text);
+	if (ret != OTD_OK) {
 		otd_err("Protocol decoder %s submitted annotation list, but second element was malformed.",
 				di->decoder->name);
 		goto err;
@@ -124,15 +304,297 @@ err:
 	return OTD_ERR_PYTHON;
 }
 
-static void release_logic(struct otd_proto_data_logic *pdl)
+static struct otd_ann_batch *ann_batch_new(void)
+{
+	struct otd_ann_batch *batch;
+
+	batch = g_malloc(sizeof(*batch));
+	batch->pdata = g_array_new(FALSE, FALSE, sizeof(struct otd_proto_data));
+	batch->anns = g_array_new(FALSE, FALSE,
+		sizeof(struct otd_proto_data_annotation));
+	batch->text_idx = g_array_new(FALSE, FALSE, sizeof(guint));
+	batch->texts = g_ptr_array_new();
+	batch->strings = g_string_chunk_new(4096);
+	batch->retired = g_ptr_array_new_with_free_func((GDestroyNotify)g_strfreev);
+
+	return batch;
+}
+
+static void ann_batch_destroy(struct otd_ann_batch *batch)
+{
+	g_array_free(batch->pdata, TRUE);
+	g_array_free(batch->anns, TRUE);
+	g_array_free(batch->text_idx, TRUE);
+	g_ptr_array_free(batch->texts, TRUE);
+	g_string_chunk_free(batch->strings);
+	g_ptr_array_free(batch->retired, TRUE);
+	g_free(batch);
+}
+
+/* Empty a batch, keeping its memory for the next annotations. */
+static void ann_batch_clear(struct otd_ann_batch *batch)
+{
+	g_array_set_size(batch->pdata, 0);
+	g_array_set_size(batch->anns, 0);
+	g_array_set_size(batch->text_idx, 0);
+	g_ptr_array_set_size(batch->texts, 0);
+	g_string_chunk_clear(batch->strings);
+	g_ptr_array_set_size(batch->retired, 0);
+}
+
+/*
+ * Convert an annotation into the instance's batch, see
+ * otd_pd_output_batch_callback_add(). Returns the number of annotations
+ * in the batch, or a (negative) error code.
+ */
+static int ann_batch_append(struct otd_decoder_inst *di, PyObject *obj,
+		const struct otd_proto_data *pdata)
+{
+	struct otd_ann_batch *batch;
+	struct otd_proto_data_annotation pda;
+	PyObject *py_texts, *py_item, *py_bytes;
+	Py_ssize_t i, num_texts, len;
+	char *str, **strv;
+	guint idx;
+	int ret;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+
+	if (check_annotation(di, obj, &pda.ann_class, &py_texts) != OTD_OK)
+		goto err;
+
+	if (!di->ann_batch)
+		di->ann_batch = ann_batch_new();
+	batch = di->ann_batch;
+
+	/* Use the cached texts, or copy them into the batch's string chunk. */
+	idx = batch->texts->len;
+	ret = ann_cache_lookup(di, py_texts, &strv);
+	if (ret == OTD_OK) {
+		for (i = 0; strv[i]; i++)
+			g_ptr_array_add(batch->texts, strv[i]);
+	} else if (ret != OTD_ERR_ARG) {
+		otd_err("Protocol decoder %s submitted annotation list, but second element was malformed.",
+				di->decoder->name);
+		goto err;
+	}
+	num_texts = ret == OTD_OK ? 0 : PyList_Size(py_texts);
+	for (i = 0; i < num_texts; i++) {
+		py_item = PyList_GetItem(py_texts, i);
+		py_bytes = NULL;
+		if (PyUnicode_Check(py_item))
+			py_bytes = PyUnicode_AsUTF8String(py_item);
+		if (!py_bytes || PyBytes_AsStringAndSize(py_bytes, &str, &len) < 0) {
+			Py_XDECREF(py_bytes);
+			if (PyErr_Occurred())
+				otd_exception_catch("Failed to obtain string item");
+			otd_err("Protocol decoder %s submitted annotation list, but second element was malformed.",
+					di->decoder->name);
+			g_ptr_array_set_size(batch->texts, idx);
+			goto err;
+		}
+		g_ptr_array_add(batch->texts,
+			g_string_chunk_insert_len(batch->strings, str, len));
+		Py_DECREF(py_bytes);
+	}
+	g_ptr_array_add(batch->texts, NULL);
+
+	/* Pointers into the arrays get set up upon delivery. */
+	pda.ann_text = NULL;
+	g_array_append_val(batch->pdata, *pdata);
+	g_array_append_val(batch->anns, pda);
+	g_array_append_val(batch->text_idx, idx);
+
+	PyGILState_Release(gstate);
+
+	return batch->pdata->len;
+
+err:
+	PyGILState_Release(gstate);
+
+	return OTD_ERR_PYTHON;
+}
+
+/**
+ * Pass the collected annotations of an instance, and of the instances
+ * stacked on top of it, to the session's batch callback.
+ *
+ * The batch gets detached from the instance while the callback runs
+ * without the GIL, so that Decoder_put() can start a new one meanwhile.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void ann_batch_deliver(struct otd_decoder_inst *di)
+{
+	struct otd_session *sess;
+	struct otd_ann_batch *batch;
+	struct otd_proto_data *pdata;
+	struct otd_proto_data_annotation *anns;
+	guint i, idx;
+	GSList *l;
+	PyGILState_STATE gstate;
+
+	sess = di->sess;
+
+	gstate = PyGILState_Ensure();
+
+	batch = di->ann_batch;
+	if (batch && batch->pdata->len && sess->ann_batch_cb) {
+		di->ann_batch = NULL;
+		Py_BEGIN_ALLOW_THREADS
+		pdata = (struct otd_proto_data *)batch->pdata->data;
+		anns = (struct otd_proto_data_annotation *)batch->anns->data;
+		for (i = 0; i < batch->pdata->len; i++) {
+			idx = g_array_index(batch->text_idx, guint, i);
+			anns[i].ann_text = (char **)&batch->texts->pdata[idx];
+			pdata[i].data = &anns[i];
+		}
+		sess->ann_batch_cb(pdata, batch->pdata->len,
+			sess->ann_batch_cb_data);
+		ann_batch_clear(batch);
+		Py_END_ALLOW_THREADS
+
+		/* Keep the memory for the next batch, unless one was started. */
+		if (di->ann_batch)
+			ann_batch_destroy(batch);
+		else
+			di->ann_batch = batch;
+	}
+
+	PyGILState_Release(gstate);
+
+	for (l = di->next_di; l; l = l->next)
+		ann_batch_deliver(l->data);
+}
+
+/**
+ * Discard the annotations which an instance collected, and free the batch.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void ann_batch_free(struct otd_decoder_inst *di)
+{
+	if (!di->ann_batch)
+		return;
+
+	ann_batch_destroy(di->ann_batch);
+	di->ann_batch = NULL;
+}
+
+/* Pass the coalesced binary output of one instance to the frontend. */
+static void bin_buffer_flush(struct otd_decoder_inst *di)
+{
+	struct otd_bin_buffer *buf;
+	struct otd_pd_callback *cb;
+	struct otd_proto_data pdata;
+	struct otd_proto_data_binary pdb;
+
+	buf = di->bin_buffer;
+	if (!buf || !buf->data->len)
+		return;
+
+	if ((cb = otd_pd_output_callback_find(di->sess, OTD_OUTPUT_BINARY))) {
+		pdb.bin_class = buf->bin_class;
+		pdb.size = buf->data->len;
+		pdb.data = buf->data->data;
+		pdata.start_sample = buf->start_sample;
+		pdata.end_sample = buf->end_sample;
+		pdata.pdo = buf->pdo;
+		pdata.data = &pdb;
+		cb->cb(&pdata, cb->cb_data);
+	}
+	g_byte_array_set_size(buf->data, 0);
+}
+
+/*
+ * Append binary output to the instance's buffer, pass the buffer on when
+ * it is full. Must be called without the GIL held.
+ */
+static void bin_buffer_put(struct otd_decoder_inst *di,
+		struct otd_proto_data *pdata, struct otd_pd_callback *cb)
+{
+	struct otd_bin_buffer *buf;
+	struct otd_proto_data_binary *pdb;
+	size_t size;
+
+	pdb = pdata->data;
+	size = di->sess->bin_buffer_size;
+
+	buf = di->bin_buffer;
+	if (buf && buf->data->len && (buf->pdo != pdata->pdo ||
+			buf->bin_class != pdb->bin_class))
+		bin_buffer_flush(di);
+
+	/* Don't copy blocks which are large enough already. */
+	if ((!buf || !buf->data->len) && pdb->size >= size) {
+		cb->cb(pdata, cb->cb_data);
+		return;
+	}
+
+	if (!buf) {
+		buf = g_malloc0(sizeof(*buf));
+		buf->data = g_byte_array_sized_new(size);
+		di->bin_buffer = buf;
+	}
+	if (!buf->data->len) {
+		buf->pdo = pdata->pdo;
+		buf->bin_class = pdb->bin_class;
+		buf->start_sample = pdata->start_sample;
+	}
+	buf->end_sample = pdata->end_sample;
+	g_byte_array_append(buf->data, pdb->data, pdb->size);
+
+	if (buf->data->len >= size)
+		bin_buffer_flush(di);
+}
+
+/**
+ * Pass the binary output which was coalesced since the last delivery to
+ * the frontend, for an instance and all instances stacked on top of it.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void bin_buffer_deliver(struct otd_decoder_inst *di)
+{
+	GSList *l;
+
+	bin_buffer_flush(di);
+
+	for (l = di->next_di; l; l = l->next)
+		bin_buffer_deliver(l->data);
+}
+
+/**
+ * Free an instance's binary output buffer.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void bin_buffer_free(struct otd_decoder_inst *di)
 {
-	if (!pdl)
+	if (!di->bin_buffer)
 		return;
-	g_free((void *)pdl->data);
+
+	g_byte_array_free(di->bin_buffer->data, TRUE);
+	g_free(di->bin_buffer);
+	di->bin_buffer = NULL;
 }
 
+/*
+ * Convert a [logic group, bytes] list. The data is not copied, 'pdata'
+ * points into the bytes object, which 'py_bytes' receives a new reference
+ * to.
+ */
 static int convert_logic(struct otd_decoder_inst *di, PyObject *obj,
-		struct otd_proto_data *pdata)
+		struct otd_proto_data *pdata, PyObject **py_bytes)
 {
 	struct otd_proto_data_logic *pdl;
 	PyObject *py_tmp;
@@ -180,24 +642,26 @@ static int convert_logic(struct otd_decoder_inst *di, PyObject *obj,
 		goto err;
 	}
 
-	/* Consider an empty set of bytes a bug. */
-	if (PyBytes_Size(py_tmp) == 0) {
+	/* Frontends read one bit per logic output channel. */
+	if ((size_t)PyBytes_Size(py_tmp) < otd_decoder_logic_unitsize(di->decoder)) {
 		otd_err("Protocol decoder %s submitted OTD_OUTPUT_LOGIC "
-				"with empty data set.", di->decoder->name);
+				"with %zd bytes instead of %zu.", di->decoder->name,
+				PyBytes_Size(py_tmp),
+				otd_decoder_logic_unitsize(di->decoder));
 		goto err;
 	}
 
 	if (PyBytes_AsStringAndSize(py_tmp, &buf, &size) == -1)
 		goto err;
+	Py_INCREF(py_tmp);
+	*py_bytes = py_tmp;
 
 	PyGILState_Release(gstate);
 
 	pdl = pdata->data;
 	pdl->logic_group = logic_group;
 	/* pdl->repeat_count is set by the caller as it depends on the sample range */
-	if (!(pdl->data = g_try_malloc(size)))
-		return OTD_ERR_MALLOC;
-	memcpy((void *)pdl->data, (const void *)buf, size);
+	pdl->data = (const uint8_t *)buf;
 
 	return OTD_OK;
 
@@ -207,15 +671,13 @@ err:
 	return OTD_ERR_PYTHON;
 }
 
-static void release_binary(struct otd_proto_data_binary *pdb)
-{
-	if (!pdb)
-		return;
-	g_free((void *)pdb->data);
-}
-
+/*
+ * Convert a [binary class, bytes] list. The data is not copied, 'pdata'
+ * points into the bytes object, which 'py_bytes' receives a new reference
+ * to.
+ */
 static int convert_binary(struct otd_decoder_inst *di, PyObject *obj,
-		struct otd_proto_data *pdata)
+		struct otd_proto_data *pdata, PyObject **py_bytes)
 {
 	struct otd_proto_data_binary *pdb;
 	PyObject *py_tmp;
@@ -272,15 +734,15 @@ static int convert_binary(struct otd_decoder_inst *di, PyObject *obj,
 
 	if (PyBytes_AsStringAndSize(py_tmp, &buf, &size) == -1)
 		goto err;
+	Py_INCREF(py_tmp);
+	*py_bytes = py_tmp;
 
 	PyGILState_Release(gstate);
 
 	pdb = pdata->data;
 	pdb->bin_class = bin_class;
 	pdb->size = size;
-	if (!(pdb->data = g_try_malloc(pdb->size)))
-		return OTD_ERR_MALLOC;
-	memcpy((void *)pdb->data, (const void *)buf, pdb->size);
+	pdb->data = (const uint8_t *)buf;
 
 	return OTD_OK;
 
@@ -290,63 +752,21 @@ err:
 	return OTD_ERR_PYTHON;
 }
 
-static inline struct otd_decoder_inst *otd_sess_inst_find_by_obj(
-	struct otd_session *sess, const GSList *stack, const PyObject *obj)
-{
-	const GSList *l;
-	struct otd_decoder_inst *tmp, *di;
-
-	if (!sess)
-		return NULL;
-
-	di = NULL;
-	for (l = stack ? stack : sess->di_list; di == NULL && l != NULL; l = l->next) {
-		tmp = l->data;
-		if (tmp->py_inst == obj)
-			di = tmp;
-		else if (tmp->next_di)
-			di = otd_sess_inst_find_by_obj(sess, tmp->next_di, obj);
-	}
-
-	return di;
-}
-
 /**
  * Find a decoder instance by its Python object.
  *
  * I.e. find that instance's instantiation of the opentracedecode.Decoder class.
- * This will recurse to find the instance anywhere in the stack tree of all
- * sessions.
+ * The instance gets stored in the object when the instance is created.
  *
- * @param stack Pointer to a GSList of struct otd_decoder_inst, indicating the
- *              stack to search. To start searching at the bottom level of
- *              decoder instances, pass NULL.
  * @param obj The Python class instantiation.
  *
  * @return Pointer to struct otd_decoder_inst, or NULL if not found.
  *
  * @since 0.1.0
  */
-static inline struct otd_decoder_inst *otd_inst_find_by_obj(
-		const GSList *stack, const PyObject *obj)
+static inline struct otd_decoder_inst *otd_inst_find_by_obj(PyObject *obj)
 {
-	struct otd_decoder_inst *di;
-	struct otd_session *sess;
-	GSList *l;
-
-	/* Performance shortcut: Handle the most common case first. */
-	sess = sessions->data;
-	di = sess->di_list->data;
-	if (di->py_inst == obj)
-		return di;
-
-	di = NULL;
-	for (l = sessions; di == NULL && l != NULL; l = l->next) {
-		sess = l->data;
-		di = otd_sess_inst_find_by_obj(sess, stack, obj);
-	}
-
-	return di;
+	return ((otd_Decoder *)obj)->di;
 }
 
 static int convert_meta(struct otd_proto_data *pdata, PyObject *obj)
@@ -396,54 +816,315 @@ static void release_meta(GVariant *gvar)
 	g_variant_unref(gvar);
 }
 
-PyDoc_STRVAR(Decoder_put_doc,
-	"Put an annotation for the specified span of samples.\n"
-	"\n"
-	"Arguments: start and end sample number, stream id, annotation data.\n"
-	"Annotation data's layout depends on the output stream type."
-);
+/* Whether the frontend wants output of a type, see otd_inst_output_types_set(). */
+static inline gboolean output_type_wanted(const struct otd_decoder_inst *di,
+		int output_type)
+{
+	if (output_type < 0 || output_type >= OTD_NUM_OUTPUT_TYPES)
+		return TRUE;
 
-static PyObject *Decoder_put(PyObject *self, PyObject *args)
+	return (di->output_types & (1U << output_type)) != 0;
+}
+
+/*
+ * Whether the frontend wants annotations of a class, see
+ * otd_inst_annotation_classes_set(). Invalid classes are "wanted", so
+ * that they get reported.
+ */
+static inline gboolean ann_class_wanted(const struct otd_decoder_inst *di,
+		long ann_class)
 {
-	GSList *l;
-	PyObject *py_data, *py_res;
-	struct otd_decoder_inst *di, *next_di;
-	struct otd_pd_output *pdo;
-	struct otd_proto_data pdata;
-	struct otd_proto_data_annotation pda;
-	struct otd_proto_data_binary pdb;
-	struct otd_proto_data_logic pdl;
-	uint64_t start_sample, end_sample;
-	int output_id;
-	struct otd_pd_callback *cb;
-	PyGILState_STATE gstate;
+	if (!di->ann_classes_wanted)
+		return TRUE;
+	if (ann_class < 0 || ann_class >= di->num_ann_classes)
+		return TRUE;
 
-	py_data = NULL;
+	return di->ann_classes_wanted[ann_class];
+}
 
-	gstate = PyGILState_Ensure();
+/* Get the class of an annotation before checking it, or -1. */
+static long peek_ann_class(PyObject *obj)
+{
+	PyObject *py_class;
+	long ann_class;
 
-	if (!(di = otd_inst_find_by_obj(NULL, self))) {
-		/* Shouldn't happen. */
-		otd_dbg("put(): self instance not found.");
-		goto err;
-	}
+	if (!PyList_Check(obj) || PyList_Size(obj) != 2)
+		return -1;
+	py_class = PyList_GetItem(obj, 0);
+	if (!PyLong_Check(py_class))
+		return -1;
+	ann_class = PyLong_AsLong(py_class);
+	if (ann_class == -1 && PyErr_Occurred())
+		PyErr_Clear();
 
-	if (!PyArg_ParseTuple(args, "KKiO", &start_sample, &end_sample,
-		&output_id, &py_data)) {
-		/*
-		 * This throws an exception, but by returning NULL here we let
+	return ann_class;
+}
+
+/*
+ * Get the formatters of a decoder's lazy annotations, from its
+ * 'annotation_formats' dict (checked when the decoder got loaded): A list
+ * with an item per annotation class, which is either None, a callable
+ * which returns the texts, or a tuple of the bound format() methods of
+ * the class' text templates.
+ */
+static PyObject *ann_formatters_get(struct otd_decoder_inst *di)
+{
+	PyObject *py_formats, *py_formatters, *py_key, *py_value, *py_item;
+	PyObject *py_tmpl;
+	Py_ssize_t pos, i, num_tmpls;
+	long ann_class;
+
+	if (di->ann_formatters)
+		return di->ann_formatters;
+
+	py_formats = PyObject_GetAttrString(di->decoder->py_dec,
+		"annotation_formats");
+	if (!py_formats)
+		goto except_out;
+
+	py_formatters = PyList_New(di->num_ann_classes);
+	for (i = 0; i < di->num_ann_classes; i++) {
+		Py_INCREF(Py_None);
+		PyList_SetItem(py_formatters, i, Py_None);
+	}
+
+	pos = 0;
+	while (PyDict_Next(py_formats, &pos, &py_key, &py_value)) {
+		ann_class = PyLong_AsLong(py_key);
+		if (PyUnicode_Check(py_value)) {
+			/* The name of a method which returns the texts. */
+			py_item = PyObject_GetAttr(di->py_inst, py_value);
+		} else {
+			/* A sequence of str.format() templates. */
+			num_tmpls = PySequence_Size(py_value);
+			py_item = PyTuple_New(num_tmpls);
+			for (i = 0; py_item && i < num_tmpls; i++) {
+				py_tmpl = PySequence_GetItem(py_value, i);
+				PyTuple_SetItem(py_item, i,
+					PyObject_GetAttrString(py_tmpl, "format"));
+				Py_DECREF(py_tmpl);
+			}
+		}
+		if (!py_item) {
+			Py_DECREF(py_formatters);
+			Py_DECREF(py_formats);
+			goto except_out;
+		}
+		PyList_SetItem(py_formatters, ann_class, py_item);
+	}
+	Py_DECREF(py_formats);
+
+	di->ann_formatters = py_formatters;
+
+	return py_formatters;
+
+except_out:
+	otd_exception_catch("Failed to get %s annotation formats",
+		di->decoder->name);
+
+	return NULL;
+}
+
+/*
+ * Render the texts of a lazy annotation, which is a list of
+ * [annotation class, value] instead of [annotation class, [string, ...]],
+ * for a class which the decoder's 'annotation_formats' declares.
+ * Returns a new reference to the regular form of the annotation, or NULL
+ * upon errors. Other annotations are returned as they are, and get
+ * checked like any annotation.
+ */
+static PyObject *render_annotation(struct otd_decoder_inst *di, PyObject *obj)
+{
+	PyObject *py_class, *py_value, *py_formatters, *py_formatter;
+	PyObject *py_args, *py_texts, *py_ann;
+	Py_ssize_t i, num_texts;
+	long ann_class;
+
+	ann_class = peek_ann_class(obj);
+	if (!di->decoder->lazy_ann_classes || ann_class < 0 ||
+			ann_class >= di->num_ann_classes ||
+			!di->decoder->lazy_ann_classes[ann_class] ||
+			PyList_Check(PyList_GetItem(obj, 1))) {
+		Py_INCREF(obj);
+		return obj;
+	}
+
+	py_class = PyList_GetItem(obj, 0);
+	py_value = PyList_GetItem(obj, 1);
+	if (!(py_formatters = ann_formatters_get(di)))
+		return NULL;
+	py_formatter = PyList_GetItem(py_formatters, ann_class);
+
+	if (PyTuple_Check(py_formatter)) {
+		/* Multiple values are passed to the templates as a tuple. */
+		if (PyTuple_Check(py_value)) {
+			Py_INCREF(py_value);
+			py_args = py_value;
+		} else {
+			py_args = PyTuple_Pack(1, py_value);
+		}
+		num_texts = PyTuple_Size(py_formatter);
+		py_texts = PyList_New(num_texts);
+		for (i = 0; py_texts && i < num_texts; i++) {
+			py_ann = PyObject_Call(PyTuple_GetItem(py_formatter, i),
+				py_args, NULL);
+			if (!py_ann) {
+				Py_CLEAR(py_texts);
+				break;
+			}
+			PyList_SetItem(py_texts, i, py_ann);
+		}
+		Py_DECREF(py_args);
+	} else {
+		py_texts = PyObject_CallFunctionObjArgs(py_formatter, py_value, NULL);
+	}
+	if (!py_texts) {
+		otd_exception_catch("Protocol decoder %s failed to render "
+			"annotation class %ld", di->decoder->name, ann_class);
+		return NULL;
+	}
+
+	py_ann = PyList_New(2);
+	Py_INCREF(py_class);
+	PyList_SetItem(py_ann, 0, py_class);
+	PyList_SetItem(py_ann, 1, py_texts);
+
+	return py_ann;
+}
+
+/*
+ * Get the method of a stacked instance which receives the OTD_OUTPUT_PYTHON
+ * output of the instance below it: decode_batch() if the decoder has one,
+ * decode() otherwise. The bound method gets looked up once per instance.
+ */
+static PyObject *stacked_decode_get(struct otd_decoder_inst *di)
+{
+	if (di->py_decode)
+		return di->py_decode;
+
+	if (PyObject_HasAttrString(di->py_inst, "decode_batch")) {
+		di->py_decode = PyObject_GetAttrString(di->py_inst, "decode_batch");
+		if (di->py_decode)
+			di->py_decode_items = PyList_New(0);
+	} else {
+		di->py_decode = PyObject_GetAttrString(di->py_inst, "decode");
+	}
+
+	return di->py_decode;
+}
+
+/**
+ * Pass the OTD_OUTPUT_PYTHON items which were collected for an instance
+ * to its decode_batch() method, as a list of (ss, es, data) tuples.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void decode_batch_deliver(struct otd_decoder_inst *di)
+{
+	PyObject *py_items, *py_res;
+	PyGILState_STATE gstate;
+
+	gstate = PyGILState_Ensure();
+
+	py_items = di->py_decode_items;
+	if (py_items && PyList_Size(py_items)) {
+		/* Items which decode_batch() causes go to a new list. */
+		di->py_decode_items = PyList_New(0);
+		py_res = PyObject_CallFunctionObjArgs(di->py_decode, py_items, NULL);
+		if (!py_res)
+			otd_exception_catch("Calling %s decode_batch() failed",
+				di->inst_id);
+		Py_XDECREF(py_res);
+		Py_DECREF(py_items);
+	}
+
+	PyGILState_Release(gstate);
+}
+
+/**
+ * Drop an instance's cached decode() method, and the items which were
+ * collected for its decode_batch() method.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void stacked_decode_free(struct otd_decoder_inst *di)
+{
+	PyGILState_STATE gstate;
+
+	if (!di->py_decode)
+		return;
+
+	gstate = PyGILState_Ensure();
+	Py_CLEAR(di->py_decode);
+	Py_CLEAR(di->py_decode_items);
+	PyGILState_Release(gstate);
+}
+
+PyDoc_STRVAR(Decoder_put_doc,
+	"Put an annotation for the specified span of samples.\n"
+	"\n"
+	"Arguments: start and end sample number, stream id, annotation data.\n"
+	"Annotation data's layout depends on the output stream type.\n"
+	"Annotations of the classes in the decoder's annotation_formats can\n"
+	"also be [class, value], their texts then get rendered when somebody\n"
+	"wants them."
+);
+
+static PyObject *Decoder_put(PyObject *self, PyObject *args)
+{
+	GSList *l;
+	PyObject *py_data, *py_res, *py_ann, *py_bytes;
+	PyObject *py_decode, *py_ss, *py_es, *py_item;
+	struct otd_decoder_inst *di, *next_di;
+	struct otd_pd_output *pdo;
+	struct otd_proto_data pdata;
+	struct otd_proto_data_annotation pda;
+	struct otd_proto_data_binary pdb;
+	struct otd_proto_data_logic pdl;
+	uint64_t start_sample, end_sample;
+	int output_id, ret;
+	gboolean interned;
+	struct otd_pd_callback *cb;
+	PyGILState_STATE gstate;
+
+	py_data = NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		/* Shouldn't happen. */
+		otd_dbg("put(): self instance not found.");
+		goto err;
+	}
+
+	if (!PyArg_ParseTuple(args, "KKiO", &start_sample, &end_sample,
+		&output_id, &py_data)) {
+		/*
+		 * This throws an exception, but by returning NULL here we let
 		 * Python raise it. This results in a much better trace in
 		 * controller.c on the decode() method call.
 		 */
 		goto err;
 	}
 
-	if (!(l = g_slist_nth(di->pd_output, output_id))) {
+	if (output_id < 0 || (guint)output_id >= di->pd_output_table->len) {
 		otd_err("Protocol decoder %s submitted invalid output ID %d.",
 			di->decoder->name, output_id);
 		goto err;
 	}
-	pdo = l->data;
+	pdo = g_ptr_array_index(di->pd_output_table, output_id);
+	g_atomic_int_inc(&di->num_puts);
+
+	/* Discard output the frontend doesn't want, except for stacked PDs. */
+	if (pdo->output_type != OTD_OUTPUT_PYTHON &&
+			!output_type_wanted(di, pdo->output_type)) {
+		PyGILState_Release(gstate);
+		Py_RETURN_NONE;
+	}
 
 	/* Upon OTD_OUTPUT_PYTHON for stacked PDs, we have a nicer log message later. */
 	if (pdo->output_type != OTD_OUTPUT_PYTHON && di->next_di != NULL) {
@@ -461,20 +1142,40 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 	switch (pdo->output_type) {
 	case OTD_OUTPUT_ANN:
 		/* Annotations are only fed to callbacks. */
-		if ((cb = otd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		if (di->ann_classes_wanted &&
+				!ann_class_wanted(di, peek_ann_class(py_data)))
+			break;
+		cb = NULL;
+		if (!di->sess->ann_batch_cb &&
+				!(cb = otd_pd_output_callback_find(di->sess, pdo->output_type)))
+			break;
+		/* Lazy annotations only get rendered when they are wanted. */
+		if (!(py_ann = render_annotation(di, py_data)))
+			break;
+		if (!cb) {
+			/* Collect the annotation, deliver full batches. */
+			ret = ann_batch_append(di, py_ann, &pdata);
+			if (ret >= 0 && (size_t)ret >= di->sess->ann_batch_max_count)
+				ann_batch_deliver(di);
+		} else {
 			pdata.data = &pda;
 			/* Convert from PyDict to otd_proto_data_annotation. */
-			if (convert_annotation(di, py_data, &pdata) != OTD_OK) {
-				/* An error was already logged. */
-				break;
+			if (convert_annotation(di, py_ann, &pdata, &interned) == OTD_OK) {
+				Py_BEGIN_ALLOW_THREADS
+				cb->cb(&pdata, cb->cb_data);
+				Py_END_ALLOW_THREADS
+				if (!interned)
+					release_annotation(pdata.data);
 			}
-			Py_BEGIN_ALLOW_THREADS
-			cb->cb(&pdata, cb->cb_data);
-			Py_END_ALLOW_THREADS
-			release_annotation(pdata.data);
 		}
+		Py_DECREF(py_ann);
 		break;
 	case OTD_OUTPUT_PYTHON:
+		py_ss = py_es = py_item = NULL;
+		if (di->next_di) {
+			py_ss = PyLong_FromUnsignedLongLong(start_sample);
+			py_es = PyLong_FromUnsignedLongLong(end_sample);
+		}
 		for (l = di->next_di; l; l = l->next) {
 			next_di = l->data;
 			otd_spew("Instance %s put %" PRIu64 "-%" PRIu64 " %s "
@@ -482,15 +1183,33 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 				 start_sample,
 				 end_sample, output_type_name(pdo->output_type),
 				 output_id, pdo->proto_id, next_di->inst_id);
-			py_res = PyObject_CallMethod(next_di->py_inst, "decode",
-				"KKO", start_sample, end_sample, py_data);
+			if (!(py_decode = stacked_decode_get(next_di))) {
+				otd_exception_catch("Calling %s decode() failed",
+							next_di->inst_id);
+				continue;
+			}
+			if (next_di->py_decode_items) {
+				/* Collect the item, decode full batches. */
+				if (!py_item)
+					py_item = PyTuple_Pack(3, py_ss, py_es, py_data);
+				PyList_Append(next_di->py_decode_items, py_item);
+				if (PyList_Size(next_di->py_decode_items) >= OTD_DECODE_BATCH_MAX_COUNT)
+					decode_batch_deliver(next_di);
+				continue;
+			}
+			py_res = PyObject_CallFunctionObjArgs(py_decode,
+				py_ss, py_es, py_data, NULL);
 			if (!py_res) {
 				otd_exception_catch("Calling %s decode() failed",
 							next_di->inst_id);
 			}
 			Py_XDECREF(py_res);
 		}
-		if ((cb = otd_pd_output_callback_find(di->sess, pdo->output_type))) {
+		Py_XDECREF(py_item);
+		Py_XDECREF(py_ss);
+		Py_XDECREF(py_es);
+		if (output_type_wanted(di, pdo->output_type) &&
+				(cb = otd_pd_output_callback_find(di->sess, pdo->output_type))) {
 			/*
 			 * Frontends aren't really supposed to get Python
 			 * callbacks, but it's useful for testing.
@@ -503,33 +1222,38 @@ static PyObject *Decoder_put(PyObject *self, PyObject *args)
 		if ((cb = otd_pd_output_callback_find(di->sess, pdo->output_type))) {
 			pdata.data = &pdb;
 			/* Convert from PyDict to otd_proto_data_binary. */
-			if (convert_binary(di, py_data, &pdata) != OTD_OK) {
+			if (convert_binary(di, py_data, &pdata, &py_bytes) != OTD_OK) {
 				/* An error was already logged. */
 				break;
 			}
+			/* The callback borrows the data of the bytes object. */
 			Py_BEGIN_ALLOW_THREADS
-			cb->cb(&pdata, cb->cb_data);
+			if (di->sess->bin_buffer_size)
+				bin_buffer_put(di, &pdata, cb);
+			else
+				cb->cb(&pdata, cb->cb_data);
 			Py_END_ALLOW_THREADS
-			release_binary(pdata.data);
+			Py_DECREF(py_bytes);
 		}
 		break;
 	case OTD_OUTPUT_LOGIC:
 		if ((cb = otd_pd_output_callback_find(di->sess, pdo->output_type))) {
+			if (end_sample <= start_sample) {
+				otd_err("Ignored OTD_OUTPUT_LOGIC with invalid sample range.");
+				break;
+			}
 			pdata.data = &pdl;
 			/* Convert from PyDict to otd_proto_data_logic. */
-			if (convert_logic(di, py_data, &pdata) != OTD_OK) {
+			if (convert_logic(di, py_data, &pdata, &py_bytes) != OTD_OK) {
 				/* An error was already logged. */
 				break;
 			}
-			if (end_sample <= start_sample) {
-				otd_err("Ignored OTD_OUTPUT_LOGIC with invalid sample range.");
-				break;
-			}
 			pdl.repeat_count = (end_sample - start_sample) - 1;
+			/* The callback borrows the data of the bytes object. */
 			Py_BEGIN_ALLOW_THREADS
 			cb->cb(&pdata, cb->cb_data);
 			Py_END_ALLOW_THREADS
-			release_logic(pdata.data);
+			Py_DECREF(py_bytes);
 		}
 		break;
 	case OTD_OUTPUT_META:
@@ -587,7 +1311,7 @@ static PyObject *Decoder_register(PyObject *self,
 	meta_type_gv = NULL;
 	meta_name = meta_descr = NULL;
 
-	if (!(di = otd_inst_find_by_obj(NULL, self))) {
+	if (!(di = otd_inst_find_by_obj(self))) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		goto err;
 	}
@@ -651,6 +1375,7 @@ static PyObject *Decoder_register(PyObject *self,
 	}
 
 	di->pd_output = g_slist_append(di->pd_output, pdo);
+	g_ptr_array_add(di->pd_output_table, pdo);
 	py_new_output_id = Py_BuildValue("i", pdo->pdo_id);
 
 	PyGILState_Release(gstate);
@@ -689,21 +1414,44 @@ static int get_term_type(const char *v)
 	return -1;
 }
 
+/* Create a tuple of pin values, from a bitmask over the PD's channels. */
+static PyObject *pinvalues_new(const struct otd_decoder_inst *di, uint64_t pins)
+{
+	int i;
+	unsigned long value;
+	PyObject *py_pinvalues;
+
+	py_pinvalues = PyTuple_New(di->dec_num_channels);
+	for (i = 0; i < di->dec_num_channels; i++) {
+		/* Value of unused channel is 0xff, instead of 0 or 1. */
+		if (di->dec_channelmap[i] == -1)
+			value = 0xff;
+		else
+			value = (pins >> i) & 1;
+		PyTuple_SetItem(py_pinvalues, i, PyLong_FromUnsignedLong(value));
+	}
+
+	return py_pinvalues;
+}
+
 /**
  * Get the pin values at the current sample number.
  *
+ * Tuples are immutable, so for decoders with up to
+ * OTD_PIN_TUPLE_MAX_CHANNELS channels, the tuple of every distinct pin
+ * combination gets created once and is returned again afterwards.
+ *
  * @param di The decoder instance to use. Must not be NULL.
  *           The number of channels must be >= 1.
  *
- * @return A newly allocated PyTuple containing the pin values at the
+ * @return A new reference to a PyTuple containing the pin values at the
  *         current sample number.
  */
-static PyObject *get_current_pinvalues(const struct otd_decoder_inst *di)
+static PyObject *get_current_pinvalues(struct otd_decoder_inst *di)
 {
-	int i;
-	uint8_t sample;
+	int i, ch;
+	uint64_t pins;
 	const uint8_t *sample_pos;
-	int byte_offset, bit_offset;
 	PyObject *py_pinvalues;
 	PyGILState_STATE gstate;
 
@@ -714,54 +1462,152 @@ static PyObject *get_current_pinvalues(const struct otd_decoder_inst *di)
 
 	gstate = PyGILState_Ensure();
 
-	py_pinvalues = PyTuple_New(di->dec_num_channels);
-
+	/* A channelmap value of -1 means "unused optional channel". */
+	sample_pos = inst_sample_pos(di, di->abs_cur_samplenum);
+	pins = 0;
 	for (i = 0; i < di->dec_num_channels; i++) {
-		/* A channelmap value of -1 means "unused optional channel". */
-		if (di->dec_channelmap[i] == -1) {
-			/* Value of unused channel is 0xff, instead of 0 or 1. */
-			PyTuple_SetItem(py_pinvalues, i, PyLong_FromUnsignedLong(0xff));
-		} else {
-			sample_pos = di->inbuf + ((di->abs_cur_samplenum - di->abs_start_samplenum) * di->data_unitsize);
-			byte_offset = di->dec_channelmap[i] / 8;
-			bit_offset = di->dec_channelmap[i] % 8;
-			sample = *(sample_pos + byte_offset) & (1 << bit_offset) ? 1 : 0;
-			PyTuple_SetItem(py_pinvalues, i, PyLong_FromUnsignedLong(sample));
-		}
+		ch = di->dec_channelmap[i];
+		if (ch != -1 && (sample_pos[ch / 8] & (1 << (ch % 8))))
+			pins |= (uint64_t)1 << i;
 	}
 
+	if (di->dec_num_channels > OTD_PIN_TUPLE_MAX_CHANNELS) {
+		py_pinvalues = pinvalues_new(di, pins);
+		PyGILState_Release(gstate);
+		return py_pinvalues;
+	}
+
+	if (!di->pin_tuples)
+		di->pin_tuples = g_malloc0(sizeof(PyObject *) << di->dec_num_channels);
+	if (!di->pin_tuples[pins])
+		di->pin_tuples[pins] = pinvalues_new(di, pins);
+	py_pinvalues = di->pin_tuples[pins];
+	Py_INCREF(py_pinvalues);
+
 	PyGILState_Release(gstate);
 
 	return py_pinvalues;
 }
 
 /**
- * Create a list of terms in the specified condition.
+ * Get the value for self.matched after a match.
+ *
+ * Like the pin values, the tuples for up to OTD_MATCHED_TUPLE_MAX_CONDS
+ * conditions get created once per instance. Tuples for n conditions are
+ * stored at index (1 << n) | mask, where 'mask' has bit i set when
+ * condition i matched.
+ *
+ * @param di The decoder instance to use. Must not be NULL.
+ *
+ * @return A new reference to a PyTuple of PyBool, or to None when the
+ *         wait() call had no conditions.
+ */
+static PyObject *get_current_matched(struct otd_decoder_inst *di)
+{
+	unsigned int i, num_conds;
+	uint64_t mask;
+	const gboolean *matches;
+	PyObject *py_matched;
+
+	if (!di->match_array || !di->match_array->len)
+		Py_RETURN_NONE;
+
+	num_conds = di->match_array->len;
+	matches = (const gboolean *)di->match_array->data;
+	if (num_conds > OTD_MATCHED_TUPLE_MAX_CONDS) {
+		py_matched = PyTuple_New(num_conds);
+		for (i = 0; i < num_conds; i++)
+			PyTuple_SetItem(py_matched, i, PyBool_FromLong(matches[i]));
+		return py_matched;
+	}
+
+	mask = 0;
+	for (i = 0; i < num_conds; i++) {
+		if (matches[i])
+			mask |= (uint64_t)1 << i;
+	}
+
+	if (!di->matched_tuples) {
+		di->matched_tuples = g_malloc0(sizeof(PyObject *)
+			<< (OTD_MATCHED_TUPLE_MAX_CONDS + 1));
+	}
+	py_matched = di->matched_tuples[((uint64_t)1 << num_conds) | mask];
+	if (!py_matched) {
+		py_matched = PyTuple_New(num_conds);
+		for (i = 0; i < num_conds; i++)
+			PyTuple_SetItem(py_matched, i, PyBool_FromLong(matches[i]));
+		di->matched_tuples[((uint64_t)1 << num_conds) | mask] = py_matched;
+	}
+	Py_INCREF(py_matched);
+
+	return py_matched;
+}
+
+/**
+ * Release the tuples which wait() returns repeatedly.
+ *
+ * @param di The decoder instance to use. Must not be NULL.
+ * @param all Whether to release the 'matched' tuples as well. The pin
+ *            value tuples depend on the channel map, the 'matched' tuples
+ *            don't.
+ *
+ * @private
+ */
+OTD_PRIV void wait_tuples_free(struct otd_decoder_inst *di, gboolean all)
+{
+	PyGILState_STATE gstate;
+	unsigned int i;
+
+	if (!di->pin_tuples && !(all && di->matched_tuples))
+		return;
+
+	gstate = PyGILState_Ensure();
+	if (di->pin_tuples) {
+		for (i = 0; i < (1U << di->dec_num_channels); i++)
+			Py_XDECREF(di->pin_tuples[i]);
+		g_free(di->pin_tuples);
+		di->pin_tuples = NULL;
+	}
+	if (all && di->matched_tuples) {
+		for (i = 0; i < (1U << (OTD_MATCHED_TUPLE_MAX_CONDS + 1)); i++)
+			Py_XDECREF(di->matched_tuples[i]);
+		g_free(di->matched_tuples);
+		di->matched_tuples = NULL;
+	}
+	PyGILState_Release(gstate);
+}
+
+/**
+ * Compile the terms of the specified condition.
  *
- * If there are no terms in the condition, 'term_list' will be NULL.
+ * All terms get folded into the bitmasks of 'cond', a skip term's count
+ * gets stored in 'skip'. If there are no terms in the condition, 'cond'
+ * will have zero terms.
  *
  * @param di The decoder instance to use. Must not be NULL.
  * @param py_dict A Python dict containing terms. Must not be NULL.
- * @param term_list Pointer to a GSList which will be set to the newly
- *                  created list of terms. Must not be NULL.
+ * @param cond The condition to fill in. Must not be NULL.
+ * @param skip The condition's skip state to fill in. Must not be NULL.
  *
  * @return OTD_OK upon success, a negative error code otherwise.
  */
-static int create_term_list(struct otd_decoder_inst *di,
-	PyObject *py_dict, GSList **term_list)
+static int compile_condition(struct otd_decoder_inst *di,
+	PyObject *py_dict, struct otd_cond *cond, struct otd_cond_skip *skip)
 {
 	Py_ssize_t pos = 0;
 	PyObject *py_key, *py_value;
-	struct otd_term *term;
 	int64_t num_samples_to_skip;
+	long channel;
+	uint64_t bit;
 	char *term_str;
 	PyGILState_STATE gstate;
 
-	if (!py_dict || !term_list)
+	if (!py_dict || !cond || !skip)
 		return OTD_ERR_ARG;
 
-	/* "Create" an empty GSList of terms. */
-	*term_list = NULL;
+	/* Conditions get compared bytewise, see cond_program_get(). */
+	memset(cond, 0, sizeof(*cond));
+	skip->num_samples_to_skip = 0;
 
 	gstate = PyGILState_Ensure();
 
@@ -775,11 +1621,39 @@ static int create_term_list(struct otd_decoder_inst *di,
 				otd_err("Failed to get the value.");
 				goto err;
 			}
-			term = g_malloc(sizeof(struct otd_term));
-			term->type = get_term_type(term_str);
-			term->channel = PyLong_AsLong(py_key);
-			if (term->channel < 0 || term->channel >= di->dec_num_channels)
-				term->type = OTD_TERM_ALWAYS_FALSE;
+			channel = PyLong_AsLong(py_key);
+			if (channel < 0 || channel >= di->dec_num_channels) {
+				cond->always_false = TRUE;
+				g_free(term_str);
+				continue;
+			}
+			bit = (uint64_t)1 << channel;
+			switch (get_term_type(term_str)) {
+			case OTD_TERM_HIGH:
+				cond->level_mask |= bit;
+				cond->level_value |= bit;
+				break;
+			case OTD_TERM_LOW:
+				cond->level_mask |= bit;
+				cond->level_value &= ~bit;
+				break;
+			case OTD_TERM_RISING_EDGE:
+				cond->rise_mask |= bit;
+				break;
+			case OTD_TERM_FALLING_EDGE:
+				cond->fall_mask |= bit;
+				break;
+			case OTD_TERM_EITHER_EDGE:
+				cond->edge_mask |= bit;
+				break;
+			case OTD_TERM_NO_EDGE:
+				cond->no_edge_mask |= bit;
+				break;
+			default:
+				otd_err("Unknown term type '%s'.", term_str);
+				cond->always_false = TRUE;
+				break;
+			}
 			g_free(term_str);
 		} else if (PyUnicode_Check(py_key)) {
 			/* The key is a string. */
@@ -788,19 +1662,17 @@ static int create_term_list(struct otd_decoder_inst *di,
 				otd_err("Failed to get number of samples to skip.");
 				goto err;
 			}
-			term = g_malloc(sizeof(struct otd_term));
-			term->type = OTD_TERM_SKIP;
-			term->num_samples_to_skip = num_samples_to_skip;
-			term->num_samples_already_skipped = 0;
 			if (num_samples_to_skip < 0)
-				term->type = OTD_TERM_ALWAYS_FALSE;
+				cond->always_false = TRUE;
+			else if ((uint64_t)num_samples_to_skip > skip->num_samples_to_skip)
+				skip->num_samples_to_skip = num_samples_to_skip;
+			cond->has_skip = TRUE;
 		} else {
 			otd_err("Term key is neither a string nor a number.");
 			goto err;
 		}
 
-		/* Add the term to the list of terms. */
-		*term_list = g_slist_append(*term_list, term);
+		cond->num_terms++;
 	}
 
 	PyGILState_Release(gstate);
@@ -813,21 +1685,82 @@ err:
 	return OTD_ERR;
 }
 
+/*
+ * Prepare the per-call match state of the current program: skip terms
+ * count from the current sample on, and no condition matched yet.
+ */
+static void reset_match_state(struct otd_decoder_inst *di,
+		unsigned int num_conditions)
+{
+	struct otd_cond_skip *skip;
+	unsigned int i;
+
+	for (i = 0; i < num_conditions; i++) {
+		skip = &g_array_index(di->cond_skip_array, struct otd_cond_skip, i);
+		skip->abs_target_samplenum = di->abs_cur_samplenum +
+			skip->num_samples_to_skip;
+		if (skip->abs_target_samplenum < di->abs_cur_samplenum)
+			skip->abs_target_samplenum = UINT64_MAX;
+	}
+
+	if (!di->match_array)
+		di->match_array = g_array_sized_new(FALSE, TRUE,
+			sizeof(gboolean), num_conditions);
+
+	/* An empty match array means "automatic match", self.matched is None. */
+	g_array_set_size(di->match_array,
+		di->cond_prog->num_active ? num_conditions : 0);
+	if (di->cond_prog->num_active)
+		memset(di->match_array->data, 0, num_conditions * sizeof(gboolean));
+}
+
+/*
+ * Make the compiled conditions in di->cond_scratch the current program,
+ * and prepare the per-call match state for them.
+ */
+static void activate_conditions(struct otd_decoder_inst *di,
+		unsigned int num_conditions)
+{
+	di->cond_prog = cond_program_get(di,
+		(struct otd_cond *)di->cond_scratch->data, num_conditions);
+	reset_match_state(di, num_conditions);
+}
+
+/* Size the scratch buffers for compiling the given number of conditions. */
+static void prepare_conditions(struct otd_decoder_inst *di,
+		unsigned int num_conditions)
+{
+	if (!di->cond_scratch)
+		di->cond_scratch = g_array_sized_new(FALSE, TRUE,
+			sizeof(struct otd_cond), num_conditions);
+	g_array_set_size(di->cond_scratch, num_conditions);
+
+	if (!di->cond_skip_array)
+		di->cond_skip_array = g_array_sized_new(FALSE, TRUE,
+			sizeof(struct otd_cond_skip), num_conditions);
+	g_array_set_size(di->cond_skip_array, num_conditions);
+}
+
 /**
  * Replace the current condition list with the new one.
  *
+ * The conditions get compiled, and the compiled program gets looked up in
+ * the instance's cache (see cond_program_get()). Decoders which call
+ * wait() with the same set of conditions over and over again only pay
+ * for the compilation of the conditions' terms, the preparation of the
+ * program gets done once.
+ *
  * @param self TODO. Must not be NULL.
  * @param args TODO. Must not be NULL.
  *
  * @retval OTD_OK The new condition list was set successfully.
  * @retval OTD_ERR There was an error setting the new condition list.
- *                 The contents of di->condition_list are undefined.
+ *                 The contents of di->cond_prog are undefined.
  * @retval 9999 TODO.
  */
 static int set_new_condition_list(PyObject *self, PyObject *args)
 {
 	struct otd_decoder_inst *di;
-	GSList *term_list;
 	PyObject *py_conditionlist, *py_conds, *py_dict;
 	int i, num_conditions, ret;
 	PyGILState_STATE gstate;
@@ -838,7 +1771,7 @@ static int set_new_condition_list(PyObject *self, PyObject *args)
 	gstate = PyGILState_Ensure();
 
 	/* Get the decoder instance. */
-	if (!(di = otd_inst_find_by_obj(NULL, self))) {
+	if (!(di = otd_inst_find_by_obj(self))) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		goto err;
 	}
@@ -888,12 +1821,11 @@ static int set_new_condition_list(PyObject *self, PyObject *args)
 		goto err;
 	}
 
-	/* Free the old condition list. */
-	condition_list_free(di);
+	prepare_conditions(di, num_conditions);
 
 	ret = OTD_OK;
 
-	/* Iterate over the conditions, set di->condition_list accordingly. */
+	/* Iterate over the conditions, compile them into di->cond_scratch. */
 	for (i = 0; i < num_conditions; i++) {
 		/* Get a condition (dict) from the condition list. */
 		py_dict = PyList_GetItem(py_conditionlist, i);
@@ -903,16 +1835,19 @@ static int set_new_condition_list(PyObject *self, PyObject *args)
 			break;
 		}
 
-		/* Create the list of terms in this condition. */
-		if ((ret = create_term_list(di, py_dict, &term_list)) < 0)
+		/* Compile the terms in this condition. */
+		ret = compile_condition(di, py_dict,
+			&g_array_index(di->cond_scratch, struct otd_cond, i),
+			&g_array_index(di->cond_skip_array, struct otd_cond_skip, i));
+		if (ret < 0)
 			break;
-
-		/* Add the new condition to the PD instance's condition list. */
-		di->condition_list = g_slist_append(di->condition_list, term_list);
 	}
 
 	Py_DecRef(py_conditionlist);
 
+	if (ret == OTD_OK)
+		activate_conditions(di, num_conditions);
+
 	PyGILState_Release(gstate);
 
 	return ret;
@@ -936,12 +1871,12 @@ ret_9999:
  *
  * @retval OTD_OK The new condition list was set successfully.
  * @retval OTD_ERR There was an error setting the new condition list.
- *                 The contents of di->condition_list are undefined.
+ *                 The contents of di->cond_prog are undefined.
  *
  * This routine is a reduced and specialized version of the @ref
- * set_new_condition_list() and @ref create_term_list() routines which
+ * set_new_condition_list() and @ref compile_condition() routines which
  * gets invoked when .wait() was called without specifications for
- * conditions. This minor duplication of the SKIP term list creation
+ * conditions. This minor duplication of the SKIP term compilation
  * simplifies the logic and avoids the creation of expensive Python
  * objects with "constant" values which the caller did not pass in the
  * first place. It results in maximum sharing of match handling code
@@ -949,16 +1884,17 @@ ret_9999:
  */
 static int set_skip_condition(struct otd_decoder_inst *di, uint64_t count)
 {
-	struct otd_term *term;
-	GSList *term_list;
-
-	condition_list_free(di);
-	term = g_malloc(sizeof(*term));
-	term->type = OTD_TERM_SKIP;
-	term->num_samples_to_skip = count;
-	term->num_samples_already_skipped = 0;
-	term_list = g_slist_append(NULL, term);
-	di->condition_list = g_slist_append(di->condition_list, term_list);
+	struct otd_cond *cond;
+	struct otd_cond_skip *skip;
+
+	prepare_conditions(di, 1);
+	cond = &g_array_index(di->cond_scratch, struct otd_cond, 0);
+	memset(cond, 0, sizeof(*cond));
+	cond->has_skip = TRUE;
+	cond->num_terms = 1;
+	skip = &g_array_index(di->cond_skip_array, struct otd_cond_skip, 0);
+	skip->num_samples_to_skip = count;
+	activate_conditions(di, 1);
 
 	return OTD_OK;
 }
@@ -980,26 +1916,165 @@ PyDoc_STRVAR(Decoder_wait_doc,
 	"'skip' to advance over the given number of samples.\n"
 );
 
-static PyObject *Decoder_wait(PyObject *self, PyObject *args)
+/**
+ * Wait until the current conditions match.
+ *
+ * Chunks without a match get handed back to the main thread (or get
+ * released when they were queued), and the next chunk gets waited for.
+ * In inline and pool mode, the instance's greenlet gets suspended instead.
+ * Must be called with the GIL held.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @retval OTD_OK There was a match at di->abs_cur_samplenum.
+ * @retval OTD_ERR EOF was reached, a Python EOFError is pending.
+ * @retval OTD_ERR_TERM_REQ Termination was requested.
+ * @retval OTD_ERR_PYTHON Switching greenlets failed, an exception is pending.
+ */
+static int wait_core(struct otd_decoder_inst *di)
 {
-	int ret;
-	uint64_t skip_count;
-	unsigned int i;
-	gboolean found_match;
-	struct otd_decoder_inst *di;
-	PyObject *py_pinvalues, *py_matched, *py_samplenum;
-	PyGILState_STATE gstate;
+	gboolean found_match, suspend;
+	struct otd_chunk *queued_chunk;
+	PyObject *py_samplenum, *py_parent, *py_res;
 
-	if (!self || !args)
-		return NULL;
+	while (1) {
 
-	gstate = PyGILState_Ensure();
+		/*
+		 * In inline and pool mode, switch back to the greenlet which
+		 * resumed this one, until there are new samples or
+		 * termination was requested.
+		 */
+		if (di->py_greenlet) {
+			g_mutex_lock(&di->data_mutex);
+			suspend = !di->got_new_samples && !di->want_wait_terminate &&
+				g_queue_is_empty(&di->chunk_queue);
+			g_mutex_unlock(&di->data_mutex);
+			if (suspend) {
+				py_parent = PyObject_GetAttrString(di->py_greenlet,
+					"parent");
+				py_res = NULL;
+				if (py_parent)
+					py_res = PyObject_CallMethod(py_parent,
+						"switch", NULL);
+				Py_XDECREF(py_parent);
+				if (!py_res)
+					return OTD_ERR_PYTHON;
+				Py_DECREF(py_res);
+				continue;
+			}
+		}
 
-	if (!(di = otd_inst_find_by_obj(NULL, self))) {
-		PyErr_SetString(PyExc_Exception, "decoder instance not found");
-		PyGILState_Release(gstate);
-		Py_RETURN_NONE;
-	}
+		Py_BEGIN_ALLOW_THREADS
+
+		/* Wait for new samples to process, or termination request. */
+		g_mutex_lock(&di->data_mutex);
+		while (!di->got_new_samples && !di->want_wait_terminate) {
+			if (otd_inst_queue_next(di))
+				break;
+			g_cond_wait(&di->got_new_samples_cond, &di->data_mutex);
+		}
+
+		/*
+		 * Check whether any of the current condition(s) match.
+		 * Arrange for termination requests to take a code path which
+		 * won't find new samples to process, pretends to have processed
+		 * previously stored samples, and returns to the main thread,
+		 * while the termination request still gets signalled.
+		 */
+		found_match = FALSE;
+
+		/* Ignore return value for now, should never be negative. */
+		(void)process_samples_until_condition_match(di, &found_match);
+
+		Py_END_ALLOW_THREADS
+
+		/* If there's a match, return. */
+		if (found_match) {
+			g_mutex_unlock(&di->data_mutex);
+			return OTD_OK;
+		}
+
+		/* No match, reset state for the next chunk. */
+		queued_chunk = NULL;
+		if (!di->want_wait_terminate) {
+			queued_chunk = di->queued_chunk;
+			di->queued_chunk = NULL;
+		}
+		di->got_new_samples = FALSE;
+		di->handled_all_samples = TRUE;
+		di->abs_start_samplenum = 0;
+		di->abs_end_samplenum = 0;
+		di->chunk = NULL;
+		di->inbuf = NULL;
+		di->inbuflen = 0;
+		chunk_views_release(di);
+
+		/* Signal the main thread that we handled all samples. */
+		g_cond_signal(&di->handled_all_samples_cond);
+
+		/* Flush the stack and release a queued chunk ourselves. */
+		if (queued_chunk) {
+			g_mutex_unlock(&di->data_mutex);
+			otd_inst_queue_done(di, queued_chunk);
+			g_mutex_lock(&di->data_mutex);
+		}
+
+		/*
+		 * When EOF was provided externally, communicate the
+		 * Python EOFError exception to .decode() and return
+		 * from the .wait() method call. This is motivated by
+		 * the use of Python context managers, so that .decode()
+		 * methods can "close" incompletely accumulated data
+		 * when the sample data is exhausted.
+		 */
+		if (di->communicate_eof) {
+			/* Advance self.samplenum to the (absolute) last sample number. */
+			py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
+			PyObject_SetAttr(di->py_inst, py_attr_samplenum, py_samplenum);
+			Py_DECREF(py_samplenum);
+			/* Raise an EOFError Python exception. */
+			otd_dbg("%s: %s: Raising EOF from wait().",
+				di->inst_id, __func__);
+			g_mutex_unlock(&di->data_mutex);
+			PyErr_SetString(PyExc_EOFError, "samples exhausted");
+			return OTD_ERR;
+		}
+
+		/*
+		 * When termination of wait() and decode() was requested,
+		 * then exit the loop after releasing the mutex.
+		 */
+		if (di->want_wait_terminate) {
+			otd_dbg("%s: %s: Will return from wait().",
+				di->inst_id, __func__);
+			g_mutex_unlock(&di->data_mutex);
+			return OTD_ERR_TERM_REQ;
+		}
+
+		g_mutex_unlock(&di->data_mutex);
+	}
+
+	return OTD_OK;
+}
+
+static PyObject *Decoder_wait(PyObject *self, PyObject *args)
+{
+	int ret;
+	uint64_t skip_count;
+	struct otd_decoder_inst *di;
+	PyObject *py_pinvalues, *py_matched, *py_samplenum;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		PyGILState_Release(gstate);
+		Py_RETURN_NONE;
+	}
 
 	ret = set_new_condition_list(self, args);
 	if (ret < 0) {
@@ -1016,7 +2091,7 @@ static PyObject *Decoder_wait(PyObject *self, PyObject *args)
 		 */
 		if (di->abs_cur_samplenum)
 			skip_count = 1;
-		else if (!di->condition_list)
+		else if (!di->cond_prog)
 			skip_count = 0;
 		else
 			skip_count = 1;
@@ -1028,105 +2103,1083 @@ static PyObject *Decoder_wait(PyObject *self, PyObject *args)
 		}
 	}
 
-	while (1) {
+	if (wait_core(di) != OTD_OK)
+		goto err;
+
+	/* Set self.samplenum to the (absolute) sample number that matched. */
+	py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
+	PyObject_SetAttr(di->py_inst, py_attr_samplenum, py_samplenum);
+	Py_DECREF(py_samplenum);
+
+	py_matched = get_current_matched(di);
+	PyObject_SetAttr(di->py_inst, py_attr_matched, py_matched);
+	Py_DECREF(py_matched);
+
+	py_pinvalues = get_current_pinvalues(di);
+
+	PyGILState_Release(gstate);
+
+	return py_pinvalues;
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+PyDoc_STRVAR(Decoder_wait_batch_doc,
+	"Wait for up to max_count occurrences of one or more conditions.\n"
+	"\n"
+	"Takes the same conditions as wait(), plus the maximum number of\n"
+	"matches to return. Behaves like consecutive wait() calls with the\n"
+	"same conditions: Blocks until the first match, then collects further\n"
+	"matches from the sample data which is available already.\n"
+	"Sets self.samplenum and self.matched for the last match.\n"
+	"\n"
+	"Returns a tuple of three memoryviews: the matches' sample numbers\n"
+	"(format 'Q'), the matches' condition bitmasks (format 'Q', bit n\n"
+	"is set when condition n matched, 0 when there were no conditions),\n"
+	"and the pin values at the matches (format 'B', one item per channel\n"
+	"and match).\n"
+);
+
+/* Wrap the contents of an array into a read-only, typed memoryview. */
+static PyObject *array_to_memoryview(const GArray *arr, const char *format)
+{
+	PyObject *py_bytes, *py_view, *py_cast;
+
+	py_bytes = PyBytes_FromStringAndSize(arr->data,
+		(Py_ssize_t)arr->len * g_array_get_element_size((GArray *)arr));
+	if (!py_bytes)
+		return NULL;
+	py_view = PyMemoryView_FromObject(py_bytes);
+	Py_DECREF(py_bytes);
+	if (!py_view)
+		return NULL;
+	py_cast = PyObject_CallMethod(py_view, "cast", "s", format);
+	Py_DECREF(py_view);
+
+	return py_cast;
+}
+
+/*
+ * Handle a match while collecting matches. Returns whether to continue
+ * collecting.
+ */
+typedef gboolean (*wait_collect_cb)(const struct otd_decoder_inst *di,
+		void *cb_data);
+
+/*
+ * Collect further matches of the current conditions from the current
+ * chunk, like consecutive wait() calls would find them, and pass them to
+ * 'cb'. The search for a match which is not in the chunk gets undone, so
+ * that the next call to wait() resumes right after the last match.
+ */
+static void wait_collect(struct otd_decoder_inst *di,
+		gboolean condition_less, wait_collect_cb cb, void *cb_data)
+{
+	uint64_t abs_cur_samplenum;
+	uint8_t old_pins[OTD_MAX_COND_CHANNELS];
+	gboolean old_matches[OTD_MAX_CONDITIONS];
+	unsigned int num_conditions, num_matches;
+	gboolean found_match;
+
+	num_conditions = di->cond_skip_array->len;
+	num_matches = di->match_array->len;
+
+	/* Condition-less waits skip one sample after the first. */
+	if (condition_less) {
+		g_array_index(di->cond_skip_array, struct otd_cond_skip,
+			0).num_samples_to_skip = 1;
+	}
+
+	while (TRUE) {
+		abs_cur_samplenum = di->abs_cur_samplenum;
+		memcpy(old_pins, di->old_pins_array->data,
+			di->old_pins_array->len);
+		memcpy(old_matches, di->match_array->data,
+			num_matches * sizeof(gboolean));
+
+		reset_match_state(di, num_conditions);
+		found_match = FALSE;
+		if (di->abs_cur_samplenum < di->abs_end_samplenum)
+			(void)process_samples_until_condition_match(di, &found_match);
+		if (!found_match) {
+			di->abs_cur_samplenum = abs_cur_samplenum;
+			memcpy(di->old_pins_array->data, old_pins,
+				di->old_pins_array->len);
+			g_array_set_size(di->match_array, num_matches);
+			memcpy(di->match_array->data, old_matches,
+				num_matches * sizeof(gboolean));
+			break;
+		}
+
+		if (!cb(di, cb_data))
+			break;
+	}
+}
+
+/* Set self.samplenum and self.matched after collecting matches. */
+static void wait_collect_done(struct otd_decoder_inst *di)
+{
+	PyObject *py_samplenum, *py_matched;
+
+	py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
+	PyObject_SetAttr(di->py_inst, py_attr_samplenum, py_samplenum);
+	Py_DECREF(py_samplenum);
+	py_matched = get_current_matched(di);
+	PyObject_SetAttr(di->py_inst, py_attr_matched, py_matched);
+	Py_DECREF(py_matched);
+}
+
+/* Append the pin values at the current sample number to an array. */
+static void pins_append(const struct otd_decoder_inst *di, GArray *pins)
+{
+	const uint8_t *sample_pos;
+	uint8_t value;
+	int i, ch;
+
+	sample_pos = inst_sample_pos(di, di->abs_cur_samplenum);
+	for (i = 0; i < di->dec_num_channels; i++) {
+		/* Value of unused channel is 0xff, instead of 0 or 1. */
+		ch = di->dec_channelmap[i];
+		if (ch == -1)
+			value = 0xff;
+		else
+			value = (sample_pos[ch / 8] >> (ch % 8)) & 1;
+		g_array_append_val(pins, value);
+	}
+}
+
+struct wait_batch_ctx {
+	Py_ssize_t max_count;
+	GArray *samplenums;
+	GArray *matched;
+	GArray *pins;
+};
+
+/* Append the current match of a wait_batch() call to its result arrays. */
+static gboolean wait_batch_add(const struct otd_decoder_inst *di,
+		void *cb_data)
+{
+	struct wait_batch_ctx *ctx;
+	const gboolean *matches;
+	uint64_t mask;
+	unsigned int i;
+
+	ctx = cb_data;
+	g_array_append_val(ctx->samplenums, di->abs_cur_samplenum);
+
+	mask = 0;
+	matches = (const gboolean *)di->match_array->data;
+	for (i = 0; i < di->match_array->len; i++) {
+		if (matches[i])
+			mask |= (uint64_t)1 << i;
+	}
+	g_array_append_val(ctx->matched, mask);
+
+	pins_append(di, ctx->pins);
+
+	return (Py_ssize_t)ctx->samplenums->len < ctx->max_count;
+}
+
+/**
+ * Wait for a number of matches of the specified condition(s).
+ *
+ * The first match is handled by Decoder_wait(), which may block for
+ * more sample data. Subsequent matches only get collected from the
+ * current chunk, see wait_collect().
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args TODO. Must not be NULL.
+ *
+ * @return A tuple of memoryviews, or NULL upon errors and EOF.
+ */
+static PyObject *Decoder_wait_batch(PyObject *self, PyObject *args)
+{
+	struct otd_decoder_inst *di;
+	struct wait_batch_ctx ctx;
+	PyObject *py_conds, *py_wait_args, *py_pinvalues, *py_ret;
+	PyObject *py_samplenums, *py_matched, *py_pins;
+	Py_ssize_t max_count;
+	gboolean condition_less;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!PyArg_ParseTuple(args, "On", &py_conds, &max_count)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+	if (max_count < 1) {
+		PyErr_SetString(PyExc_ValueError, "max_count must be positive");
+		goto err;
+	}
+	condition_less = FALSE;
+	if (py_conds == Py_None) {
+		condition_less = TRUE;
+	} else if (PyList_Check(py_conds)) {
+		condition_less = PyList_Size(py_conds) == 0;
+		if (PyList_Size(py_conds) > OTD_MAX_CONDITIONS) {
+			PyErr_SetString(PyExc_ValueError, "too many conditions");
+			goto err;
+		}
+	} else if (PyDict_Check(py_conds)) {
+		condition_less = PyDict_Size(py_conds) == 0;
+	}
+
+	/* Have the first match found (or EOF raised) by wait(). */
+	py_wait_args = PyTuple_Pack(1, py_conds);
+	py_pinvalues = Decoder_wait(self, py_wait_args);
+	Py_DECREF(py_wait_args);
+	if (!py_pinvalues)
+		goto err;
+	Py_DECREF(py_pinvalues);
+
+	ctx.max_count = max_count;
+	ctx.samplenums = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	ctx.matched = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	ctx.pins = g_array_new(FALSE, FALSE, sizeof(uint8_t));
+
+	if (wait_batch_add(di, &ctx)) {
+		Py_BEGIN_ALLOW_THREADS
+		g_mutex_lock(&di->data_mutex);
+		wait_collect(di, condition_less, wait_batch_add, &ctx);
+		g_mutex_unlock(&di->data_mutex);
+		Py_END_ALLOW_THREADS
+
+		/* Set self.samplenum and self.matched for the last match. */
+		if (ctx.samplenums->len > 1)
+			wait_collect_done(di);
+	}
+
+	py_samplenums = array_to_memoryview(ctx.samplenums, "Q");
+	py_matched = array_to_memoryview(ctx.matched, "Q");
+	py_pins = array_to_memoryview(ctx.pins, "B");
+	g_array_free(ctx.samplenums, TRUE);
+	g_array_free(ctx.matched, TRUE);
+	g_array_free(ctx.pins, TRUE);
+
+	py_ret = NULL;
+	if (py_samplenums && py_matched && py_pins)
+		py_ret = PyTuple_Pack(3, py_samplenums, py_matched, py_pins);
+	Py_XDECREF(py_samplenums);
+	Py_XDECREF(py_matched);
+	Py_XDECREF(py_pins);
+
+	PyGILState_Release(gstate);
+
+	return py_ret;
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+PyDoc_STRVAR(Decoder_shift_in_doc,
+	"Shift in bits on the edges of a clock channel.\n"
+	"\n"
+	"Arguments: clk (a channel index), edge ('r', 'f' or 'e'), data (a\n"
+	"channel index or a sequence of channel indices) and num_bits (1 to\n"
+	"64). Optional arguments: msb_first (default True), cs (the channel\n"
+	"index of a gate, default None) and cs_level (the gate's active\n"
+	"level, default 0).\n"
+	"\n"
+	"Behaves like consecutive wait() calls for the clock edge, sampling\n"
+	"the data channels at every edge. With a gate, stops early at the\n"
+	"first sample where the gate is seen inactive, before or instead of\n"
+	"a clock edge. Unconnected data channels read as 0, an unconnected\n"
+	"gate is ignored. Sets self.samplenum and self.matched like wait().\n"
+	"\n"
+	"Returns a tuple of the words (a tuple with one integer per data\n"
+	"channel) and a memoryview of the bits' sample numbers (format 'Q').\n"
+	"Fewer than num_bits sample numbers mean that the gate deasserted.\n"
+);
+
+struct shift_in_ctx {
+	unsigned int num_bits;
+	gboolean msb_first;
+	gboolean gated;
+	gboolean gate_seen;
+	unsigned int num_data;
+	int data_chans[OTD_MAX_COND_CHANNELS];
+	uint64_t words[OTD_MAX_COND_CHANNELS];
+	GArray *samplenums;
+};
+
+/* Shift the data channels' bits at a clock edge into the words. */
+static gboolean shift_in_add(const struct otd_decoder_inst *di,
+		void *cb_data)
+{
+	struct shift_in_ctx *ctx;
+	const uint8_t *sample_pos;
+	const gboolean *matches;
+	unsigned int i, bitnum;
+	uint64_t bit;
+	int ch;
+
+	ctx = cb_data;
+	matches = (const gboolean *)di->match_array->data;
+	if (ctx->gated && matches[1]) {
+		ctx->gate_seen = TRUE;
+		return FALSE;
+	}
+
+	sample_pos = inst_sample_pos(di, di->abs_cur_samplenum);
+	bitnum = ctx->samplenums->len;
+	for (i = 0; i < ctx->num_data; i++) {
+		ch = ctx->data_chans[i];
+		bit = 0;
+		if (ch != -1)
+			bit = (sample_pos[ch / 8] >> (ch % 8)) & 1;
+		if (ctx->msb_first)
+			ctx->words[i] = (ctx->words[i] << 1) | bit;
+		else
+			ctx->words[i] |= bit << bitnum;
+	}
+	g_array_append_val(ctx->samplenums, di->abs_cur_samplenum);
+
+	return ctx->samplenums->len < ctx->num_bits;
+}
+
+/* Get a PD channel index argument, raise an exception when it's invalid. */
+static int shift_in_channel(const struct otd_decoder_inst *di,
+		PyObject *py_idx, int *idx)
+{
+	*idx = PyLong_AsLong(py_idx);
+	if (*idx == -1 && PyErr_Occurred())
+		return OTD_ERR_ARG;
+	if (*idx < 0 || *idx >= di->dec_num_channels) {
+		PyErr_SetString(PyExc_IndexError, "invalid channel index");
+		return OTD_ERR_ARG;
+	}
+
+	return OTD_OK;
+}
+
+/* Create the condition list for the clock edge, and the inactive gate. */
+static PyObject *shift_in_conditions(int clk, const char *edge,
+		int cs, int cs_level, gboolean gated)
+{
+	PyObject *py_conds, *py_dict, *py_key, *py_value;
+
+	py_conds = PyList_New(gated ? 2 : 1);
+
+	py_dict = PyDict_New();
+	py_key = PyLong_FromLong(clk);
+	py_value = PyUnicode_FromString(edge);
+	PyDict_SetItem(py_dict, py_key, py_value);
+	Py_DECREF(py_key);
+	Py_DECREF(py_value);
+	PyList_SetItem(py_conds, 0, py_dict);
+
+	if (gated) {
+		py_dict = PyDict_New();
+		py_key = PyLong_FromLong(cs);
+		py_value = PyUnicode_FromString(cs_level ? "l" : "h");
+		PyDict_SetItem(py_dict, py_key, py_value);
+		Py_DECREF(py_key);
+		Py_DECREF(py_value);
+		PyList_SetItem(py_conds, 1, py_dict);
+	}
+
+	return py_conds;
+}
+
+/**
+ * Shift in a number of bits on clock edges.
+ *
+ * Like Decoder_wait_batch(), every run of clock edges within a chunk gets
+ * handled by wait_collect(), and Decoder_wait() waits for the next chunk.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args TODO. Must not be NULL.
+ * @param kwargs TODO.
+ *
+ * @return A tuple of the words and the sample numbers, or NULL upon
+ *         errors and EOF.
+ */
+static PyObject *Decoder_shift_in(PyObject *self, PyObject *args,
+		PyObject *kwargs)
+{
+	struct otd_decoder_inst *di;
+	struct shift_in_ctx ctx;
+	PyObject *py_data, *py_cs, *py_idx, *py_conds, *py_wait_args;
+	PyObject *py_pinvalues, *py_words, *py_samplenums, *py_ret;
+	const char *edge;
+	int clk, cs, cs_level, msb_first, num_bits, idx, term, ret;
+	Py_ssize_t i, num_data;
+	char *keywords[] = { "clk", "edge", "data", "num_bits", "msb_first",
+		"cs", "cs_level", NULL };
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	msb_first = 1;
+	py_cs = Py_None;
+	cs_level = 0;
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "isOi|pOi", keywords,
+			&clk, &edge, &py_data, &num_bits, &msb_first,
+			&py_cs, &cs_level)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+
+	if (clk < 0 || clk >= di->dec_num_channels) {
+		PyErr_SetString(PyExc_IndexError, "invalid channel index");
+		goto err;
+	}
+	term = get_term_type(edge);
+	if (strlen(edge) != 1 || (term != OTD_TERM_RISING_EDGE &&
+			term != OTD_TERM_FALLING_EDGE &&
+			term != OTD_TERM_EITHER_EDGE)) {
+		PyErr_SetString(PyExc_ValueError, "edge must be 'r', 'f' or 'e'");
+		goto err;
+	}
+	if (num_bits < 1 || num_bits > 64) {
+		PyErr_SetString(PyExc_ValueError, "num_bits must be 1 to 64");
+		goto err;
+	}
+
+	memset(&ctx, 0, sizeof(ctx));
+	ctx.num_bits = num_bits;
+	ctx.msb_first = msb_first;
+
+	/* Accept a single data channel, or a sequence of them. */
+	if (PyLong_Check(py_data)) {
+		if (shift_in_channel(di, py_data, &idx) != OTD_OK)
+			goto err;
+		ctx.data_chans[ctx.num_data++] = di->dec_channelmap[idx];
+	} else {
+		num_data = PySequence_Size(py_data);
+		if (num_data < 1 || num_data > OTD_MAX_COND_CHANNELS) {
+			if (!PyErr_Occurred())
+				PyErr_SetString(PyExc_ValueError, "invalid number of data channels");
+			goto err;
+		}
+		for (i = 0; i < num_data; i++) {
+			py_idx = PySequence_GetItem(py_data, i);
+			if (!py_idx)
+				goto err;
+			ret = shift_in_channel(di, py_idx, &idx);
+			Py_DECREF(py_idx);
+			if (ret != OTD_OK)
+				goto err;
+			ctx.data_chans[ctx.num_data++] = di->dec_channelmap[idx];
+		}
+	}
+
+	/* An unconnected gate is ignored. */
+	cs = -1;
+	if (py_cs != Py_None) {
+		if (shift_in_channel(di, py_cs, &cs) != OTD_OK)
+			goto err;
+		ctx.gated = di->dec_channelmap[cs] != -1;
+	}
+
+	py_conds = shift_in_conditions(clk, edge, cs, cs_level, ctx.gated);
+	py_wait_args = PyTuple_Pack(1, py_conds);
+	Py_DECREF(py_conds);
+	ctx.samplenums = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+
+	while (TRUE) {
+		/* Wait for the next edge, possibly in the next chunk. */
+		py_pinvalues = Decoder_wait(self, py_wait_args);
+		if (!py_pinvalues) {
+			Py_DECREF(py_wait_args);
+			g_array_free(ctx.samplenums, TRUE);
+			goto err;
+		}
+		Py_DECREF(py_pinvalues);
+		if (!shift_in_add(di, &ctx))
+			break;
+
+		/* Take the following edges from the current chunk. */
+		Py_BEGIN_ALLOW_THREADS
+		g_mutex_lock(&di->data_mutex);
+		wait_collect(di, FALSE, shift_in_add, &ctx);
+		g_mutex_unlock(&di->data_mutex);
+		Py_END_ALLOW_THREADS
+		if (ctx.gate_seen || ctx.samplenums->len >= ctx.num_bits)
+			break;
+	}
+	Py_DECREF(py_wait_args);
+
+	wait_collect_done(di);
+
+	py_words = PyTuple_New(ctx.num_data);
+	for (i = 0; i < (Py_ssize_t)ctx.num_data; i++)
+		PyTuple_SetItem(py_words, i, PyLong_FromUnsignedLongLong(ctx.words[i]));
+	py_samplenums = array_to_memoryview(ctx.samplenums, "Q");
+	g_array_free(ctx.samplenums, TRUE);
+
+	py_ret = NULL;
+	if (py_samplenums)
+		py_ret = PyTuple_Pack(2, py_words, py_samplenums);
+	Py_DECREF(py_words);
+	Py_XDECREF(py_samplenums);
+
+	PyGILState_Release(gstate);
+
+	return py_ret;
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+PyDoc_STRVAR(Decoder_edges_doc,
+	"Get the sample numbers of a channel's next edges.\n"
+	"\n"
+	"Arguments: channel (a channel index), and optionally kind ('r', 'f'\n"
+	"or 'e', default 'e') and max_count (the maximum number of edges to\n"
+	"return).\n"
+	"\n"
+	"Behaves like consecutive wait({channel: kind}) calls: Blocks until\n"
+	"the first edge, then collects further edges from the sample data\n"
+	"which is available already. Sets self.samplenum and self.matched\n"
+	"for the last edge, so edges() and wait() calls can be mixed.\n"
+	"\n"
+	"Returns a tuple of two memoryviews: the edges' sample numbers\n"
+	"(format 'Q') and the channel's new levels (format 'B').\n"
+);
+
+struct edges_ctx {
+	Py_ssize_t max_count;
+	int channel;
+	GArray *samplenums;
+	GArray *levels;
+};
+
+/* Append the current edge of an edges() call to its result arrays. */
+static gboolean edges_add(const struct otd_decoder_inst *di, void *cb_data)
+{
+	struct edges_ctx *ctx;
+	const uint8_t *sample_pos;
+	uint8_t level;
+
+	ctx = cb_data;
+	g_array_append_val(ctx->samplenums, di->abs_cur_samplenum);
+	sample_pos = inst_sample_pos(di, di->abs_cur_samplenum);
+	level = (sample_pos[ctx->channel / 8] >> (ctx->channel % 8)) & 1;
+	g_array_append_val(ctx->levels, level);
+
+	return (Py_ssize_t)ctx->samplenums->len < ctx->max_count;
+}
+
+/**
+ * Get the next edges of a channel.
+ *
+ * Works like Decoder_wait_batch() with a single edge condition, and
+ * only returns the channel's levels instead of all pin values.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args TODO. Must not be NULL.
+ * @param kwargs TODO.
+ *
+ * @return A tuple of memoryviews, or NULL upon errors and EOF.
+ */
+static PyObject *Decoder_edges(PyObject *self, PyObject *args,
+		PyObject *kwargs)
+{
+	struct otd_decoder_inst *di;
+	struct edges_ctx ctx;
+	PyObject *py_conds, *py_wait_args, *py_pinvalues, *py_ret;
+	PyObject *py_samplenums, *py_levels;
+	const char *kind;
+	int channel, term;
+	Py_ssize_t max_count;
+	char *keywords[] = { "channel", "kind", "max_count", NULL };
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	kind = "e";
+	max_count = OTD_EDGES_DEFAULT_MAX_COUNT;
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|sn", keywords,
+			&channel, &kind, &max_count)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+
+	if (channel < 0 || channel >= di->dec_num_channels) {
+		PyErr_SetString(PyExc_IndexError, "invalid channel index");
+		goto err;
+	}
+	term = get_term_type(kind);
+	if (strlen(kind) != 1 || (term != OTD_TERM_RISING_EDGE &&
+			term != OTD_TERM_FALLING_EDGE &&
+			term != OTD_TERM_EITHER_EDGE)) {
+		PyErr_SetString(PyExc_ValueError, "kind must be 'r', 'f' or 'e'");
+		goto err;
+	}
+	if (max_count < 1) {
+		PyErr_SetString(PyExc_ValueError, "max_count must be positive");
+		goto err;
+	}
+
+	/* Have the first edge found (or EOF raised) by wait(). */
+	py_conds = shift_in_conditions(channel, kind, -1, 0, FALSE);
+	py_wait_args = PyTuple_Pack(1, py_conds);
+	Py_DECREF(py_conds);
+	py_pinvalues = Decoder_wait(self, py_wait_args);
+	Py_DECREF(py_wait_args);
+	if (!py_pinvalues)
+		goto err;
+	Py_DECREF(py_pinvalues);
 
-		Py_BEGIN_ALLOW_THREADS
+	/* Edges only match on connected channels. */
+	ctx.max_count = max_count;
+	ctx.channel = di->dec_channelmap[channel];
+	ctx.samplenums = g_array_new(FALSE, FALSE, sizeof(uint64_t));
+	ctx.levels = g_array_new(FALSE, FALSE, sizeof(uint8_t));
 
-		/* Wait for new samples to process, or termination request. */
+	if (edges_add(di, &ctx)) {
+		Py_BEGIN_ALLOW_THREADS
 		g_mutex_lock(&di->data_mutex);
-		while (!di->got_new_samples && !di->want_wait_terminate)
-			g_cond_wait(&di->got_new_samples_cond, &di->data_mutex);
+		wait_collect(di, FALSE, edges_add, &ctx);
+		g_mutex_unlock(&di->data_mutex);
+		Py_END_ALLOW_THREADS
 
-		/*
-		 * Check whether any of the current condition(s) match.
-		 * Arrange for termination requests to take a code path which
-		 * won't find new samples to process, pretends to have processed
-		 * previously stored samples, and returns to the main thread,
-		 * while the termination request still gets signalled.
-		 */
-		found_match = FALSE;
+		/* Set self.samplenum and self.matched for the last edge. */
+		if (ctx.samplenums->len > 1)
+			wait_collect_done(di);
+	}
 
-		/* Ignore return value for now, should never be negative. */
-		(void)process_samples_until_condition_match(di, &found_match);
+	py_samplenums = array_to_memoryview(ctx.samplenums, "Q");
+	py_levels = array_to_memoryview(ctx.levels, "B");
+	g_array_free(ctx.samplenums, TRUE);
+	g_array_free(ctx.levels, TRUE);
 
-		Py_END_ALLOW_THREADS
+	py_ret = NULL;
+	if (py_samplenums && py_levels)
+		py_ret = PyTuple_Pack(2, py_samplenums, py_levels);
+	Py_XDECREF(py_samplenums);
+	Py_XDECREF(py_levels);
 
-		/* If there's a match, set self.samplenum etc. and return. */
-		if (found_match) {
-			/* Set self.samplenum to the (absolute) sample number that matched. */
-			py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
-			PyObject_SetAttrString(di->py_inst, "samplenum", py_samplenum);
-			Py_DECREF(py_samplenum);
+	PyGILState_Release(gstate);
 
-			if (di->match_array && di->match_array->len > 0) {
-				py_matched = PyTuple_New(di->match_array->len);
-				for (i = 0; i < di->match_array->len; i++)
-					PyTuple_SetItem(py_matched, i, PyBool_FromLong(di->match_array->data[i]));
-				PyObject_SetAttrString(di->py_inst, "matched", py_matched);
-				Py_DECREF(py_matched);
-				match_array_free(di);
-			} else {
-				PyObject_SetAttrString(di->py_inst, "matched", Py_None);
-			}
+	return py_ret;
 
-			py_pinvalues = get_current_pinvalues(di);
+err:
+	PyGILState_Release(gstate);
 
-			g_mutex_unlock(&di->data_mutex);
+	return NULL;
+}
 
-			PyGILState_Release(gstate);
+PyDoc_STRVAR(Decoder_sample_at_doc,
+	"Get the pin values at a number of sample numbers.\n"
+	"\n"
+	"Arguments: Either a sequence of absolute sample numbers, or the\n"
+	"start, the period (both can be fractional) and the count of evenly\n"
+	"spaced sample points, which are at ceil(start + i * period) for i\n"
+	"in range(count). Sample numbers must not decrease, and must not be\n"
+	"before self.samplenum.\n"
+	"\n"
+	"Behaves like consecutive wait({'skip': n}) calls which advance to\n"
+	"the sample numbers, including blocking for more sample data and\n"
+	"raising EOFError. Sets self.samplenum and self.matched like wait().\n"
+	"\n"
+	"Returns a memoryview of the pin values (format 'B', one item per\n"
+	"channel and sample number).\n"
+);
 
-			return py_pinvalues;
-		}
+/* Get the sample numbers for sample_at(), raise an exception when invalid. */
+static GArray *sample_at_targets(const struct otd_decoder_inst *di,
+		PyObject *args)
+{
+	GArray *targets;
+	PyObject *py_samplenums, *py_item;
+	Py_ssize_t i, count;
+	uint64_t target, prev;
+	double start, period, pos;
 
-		/* No match, reset state for the next chunk. */
-		di->got_new_samples = FALSE;
-		di->handled_all_samples = TRUE;
-		di->abs_start_samplenum = 0;
-		di->abs_end_samplenum = 0;
-		di->inbuf = NULL;
-		di->inbuflen = 0;
+	targets = g_array_new(FALSE, FALSE, sizeof(uint64_t));
 
-		/* Signal the main thread that we handled all samples. */
-		g_cond_signal(&di->handled_all_samples_cond);
+	if (PyTuple_Size(args) == 1) {
+		if (!PyArg_ParseTuple(args, "O", &py_samplenums))
+			goto err;
+		if ((count = PySequence_Size(py_samplenums)) < 0)
+			goto err;
+		for (i = 0; i < count; i++) {
+			if (!(py_item = PySequence_GetItem(py_samplenums, i)))
+				goto err;
+			target = PyLong_AsUnsignedLongLong(py_item);
+			Py_DECREF(py_item);
+			if (PyErr_Occurred())
+				goto err;
+			g_array_append_val(targets, target);
+		}
+	} else {
+		if (!PyArg_ParseTuple(args, "ddn", &start, &period, &count))
+			goto err;
+		for (i = 0; i < count; i++) {
+			pos = start + i * period;
+			if (!(pos > -1.0 && pos < 18446744073709551616.0)) {
+				PyErr_SetString(PyExc_ValueError, "sample number out of range");
+				goto err;
+			}
+			/* Round up, like math.ceil() does. */
+			target = pos > 0 ? (uint64_t)pos : 0;
+			if ((double)target < pos)
+				target++;
+			g_array_append_val(targets, target);
+		}
+	}
 
-		/*
-		 * When EOF was provided externally, communicate the
-		 * Python EOFError exception to .decode() and return
-		 * from the .wait() method call. This is motivated by
-		 * the use of Python context managers, so that .decode()
-		 * methods can "close" incompletely accumulated data
-		 * when the sample data is exhausted.
-		 */
-		if (di->communicate_eof) {
-			/* Advance self.samplenum to the (absolute) last sample number. */
-			py_samplenum = PyLong_FromUnsignedLongLong(di->abs_cur_samplenum);
-			PyObject_SetAttrString(di->py_inst, "samplenum", py_samplenum);
-			Py_DECREF(py_samplenum);
-			/* Raise an EOFError Python exception. */
-			otd_dbg("%s: %s: Raising EOF from wait().",
-				di->inst_id, __func__);
-			g_mutex_unlock(&di->data_mutex);
-			PyErr_SetString(PyExc_EOFError, "samples exhausted");
+	prev = di->abs_cur_samplenum;
+	for (i = 0; i < (Py_ssize_t)targets->len; i++) {
+		target = g_array_index(targets, uint64_t, i);
+		if (target < prev) {
+			PyErr_SetString(PyExc_ValueError, "sample numbers must not decrease");
 			goto err;
 		}
+		prev = target;
+	}
 
-		/*
-		 * When termination of wait() and decode() was requested,
-		 * then exit the loop after releasing the mutex.
-		 */
-		if (di->want_wait_terminate) {
-			otd_dbg("%s: %s: Will return from wait().",
-				di->inst_id, __func__);
-			g_mutex_unlock(&di->data_mutex);
+	return targets;
+
+err:
+	g_array_free(targets, TRUE);
+
+	return NULL;
+}
+
+/**
+ * Get the pin values at a number of sample numbers.
+ *
+ * Every sample number gets waited for by a skip condition, so that
+ * sample_at() shares the semantics of wait(), but does not return to
+ * Python in between.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args TODO. Must not be NULL.
+ *
+ * @return A memoryview of the pin values, or NULL upon errors and EOF.
+ */
+static PyObject *Decoder_sample_at(PyObject *self, PyObject *args)
+{
+	struct otd_decoder_inst *di;
+	GArray *targets, *pins;
+	PyObject *py_pins;
+	uint64_t target;
+	unsigned int i;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!(targets = sample_at_targets(di, args)))
+		goto err;
+
+	pins = g_array_new(FALSE, FALSE, sizeof(uint8_t));
+	for (i = 0; i < targets->len; i++) {
+		target = g_array_index(targets, uint64_t, i);
+		set_skip_condition(di, target - di->abs_cur_samplenum);
+		if (wait_core(di) != OTD_OK) {
+			g_array_free(targets, TRUE);
+			g_array_free(pins, TRUE);
 			goto err;
 		}
+		pins_append(di, pins);
+	}
+	if (targets->len)
+		wait_collect_done(di);
+	g_array_free(targets, TRUE);
 
-		g_mutex_unlock(&di->data_mutex);
+	py_pins = array_to_memoryview(pins, "B");
+	g_array_free(pins, TRUE);
+
+	PyGILState_Release(gstate);
+
+	return py_pins;
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+PyDoc_STRVAR(Decoder_chunk_view_doc,
+	"Get a read-only view of the current chunk of sample data.\n"
+	"\n"
+	"Returns None when there is no current chunk, or when its data is\n"
+	"run-length encoded. Otherwise returns a tuple of the chunk's first\n"
+	"absolute sample number, a memoryview of the raw samples (format 'B',\n"
+	"shape (samples, unitsize)), and the channel map: a tuple with the\n"
+	"input channel number for every PD channel, or -1 for unused optional\n"
+	"channels. Input channel n is bit n % 8 of byte n // 8 of a sample.\n"
+	"\n"
+	"The view does not copy the samples. It gets released when wait() or\n"
+	"one of its variants moves on to the next chunk, using it then raises\n"
+	"ValueError. Slices and objects derived from the view (like NumPy\n"
+	"arrays) of chunks the frontend sent with otd_session_send_async()\n"
+	"hold on to the chunk's buffer, and stay valid. Those of other chunks\n"
+	"must not be kept beyond the chunk, the frontend reuses its buffer.\n"
+);
+
+/**
+ * Release the memoryviews of the current chunk which chunk_view() has
+ * handed out, so that decoders notice when they use them afterwards.
+ *
+ * @param di The decoder instance. Must not be NULL.
+ *
+ * @private
+ */
+OTD_PRIV void chunk_views_release(struct otd_decoder_inst *di)
+{
+	PyObject *py_views, *py_ret;
+	Py_ssize_t i;
+	PyGILState_STATE gstate;
+
+	if (!di->chunk_views)
+		return;
+
+	gstate = PyGILState_Ensure();
+
+	/* Release derived views before the views they were derived from. */
+	py_views = di->chunk_views;
+	di->chunk_views = NULL;
+	for (i = PyList_Size(py_views) - 1; i >= 0; i--) {
+		py_ret = PyObject_CallMethod(PyList_GetItem(py_views, i),
+			"release", NULL);
+		if (!py_ret) {
+			/*
+			 * Somebody still holds a buffer of the view, which
+			 * keeps the chunk alive if it is reference counted.
+			 */
+			otd_dbg("%s: Chunk view is still exported.", di->inst_id);
+			PyErr_Clear();
+		}
+		Py_XDECREF(py_ret);
 	}
+	Py_DECREF(py_views);
 
 	PyGILState_Release(gstate);
+}
 
-	Py_RETURN_NONE;
+/* Drop the chunk reference of a chunk view's buffer. */
+static void chunk_capsule_free(PyObject *py_capsule)
+{
+	chunk_unref(PyCapsule_GetPointer(py_capsule, "opentracedecode.chunk"));
+}
+
+/*
+ * Get a ctypes array over the samples of the current chunk, without
+ * copying them. Reference counted chunks (see otd_session_send_async())
+ * stay alive as long as the array does, and so do their buffers.
+ */
+static PyObject *chunk_buffer_new(struct otd_decoder_inst *di)
+{
+	struct otd_chunk *chunk;
+	PyObject *py_ctypes, *py_ubyte, *py_len, *py_type, *py_buf;
+	PyObject *py_capsule;
+	int ret;
+
+	chunk = (struct otd_chunk *)di->chunk;
+	if (!(py_ctypes = PyImport_ImportModule("ctypes")))
+		return NULL;
+	py_ubyte = PyObject_GetAttrString(py_ctypes, "c_ubyte");
+	Py_DECREF(py_ctypes);
+	if (!py_ubyte)
+		return NULL;
+	py_len = PyLong_FromUnsignedLongLong(chunk->num_samples * chunk->unitsize);
+	py_type = py_len ? PyNumber_Multiply(py_ubyte, py_len) : NULL;
+	Py_DECREF(py_ubyte);
+	Py_XDECREF(py_len);
+	if (!py_type)
+		return NULL;
+	py_buf = PyObject_CallMethod(py_type, "from_address", "K",
+		(unsigned long long)(uintptr_t)di->inbuf);
+	Py_DECREF(py_type);
+	if (!py_buf || !chunk->refcount)
+		return py_buf;
+
+	py_capsule = PyCapsule_New(chunk_ref(chunk), "opentracedecode.chunk",
+		chunk_capsule_free);
+	if (!py_capsule) {
+		chunk_unref(chunk);
+		Py_DECREF(py_buf);
+		return NULL;
+	}
+	ret = PyObject_SetAttrString(py_buf, "_chunk", py_capsule);
+	Py_DECREF(py_capsule);
+	if (ret < 0) {
+		Py_DECREF(py_buf);
+		return NULL;
+	}
+
+	return py_buf;
+}
+
+/**
+ * Get a view of the current chunk, see Decoder_chunk_view_doc.
+ *
+ * The first call for a chunk creates the views over the chunk's buffer.
+ * Later calls for the same chunk return the same view.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args Unused.
+ *
+ * @return A tuple, None, or NULL upon errors.
+ */
+static PyObject *Decoder_chunk_view(PyObject *self, PyObject *args)
+{
+	struct otd_decoder_inst *di;
+	PyObject *py_buf, *py_mem, *py_ro, *py_view, *py_chans, *py_ret;
+	Py_ssize_t num_samples, unitsize;
+	int i;
+	PyGILState_STATE gstate;
+
+	(void)args;
+
+	if (!self)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!di->chunk || !di->inbuf || !di->chunk->num_samples) {
+		PyGILState_Release(gstate);
+		Py_RETURN_NONE;
+	}
+	num_samples = di->chunk->num_samples;
+	unitsize = di->chunk->unitsize;
+
+	if (!di->chunk_views && !(di->chunk_views = PyList_New(0)))
+		goto err;
+
+	if (PyList_Size(di->chunk_views)) {
+		/* The view of the whole chunk is the last one. */
+		py_view = PyList_GetItem(di->chunk_views,
+			PyList_Size(di->chunk_views) - 1);
+		Py_INCREF(py_view);
+	} else {
+		if (!(py_buf = chunk_buffer_new(di)))
+			goto err;
+		py_mem = PyMemoryView_FromObject(py_buf);
+		Py_DECREF(py_buf);
+		if (!py_mem)
+			goto err;
+		PyList_Append(di->chunk_views, py_mem);
+		Py_DECREF(py_mem);
+		if (!(py_ro = PyObject_CallMethod(py_mem, "toreadonly", NULL)))
+			goto err;
+		PyList_Append(di->chunk_views, py_ro);
+		Py_DECREF(py_ro);
+		py_view = PyObject_CallMethod(py_ro, "cast", "s(nn)", "B",
+			num_samples, unitsize);
+		if (!py_view)
+			goto err;
+		PyList_Append(di->chunk_views, py_view);
+	}
+
+	py_chans = PyTuple_New(di->dec_num_channels);
+	for (i = 0; i < di->dec_num_channels; i++)
+		PyTuple_SetItem(py_chans, i, PyLong_FromLong(di->dec_channelmap[i]));
+
+	py_ret = Py_BuildValue("(KOO)",
+		(unsigned long long)di->abs_start_samplenum, py_view, py_chans);
+	Py_DECREF(py_view);
+	Py_DECREF(py_chans);
+
+	PyGILState_Release(gstate);
+
+	return py_ret;
+
+err:
+	PyGILState_Release(gstate);
+
+	return NULL;
+}
+
+PyDoc_STRVAR(Decoder_is_wanted_doc,
+	"Check whether the frontend wants annotations of a class.\n"
+	"\n"
+	"Returns False when put() would discard annotations of the class,\n"
+	"because no frontend callback receives them. Decoders can skip\n"
+	"building the annotation texts then.\n"
+);
+
+/**
+ * Check whether the frontend wants annotations of a class.
+ *
+ * @param self TODO. Must not be NULL.
+ * @param args TODO. Must not be NULL.
+ *
+ * @return True or False, or NULL upon errors.
+ */
+static PyObject *Decoder_is_wanted(PyObject *self, PyObject *args)
+{
+	struct otd_decoder_inst *di;
+	int ann_class;
+	gboolean wanted;
+	PyGILState_STATE gstate;
+
+	if (!self || !args)
+		return NULL;
+
+	gstate = PyGILState_Ensure();
+
+	if (!(di = otd_inst_find_by_obj(self))) {
+		PyErr_SetString(PyExc_Exception, "decoder instance not found");
+		goto err;
+	}
+
+	if (!PyArg_ParseTuple(args, "i", &ann_class)) {
+		/* Let Python raise this exception. */
+		goto err;
+	}
+	if (ann_class < 0 || ann_class >= di->num_ann_classes) {
+		PyErr_SetString(PyExc_IndexError, "invalid annotation class");
+		goto err;
+	}
+
+	wanted = output_type_wanted(di, OTD_OUTPUT_ANN) &&
+		ann_class_wanted(di, ann_class) &&
+		(di->sess->ann_batch_cb ||
+		 otd_pd_output_callback_find(di->sess, OTD_OUTPUT_ANN));
+
+	PyGILState_Release(gstate);
+
+	return PyBool_FromLong(wanted);
 
 err:
 	PyGILState_Release(gstate);
@@ -1164,7 +3217,7 @@ static PyObject *Decoder_has_channel(PyObject *self, PyObject *args)
 
 	gstate = PyGILState_Ensure();
 
-	if (!(di = otd_inst_find_by_obj(NULL, self))) {
+	if (!(di = otd_inst_find_by_obj(self))) {
 		PyErr_SetString(PyExc_Exception, "decoder instance not found");
 		goto err;
 	}
@@ -1213,6 +3266,30 @@ static PyMethodDef Decoder_methods[] = {
 	  Decoder_wait, METH_VARARGS,
 	  Decoder_wait_doc,
 	},
+	{ "wait_batch",
+	  Decoder_wait_batch, METH_VARARGS,
+	  Decoder_wait_batch_doc,
+	},
+	{ "chunk_view",
+	  Decoder_chunk_view, METH_NOARGS,
+	  Decoder_chunk_view_doc,
+	},
+	{ "sample_at",
+	  Decoder_sample_at, METH_VARARGS,
+	  Decoder_sample_at_doc,
+	},
+	{ "shift_in",
+	  (PyCFunction)(void(*)(void))Decoder_shift_in, METH_VARARGS | METH_KEYWORDS,
+	  Decoder_shift_in_doc,
+	},
+	{ "edges",
+	  (PyCFunction)(void(*)(void))Decoder_edges, METH_VARARGS | METH_KEYWORDS,
+	  Decoder_edges_doc,
+	},
+	{ "is_wanted",
+	  Decoder_is_wanted, METH_VARARGS,
+	  Decoder_is_wanted_doc,
+	},
 	{ "has_channel",
 	  Decoder_has_channel, METH_VARARGS,
 	  Decoder_has_channel_doc,
@@ -1241,6 +3318,9 @@ OTD_PRIV PyObject *otd_Decoder_type_new(void)
 
 	gstate = PyGILState_Ensure();
 
+	py_attr_samplenum = PyUnicode_InternFromString("samplenum");
+	py_attr_matched = PyUnicode_InternFromString("matched");
+
 	spec.name = "opentracedecode.Decoder";
 	spec.basicsize = sizeof(otd_Decoder);
 	spec.itemsize = 0;
@@ -1253,3 +3333,15 @@ OTD_PRIV PyObject *otd_Decoder_type_new(void)
 
 	return py_obj;
 }
+
+/**
+ * Drop the attribute names which otd_Decoder_type_new() interned. Must
+ * be called with the GIL held, before the Python interpreter shuts down.
+ *
+ * @private
+ */
+OTD_PRIV void otd_Decoder_type_free(void)
+{
+	Py_CLEAR(py_attr_samplenum);
+	Py_CLEAR(py_attr_matched);
+}
@@ -158,8 +158,14 @@ OTD_API GSList *otd_buildinfo_libs_get(void)
 	l = g_slist_append(l, m);
 
 	m = g_slist_append(NULL, g_strdup("Python"));
-	m = g_slist_append(m, g_strdup_printf("%s / 0x%x (API %s, ABI %s)",
-		PY_VERSION, PY_VERSION_HEX, PYTHON_API_STRING, PYTHON_ABI_STRING));
+	m = g_slist_append(m, g_strdup_printf("%s / 0x%x (API %s, ABI %s%s)",
+		PY_VERSION, PY_VERSION_HEX, PYTHON_API_STRING, PYTHON_ABI_STRING,
+#ifdef Py_GIL_DISABLED
+		", free-threaded"
+#else
+		""
+#endif
+		));
 	l = g_slist_append(l, m);
 
 	return l;
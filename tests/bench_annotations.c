@@ -0,0 +1,133 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * Measure how many annotations per second get from a decoder to the
+ * frontend, with one callback per annotation and with batch callbacks
+ * (see otd_pd_output_batch_callback_add()).
+ *
+ * The decoder puts bit-level annotations like the 'uart' decoder does.
+ */
+
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <stdint.h>
+#include <stdio.h>
+#include "bench_common.h"
+
+#define NUM_SAMPLES (1024 * 1024)
+#define CHUNK_SIZE (64 * 1024)
+#define SAMPLES_PER_EDGE 8
+
+static const char decoder_pd_py[] =
+	"import opentracedecode as otd\n"
+	"\n"
+	"class Decoder(otd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'annbench'\n"
+	"    name = 'annbench'\n"
+	"    longname = 'Annotation benchmark'\n"
+	"    desc = 'Annotates every bit between two edges.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Util']\n"
+	"    channels = (\n"
+	"        {'id': 'data', 'name': 'Data', 'desc': 'Data line'},\n"
+	"    )\n"
+	"    annotations = (\n"
+	"        ('bit', 'Bit'),\n"
+	"        ('edge', 'Edge'),\n"
+	"    )\n"
+	"\n"
+	"    def __init__(self):\n"
+	"        self.reset()\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(otd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        last = 0\n"
+	"        while True:\n"
+	"            (bit,) = self.wait({0: 'e'})\n"
+	"            step = (self.samplenum - last) // 4\n"
+	"            for i in range(4):\n"
+	"                ss = last + i * step\n"
+	"                self.put(ss, ss + step, self.out_ann,\n"
+	"                         [0, ['Bit %d' % bit, '%d' % bit]])\n"
+	"            self.put(last, self.samplenum, self.out_ann, [1, ['Edge']])\n"
+	"            last = self.samplenum\n";
+
+static uint8_t *samples;
+
+/* Decode the samples, return the number of annotations per second. */
+static double run(gboolean batch, uint64_t *count)
+{
+	struct otd_session *sess;
+	gint64 elapsed;
+
+	otd_session_new(&sess);
+	if (batch)
+		otd_pd_output_batch_callback_add(sess, OTD_OUTPUT_ANN,
+			bench_ann_batch_cb, NULL, 0);
+	else
+		otd_pd_output_callback_add(sess, OTD_OUTPUT_ANN,
+			bench_ann_cb, NULL);
+	if (!otd_inst_new(sess, "annbench", NULL)) {
+		otd_session_destroy(sess);
+		return -1;
+	}
+	otd_session_start(sess);
+
+	bench_ann_reset();
+	elapsed = bench_decode(sess, samples, NUM_SAMPLES, CHUNK_SIZE);
+	*count = bench_ann_count();
+
+	return *count * 1e6 / elapsed;
+}
+
+static int scenario(void)
+{
+	uint64_t i, count_single, count_batch;
+	double rate_single, rate_batch;
+
+	samples = g_malloc(NUM_SAMPLES);
+	for (i = 0; i < NUM_SAMPLES; i++)
+		samples[i] = (i / SAMPLES_PER_EDGE) & 1;
+
+	rate_single = run(FALSE, &count_single);
+	rate_batch = run(TRUE, &count_batch);
+	g_free(samples);
+
+	printf("callback per annotation: %" G_GUINT64_FORMAT " annotations, "
+		"%.0f annotations/s\n", count_single, rate_single);
+	printf("batch callback:          %" G_GUINT64_FORMAT " annotations, "
+		"%.0f annotations/s\n", count_batch, rate_batch);
+
+	if (rate_single > 0 && rate_batch > 0 && count_single == count_batch)
+		return 0;
+
+	return -1;
+}
+
+int main(void)
+{
+	return bench_main("annbench", decoder_pd_py, scenario);
+}
@@ -0,0 +1,151 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * The parts the benchmarks have in common. Each benchmark brings its own
+ * decoder, which gets written to a temporary directory, so that the
+ * benchmarks do not depend on the installed decoders.
+ */
+
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <glib/gstdio.h>
+#include <stdint.h>
+#include "bench_common.h"
+
+static const char decoder_init_py[] = "from .pd import Decoder\n";
+
+/* Callbacks of different stacks may run concurrently. */
+static gint num_annotations;
+
+/* Annotation callback which counts the annotations. */
+void bench_ann_cb(struct otd_proto_data *pdata, void *cb_data)
+{
+	(void)pdata;
+	(void)cb_data;
+
+	g_atomic_int_inc(&num_annotations);
+}
+
+/* Batch annotation callback which counts the annotations. */
+void bench_ann_batch_cb(struct otd_proto_data *pdata, size_t count,
+		void *cb_data)
+{
+	(void)pdata;
+	(void)cb_data;
+
+	g_atomic_int_add(&num_annotations, count);
+}
+
+void bench_ann_reset(void)
+{
+	g_atomic_int_set(&num_annotations, 0);
+}
+
+/* The number of annotations the callbacks got since bench_ann_reset(). */
+uint64_t bench_ann_count(void)
+{
+	return g_atomic_int_get(&num_annotations);
+}
+
+/*
+ * Send the samples to a started session in chunks of chunk_size samples,
+ * followed by EOF, and destroy the session. Returns the time this took,
+ * in microseconds.
+ */
+gint64 bench_decode(struct otd_session *sess, const uint8_t *samples,
+		uint64_t num_samples, uint64_t chunk_size)
+{
+	uint64_t i, n;
+	gint64 start;
+
+	start = g_get_monotonic_time();
+	for (i = 0; i < num_samples; i += n) {
+		n = MIN(chunk_size, num_samples - i);
+		otd_session_send(sess, i, i + n, samples + i, n, 1);
+	}
+	otd_session_send_eof(sess);
+	otd_session_destroy(sess);
+
+	return MAX(g_get_monotonic_time() - start, 1);
+}
+
+static int write_decoder(const char *dir, const char *decoder_id,
+		const char *decoder_pd_py)
+{
+	char *pd_dir, *path;
+	gboolean ok;
+
+	pd_dir = g_build_filename(dir, decoder_id, NULL);
+	ok = g_mkdir(pd_dir, 0700) == 0;
+	path = g_build_filename(pd_dir, "__init__.py", NULL);
+	ok = ok && g_file_set_contents(path, decoder_init_py, -1, NULL);
+	g_free(path);
+	path = g_build_filename(pd_dir, "pd.py", NULL);
+	ok = ok && g_file_set_contents(path, decoder_pd_py, -1, NULL);
+	g_free(path);
+	g_free(pd_dir);
+
+	return ok ? 0 : -1;
+}
+
+static void remove_decoder(const char *dir, const char *decoder_id)
+{
+	char *pd_dir, *path;
+
+	pd_dir = g_build_filename(dir, decoder_id, NULL);
+	path = g_build_filename(pd_dir, "__init__.py", NULL);
+	g_remove(path);
+	g_free(path);
+	path = g_build_filename(pd_dir, "pd.py", NULL);
+	g_remove(path);
+	g_free(path);
+	g_rmdir(pd_dir);
+	g_free(pd_dir);
+	g_rmdir(dir);
+}
+
+/*
+ * Write the benchmark's decoder (the contents of its pd.py), initialize
+ * the library and load the decoder, and run the scenario. Returns the
+ * process exit status, 0 when the scenario returned 0.
+ */
+int bench_main(const char *decoder_id, const char *decoder_pd_py,
+		int (*scenario)(void))
+{
+	char *dir;
+	int ret;
+
+	/* Keep the temporary decoder directory free of bytecode. */
+	g_setenv("PYTHONDONTWRITEBYTECODE", "1", TRUE);
+
+	if (!(dir = g_dir_make_tmp("otd-bench-XXXXXX", NULL)))
+		return 1;
+	ret = 1;
+	if (write_decoder(dir, decoder_id, decoder_pd_py) != 0 ||
+			otd_init(dir) != OTD_OK)
+		goto out;
+	if (otd_decoder_load(decoder_id) == OTD_OK)
+		ret = scenario() ? 1 : 0;
+
+	otd_exit();
+out:
+	remove_decoder(dir, decoder_id);
+	g_free(dir);
+
+	return ret;
+}
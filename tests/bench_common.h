@@ -0,0 +1,35 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef LIBOPENTRACEDECODE_TESTS_BENCH_COMMON_H
+#define LIBOPENTRACEDECODE_TESTS_BENCH_COMMON_H
+
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <stdint.h>
+
+void bench_ann_cb(struct otd_proto_data *pdata, void *cb_data);
+void bench_ann_batch_cb(struct otd_proto_data *pdata, size_t count,
+		void *cb_data);
+void bench_ann_reset(void);
+uint64_t bench_ann_count(void);
+gint64 bench_decode(struct otd_session *sess, const uint8_t *samples,
+		uint64_t num_samples, uint64_t chunk_size);
+int bench_main(const char *decoder_id, const char *decoder_pd_py,
+		int (*scenario)(void));
+
+#endif
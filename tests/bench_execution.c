@@ -0,0 +1,141 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * Measure how many samples per second a decoder handles with worker
+ * threads and in inline mode (see otd_session_inline_set()), for several
+ * chunk sizes. Small chunks show the cost of handing each chunk to the
+ * worker thread and back.
+ *
+ * The decoder waits for edges and annotates every tenth of them.
+ */
+
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <stdint.h>
+#include <stdio.h>
+#include "bench_common.h"
+
+#define NUM_SAMPLES (1024 * 1024)
+#define SAMPLES_PER_EDGE 8
+
+static const uint64_t chunk_sizes[] = { 16, 64, 256, 1024, 4096, 65536 };
+
+static const char decoder_pd_py[] =
+	"import opentracedecode as otd\n"
+	"\n"
+	"class Decoder(otd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'execbench'\n"
+	"    name = 'execbench'\n"
+	"    longname = 'Execution mode benchmark'\n"
+	"    desc = 'Annotates every tenth edge.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Util']\n"
+	"    channels = (\n"
+	"        {'id': 'data', 'name': 'Data', 'desc': 'Data line'},\n"
+	"    )\n"
+	"    annotations = (\n"
+	"        ('edge', 'Edge'),\n"
+	"    )\n"
+	"\n"
+	"    def __init__(self):\n"
+	"        self.reset()\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(otd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        count = 0\n"
+	"        while True:\n"
+	"            self.wait({0: 'e'})\n"
+	"            count += 1\n"
+	"            if count % 10 == 0:\n"
+	"                self.put(self.samplenum, self.samplenum, self.out_ann,\n"
+	"                         [0, ['Edge']])\n";
+
+static uint8_t *samples;
+
+/* Decode the samples, return the number of samples per second. */
+static double run(uint64_t chunk_size, gboolean inline_mode, uint64_t *count)
+{
+	struct otd_session *sess;
+	gint64 elapsed;
+
+	otd_session_new(&sess);
+	if (inline_mode && otd_session_inline_set(sess, TRUE) != OTD_OK) {
+		otd_session_destroy(sess);
+		return -1;
+	}
+	otd_pd_output_callback_add(sess, OTD_OUTPUT_ANN, bench_ann_cb, NULL);
+	if (!otd_inst_new(sess, "execbench", NULL)) {
+		otd_session_destroy(sess);
+		return -1;
+	}
+	otd_session_start(sess);
+
+	bench_ann_reset();
+	elapsed = bench_decode(sess, samples, NUM_SAMPLES, chunk_size);
+	*count = bench_ann_count();
+
+	return NUM_SAMPLES * 1e6 / elapsed;
+}
+
+static int scenario(void)
+{
+	uint64_t i, count_threaded, count_inline;
+	double rate_threaded, rate_inline;
+	int ret;
+
+	samples = g_malloc(NUM_SAMPLES);
+	for (i = 0; i < NUM_SAMPLES; i++)
+		samples[i] = (i / SAMPLES_PER_EDGE) & 1;
+
+	printf("chunk size   threaded samples/s   inline samples/s\n");
+	ret = 0;
+	for (i = 0; i < G_N_ELEMENTS(chunk_sizes); i++) {
+		rate_threaded = run(chunk_sizes[i], FALSE, &count_threaded);
+		rate_inline = run(chunk_sizes[i], TRUE, &count_inline);
+		if (rate_threaded <= 0) {
+			ret = -1;
+			break;
+		}
+		if (rate_inline <= 0) {
+			/* The greenlet module is not available. */
+			printf("%10" G_GUINT64_FORMAT "   %18.0f   %16s\n",
+				chunk_sizes[i], rate_threaded, "-");
+			continue;
+		}
+		printf("%10" G_GUINT64_FORMAT "   %18.0f   %16.0f\n",
+			chunk_sizes[i], rate_threaded, rate_inline);
+		if (count_threaded != count_inline)
+			ret = -1;
+	}
+	g_free(samples);
+
+	return ret;
+}
+
+int main(void)
+{
+	return bench_main("execbench", decoder_pd_py, scenario);
+}
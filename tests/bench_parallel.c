@@ -0,0 +1,166 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * Measure how many samples per second a session with several decoder
+ * stacks handles, when each chunk goes to one stack after the other, and
+ * in parallel mode (see otd_session_parallel_set()), and print the
+ * speedup of parallel mode.
+ *
+ * Each stack waits for edges on a channel of its own, and annotates every
+ * edge. Only the scanning of the samples for the wait() conditions runs
+ * in parallel, the Python code runs one stack at a time. With dense edges
+ * the stacks are bound by their Python code, and parallel mode doesn't
+ * help. With sparse edges, the scanning dominates.
+ */
+
+#include <opentracedecode/libopentracedecode.h>
+#include <glib.h>
+#include <inttypes.h>
+#include <stdint.h>
+#include <stdio.h>
+#include "bench_common.h"
+
+#define NUM_SAMPLES (4 * 1024 * 1024)
+#define CHUNK_SIZE (64 * 1024)
+#define NUM_STACKS 8
+
+static const char decoder_pd_py[] =
+	"import opentracedecode as otd\n"
+	"\n"
+	"class Decoder(otd.Decoder):\n"
+	"    api_version = 3\n"
+	"    id = 'parbench'\n"
+	"    name = 'parbench'\n"
+	"    longname = 'Parallel decoding benchmark'\n"
+	"    desc = 'Annotates the edges of one channel.'\n"
+	"    license = 'gplv2+'\n"
+	"    inputs = ['logic']\n"
+	"    outputs = []\n"
+	"    tags = ['Util']\n"
+	"    channels = tuple({'id': 'd%d' % i, 'name': 'D%d' % i,\n"
+	"                      'desc': 'Data line %d' % i} for i in range(8))\n"
+	"    options = (\n"
+	"        {'id': 'channel', 'desc': 'Channel', 'default': 0},\n"
+	"    )\n"
+	"    annotations = (\n"
+	"        ('edge', 'Edge'),\n"
+	"    )\n"
+	"\n"
+	"    def __init__(self):\n"
+	"        self.reset()\n"
+	"\n"
+	"    def reset(self):\n"
+	"        pass\n"
+	"\n"
+	"    def start(self):\n"
+	"        self.out_ann = self.register(otd.OUTPUT_ANN)\n"
+	"\n"
+	"    def decode(self):\n"
+	"        ch = self.options['channel']\n"
+	"        last = 0\n"
+	"        while True:\n"
+	"            self.wait({ch: 'e'})\n"
+	"            self.put(last, self.samplenum, self.out_ann, [0, ['Edge']])\n"
+	"            last = self.samplenum\n";
+
+/* Callbacks of different stacks may run concurrently. */
+static uint8_t *samples;
+
+/* Decode the samples, return the number of samples per second. */
+static double run(gboolean parallel, uint64_t *count)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GHashTable *options;
+	gint64 elapsed;
+	int i;
+
+	otd_session_new(&sess);
+	otd_session_parallel_set(sess, parallel);
+	otd_pd_output_callback_add(sess, OTD_OUTPUT_ANN, bench_ann_cb, NULL);
+	for (i = 0; i < NUM_STACKS; i++) {
+		options = g_hash_table_new_full(g_str_hash, g_str_equal,
+			g_free, (GDestroyNotify)g_variant_unref);
+		g_hash_table_insert(options, g_strdup("channel"),
+			g_variant_ref_sink(g_variant_new_int64(i)));
+		di = otd_inst_new(sess, "parbench", options);
+		g_hash_table_destroy(options);
+		if (!di) {
+			otd_session_destroy(sess);
+			return -1;
+		}
+	}
+	otd_session_start(sess);
+
+	bench_ann_reset();
+	elapsed = bench_decode(sess, samples, NUM_SAMPLES, CHUNK_SIZE);
+	*count = bench_ann_count();
+
+	return NUM_SAMPLES * 1e6 / elapsed;
+}
+
+/* Decode one pattern both ways, and print the rates and the speedup. */
+static int run_pattern(const char *name)
+{
+	uint64_t count_serial, count_parallel;
+	double rate_serial, rate_parallel;
+
+	rate_serial = run(FALSE, &count_serial);
+	rate_parallel = run(TRUE, &count_parallel);
+
+	if (rate_serial <= 0 || rate_parallel <= 0 ||
+			count_serial != count_parallel)
+		return -1;
+
+	printf("%s, %" PRIu64 " annotations:\n", name, count_serial);
+	printf("  %d stacks, one after the other: %.0f samples/s\n",
+		NUM_STACKS, rate_serial);
+	printf("  %d stacks in parallel:          %.0f samples/s\n",
+		NUM_STACKS, rate_parallel);
+	printf("  speedup: %.2fx\n", rate_parallel / rate_serial);
+
+	return 0;
+}
+
+static int scenario(void)
+{
+	uint64_t i;
+	int ret;
+
+	samples = g_malloc(NUM_SAMPLES);
+
+	/* Dense edges: channel n toggles every 2^(n + 4) samples. */
+	for (i = 0; i < NUM_SAMPLES; i++)
+		samples[i] = (i >> 4) & 0xff;
+	ret = run_pattern("Dense edges (Python-bound)");
+
+	/* Sparse edges: channel n toggles every 2^(n + 14) samples. */
+	for (i = 0; i < NUM_SAMPLES && ret == 0; i++)
+		samples[i] = (i >> 14) & 0xff;
+	if (ret == 0)
+		ret = run_pattern("Sparse edges (scan-bound)");
+
+	g_free(samples);
+
+	return ret;
+}
+
+int main(void)
+{
+	return bench_main("parbench", decoder_pd_py, scenario);
+}
@@ -0,0 +1,796 @@
+/*
+ * This file is part of the libopentracedecode project.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; either version 2 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <config.h>
+#include <libopentracedecode.h> /* First, to avoid compiler warning. */
+#include <inttypes.h>
+#include <stdarg.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <check.h>
+#include "lib.h"
+
+#define NUM_SAMPLES 3000
+
+/*
+ * Start the session, send it samples of one byte in chunks of chunk_size
+ * samples, followed by EOF, and destroy it.
+ */
+static void decode_session(struct otd_session *sess, const uint8_t *samples,
+		uint64_t num_samples, uint64_t chunk_size)
+{
+	uint64_t start, len;
+
+	ck_assert(otd_session_start(sess) == OTD_OK);
+	for (start = 0; start < num_samples; start += len) {
+		len = MIN(chunk_size, num_samples - start);
+		ck_assert(otd_session_send(sess, start, start + len,
+			samples + start, len, 1) == OTD_OK);
+	}
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+	otd_session_destroy(sess);
+}
+
+/*
+ * Decode samples of one byte with a decoder from TEST_DECODERS_DIR, in
+ * chunks of chunk_size samples, and return its annotations. Options
+ * can be NULL.
+ */
+static GString *decode(const char *decoder_id, GHashTable *options,
+		const uint8_t *samples, uint64_t num_samples, uint64_t chunk_size)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GString *anns;
+
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new(decoder_id, options, anns, &di);
+	ck_assert(sess != NULL);
+	decode_session(sess, samples, num_samples, chunk_size);
+
+	return anns;
+}
+
+/*
+ * A table of options for otd_inst_new(), see option_set(). Options get
+ * removed from it when the instance takes them.
+ */
+static GHashTable *options_new(void)
+{
+	return g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+}
+
+static void option_set(GHashTable *options, const char *key, GVariant *value)
+{
+	g_hash_table_insert(options, (char *)key, g_variant_ref_sink(value));
+}
+
+/* Samples with random levels on the lower 'bits' bits, in runs. */
+static uint8_t *random_samples(uint64_t num_samples, unsigned int bits)
+{
+	GRand *rand;
+	uint8_t *samples, value;
+	uint64_t i;
+
+	rand = g_rand_new_with_seed(4711);
+	samples = g_malloc(num_samples);
+	value = 0;
+	for (i = 0; i < num_samples; i++) {
+		if (!g_rand_int_range(rand, 0, 4))
+			value = g_rand_int_range(rand, 0, 1 << bits);
+		samples[i] = value;
+	}
+	g_rand_free(rand);
+
+	return samples;
+}
+
+/*
+ * Check whether wait() finds the expected matches of a condition list,
+ * with pins and matched conditions.
+ */
+START_TEST(test_wait)
+{
+	/* D0 rises at 2 and 5, D1 falls at 3. */
+	const uint8_t samples[] = { 2, 2, 3, 1, 0, 1, 3, 2 };
+	GString *anns;
+
+	otd_init(TEST_DECODERS_DIR);
+	anns = decode("testwait", NULL, samples, sizeof(samples), 3);
+	ck_assert_str_eq(anns->str,
+		"2-2 0: 11 1\n"
+		"3-3 0: 10 2\n"
+		"5-5 0: 10 1\n");
+	g_string_free(anns, TRUE);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether wait_batch() finds the same matches as consecutive
+ * wait() calls, for various batch and chunk sizes.
+ */
+START_TEST(test_wait_batch)
+{
+	const int64_t counts[] = { 1, 2, 7, 1000 };
+	const uint64_t chunk_sizes[] = { 1, 61, NUM_SAMPLES };
+	GHashTable *options;
+	GString *expected, *anns;
+	uint8_t *samples;
+	unsigned int i, j;
+
+	otd_init(TEST_DECODERS_DIR);
+	samples = random_samples(NUM_SAMPLES, 2);
+
+	expected = decode("testwait", NULL, samples, NUM_SAMPLES, 97);
+	ck_assert(expected->len > 0);
+	for (i = 0; i < G_N_ELEMENTS(counts); i++) {
+		for (j = 0; j < G_N_ELEMENTS(chunk_sizes); j++) {
+			options = options_new();
+			option_set(options, "batch",
+				g_variant_new_int64(counts[i]));
+			anns = decode("testwait", options, samples,
+				NUM_SAMPLES, chunk_sizes[j]);
+			g_hash_table_destroy(options);
+			ck_assert_str_eq(anns->str, expected->str);
+			g_string_free(anns, TRUE);
+		}
+	}
+	g_string_free(expected, TRUE);
+
+	g_free(samples);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether shift_in() shifts in words of several data channels,
+ * and stops early when the gate gets deasserted.
+ */
+START_TEST(test_shift_in)
+{
+	/* CLK is bit 0, MOSI bit 1, MISO bit 2, CS# bit 3. */
+	const uint8_t samples[] = {
+		2, 3, 4, 5, 6, 7, 0, 1,	/* MOSI 1010, MISO 0110. */
+		2, 3, 6, 7,		/* MOSI 11, MISO 01. */
+		8, 8, 0,		/* CS# deasserted. */
+		4, 5, 4, 5, 4, 5, 6, 7,	/* MOSI 0001, MISO 1111. */
+		6,
+	};
+	GString *anns;
+
+	otd_init(TEST_DECODERS_DIR);
+	anns = decode("testshift", NULL, samples, sizeof(samples), 5);
+	ck_assert_str_eq(anns->str,
+		"1-7 0: a 6 4\n"
+		"9-12 0: 3 1 2\n"
+		"16-22 0: 1 f 4\n");
+	g_string_free(anns, TRUE);
+	otd_exit();
+}
+END_TEST
+
+/* Options for testshift. otd_inst_new() consumes them. */
+static GHashTable *shift_options(const char *mode, const char *gated,
+		const char *msb_first)
+{
+	GHashTable *options;
+
+	options = options_new();
+	option_set(options, "mode", g_variant_new_string(mode));
+	option_set(options, "gated", g_variant_new_string(gated));
+	option_set(options, "msb_first", g_variant_new_string(msb_first));
+
+	return options;
+}
+
+/*
+ * Check whether shift_in() shifts in the same words as wait() calls for
+ * every clock edge, gated or not, in both bit orders.
+ */
+START_TEST(test_shift_in_wait)
+{
+	const char *yes_no[] = { "yes", "no" };
+	const uint64_t chunk_sizes[] = { 1, 61, NUM_SAMPLES };
+	GHashTable *options;
+	GString *expected, *anns;
+	uint8_t *samples;
+	unsigned int i, j, k;
+
+	otd_init(TEST_DECODERS_DIR);
+	samples = random_samples(NUM_SAMPLES, 4);
+
+	for (i = 0; i < G_N_ELEMENTS(yes_no); i++) {
+		for (j = 0; j < G_N_ELEMENTS(yes_no); j++) {
+			options = shift_options("wait", yes_no[i], yes_no[j]);
+			expected = decode("testshift", options, samples,
+				NUM_SAMPLES, 97);
+			g_hash_table_destroy(options);
+			ck_assert(expected->len > 0);
+
+			for (k = 0; k < G_N_ELEMENTS(chunk_sizes); k++) {
+				options = shift_options("shift_in",
+					yes_no[i], yes_no[j]);
+				anns = decode("testshift", options, samples,
+					NUM_SAMPLES, chunk_sizes[k]);
+				g_hash_table_destroy(options);
+				ck_assert_str_eq(anns->str, expected->str);
+				g_string_free(anns, TRUE);
+			}
+			g_string_free(expected, TRUE);
+		}
+	}
+
+	g_free(samples);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether sample_at() gets the pins at fractionally spaced sample
+ * points, given by period or as a list.
+ */
+START_TEST(test_sample_at)
+{
+	/* D0 is bit 0 and falls at 2, the points are 4, 8, 11, 15 and 18. */
+	const uint8_t samples[] = {
+		1, 1, 0, 0, 2, 0, 0, 0, 1, 1, 1, 3, 3, 3, 3,
+		0, 0, 0, 2, 3, 3,
+	};
+	const char *modes[] = { "period", "list" };
+	GHashTable *options;
+	GString *anns;
+	unsigned int i;
+
+	otd_init(TEST_DECODERS_DIR);
+	for (i = 0; i < G_N_ELEMENTS(modes); i++) {
+		options = options_new();
+		option_set(options, "mode", g_variant_new_string(modes[i]));
+		anns = decode("testsample", options, samples, sizeof(samples), 4);
+		g_hash_table_destroy(options);
+		ck_assert_str_eq(anns->str, "2-18 0: 01 10 11 00 01\n");
+		g_string_free(anns, TRUE);
+	}
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether sample_at() gets the same pins as wait() calls which
+ * skip to the sample points.
+ */
+START_TEST(test_sample_at_wait)
+{
+	const char *modes[] = { "period", "list" };
+	const uint64_t chunk_sizes[] = { 1, 61, NUM_SAMPLES };
+	GHashTable *options;
+	GString *expected, *anns;
+	uint8_t *samples;
+	unsigned int i, j;
+
+	otd_init(TEST_DECODERS_DIR);
+	samples = random_samples(NUM_SAMPLES, 2);
+
+	options = options_new();
+	option_set(options, "mode", g_variant_new_string("wait"));
+	expected = decode("testsample", options, samples, NUM_SAMPLES, 97);
+	g_hash_table_destroy(options);
+	ck_assert(expected->len > 0);
+
+	for (i = 0; i < G_N_ELEMENTS(modes); i++) {
+		for (j = 0; j < G_N_ELEMENTS(chunk_sizes); j++) {
+			options = options_new();
+			option_set(options, "mode",
+				g_variant_new_string(modes[i]));
+			anns = decode("testsample", options, samples,
+				NUM_SAMPLES, chunk_sizes[j]);
+			g_hash_table_destroy(options);
+			ck_assert_str_eq(anns->str, expected->str);
+			g_string_free(anns, TRUE);
+		}
+	}
+	g_string_free(expected, TRUE);
+
+	g_free(samples);
+	otd_exit();
+}
+END_TEST
+
+/* Options for testedgelist. otd_inst_new() consumes them. */
+static GHashTable *edges_options(const char *kind, int64_t max_count)
+{
+	GHashTable *options;
+
+	options = options_new();
+	option_set(options, "kind", g_variant_new_string(kind));
+	option_set(options, "max_count", g_variant_new_int64(max_count));
+
+	return options;
+}
+
+/*
+ * Check whether edges() finds the edges of the requested kind, with
+ * the channel's new levels.
+ */
+START_TEST(test_edges)
+{
+	const uint8_t samples[] = { 0, 1, 1, 0, 0, 1, 0, 0 };
+	const char *kinds[] = { "r", "f", "e" };
+	const char *expected[] = {
+		"1-1 0: 1\n5-5 0: 1\n",
+		"3-3 0: 0\n6-6 0: 0\n",
+		"1-1 0: 1\n3-3 0: 0\n5-5 0: 1\n6-6 0: 0\n",
+	};
+	GHashTable *options;
+	GString *anns;
+	unsigned int i;
+
+	otd_init(TEST_DECODERS_DIR);
+	for (i = 0; i < G_N_ELEMENTS(kinds); i++) {
+		options = edges_options(kinds[i], 8);
+		anns = decode("testedgelist", options, samples,
+			sizeof(samples), 3);
+		g_hash_table_destroy(options);
+		ck_assert_str_eq(anns->str, expected[i]);
+		g_string_free(anns, TRUE);
+	}
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether edges(), mixed with wait() calls, finds the same edges
+ * as wait() alone, for various counts and chunk sizes.
+ */
+START_TEST(test_edges_wait)
+{
+	const char *kinds[] = { "r", "f", "e" };
+	const int64_t counts[] = { 1, 3, 1000 };
+	const uint64_t chunk_sizes[] = { 1, 61, NUM_SAMPLES };
+	GHashTable *options;
+	GString *expected, *anns;
+	uint8_t *samples;
+	unsigned int i, j, k;
+
+	otd_init(TEST_DECODERS_DIR);
+	samples = random_samples(NUM_SAMPLES, 1);
+
+	for (i = 0; i < G_N_ELEMENTS(kinds); i++) {
+		options = edges_options(kinds[i], 0);
+		expected = decode("testedgelist", options, samples,
+			NUM_SAMPLES, 97);
+		g_hash_table_destroy(options);
+		ck_assert(expected->len > 0);
+		for (j = 0; j < G_N_ELEMENTS(counts); j++) {
+			for (k = 0; k < G_N_ELEMENTS(chunk_sizes); k++) {
+				options = edges_options(kinds[i], counts[j]);
+				anns = decode("testedgelist", options, samples,
+					NUM_SAMPLES, chunk_sizes[k]);
+				g_hash_table_destroy(options);
+				ck_assert_str_eq(anns->str, expected->str);
+				g_string_free(anns, TRUE);
+			}
+		}
+		g_string_free(expected, TRUE);
+	}
+
+	g_free(samples);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether chunk_view() shows the frontend's buffer without copying
+ * it, and whether the views get released at the end of their chunk.
+ */
+START_TEST(test_chunk_view)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GString *anns;
+	char *expected;
+	uint8_t buf[8];
+	uint64_t start;
+
+	otd_init(TEST_DECODERS_DIR);
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new("testview", NULL, anns, &di);
+	ck_assert(sess != NULL);
+	ck_assert(otd_session_start(sess) == OTD_OK);
+	for (start = 0; start < 3 * sizeof(buf); start += sizeof(buf)) {
+		/* Each chunk has samples of its own, in the same buffer. */
+		memset(buf, 1 + start / sizeof(buf), sizeof(buf));
+		ck_assert(otd_session_send(sess, start, start + sizeof(buf),
+			buf, sizeof(buf), 1) == OTD_OK);
+	}
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+	otd_session_destroy(sess);
+
+	/* Slices of earlier chunks show the reused buffer. */
+	expected = g_strdup_printf(
+		"0-0 0: 1 %" PRIxPTR "\n"
+		"8-8 0: 2 %" PRIxPTR " released changed\n"
+		"16-16 0: 3 %" PRIxPTR " released changed\n",
+		(uintptr_t)buf, (uintptr_t)buf, (uintptr_t)buf);
+	ck_assert_str_eq(anns->str, expected);
+	g_free(expected);
+	g_string_free(anns, TRUE);
+	otd_exit();
+}
+END_TEST
+
+static void chunk_release_cb(const uint8_t *inbuf, void *cb_data)
+{
+	(void)inbuf;
+
+	g_atomic_int_inc((gint *)cb_data);
+}
+
+/*
+ * Check whether slices of chunk_view() views of asynchronously sent
+ * chunks keep the chunks' buffers, which the frontend then gets back
+ * only when the slices are gone.
+ */
+START_TEST(test_chunk_view_async)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GString *anns;
+	/* Outlives the test, in case the decoder releases a chunk late. */
+	static gint released;
+	char *expected;
+	uint8_t *bufs[3];
+	unsigned int i;
+
+	otd_init(TEST_DECODERS_DIR);
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new("testview", NULL, anns, &di);
+	ck_assert(sess != NULL);
+	ck_assert(otd_session_start(sess) == OTD_OK);
+	g_atomic_int_set(&released, 0);
+	for (i = 0; i < G_N_ELEMENTS(bufs); i++) {
+		bufs[i] = g_malloc(8);
+		memset(bufs[i], 1 + i, 8);
+		ck_assert(otd_session_send_async(sess, i * 8, i * 8 + 8,
+			bufs[i], 8, 1, chunk_release_cb, &released) == OTD_OK);
+	}
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+
+	/*
+	 * The decoder dropped the slices of the first two chunks, and
+	 * keeps one of the last chunk.
+	 */
+	ck_assert_int_eq(g_atomic_int_get(&released), 2);
+	otd_session_destroy(sess);
+
+	expected = g_strdup_printf(
+		"0-0 0: 1 %" PRIxPTR "\n"
+		"8-8 0: 2 %" PRIxPTR " released same\n"
+		"16-16 0: 3 %" PRIxPTR " released same\n",
+		(uintptr_t)bufs[0], (uintptr_t)bufs[1], (uintptr_t)bufs[2]);
+	ck_assert_str_eq(anns->str, expected);
+	g_free(expected);
+	/* The last buffer wasn't released, it still belongs to the library. */
+	g_free(bufs[0]);
+	g_free(bufs[1]);
+	g_string_free(anns, TRUE);
+	otd_exit();
+}
+END_TEST
+
+static void binary_cb(struct otd_proto_data *pdata, void *cb_data)
+{
+	struct otd_proto_data_binary *pdb;
+
+	pdb = pdata->data;
+	g_string_append_printf(cb_data, "%" PRIu64 "-%" PRIu64 " %d: %d\n",
+		pdata->start_sample, pdata->end_sample, pdb->bin_class,
+		pdb->size == 1 ? pdb->data[0] : -1);
+}
+
+/*
+ * Decode with the 'testsubscribe' decoder, after subscribing to the
+ * given output types, and annotation classes or rows (either can be
+ * NULL). Returns the annotations, and the binary data in bins.
+ */
+static GString *decode_subscribed(unsigned int output_types,
+		GArray *ann_classes, GSList *rows, GString *bins)
+{
+	/* D0 rises at 1 and 5, falls at 3. */
+	const uint8_t samples[] = { 0, 1, 1, 0, 0, 1, 1 };
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GString *anns;
+
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new("testsubscribe", NULL, anns, &di);
+	ck_assert(sess != NULL);
+	otd_pd_output_callback_add(sess, OTD_OUTPUT_BINARY, binary_cb, bins);
+	ck_assert(otd_inst_output_types_set(di, output_types) == OTD_OK);
+	if (ann_classes)
+		ck_assert(otd_inst_annotation_classes_set(di,
+			ann_classes) == OTD_OK);
+	if (rows)
+		ck_assert(otd_inst_annotation_rows_set(di, rows) == OTD_OK);
+	decode_session(sess, samples, sizeof(samples), 3);
+
+	return anns;
+}
+
+/*
+ * Check whether the callbacks only receive the subscribed output types
+ * and annotation classes, and whether is_wanted() agrees.
+ */
+START_TEST(test_subscription)
+{
+	const unsigned int all = (1U << OTD_OUTPUT_ANN) |
+		(1U << OTD_OUTPUT_BINARY);
+	const char *bins_all = "1-1 0: 1\n3-3 0: 0\n5-5 0: 1\n";
+	GArray *ann_classes;
+	GSList *rows;
+	GString *anns, *bins;
+	int ann_class;
+
+	otd_init(TEST_DECODERS_DIR);
+
+	bins = g_string_new(NULL);
+	anns = decode_subscribed(all, NULL, NULL, bins);
+	ck_assert_str_eq(anns->str,
+		"1-1 0: 11\n1-1 1: 11\n"
+		"3-3 0: 11\n3-3 1: 11\n"
+		"5-5 0: 11\n5-5 1: 11\n");
+	ck_assert_str_eq(bins->str, bins_all);
+	g_string_free(anns, TRUE);
+	g_string_free(bins, TRUE);
+
+	ann_classes = g_array_new(FALSE, FALSE, sizeof(int));
+	ann_class = 1;
+	g_array_append_val(ann_classes, ann_class);
+	bins = g_string_new(NULL);
+	anns = decode_subscribed(all, ann_classes, NULL, bins);
+	ck_assert_str_eq(anns->str, "1-1 1: 01\n3-3 1: 01\n5-5 1: 01\n");
+	ck_assert_str_eq(bins->str, bins_all);
+	g_string_free(anns, TRUE);
+	g_string_free(bins, TRUE);
+	g_array_free(ann_classes, TRUE);
+
+	rows = g_slist_append(NULL, "bits");
+	bins = g_string_new(NULL);
+	anns = decode_subscribed(all, NULL, rows, bins);
+	ck_assert_str_eq(anns->str, "1-1 0: 10\n3-3 0: 10\n5-5 0: 10\n");
+	ck_assert_str_eq(bins->str, bins_all);
+	g_string_free(anns, TRUE);
+	g_string_free(bins, TRUE);
+	g_slist_free(rows);
+
+	/* Only binary output, is_wanted() is False for all classes. */
+	bins = g_string_new(NULL);
+	anns = decode_subscribed(1U << OTD_OUTPUT_BINARY, NULL, NULL, bins);
+	ck_assert_str_eq(anns->str, "");
+	ck_assert_str_eq(bins->str, bins_all);
+	g_string_free(anns, TRUE);
+	g_string_free(bins, TRUE);
+
+	/* Only annotations. */
+	bins = g_string_new(NULL);
+	anns = decode_subscribed(1U << OTD_OUTPUT_ANN, NULL, NULL, bins);
+	ck_assert_str_eq(anns->str,
+		"1-1 0: 11\n1-1 1: 11\n"
+		"3-3 0: 11\n3-3 1: 11\n"
+		"5-5 0: 11\n5-5 1: 11\n");
+	ck_assert_str_eq(bins->str, "");
+	g_string_free(anns, TRUE);
+	g_string_free(bins, TRUE);
+
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether lazy annotations get rendered with the templates and
+ * methods from the decoder's annotation_formats.
+ */
+START_TEST(test_lazy)
+{
+	/* D0 rises at 1, falls at 3. */
+	const uint8_t samples[] = { 0, 1, 1, 0, 0 };
+	GString *anns;
+
+	otd_init(TEST_DECODERS_DIR);
+	anns = decode("testlazy", NULL, samples, sizeof(samples), 2);
+	ck_assert_str_eq(anns->str,
+		"1-1 0: Level 1 1\n"
+		"1-1 1: 0-1\n"
+		"1-1 2: High\n"
+		"1-1 2: Edge\n"
+		"1-1 3: 1\n"
+		"3-3 0: Level 0 0\n"
+		"3-3 1: 1-3\n"
+		"3-3 2: Low\n"
+		"3-3 2: Edge\n"
+		"3-3 3: 0\n");
+	g_string_free(anns, TRUE);
+	otd_exit();
+}
+END_TEST
+
+/* Log callback which appends the messages to the GString in cb_data. */
+static int log_cb(void *cb_data, int loglevel, const char *format,
+		va_list args)
+{
+	(void)loglevel;
+
+	g_string_append_vprintf(cb_data, format, args);
+	g_string_append_c(cb_data, '\n');
+
+	return OTD_OK;
+}
+
+/*
+ * Check whether lazy annotations of classes without annotation formats
+ * get rejected like any invalid annotation, and decoders with invalid
+ * annotation formats don't load.
+ */
+START_TEST(test_lazy_invalid)
+{
+	const uint8_t samples[] = { 0, 1, 1, 0, 0 };
+	GHashTable *options;
+	GString *log, *anns;
+
+	otd_init(TEST_DECODERS_DIR);
+	log = g_string_new(NULL);
+	otd_log_loglevel_set(OTD_LOG_ERR);
+	otd_log_callback_set(log_cb, log);
+
+	ck_assert(otd_decoder_load("testlazybad") != OTD_OK);
+	ck_assert(strstr(log->str, "references invalid class 1") != NULL);
+
+	g_string_truncate(log, 0);
+	options = options_new();
+	option_set(options, "plain", g_variant_new_string("yes"));
+	anns = decode("testlazy", options, samples, sizeof(samples), 2);
+	g_hash_table_destroy(options);
+	ck_assert(strstr(anns->str, " 3:") == NULL);
+	ck_assert(strstr(anns->str, "3-3 2: Low\n") != NULL);
+	ck_assert(strstr(log->str, "second element was not a list") != NULL);
+	ck_assert(strstr(log->str, "lazy annotation") == NULL);
+	g_string_free(anns, TRUE);
+
+	otd_log_callback_set_default();
+	otd_log_loglevel_set(OTD_LOG_NONE);
+	g_string_free(log, TRUE);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Decode with the 'teststacklow' decoder, and the given decoder stacked
+ * on top of it, and return the annotations.
+ */
+static GString *decode_stacked(const char *decoder_id, const uint8_t *samples,
+		uint64_t num_samples, uint64_t chunk_size)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di, *di_top;
+	GString *anns;
+
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new("teststacklow", NULL, anns, &di);
+	ck_assert(sess != NULL);
+	ck_assert(otd_decoder_load(decoder_id) == OTD_OK);
+	di_top = otd_inst_new(sess, decoder_id, NULL);
+	ck_assert(di_top != NULL);
+	ck_assert(otd_inst_stack(sess, di, di_top) == OTD_OK);
+	decode_session(sess, samples, num_samples, chunk_size);
+
+	return anns;
+}
+
+/*
+ * Check whether a stacked decoder gets the same items in decode_batch()
+ * as in decode(), for various chunk sizes.
+ */
+START_TEST(test_decode_batch)
+{
+	/* D0 rises at 1 and 5, falls at 3. */
+	const uint8_t edges[] = { 0, 1, 1, 0, 0, 1, 1 };
+	const uint64_t chunk_sizes[] = { 1, 61, NUM_SAMPLES };
+	GString *expected, *anns;
+	uint8_t *samples;
+	unsigned int i;
+
+	otd_init(TEST_DECODERS_DIR);
+
+	anns = decode_stacked("teststackbatch", edges, sizeof(edges), 3);
+	ck_assert_str_eq(anns->str,
+		"0-1 0: EDGE 1\n"
+		"1-3 0: EDGE 0\n"
+		"3-5 0: EDGE 1\n");
+	g_string_free(anns, TRUE);
+
+	samples = random_samples(NUM_SAMPLES, 1);
+	expected = decode_stacked("teststackup", samples, NUM_SAMPLES, 97);
+	ck_assert(expected->len > 0);
+	for (i = 0; i < G_N_ELEMENTS(chunk_sizes); i++) {
+		anns = decode_stacked("teststackbatch", samples, NUM_SAMPLES,
+			chunk_sizes[i]);
+		ck_assert_str_eq(anns->str, expected->str);
+		g_string_free(anns, TRUE);
+	}
+	g_string_free(expected, TRUE);
+	g_free(samples);
+	otd_exit();
+}
+END_TEST
+
+Suite *suite_decode(void)
+{
+	Suite *s;
+	TCase *tc;
+
+	s = suite_create("decode");
+
+	tc = tcase_create("wait");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_wait);
+	tcase_add_test(tc, test_wait_batch);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("shift_in");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_shift_in);
+	tcase_add_test(tc, test_shift_in_wait);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("sample_at");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_sample_at);
+	tcase_add_test(tc, test_sample_at_wait);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("edges");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_edges);
+	tcase_add_test(tc, test_edges_wait);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("chunk_view");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_chunk_view);
+	tcase_add_test(tc, test_chunk_view_async);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("subscription");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_subscription);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("lazy");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_lazy);
+	tcase_add_test(tc, test_lazy_invalid);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("decode_batch");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_decode_batch);
+	suite_add_tcase(s, tc);
+
+	return s;
+}
@@ -0,0 +1,67 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testedgelist'
+    name = 'Test edge list'
+    longname = 'Test decoder for edges()'
+    desc = 'Annotate the edges of a channel.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    annotations = (
+        ('edge', 'Edge'),
+    )
+    options = (
+        {'id': 'kind', 'desc': 'Edge kind', 'default': 'e',
+            'values': ('r', 'f', 'e')},
+        {'id': 'max_count', 'desc': 'edges() count, 0 for wait()',
+            'default': 0},
+    )
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def putl(self, samplenum, level):
+        self.put(samplenum, samplenum, self.out_ann, [0, ['%d' % level]])
+
+    def decode(self):
+        kind = self.options['kind']
+        count = self.options['max_count']
+        while True:
+            if not count:
+                (d0,) = self.wait({0: kind})
+                self.putl(self.samplenum, d0)
+                continue
+            (samplenums, levels) = self.edges(0, kind, count)
+            if len(samplenums) > count or samplenums[-1] != self.samplenum:
+                raise Exception('edges() returned wrong edges')
+            for i in range(len(samplenums)):
+                self.putl(samplenums[i], levels[i])
+            # Mix in a wait(), which must continue after the last edge.
+            (d0,) = self.wait({0: kind})
+            self.putl(self.samplenum, d0)
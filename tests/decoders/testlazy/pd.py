@@ -0,0 +1,74 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testlazy'
+    name = 'Test lazy'
+    longname = 'Test decoder for lazy annotations'
+    desc = 'Put lazy annotations on each edge.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    annotations = (
+        ('level', 'Level'),
+        ('span', 'Span'),
+        ('name', 'Name'),
+        ('plain', 'Plain'),
+    )
+    annotation_formats = {
+        0: ('Level {}', '{}'),
+        1: ('{}-{}',),
+        2: 'name_texts',
+    }
+    options = (
+        {'id': 'plain', 'desc': 'Put a lazy annotation of class plain',
+            'default': 'no', 'values': ('yes', 'no')},
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last = 0
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def name_texts(self, level):
+        return ['High' if level else 'Low']
+
+    def decode(self):
+        while True:
+            (d0,) = self.wait({0: 'e'})
+            ss = es = self.samplenum
+            self.put(ss, es, self.out_ann, [0, d0])
+            self.put(ss, es, self.out_ann, [1, (self.last, ss)])
+            self.put(ss, es, self.out_ann, [2, d0])
+            # Classes in annotation_formats still take regular texts.
+            self.put(ss, es, self.out_ann, [2, ['Edge']])
+            if self.options['plain'] == 'yes':
+                self.put(ss, es, self.out_ann, [3, d0])
+            else:
+                self.put(ss, es, self.out_ann, [3, ['%d' % d0]])
+            self.last = ss
@@ -0,0 +1,49 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testlazybad'
+    name = 'Test lazy bad'
+    longname = 'Test decoder for invalid annotation formats'
+    desc = 'Declare annotation formats for an invalid class.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    annotations = (
+        ('level', 'Level'),
+    )
+    annotation_formats = {
+        1: ('Level {}',),
+    }
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def decode(self):
+        while True:
+            (d0,) = self.wait({0: 'e'})
+            self.put(self.samplenum, self.samplenum, self.out_ann, [0, d0])
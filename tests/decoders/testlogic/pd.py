@@ -0,0 +1,51 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testlogic'
+    name = 'Test logic'
+    longname = 'Test decoder for logic output'
+    desc = 'Put the sample number and D0 as logic output at each edge.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    logic_output_channels = tuple(('p%d' % i, 'P%d' % i) for i in range(12))
+    annotations = ()
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_logic = self.register(otd.OUTPUT_LOGIC)
+
+    def decode(self):
+        last = 0
+        while True:
+            (d0,) = self.wait({0: 'e'})
+            # P0 is D0, P1 to P10 the sample number, P11 is always high.
+            value = 0x800 | (self.samplenum << 1) | d0
+            self.put(last, self.samplenum, self.out_logic,
+                     [0, value.to_bytes(2, 'little')])
+            last = self.samplenum
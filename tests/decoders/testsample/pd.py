@@ -0,0 +1,70 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import math
+import opentracedecode as otd
+
+# Sample points at ceil(edge + START + i * PERIOD).
+START, PERIOD, COUNT = 1.75, 3.5, 5
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testsample'
+    name = 'Test sample'
+    longname = 'Test decoder for sample_at()'
+    desc = 'Annotate pins at sample points after edges.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+        {'id': 'd1', 'name': 'D1', 'desc': 'Data 1'},
+    )
+    annotations = (
+        ('points', 'Sample points'),
+    )
+    options = (
+        {'id': 'mode', 'desc': 'Method', 'default': 'period',
+            'values': ('period', 'list', 'wait')},
+    )
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def decode(self):
+        mode = self.options['mode']
+        while True:
+            self.wait({0: 'f'})
+            edge = self.samplenum
+            targets = [math.ceil(edge + START + i * PERIOD)
+                       for i in range(COUNT)]
+            if mode == 'period':
+                pins = self.sample_at(edge + START, PERIOD, COUNT)
+            elif mode == 'list':
+                pins = self.sample_at(targets)
+            else:
+                pins = []
+                for t in targets:
+                    pins.extend(self.wait({'skip': t - self.samplenum}))
+            points = ['%d%d' % (pins[i * 2], pins[i * 2 + 1])
+                      for i in range(COUNT)]
+            self.put(edge, self.samplenum, self.out_ann,
+                     [0, [' '.join(points)]])
@@ -0,0 +1,84 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testshift'
+    name = 'Test shift'
+    longname = 'Test decoder for shift_in()'
+    desc = 'Annotate words shifted in on clock edges.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'clk', 'name': 'CLK', 'desc': 'Clock'},
+        {'id': 'mosi', 'name': 'MOSI', 'desc': 'Data 0'},
+        {'id': 'miso', 'name': 'MISO', 'desc': 'Data 1'},
+        {'id': 'cs', 'name': 'CS#', 'desc': 'Chip select'},
+    )
+    annotations = (
+        ('word', 'Word'),
+    )
+    options = (
+        {'id': 'mode', 'desc': 'Method', 'default': 'shift_in',
+            'values': ('shift_in', 'wait')},
+        {'id': 'gated', 'desc': 'Gate with CS#', 'default': 'yes',
+            'values': ('yes', 'no')},
+        {'id': 'msb_first', 'desc': 'MSB first', 'default': 'yes',
+            'values': ('yes', 'no')},
+    )
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def shift_in_wait(self, gated, msb_first):
+        # What shift_in() is documented to do, one wait() per bit.
+        conds = [{0: 'r'}, {3: 'h'}] if gated else [{0: 'r'}]
+        words, samplenums = [0, 0], []
+        while len(samplenums) < 4:
+            pins = self.wait(conds)
+            if gated and self.matched[1]:
+                break
+            for i in range(2):
+                if msb_first:
+                    words[i] = (words[i] << 1) | pins[i + 1]
+                else:
+                    words[i] |= pins[i + 1] << len(samplenums)
+            samplenums.append(self.samplenum)
+        return (tuple(words), samplenums)
+
+    def decode(self):
+        gated = self.options['gated'] == 'yes'
+        msb_first = self.options['msb_first'] == 'yes'
+        while True:
+            if self.options['mode'] == 'wait':
+                (words, samplenums) = self.shift_in_wait(gated, msb_first)
+            else:
+                (words, samplenums) = self.shift_in(0, 'r', (1, 2), 4,
+                    msb_first=msb_first, cs=3 if gated else None)
+            ss = samplenums[0] if len(samplenums) else self.samplenum
+            self.put(ss, self.samplenum, self.out_ann,
+                     [0, ['%x %x %d' % (words[0], words[1], len(samplenums))]])
+            if len(samplenums) < 4:
+                # The chip select was deasserted.
+                self.wait({3: 'l'})
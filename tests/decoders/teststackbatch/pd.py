@@ -0,0 +1,45 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'teststackbatch'
+    name = 'Test stack batch'
+    longname = 'Test decoder for stacked decode_batch()'
+    desc = 'Annotate edges from decode_batch().'
+    license = 'gplv2+'
+    inputs = ['teststack']
+    outputs = []
+    tags = ['Util']
+    annotations = (
+        ('edge', 'Edge'),
+    )
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def decode(self, ss, es, data):
+        raise Exception('decode() got called instead of decode_batch()')
+
+    def decode_batch(self, items):
+        for (ss, es, (ptype, level)) in items:
+            self.put(ss, es, self.out_ann, [0, ['%s %d' % (ptype, level)]])
@@ -0,0 +1,46 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'teststacklow'
+    name = 'Test stack low'
+    longname = 'Test decoder at the bottom of a stack'
+    desc = 'Pass edges to stacked decoders.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = ['teststack']
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    annotations = ()
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_python = self.register(otd.OUTPUT_PYTHON)
+
+    def decode(self):
+        last = 0
+        while True:
+            (d0,) = self.wait({0: 'e'})
+            self.put(last, self.samplenum, self.out_python, ['EDGE', d0])
+            last = self.samplenum
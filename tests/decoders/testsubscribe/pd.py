@@ -0,0 +1,62 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testsubscribe'
+    name = 'Test subscribe'
+    longname = 'Test decoder for output subscriptions'
+    desc = 'Put annotations and binary data on each edge.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    annotations = (
+        ('bit', 'Bit'),
+        ('byte', 'Byte'),
+    )
+    annotation_rows = (
+        ('bits', 'Bits', (0,)),
+        ('bytes', 'Bytes', (1,)),
+    )
+    binary = (
+        ('raw', 'Raw'),
+    )
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+        self.out_binary = self.register(otd.OUTPUT_BINARY)
+
+    def decode(self):
+        while True:
+            (d0,) = self.wait({0: 'e'})
+            # Tell which classes are wanted, e.g. '01' for class 1 only.
+            wanted = '%d%d' % (self.is_wanted(0), self.is_wanted(1))
+            self.put(self.samplenum, self.samplenum, self.out_ann,
+                     [0, [wanted]])
+            self.put(self.samplenum, self.samplenum, self.out_ann,
+                     [1, [wanted]])
+            self.put(self.samplenum, self.samplenum, self.out_binary,
+                     [0, bytes([d0])])
@@ -0,0 +1,71 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import ctypes
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testview'
+    name = 'Test view'
+    longname = 'Test decoder for chunk_view()'
+    desc = 'Annotate the state of views of previous chunks.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+    )
+    annotations = (
+        ('chunk', 'Chunk'),
+    )
+
+    def __init__(self):
+        # A slice of the previous chunk, with its contents at the time.
+        self.kept = None
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def decode(self):
+        last = None
+        while True:
+            self.wait({'skip': 1})
+            (start, view, channels) = self.chunk_view()
+            if last and last[0] == start:
+                if self.chunk_view()[1] is not view:
+                    raise Exception('chunk_view() made a second view')
+                continue
+            # The first sample, and the address of the samples.
+            texts = ['%d' % view[0, 0], '%x' % ctypes.addressof(view.obj)]
+            if last:
+                try:
+                    last[1][0, 0]
+                    texts.append('alive')
+                except ValueError:
+                    texts.append('released')
+            if self.kept:
+                # No locals, so only self.kept holds on to the slice.
+                texts.append('same' if self.kept[0].tobytes() == self.kept[1]
+                             else 'changed')
+            last = (start, view)
+            self.kept = (view[:2], view[:2].tobytes())
+            self.put(start, start, self.out_ann, [0, [' '.join(texts)]])
@@ -0,0 +1,67 @@
+##
+## This file is part of the libopentracedecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import opentracedecode as otd
+
+class Decoder(otd.Decoder):
+    api_version = 3
+    id = 'testwait'
+    name = 'Test wait'
+    longname = 'Test decoder for wait() and wait_batch()'
+    desc = 'Annotate the matches of wait conditions.'
+    license = 'gplv2+'
+    inputs = ['logic']
+    outputs = []
+    tags = ['Util']
+    channels = (
+        {'id': 'd0', 'name': 'D0', 'desc': 'Data 0'},
+        {'id': 'd1', 'name': 'D1', 'desc': 'Data 1'},
+    )
+    annotations = (
+        ('match', 'Match'),
+    )
+    options = (
+        {'id': 'batch', 'desc': 'wait_batch() count, 0 for wait()',
+            'default': 0},
+    )
+
+    def reset(self):
+        pass
+
+    def start(self):
+        self.out_ann = self.register(otd.OUTPUT_ANN)
+
+    def putm(self, samplenum, pins, mask):
+        self.put(samplenum, samplenum, self.out_ann,
+                 [0, ['%d%d %x' % (pins[0], pins[1], mask)]])
+
+    def decode(self):
+        conds = [{0: 'r'}, {1: 'f'}, {'skip': 50}]
+        count = self.options['batch']
+        while True:
+            if not count:
+                pins = self.wait(conds)
+                mask = sum(1 << i for i, m in enumerate(self.matched) if m)
+                self.putm(self.samplenum, pins, mask)
+                continue
+            (samplenums, matched, pins) = self.wait_batch(conds, count)
+            mask = sum(1 << i for i, m in enumerate(self.matched) if m)
+            if len(samplenums) > count or samplenums[-1] != self.samplenum \
+                    or matched[-1] != mask:
+                raise Exception('wait_batch() returned wrong matches')
+            for i in range(len(samplenums)):
+                self.putm(samplenums[i], pins[i * 2:i * 2 + 2], matched[i])
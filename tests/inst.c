@@ -140,6 +140,94 @@ START_TEST(test_inst_option_set_bogus)
 }
 END_TEST
 
+/*
+ * Check whether otd_inst_annotation_cache_stats_get() works.
+ * A new instance has not looked up any annotation texts yet.
+ */
+START_TEST(test_inst_annotation_cache_stats)
+{
+	int ret;
+	struct otd_session *sess;
+	struct otd_decoder_inst *inst;
+	uint64_t hits, misses;
+
+	otd_init(DECODERS_TESTDIR);
+	otd_decoder_load_all();
+	otd_session_new(&sess);
+	inst = otd_inst_new(sess, "uart", NULL);
+
+	hits = misses = 1;
+	ret = otd_inst_annotation_cache_stats_get(inst, &hits, &misses);
+	ck_assert(ret == OTD_OK);
+	ck_assert(hits == 0 && misses == 0);
+
+	/* NULL instance, NULL counters. */
+	ret = otd_inst_annotation_cache_stats_get(NULL, &hits, &misses);
+	ck_assert(ret != OTD_OK);
+	ret = otd_inst_annotation_cache_stats_get(inst, NULL, &misses);
+	ck_assert(ret != OTD_OK);
+	ret = otd_inst_annotation_cache_stats_get(inst, &hits, NULL);
+	ck_assert(ret != OTD_OK);
+
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether the output subscription functions work, and reject
+ * bogus annotation classes and rows.
+ */
+START_TEST(test_inst_subscription)
+{
+	int ret, ann_class;
+	struct otd_session *sess;
+	struct otd_decoder_inst *inst;
+	GArray *classes;
+	GSList *rows;
+
+	otd_init(DECODERS_TESTDIR);
+	otd_decoder_load_all();
+	otd_session_new(&sess);
+	inst = otd_inst_new(sess, "uart", NULL);
+
+	ret = otd_inst_output_types_set(inst, 1U << OTD_OUTPUT_BINARY);
+	ck_assert(ret == OTD_OK);
+	ret = otd_inst_output_types_set(NULL, 1U << OTD_OUTPUT_BINARY);
+	ck_assert(ret != OTD_OK);
+
+	classes = g_array_new(FALSE, FALSE, sizeof(int));
+	ann_class = 0;
+	g_array_append_val(classes, ann_class);
+	ret = otd_inst_annotation_classes_set(inst, classes);
+	ck_assert(ret == OTD_OK);
+	ret = otd_inst_annotation_classes_set(NULL, classes);
+	ck_assert(ret != OTD_OK);
+
+	/* Invalid annotation class. */
+	ann_class = 1000;
+	g_array_append_val(classes, ann_class);
+	ret = otd_inst_annotation_classes_set(inst, classes);
+	ck_assert(ret != OTD_OK);
+	g_array_free(classes, TRUE);
+
+	rows = g_slist_append(NULL, "rx-data-vals");
+	ret = otd_inst_annotation_rows_set(inst, rows);
+	ck_assert(ret == OTD_OK);
+
+	/* Invalid annotation row. */
+	rows = g_slist_append(rows, "no-such-row");
+	ret = otd_inst_annotation_rows_set(inst, rows);
+	ck_assert(ret != OTD_OK);
+	g_slist_free(rows);
+
+	/* Back to all classes. */
+	ret = otd_inst_annotation_rows_set(inst, NULL);
+	ck_assert(ret == OTD_OK);
+
+	otd_exit();
+}
+END_TEST
+
 Suite *suite_inst(void)
 {
 	Suite *s;
@@ -159,5 +247,15 @@ Suite *suite_inst(void)
 	tcase_add_test(tc, test_inst_option_set_bogus);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("annotation_cache");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_inst_annotation_cache_stats);
+	suite_add_tcase(s, tc);
+
+	tc = tcase_create("subscription");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_inst_subscription);
+	suite_add_tcase(s, tc);
+
 	return s;
 }
@@ -22,9 +22,13 @@
 
 void srdtest_setup(void);
 void srdtest_teardown(void);
+void srdtest_ann_cb(struct otd_proto_data *pdata, void *cb_data);
+struct otd_session *srdtest_session_new(const char *decoder_id,
+		GHashTable *options, GString *anns, struct otd_decoder_inst **di);
 
 Suite *suite_core(void);
 Suite *suite_decoder(void);
+Suite *suite_decode(void);
 Suite *suite_inst(void);
 Suite *suite_session(void);
 
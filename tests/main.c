@@ -19,6 +19,7 @@
 
 #include <config.h>
 #include <libopentracedecode.h> /* First, to avoid compiler warning. */
+#include <inttypes.h>
 #include <stdlib.h>
 #include <check.h>
 #include "lib.h"
@@ -33,6 +34,56 @@ void srdtest_teardown(void)
 {
 }
 
+/*
+ * Annotation callback which appends a line per annotation to the GString
+ * in cb_data: "<start>-<end> <class>:", followed by the texts.
+ */
+void srdtest_ann_cb(struct otd_proto_data *pdata, void *cb_data)
+{
+	struct otd_proto_data_annotation *pda;
+	GString *anns;
+	char **text;
+
+	anns = cb_data;
+	pda = pdata->data;
+	g_string_append_printf(anns, "%" PRIu64 "-%" PRIu64 " %d:",
+		pdata->start_sample, pdata->end_sample, pda->ann_class);
+	for (text = pda->ann_text; text && *text; text++)
+		g_string_append_printf(anns, " %s", *text);
+	g_string_append_c(anns, '\n');
+}
+
+/*
+ * Create a session with an instance of a decoder from TEST_DECODERS_DIR,
+ * whose annotations get collected in anns by srdtest_ann_cb(). Options
+ * can be NULL for the defaults. The caller still has to set up the
+ * instance's channels, and start the session.
+ */
+struct otd_session *srdtest_session_new(const char *decoder_id,
+		GHashTable *options, GString *anns, struct otd_decoder_inst **di)
+{
+	struct otd_session *sess;
+	GHashTable *defaults;
+
+	if (otd_decoder_load(decoder_id) != OTD_OK)
+		return NULL;
+	if (otd_session_new(&sess) != OTD_OK)
+		return NULL;
+	if (!(*di = otd_inst_new(sess, decoder_id, options))) {
+		otd_session_destroy(sess);
+		return NULL;
+	}
+	if (!options) {
+		/* Have self.options hold the defaults, like frontends do. */
+		defaults = g_hash_table_new(g_str_hash, g_str_equal);
+		otd_inst_option_set(*di, defaults);
+		g_hash_table_destroy(defaults);
+	}
+	otd_pd_output_callback_add(sess, OTD_OUTPUT_ANN, srdtest_ann_cb, anns);
+
+	return sess;
+}
+
 int main(void)
 {
 	int ret;
@@ -47,6 +98,7 @@ int main(void)
 	srunner_add_suite(srunner, suite_decoder());
 	srunner_add_suite(srunner, suite_inst());
 	srunner_add_suite(srunner, suite_session());
+	srunner_add_suite(srunner, suite_decode());
 
 	srunner_run_all(srunner, CK_VERBOSE);
 	ret = srunner_ntests_failed(srunner);
@@ -22,6 +22,7 @@
 #include <libopentracedecode.h>
 #include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
 #include <check.h>
 #include "lib.h"
 
@@ -104,6 +105,63 @@ START_TEST(test_session_new_multiple)
 }
 END_TEST
 
+#define NUM_THREADS 4
+#define NUM_THREAD_SESSIONS 64
+
+/* Returns the number of failed calls. */
+static gpointer session_new_thread(gpointer data)
+{
+	struct otd_session **sess;
+	int i, failed;
+
+	sess = data;
+	failed = 0;
+	for (i = 0; i < NUM_THREAD_SESSIONS; i++) {
+		if (otd_session_new(&sess[i]) != OTD_OK)
+			return GINT_TO_POINTER(NUM_THREAD_SESSIONS);
+	}
+	/* Keep every other session for otd_exit() to destroy. */
+	for (i = 0; i < NUM_THREAD_SESSIONS; i += 2) {
+		if (otd_session_destroy(sess[i]) != OTD_OK)
+			failed++;
+	}
+
+	return GINT_TO_POINTER(failed);
+}
+
+/*
+ * Check whether sessions can be created and destroyed by several threads
+ * at once, and still get IDs of their own.
+ */
+START_TEST(test_session_new_threads)
+{
+	struct otd_session *sess[NUM_THREADS][NUM_THREAD_SESSIONS];
+	GThread *threads[NUM_THREADS];
+	GHashTable *ids;
+	int i, j;
+
+	otd_init(NULL);
+
+	for (i = 0; i < NUM_THREADS; i++)
+		threads[i] = g_thread_new("session", session_new_thread, sess[i]);
+	for (i = 0; i < NUM_THREADS; i++)
+		ck_assert(GPOINTER_TO_INT(g_thread_join(threads[i])) == 0);
+
+	ids = g_hash_table_new(g_direct_hash, g_direct_equal);
+	for (i = 0; i < NUM_THREADS; i++) {
+		for (j = 1; j < NUM_THREAD_SESSIONS; j += 2) {
+			ck_assert(!g_hash_table_contains(ids,
+				GINT_TO_POINTER(sess[i][j]->session_id)));
+			g_hash_table_add(ids,
+				GINT_TO_POINTER(sess[i][j]->session_id));
+		}
+	}
+	g_hash_table_destroy(ids);
+
+	otd_exit();
+}
+END_TEST
+
 /*
  * Check whether otd_session_destroy() works.
  * If it returns != OTD_OK (or segfaults) this test will fail.
@@ -260,6 +318,670 @@ START_TEST(test_session_reset_nodata)
 }
 END_TEST
 
+/*
+ * Check whether otd_session_send_rle() fails with invalid input.
+ * If it returns OTD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_send_rle_bogus)
+{
+	struct otd_session *sess;
+	int ret;
+	const uint8_t values[] = { 0x00, 0x01 };
+	const uint64_t lengths[] = { 10, 20 };
+	const uint64_t no_lengths[] = { 0, 0 };
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+
+	/* NULL session. */
+	ret = otd_session_send_rle(NULL, 0, values, lengths, 2, 1);
+	ck_assert(ret != OTD_OK);
+
+	/* NULL values or lengths. */
+	ret = otd_session_send_rle(sess, 0, NULL, lengths, 2, 1);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_send_rle(sess, 0, values, NULL, 2, 1);
+	ck_assert(ret != OTD_OK);
+
+	/* No runs, no samples, or no unitsize. */
+	ret = otd_session_send_rle(sess, 0, values, lengths, 0, 1);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_send_rle(sess, 0, values, no_lengths, 2, 1);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_send_rle(sess, 0, values, lengths, 2, 0);
+	ck_assert(ret != OTD_OK);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+#define RLE_NUM_RUNS 300
+
+/*
+ * Decode runs of samples with the testedges decoder, and return its
+ * annotations. The samples get sent in chunks of chunk_size samples,
+ * run-length encoded if rle is set, or expanded otherwise. Runs get
+ * split at the chunk boundaries.
+ */
+static GString *decode_runs(const uint8_t *values, const uint64_t *lengths,
+		uint64_t num_runs, uint64_t unitsize, gboolean rle,
+		uint64_t chunk_size)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GHashTable *channels;
+	GString *anns;
+	uint8_t *buf, *chunk_values;
+	uint64_t *chunk_lengths, start, len, run, off, r, n, i, j, pos;
+
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new("testedges", NULL, anns, &di);
+	ck_assert(sess != NULL);
+
+	/* D1 is in the last byte of a sample. */
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "d0",
+		g_variant_ref_sink(g_variant_new_int32(3)));
+	g_hash_table_insert(channels, "d1",
+		g_variant_ref_sink(g_variant_new_int32(unitsize * 8 - 4)));
+	ck_assert(otd_inst_channel_set_all(di, channels) == OTD_OK);
+	g_hash_table_destroy(channels);
+	ck_assert(otd_session_start(sess) == OTD_OK);
+
+	buf = NULL;
+	chunk_values = g_malloc(num_runs * unitsize);
+	chunk_lengths = g_malloc(num_runs * sizeof(uint64_t));
+	start = r = off = 0;
+	while (r < num_runs) {
+		n = len = 0;
+		while (r < num_runs && len < chunk_size) {
+			run = MIN(lengths[r] - off, chunk_size - len);
+			memcpy(chunk_values + n * unitsize,
+				values + r * unitsize, unitsize);
+			chunk_lengths[n++] = run;
+			len += run;
+			off += run;
+			if (off == lengths[r]) {
+				r++;
+				off = 0;
+			}
+		}
+		if (rle) {
+			ck_assert(otd_session_send_rle(sess, start, chunk_values,
+				chunk_lengths, n, unitsize) == OTD_OK);
+		} else {
+			buf = g_realloc(buf, len * unitsize);
+			for (pos = i = 0; i < n; i++) {
+				for (j = 0; j < chunk_lengths[i]; j++, pos++)
+					memcpy(buf + pos * unitsize,
+						chunk_values + i * unitsize, unitsize);
+			}
+			ck_assert(otd_session_send(sess, start, start + len, buf,
+				len * unitsize, unitsize) == OTD_OK);
+		}
+		start += len;
+	}
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+
+	otd_session_destroy(sess);
+	g_free(buf);
+	g_free(chunk_values);
+	g_free(chunk_lengths);
+
+	return anns;
+}
+
+/*
+ * Check whether run-length encoded samples decode to the same annotations
+ * as the same samples sent expanded, with runs which cross the boundaries
+ * of chunks, and with samples of one and two bytes.
+ */
+START_TEST(test_session_send_rle)
+{
+	uint8_t values[RLE_NUM_RUNS * 2];
+	uint64_t lengths[RLE_NUM_RUNS];
+	uint64_t unitsize, i;
+	GString *expected, *anns;
+	GRand *rand;
+	int v;
+
+	otd_init(TEST_DECODERS_DIR);
+	rand = g_rand_new_with_seed(42);
+
+	for (unitsize = 1; unitsize <= 2; unitsize++) {
+		/* Mostly short runs, some of them longer than chunks. */
+		memset(values, 0, sizeof(values));
+		for (i = 0; i < RLE_NUM_RUNS; i++) {
+			v = g_rand_int_range(rand, 0, 4);
+			values[i * unitsize] = (v & 1) << 3;
+			values[i * unitsize + unitsize - 1] |= (v & 2) << 3;
+			lengths[i] = g_rand_int_range(rand, 0, 10) ?
+				g_rand_int_range(rand, 1, 50) :
+				g_rand_int_range(rand, 100, 500);
+		}
+
+		expected = decode_runs(values, lengths, RLE_NUM_RUNS, unitsize,
+			FALSE, 97);
+		ck_assert(expected->len > 0);
+
+		anns = decode_runs(values, lengths, RLE_NUM_RUNS, unitsize,
+			FALSE, 4096);
+		ck_assert_str_eq(anns->str, expected->str);
+		g_string_free(anns, TRUE);
+
+		anns = decode_runs(values, lengths, RLE_NUM_RUNS, unitsize,
+			TRUE, 61);
+		ck_assert_str_eq(anns->str, expected->str);
+		g_string_free(anns, TRUE);
+
+		anns = decode_runs(values, lengths, RLE_NUM_RUNS, unitsize,
+			TRUE, 1000);
+		ck_assert_str_eq(anns->str, expected->str);
+		g_string_free(anns, TRUE);
+
+		g_string_free(expected, TRUE);
+	}
+
+	g_rand_free(rand);
+	otd_exit();
+}
+END_TEST
+
+static void release_count(const uint8_t *inbuf, void *cb_data)
+{
+	(void)inbuf;
+
+	(*(int *)cb_data)++;
+}
+
+/*
+ * Check whether the asynchronous send calls fail with invalid input,
+ * and release rejected chunks nevertheless.
+ * If they return OTD_OK (or segfault) this test will fail.
+ */
+START_TEST(test_session_send_async_bogus)
+{
+	struct otd_session *sess;
+	int ret, released;
+	const uint8_t inbuf[] = { 0x00, 0x01, 0x00, 0x01 };
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+	released = 0;
+
+	/* NULL session. */
+	ret = otd_session_send_async(NULL, 0, 4, inbuf, 4, 1,
+		release_count, &released);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_drain(NULL);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_queue_depth_set(NULL, 4);
+	ck_assert(ret != OTD_OK);
+
+	/* NULL buffer, empty buffer, or no unitsize. */
+	ret = otd_session_send_async(sess, 0, 4, NULL, 4, 1,
+		release_count, &released);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_send_async(sess, 0, 4, inbuf, 0, 1,
+		release_count, &released);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_send_async(sess, 0, 4, inbuf, 4, 0,
+		release_count, &released);
+	ck_assert(ret != OTD_OK);
+	ck_assert(released == 4);
+
+	/* Zero queue depth. */
+	ret = otd_session_queue_depth_set(sess, 0);
+	ck_assert(ret != OTD_OK);
+
+	/* Without decoders, chunks get released right away. */
+	ret = otd_session_send_async(sess, 0, 4, inbuf, 4, 1,
+		release_count, &released);
+	ck_assert(ret == OTD_OK);
+	ck_assert(released == 5);
+	ret = otd_session_drain(sess);
+	ck_assert(ret == OTD_OK);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+static void ann_batch_count(struct otd_proto_data *pdata, size_t count,
+		void *cb_data)
+{
+	(void)pdata;
+
+	*(size_t *)cb_data += count;
+}
+
+/*
+ * Check whether otd_pd_output_batch_callback_add() fails with invalid input.
+ * If it returns OTD_OK (or segfaults) this test will fail.
+ */
+START_TEST(test_session_batch_callback_add_bogus)
+{
+	struct otd_session *sess;
+	int ret;
+	size_t count;
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+	count = 0;
+
+	/* NULL session, NULL callback. */
+	ret = otd_pd_output_batch_callback_add(NULL, OTD_OUTPUT_ANN,
+		ann_batch_count, &count, 0);
+	ck_assert(ret != OTD_OK);
+	ret = otd_pd_output_batch_callback_add(sess, OTD_OUTPUT_ANN,
+		NULL, &count, 0);
+	ck_assert(ret != OTD_OK);
+
+	/* Only annotations can be batched. */
+	ret = otd_pd_output_batch_callback_add(sess, OTD_OUTPUT_BINARY,
+		ann_batch_count, &count, 0);
+	ck_assert(ret != OTD_OK);
+
+	ret = otd_pd_output_batch_callback_add(sess, OTD_OUTPUT_ANN,
+		ann_batch_count, &count, 16);
+	ck_assert(ret == OTD_OK);
+	ck_assert(count == 0);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether otd_session_binary_buffer_set() rejects a NULL session,
+ * and accepts any block size including 0.
+ */
+START_TEST(test_session_binary_buffer_set)
+{
+	struct otd_session *sess;
+	int ret;
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+
+	ret = otd_session_binary_buffer_set(NULL, 4096);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_binary_buffer_set(sess, 4096);
+	ck_assert(ret == OTD_OK);
+	ret = otd_session_binary_buffer_set(sess, 0);
+	ck_assert(ret == OTD_OK);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether otd_session_inline_set() rejects a NULL session, and
+ * whether worker threads can always be selected.
+ */
+START_TEST(test_session_inline_set)
+{
+	struct otd_session *sess;
+	int ret;
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+
+	ret = otd_session_inline_set(NULL, FALSE);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_inline_set(sess, FALSE);
+	ck_assert(ret == OTD_OK);
+
+	/* Inline mode depends on the greenlet module being available. */
+	ret = otd_session_inline_set(sess, TRUE);
+	ck_assert(ret == OTD_OK || ret == OTD_ERR_PYTHON);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether otd_session_pool_set() and otd_session_priority_set()
+ * reject a NULL session, and whether the pool can be resized while no
+ * stacks are running on it.
+ */
+START_TEST(test_session_pool_set)
+{
+	struct otd_session *sess;
+	int ret;
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+
+	ret = otd_session_pool_set(NULL, TRUE);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_priority_set(NULL, 1);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_priority_set(sess, -1);
+	ck_assert(ret == OTD_OK);
+
+	/* Pool mode depends on the greenlet module being available. */
+	ret = otd_session_pool_set(sess, TRUE);
+	ck_assert(ret == OTD_OK || ret == OTD_ERR_PYTHON);
+	ret = otd_session_pool_set(sess, FALSE);
+	ck_assert(ret == OTD_OK);
+
+	ret = otd_pool_size_set(2);
+	ck_assert(ret == OTD_OK);
+	ret = otd_pool_size_set(0);
+	ck_assert(ret == OTD_OK);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether otd_session_parallel_set() rejects a NULL session, and
+ * accepts both modes otherwise.
+ */
+START_TEST(test_session_parallel_set)
+{
+	struct otd_session *sess;
+	int ret;
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+
+	ret = otd_session_parallel_set(NULL, TRUE);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_parallel_set(sess, TRUE);
+	ck_assert(ret == OTD_OK);
+	ret = otd_session_parallel_set(sess, FALSE);
+	ck_assert(ret == OTD_OK);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Check whether otd_session_process_set() and
+ * otd_session_process_timeout_set() reject a NULL session, and accept
+ * valid settings otherwise. Worker processes need posix_spawn().
+ */
+START_TEST(test_session_process_set)
+{
+	struct otd_session *sess;
+	int ret;
+
+	otd_init(NULL);
+	otd_session_new(&sess);
+
+	ret = otd_session_process_set(NULL, TRUE);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_process_timeout_set(NULL, 1000);
+	ck_assert(ret != OTD_OK);
+	ret = otd_session_process_timeout_set(sess, 1000);
+	ck_assert(ret == OTD_OK);
+	ret = otd_session_process_timeout_set(sess, 0);
+	ck_assert(ret == OTD_OK);
+
+#ifdef G_OS_UNIX
+	ret = otd_session_process_set(sess, TRUE);
+	ck_assert(ret == OTD_OK);
+#endif
+	ret = otd_session_process_set(sess, FALSE);
+	ck_assert(ret == OTD_OK);
+
+	otd_session_destroy(sess);
+	otd_exit();
+}
+END_TEST
+
+#ifdef G_OS_UNIX
+/*
+ * Create a session which runs the 'testcrash' decoder in a worker
+ * process, failing as given, with a short timeout.
+ */
+static struct otd_session *process_session_new(const char *failure,
+		GString *anns)
+{
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GHashTable *options;
+
+	options = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(options, "failure",
+		g_variant_ref_sink(g_variant_new_string(failure)));
+	sess = srdtest_session_new("testcrash", options, anns, &di);
+	g_hash_table_destroy(options);
+	ck_assert(sess != NULL);
+	ck_assert(otd_session_process_set(sess, TRUE) == OTD_OK);
+	ck_assert(otd_session_process_timeout_set(sess, 500) == OTD_OK);
+	ck_assert(otd_session_start(sess) == OTD_OK);
+
+	return sess;
+}
+
+/*
+ * Check whether a decoder which crashes or hangs in its worker process
+ * has its stack fail, and whether the session survives that.
+ */
+static void check_process_failure(const char *failure)
+{
+	/* D0 rises at 1 and 5, falls at 3. */
+	const uint8_t samples[] = { 0, 1, 1, 0, 0, 1, 1 };
+	struct otd_session *sess;
+	GString *anns;
+	int ret;
+
+	otd_init(TEST_DECODERS_DIR);
+
+	anns = g_string_new(NULL);
+	sess = process_session_new("none", anns);
+	ret = otd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	ck_assert(ret == OTD_OK);
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+	otd_session_destroy(sess);
+	ck_assert_str_eq(anns->str, "1-1 0: 1\n3-3 0: 0\n5-5 0: 1\n");
+	g_string_free(anns, TRUE);
+
+	anns = g_string_new(NULL);
+	sess = process_session_new(failure, anns);
+	ret = otd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	ck_assert(ret == OTD_ERR_TERM_REQ);
+
+	/* A reset starts a new worker process, which fails again. */
+	ck_assert(otd_session_terminate_reset(sess) == OTD_OK);
+	ret = otd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	ck_assert(ret == OTD_ERR_TERM_REQ);
+	ck_assert(otd_session_terminate_reset(sess) == OTD_OK);
+	otd_session_destroy(sess);
+	g_string_free(anns, TRUE);
+
+	otd_exit();
+}
+
+START_TEST(test_session_process_crash)
+{
+	check_process_failure("crash");
+}
+END_TEST
+
+START_TEST(test_session_process_hang)
+{
+	check_process_failure("hang");
+}
+END_TEST
+
+/*
+ * Check whether a decoder which takes longer than the timeout, but keeps
+ * putting output, keeps its worker process.
+ */
+START_TEST(test_session_process_slow)
+{
+	/* D0 rises at 1 and 5, falls at 3. */
+	const uint8_t samples[] = { 0, 1, 1, 0, 0, 1, 1 };
+	struct otd_session *sess;
+	GString *anns, *expected;
+	int ret, i;
+
+	otd_init(TEST_DECODERS_DIR);
+
+	anns = g_string_new(NULL);
+	sess = process_session_new("slow", anns);
+	ret = otd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1);
+	ck_assert(ret == OTD_OK);
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+	otd_session_destroy(sess);
+
+	/* The slow part puts the falling edge 10 times, then once more. */
+	expected = g_string_new("1-1 0: 1\n");
+	for (i = 0; i < 11; i++)
+		g_string_append(expected, "3-3 0: 0\n");
+	g_string_append(expected, "5-5 0: 1\n");
+	ck_assert_str_eq(anns->str, expected->str);
+	g_string_free(expected, TRUE);
+	g_string_free(anns, TRUE);
+
+	otd_exit();
+}
+END_TEST
+
+static void process_logic_cb(struct otd_proto_data *pdata, void *cb_data)
+{
+	struct otd_proto_data_logic *pdl;
+
+	pdl = pdata->data;
+	g_string_append_printf(cb_data, "%" PRIu64 "-%" PRIu64
+		" %d %" PRIu64 ": %02x %02x\n", pdata->start_sample,
+		pdata->end_sample, pdl->logic_group, pdl->repeat_count,
+		pdl->data[0], pdl->data[1]);
+}
+
+/*
+ * Decode with the 'testlogic' decoder, in a worker process or not, and
+ * return its logic output.
+ */
+static GString *process_decode_logic(gboolean process)
+{
+	/* D0 rises at 1 and 5, falls at 3. */
+	const uint8_t samples[] = { 0, 1, 1, 0, 0, 1, 1 };
+	struct otd_session *sess;
+	struct otd_decoder_inst *di;
+	GString *logic;
+
+	logic = g_string_new(NULL);
+	sess = srdtest_session_new("testlogic", NULL, NULL, &di);
+	ck_assert(sess != NULL);
+	ck_assert(otd_pd_output_callback_add(sess, OTD_OUTPUT_LOGIC,
+		process_logic_cb, logic) == OTD_OK);
+	ck_assert(otd_session_process_set(sess, process) == OTD_OK);
+	ck_assert(otd_session_start(sess) == OTD_OK);
+	ck_assert(otd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1) == OTD_OK);
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+	otd_session_destroy(sess);
+
+	return logic;
+}
+
+/*
+ * Check whether logic output of a worker process carries the data of all
+ * logic output channels, here 12 of them in two bytes.
+ */
+START_TEST(test_session_process_logic)
+{
+	GString *logic;
+
+	otd_init(TEST_DECODERS_DIR);
+
+	logic = process_decode_logic(FALSE);
+	ck_assert_str_eq(logic->str,
+		"0-1 0 0: 03 08\n"
+		"1-3 0 1: 06 08\n"
+		"3-5 0 1: 0b 08\n");
+	g_string_free(logic, TRUE);
+	logic = process_decode_logic(TRUE);
+	ck_assert_str_eq(logic->str,
+		"0-1 0 0: 03 08\n"
+		"1-3 0 1: 06 08\n"
+		"3-5 0 1: 0b 08\n");
+	g_string_free(logic, TRUE);
+
+	otd_exit();
+}
+END_TEST
+
+/*
+ * Decode with a stack of the 'teststacklow' and 'teststackup' decoders,
+ * with D0 of the lower one on channel 1, in a worker process or not.
+ */
+static GString *process_decode_stack(gboolean process)
+{
+	/* Channel 1 rises at 1 and 5, falls at 3. Channel 0 toggles. */
+	const uint8_t samples[] = { 0, 3, 2, 1, 0, 3, 2 };
+	struct otd_session *sess;
+	struct otd_decoder_inst *di, *di_top;
+	GHashTable *channels;
+	GString *anns;
+
+	anns = g_string_new(NULL);
+	sess = srdtest_session_new("teststacklow", NULL, anns, &di);
+	ck_assert(sess != NULL);
+	channels = g_hash_table_new_full(g_str_hash, g_str_equal, NULL,
+		(GDestroyNotify)g_variant_unref);
+	g_hash_table_insert(channels, "d0",
+		g_variant_ref_sink(g_variant_new_int32(1)));
+	ck_assert(otd_inst_channel_set_all(di, channels) == OTD_OK);
+	g_hash_table_destroy(channels);
+	ck_assert(otd_decoder_load("teststackup") == OTD_OK);
+	di_top = otd_inst_new(sess, "teststackup", NULL);
+	ck_assert(di_top != NULL);
+	ck_assert(otd_inst_stack(sess, di, di_top) == OTD_OK);
+	ck_assert(otd_session_process_set(sess, process) == OTD_OK);
+	ck_assert(otd_session_start(sess) == OTD_OK);
+	ck_assert(otd_session_send(sess, 0, sizeof(samples), samples,
+		sizeof(samples), 1) == OTD_OK);
+	ck_assert(otd_session_send_eof(sess) == OTD_OK);
+	otd_session_destroy(sess);
+
+	return anns;
+}
+
+/*
+ * Check whether a worker process sets up the stack like the frontend
+ * did, with the stacked decoder and the channel map.
+ */
+START_TEST(test_session_process_stack)
+{
+	GString *anns;
+
+	otd_init(TEST_DECODERS_DIR);
+
+	anns = process_decode_stack(FALSE);
+	ck_assert_str_eq(anns->str,
+		"0-1 0: EDGE 1\n"
+		"1-3 0: EDGE 0\n"
+		"3-5 0: EDGE 1\n");
+	g_string_free(anns, TRUE);
+	anns = process_decode_stack(TRUE);
+	ck_assert_str_eq(anns->str,
+		"0-1 0: EDGE 1\n"
+		"1-3 0: EDGE 0\n"
+		"3-5 0: EDGE 1\n");
+	g_string_free(anns, TRUE);
+
+	otd_exit();
+}
+END_TEST
+#endif
+
 Suite *suite_session(void)
 {
 	Suite *s;
@@ -272,6 +994,7 @@ Suite *suite_session(void)
 	tcase_add_test(tc, test_session_new);
 	tcase_add_test(tc, test_session_new_bogus);
 	tcase_add_test(tc, test_session_new_multiple);
+	tcase_add_test(tc, test_session_new_threads);
 	tcase_add_test(tc, test_session_destroy);
 	tcase_add_test(tc, test_session_destroy_bogus);
 	suite_add_tcase(s, tc);
@@ -286,5 +1009,33 @@ Suite *suite_session(void)
 	tcase_add_test(tc, test_session_reset_nodata);
 	suite_add_tcase(s, tc);
 
+	tc = tcase_create("send");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_send_rle_bogus);
+	tcase_add_test(tc, test_session_send_rle);
+	tcase_add_test(tc, test_session_send_async_bogus);
+	tcase_add_test(tc, test_session_inline_set);
+	tcase_add_test(tc, test_session_pool_set);
+	tcase_add_test(tc, test_session_parallel_set);
+	tcase_add_test(tc, test_session_process_set);
+	suite_add_tcase(s, tc);
+
+#ifdef G_OS_UNIX
+	tc = tcase_create("process");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_process_crash);
+	tcase_add_test(tc, test_session_process_hang);
+	tcase_add_test(tc, test_session_process_slow);
+	tcase_add_test(tc, test_session_process_logic);
+	tcase_add_test(tc, test_session_process_stack);
+	suite_add_tcase(s, tc);
+#endif
+
+	tc = tcase_create("callbacks");
+	tcase_add_checked_fixture(tc, srdtest_setup, srdtest_teardown);
+	tcase_add_test(tc, test_session_batch_callback_add_bogus);
+	tcase_add_test(tc, test_session_binary_buffer_set);
+	suite_add_tcase(s, tc);
+
 	return s;
 }